@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+有界異步緩存
+- 內存層：LRU 順序 + TTL，按條目數和估算字節數限制大小
+- 可選持久層：SQLite 寫穿（pickle 序列化），啟動時載入最近寫入的未過期條目預熱，重啟 / 部署後緩存不會全部冷啟動；
+  內存淘汰的條目仍可從持久層取回
+- get_or_load 合併並發請求：同一個鍵同時只有一個加載器在運行，其餘調用方等待其結果
+- 負緩存：加載結果為 None 時按較短的 negative_ttl 緩存，避免反復查詢不存在的結果
+- 每個緩存有獨立的統計，並記錄到全局 metrics_registry（可用時）
+只在事件循環線程中使用（無鎖）；持久層查詢為本地 SQLite 主鍵查詢，直接在事件循環中執行
+"""
+
+import asyncio
+import logging
+import pickle
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Union
+
+try:
+    from metrics_registry import metrics_registry
+    METRICS_AVAILABLE = True
+except ImportError:
+    METRICS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+if METRICS_AVAILABLE:
+    CACHE_REQUESTS = metrics_registry.counter(
+        "async_cache_requests_total", "緩存查詢次數", ["cache", "result"])
+    CACHE_EVICTIONS = metrics_registry.counter(
+        "async_cache_evictions_total", "緩存容量淘汰次數", ["cache"])
+
+
+def estimate_size(value: Any) -> int:
+    """估算值佔用的字節數（numpy 數組用 nbytes，字符串 / 字節用長度，其餘用 sys.getsizeof）"""
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size")
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class AsyncCache:
+    """TTL + LRU 有界緩存，支持持久層、並發請求合併和負緩存"""
+
+    def __init__(self, name: str, ttl: Optional[float] = 300, max_entries: int = 1024,
+                 max_bytes: Optional[int] = None, negative_ttl: Optional[float] = None,
+                 persist_path: Optional[Union[str, Path]] = None,
+                 max_persisted_entries: Optional[int] = None, commit_every: int = 1,
+                 sizeof: Callable[[Any], int] = estimate_size):
+        """
+        Args:
+            name: 緩存名稱（統計標籤，也是持久層中的命名空間，多個緩存可共用一個文件）
+            ttl: 默認存活秒數，None 表示不過期
+            max_entries: 內存層條目數上限
+            max_bytes: 內存層估算字節數上限，None 表示不限制
+            negative_ttl: None 結果的存活秒數，None 表示不緩存 None
+            persist_path: SQLite 文件路徑，None 表示不持久化
+            max_persisted_entries: 持久層條目數上限（purge_expired 時裁剪），默認為 max_entries 的 10 倍
+            commit_every: 持久層每多少次寫入提交一次事務；未提交的事務會阻塞共用同一文件的其他緩存，
+                只有獨佔文件時才應調大
+            sizeof: 值大小估算函數
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+        self.max_persisted_entries = max_persisted_entries or max_entries * 10
+        self.commit_every = commit_every
+        self.sizeof = sizeof
+
+        self.entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.total_bytes = 0
+        self.inflight: Dict[Hashable, asyncio.Future] = {}
+        self.pending_writes = 0
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "negative_hits": 0,
+            "persistent_hits": 0,
+            "loads": 0,
+            "coalesced": 0,
+            "load_errors": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "warmed": 0
+        }
+
+        if METRICS_AVAILABLE:
+            self._metric_results = {
+                result: CACHE_REQUESTS.labels(name, result)
+                for result in ("hit", "miss", "negative_hit", "persistent_hit")
+            }
+            self._metric_evictions = CACHE_EVICTIONS.labels(name)
+
+        self.conn: Optional[sqlite3.Connection] = None
+        if persist_path is not None:
+            self._open_persistent(str(persist_path))
+
+    # ---------- 持久層 ----------
+
+    def _open_persistent(self, path: str):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                cache TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (cache, key)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+        self._warm()
+
+    def _warm(self):
+        """載入最近寫入的未過期條目（最新的放在 LRU 末尾）"""
+        rows = self.conn.execute(
+            "SELECT key, value, expires_at FROM cache_entries "
+            "WHERE cache = ? AND (expires_at IS NULL OR expires_at > ?) "
+            "ORDER BY updated_at DESC LIMIT ?",
+            (self.name, time.time(), self.max_entries)
+        ).fetchall()
+        for key, blob, expires_at in reversed(rows):
+            value = self._unpickle(key, blob)
+            if value is not MISSING:
+                self._store(key, value, expires_at)
+                self.stats["warmed"] += 1
+        if self.stats["warmed"]:
+            logger.info(f"🔥 緩存 {self.name} 已從持久層預熱 {self.stats['warmed']} 條")
+
+    def _unpickle(self, key: str, blob: bytes) -> Any:
+        try:
+            return pickle.loads(blob)
+        except Exception as e:
+            # 類定義變更等原因無法還原，丟棄該條目
+            logger.warning(f"緩存 {self.name} 條目無法還原，已刪除: {e}")
+            self.conn.execute("DELETE FROM cache_entries WHERE cache = ? AND key = ?", (self.name, key))
+            self.conn.commit()
+            return MISSING
+
+    def _persist(self, key: Hashable, value: Any, expires_at: Optional[float]):
+        if not isinstance(key, str):
+            return
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug(f"緩存 {self.name} 條目無法序列化，只保存在內存: {e}")
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (cache, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (self.name, key, blob, expires_at, time.time())
+        )
+        self.pending_writes += 1
+        if self.pending_writes >= self.commit_every:
+            self.flush()
+
+    def _lookup_persistent(self, key: Hashable) -> Any:
+        if not isinstance(key, str):
+            return MISSING
+        row = self.conn.execute(
+            "SELECT value, expires_at FROM cache_entries WHERE cache = ? AND key = ?", (self.name, key)
+        ).fetchone()
+        if row is None:
+            return MISSING
+        blob, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            return MISSING
+        value = self._unpickle(key, blob)
+        if value is not MISSING:
+            self._store(key, value, expires_at)
+        return value
+
+    def flush(self):
+        """提交持久層的待寫入條目"""
+        if self.conn is not None and self.pending_writes:
+            self.conn.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # ---------- 內存層 ----------
+
+    def _store(self, key: Hashable, value: Any, expires_at: Optional[float]):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+        size = self.sizeof(value)
+        self.entries[key] = _Entry(value, expires_at, size)
+        self.total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        while self.entries and (
+            len(self.entries) > self.max_entries
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            _, entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            self.stats["evictions"] += 1
+            if METRICS_AVAILABLE:
+                self._metric_evictions.inc()
+
+    def _remove(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def _record(self, result: str):
+        if METRICS_AVAILABLE:
+            self._metric_results[result].inc()
+
+    def lookup(self, key: Hashable) -> Any:
+        """查詢緩存，未命中返回 MISSING；負緩存命中返回 None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry.expires_at is not None and entry.expires_at <= time.time():
+                self._remove(key)
+                self.stats["expirations"] += 1
+            else:
+                self.entries.move_to_end(key)
+                if entry.value is None:
+                    self.stats["negative_hits"] += 1
+                    self._record("negative_hit")
+                else:
+                    self.stats["hits"] += 1
+                    self._record("hit")
+                return entry.value
+
+        if self.conn is not None:
+            value = self._lookup_persistent(key)
+            if value is not MISSING:
+                self.stats["persistent_hits"] += 1
+                self._record("persistent_hit")
+                return value
+
+        self.stats["misses"] += 1
+        self._record("miss")
+        return MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.lookup(key)
+        return default if value is MISSING else value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = MISSING):
+        """寫入緩存；值為 None 時按 negative_ttl 緩存（未配置則不緩存）"""
+        if value is None:
+            if self.negative_ttl is None:
+                return
+            ttl = self.negative_ttl
+        elif ttl is MISSING:
+            ttl = self.ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        self._store(key, value, expires_at)
+        if self.conn is not None and value is not None:
+            self._persist(key, value, expires_at)
+
+    def delete(self, key: Hashable):
+        self._remove(key)
+        if self.conn is not None and isinstance(key, str):
+            self.conn.execute("DELETE FROM cache_entries WHERE cache = ? AND key = ?", (self.name, key))
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_every:
+                self.flush()
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+        if self.conn is not None:
+            self.conn.execute("DELETE FROM cache_entries WHERE cache = ?", (self.name,))
+            self.conn.commit()
+            self.pending_writes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self.entries.get(key)
+        return entry is not None and (entry.expires_at is None or entry.expires_at > time.time())
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          ttl: Optional[float] = MISSING,
+                          cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        """命中時直接返回，否則調用 loader 加載並寫入緩存
+
+        同一個鍵的並發調用只運行一次 loader，其他調用方共享結果（或異常）；
+        cache_if 返回 False 的結果不寫入緩存，但仍返回給所有等待者
+        """
+        while True:
+            value = self.lookup(key)
+            if value is not MISSING:
+                return value
+
+            future = self.inflight.get(key)
+            if future is None:
+                break
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # 加載者被取消，由當前調用方重新加載
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.stats["loads"] += 1
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.stats["load_errors"] += 1
+            future.set_exception(e)
+            future.exception()  # 沒有等待者時不記錄未取回的異常
+            raise
+        finally:
+            self.inflight.pop(key, None)
+
+        if cache_if is None or cache_if(value):
+            self.set(key, value, ttl)
+        future.set_result(value)
+        return value
+
+    def purge_expired(self) -> int:
+        """清理內存層和持久層的過期條目，並把持久層裁剪到 max_persisted_entries，返回內存層清理數量"""
+        now = time.time()
+        expired = [key for key, entry in self.entries.items()
+                   if entry.expires_at is not None and entry.expires_at <= now]
+        for key in expired:
+            self._remove(key)
+        self.stats["expirations"] += len(expired)
+
+        if self.conn is not None:
+            self.conn.execute("DELETE FROM cache_entries WHERE cache = ? AND expires_at <= ?", (self.name, now))
+            self.conn.execute(
+                "DELETE FROM cache_entries WHERE cache = ? AND key NOT IN ("
+                "SELECT key FROM cache_entries WHERE cache = ? ORDER BY updated_at DESC LIMIT ?)",
+                (self.name, self.name, self.max_persisted_entries)
+            )
+            self.conn.commit()
+            self.pending_writes = 0
+        return len(expired)
+
+    def get_stats(self) -> Dict[str, Any]:
+        hits = self.stats["hits"] + self.stats["negative_hits"] + self.stats["persistent_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "name": self.name,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self.inflight),
+            "persistent": self.conn is not None,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
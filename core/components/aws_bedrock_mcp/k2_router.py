@@ -20,14 +20,20 @@ import json
 import logging
 import asyncio
 import aiohttp
+import sys
 import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from pathlib import Path
+from typing import Dict, List, Any, Tuple
 from dataclasses import dataclass
 from enum import Enum
 import hashlib
 import re
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from async_cache import AsyncCache
+from semantic_cache import SemanticCache, context_scope, normalize_query
+
 class RequestType(Enum):
     """请求类型枚举"""
     CODE_GENERATION = "code_generation"
@@ -132,9 +138,37 @@ class K2Router:
             "last_request_time": None
         }
         
-        # 缓存
-        self.response_cache = {}
+        # 缓存（有界 LRU，可选 SQLite 持久化，重启后保持预热）
         self.cache_ttl = self.config.get("cache_ttl", 300)  # 5分钟
+        self.response_cache = AsyncCache(
+            "k2_router_responses",
+            ttl=self.cache_ttl,
+            max_entries=self.config.get("cache_max_entries", 1000),
+            persist_path=self.config.get("cache_path")
+        )
+        
+        # 语义缓存（默认关闭）：同一模型和上下文下近似重复的查询复用缓存响应
+        # 配置 semantic_cache: {"threshold", "max_entries", "verify_rate", "verify_similarity"}，
+        # 嵌入模型由 embedding_model 提供（encode(List[str])）。未提供时不做语义匹配（字面相近但含义相反的
+        # 查询会误命中），只把大小写、全半角、空白和标点规范化后的查询作为精确缓存键
+        self.semantic_cache = None
+        self.normalize_cache_key = False
+        semantic_config = self.config.get("semantic_cache")
+        self.embedding_model = self.config.get("embedding_model")
+        if semantic_config and self.embedding_model is None:
+            self.logger.warning("语义缓存需要 embedding_model，已退化为规范化查询的精确缓存")
+            self.normalize_cache_key = True
+        elif semantic_config:
+            semantic_config = semantic_config if isinstance(semantic_config, dict) else {}
+            self.verify_similarity = semantic_config.get("verify_similarity", 0.8)
+            self.semantic_cache = SemanticCache(
+                self.response_cache,
+                self._embed_query,
+                threshold=semantic_config.get("threshold", 0.92),
+                max_entries=semantic_config.get("max_entries", 2048),
+                verify_rate=semantic_config.get("verify_rate", 0.0),
+                verify=self._responses_agree
+            )
     
     async def initialize(self) -> Dict[str, Any]:
         """初始化路由器"""
@@ -194,34 +228,26 @@ class K2Router:
         try:
             start_time = time.time()
             
-            # 1. 检查缓存
+            # 1. 检查缓存；相同请求并发到达时只执行一次
             cache_key = self._generate_cache_key(request)
-            cached_response = self._get_cached_response(cache_key)
-            if cached_response:
-                self.logger.info("返回缓存响应")
-                return cached_response
-            
-            # 2. 智能路由决策
-            routing_decision = await self._make_routing_decision(request)
-            
-            # 3. 上下文优化
-            optimized_request = await self._optimize_context(request, routing_decision)
+            executed = False
             
-            # 4. 执行请求
-            response = await self._execute_request(optimized_request, routing_decision)
+            async def execute() -> K2Response:
+                nonlocal executed
+                executed = True
+                return await self._route_uncached(request, start_time)
             
-            # 5. 质量评估
-            if self.enable_quality_assessment:
-                response.quality_score = await self._assess_response_quality(
-                    optimized_request, response
+            if self.semantic_cache is not None:
+                response, _ = await self.semantic_cache.get_or_load(
+                    request.query, context_scope(request.model_version.value, request.context),
+                    cache_key, execute, cache_if=self._is_cacheable
                 )
-            
-            # 6. 缓存响应
-            if response.status == "success" and response.quality_score > 0.7:
-                self._cache_response(cache_key, response)
-            
-            # 7. 更新统计
-            await self._update_stats(optimized_request, response, routing_decision, start_time)
+            else:
+                response = await self.response_cache.get_or_load(
+                    cache_key, execute, cache_if=self._is_cacheable
+                )
+            if not executed:
+                self.logger.info("返回缓存响应")
             
             return response
             
@@ -238,6 +264,50 @@ class K2Router:
                 metadata={"error": str(e)}
             )
     
+    async def _route_uncached(self, request: K2Request, start_time: float) -> K2Response:
+        """执行路由决策、上下文优化、请求和质量评估（缓存未命中时调用）"""
+        # 2. 智能路由决策
+        routing_decision = await self._make_routing_decision(request)
+        
+        # 3. 上下文优化
+        optimized_request = await self._optimize_context(request, routing_decision)
+        
+        # 4. 执行请求
+        response = await self._execute_request(optimized_request, routing_decision)
+        
+        # 5. 质量评估
+        if self.enable_quality_assessment:
+            response.quality_score = await self._assess_response_quality(
+                optimized_request, response
+            )
+        
+        # 6. 更新统计（缓存由调用方按 _is_cacheable 写入）
+        await self._update_stats(optimized_request, response, routing_decision, start_time)
+        
+        return response
+    
+    @staticmethod
+    def _is_cacheable(response: K2Response) -> bool:
+        """只缓存成功且质量较高的响应"""
+        return response.status == "success" and response.quality_score > 0.7
+    
+    async def _embed_query(self, query: str):
+        """语义缓存的查询向量"""
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(None, self.embedding_model.encode, [query])
+        return vectors[0]
+    
+    async def _responses_agree(self, cached: K2Response, fresh: K2Response) -> bool:
+        """抽样校验：语义命中的缓存响应与重新请求的响应内容足够相似才算有效命中"""
+        if fresh.status != "success":
+            return True
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(None, self.embedding_model.encode, [cached.content, fresh.content])
+        norms = (vectors ** 2).sum(axis=1) ** 0.5
+        if not norms.all():
+            return cached.content == fresh.content
+        return float(vectors[0] @ vectors[1] / (norms[0] * norms[1])) >= self.verify_similarity
+    
     async def _make_routing_decision(self, request: K2Request) -> RoutingDecision:
         """智能路由决策"""
         try:
@@ -657,24 +727,11 @@ class K2Router:
         self.rate_limiter.append(current_time)
     
     def _generate_cache_key(self, request: K2Request) -> str:
-        """生成缓存键"""
-        content = f"{request.query}_{request.context}_{request.model_version.value}"
+        """生成缓存键（忽略查询中的空白差异；语义缓存退化时再忽略大小写、全半角和标点）"""
+        query = normalize_query(request.query) if self.normalize_cache_key else " ".join(request.query.split())
+        content = f"{query}_{request.context}_{request.model_version.value}"
         return hashlib.md5(content.encode()).hexdigest()
     
-    def _get_cached_response(self, cache_key: str) -> Optional[K2Response]:
-        """获取缓存响应"""
-        if cache_key in self.response_cache:
-            cached_data, timestamp = self.response_cache[cache_key]
-            if time.time() - timestamp < self.cache_ttl:
-                return cached_data
-            else:
-                del self.response_cache[cache_key]
-        return None
-    
-    def _cache_response(self, cache_key: str, response: K2Response):
-        """缓存响应"""
-        self.response_cache[cache_key] = (response, time.time())
-    
     async def _update_stats(self, request: K2Request, response: K2Response, decision: RoutingDecision, start_time: float):
         """更新统计信息"""
         try:
@@ -769,16 +826,10 @@ class K2Router:
         while True:
             try:
                 await asyncio.sleep(300)  # 每5分钟清理一次
-                current_time = time.time()
-                expired_keys = [
-                    key for key, (_, timestamp) in self.response_cache.items()
-                    if current_time - timestamp > self.cache_ttl
-                ]
-                for key in expired_keys:
-                    del self.response_cache[key]
+                expired_count = self.response_cache.purge_expired()
                     
-                if expired_keys:
-                    self.logger.info(f"清理了 {len(expired_keys)} 个过期缓存")
+                if expired_count:
+                    self.logger.info(f"清理了 {expired_count} 个过期缓存")
                     
             except Exception as e:
                 self.logger.error(f"缓存清理任务错误: {str(e)}")
@@ -801,6 +852,9 @@ class K2Router:
         
         # 添加缓存统计
         stats["cache_size"] = len(self.response_cache)
+        stats["cache"] = self.response_cache.get_stats()
+        if self.semantic_cache is not None:
+            stats["semantic_cache"] = self.semantic_cache.get_stats()
         stats["rate_limiter_size"] = len(self.rate_limiter)
         
         return stats
@@ -809,6 +863,7 @@ class K2Router:
         """清理资源"""
         if self.session:
             await self.session.close()
+        self.response_cache.close()
         self.logger.info("K2 路由器资源已清理")
 
 
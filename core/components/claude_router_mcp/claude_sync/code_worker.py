@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Code Worker - 预热的代码执行工作进程
+由 CodeWorkerPool 启动，通过 stdin 逐行接收 JSON 任务，
+执行结果和 stdout/stderr 输出以 JSON 行的形式写回协议管道
+
+协议:
+    输入:  {"id": "...", "code": "...", "cpu_limit": 10}
+    输出:  {"id": "...", "stream": "stdout" | "stderr", "data": "..."}
+           {"id": "...", "done": true, "success": bool, "error": "..."}
+"""
+
+import io
+import json
+import os
+import sys
+import traceback
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+    resource = None
+
+
+class ProtocolStream(io.TextIOBase):
+    """将 print 输出转换为协议帧的文本流"""
+
+    def __init__(self, protocol, job_id: str, name: str):
+        self.protocol = protocol
+        self.job_id = job_id
+        self.name = name
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            send(self.protocol, {"id": self.job_id, "stream": self.name, "data": data})
+        return len(data)
+
+
+def send(protocol, message):
+    protocol.write(json.dumps(message, ensure_ascii=False) + "\n")
+    protocol.flush()
+
+
+def set_cpu_limit(cpu_limit: int):
+    """在已用 CPU 时间基础上为本次任务设置软限制，超出时内核发送 SIGXCPU"""
+    if not RESOURCE_AVAILABLE or not cpu_limit:
+        return
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = used + int(cpu_limit)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def main():
+    # 协议使用原始 stdout 的副本；fd 1 重定向到 stderr，
+    # 这样用户代码直接写 fd 1 也不会破坏协议帧
+    protocol = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+
+    send(protocol, {"ready": True, "pid": os.getpid()})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        job = json.loads(line)
+        job_id = job.get("id", "")
+        set_cpu_limit(job.get("cpu_limit", 0))
+
+        sys.stdout = ProtocolStream(protocol, job_id, "stdout")
+        sys.stderr = ProtocolStream(protocol, job_id, "stderr")
+
+        success = True
+        error = ""
+        try:
+            code = compile(job.get("code", ""), "<claudeditor>", "exec")
+            exec(code, {"__name__": "__main__", "__builtins__": __builtins__})
+        except SystemExit as e:
+            success = e.code in (None, 0)
+            if not success:
+                error = f"SystemExit: {e.code}"
+        except BaseException:
+            success = False
+            error = traceback.format_exc()
+        finally:
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+        send(protocol, {"id": job_id, "done": True, "success": success, "error": error})
+
+
+if __name__ == "__main__":
+    main()
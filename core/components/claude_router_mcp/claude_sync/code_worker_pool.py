@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Code Worker Pool - 沙箱化预热代码执行池
+预先启动若干受 rlimit 约束（CPU / 内存）的 Python 工作进程，
+通过管道发送代码执行任务，异步流式返回 stdout/stderr，
+运行 N 次或崩溃/超时后自动回收并替换工作进程
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "code_worker.py")
+
+# 单行协议帧上限（大量 print 输出时避免 StreamReader 溢出）
+PROTOCOL_LINE_LIMIT = 16 * 1024 * 1024
+
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+
+class CodeWorker:
+    """单个预热工作进程"""
+
+    def __init__(self, memory_limit_mb: int = 512, workdir: str = None):
+        self.worker_id = uuid.uuid4().hex[:8]
+        self.memory_limit_mb = memory_limit_mb
+        self.workdir = workdir
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.runs = 0
+        self.output_callback: Optional[OutputCallback] = None
+        self.stderr_task = None
+        self.stderr_buffer = []
+
+    def _apply_limits(self):
+        """子进程 exec 前设置资源限制"""
+        if not RESOURCE_AVAILABLE:
+            return
+
+        if self.memory_limit_mb:
+            limit = self.memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        # 禁止生成 core dump
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+
+    async def start(self):
+        """启动工作进程并等待就绪"""
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=self.workdir,
+            preexec_fn=self._apply_limits if RESOURCE_AVAILABLE else None,
+            limit=PROTOCOL_LINE_LIMIT
+        )
+
+        ready = json.loads(await self.process.stdout.readline())
+        if not ready.get("ready"):
+            raise RuntimeError(f"工作进程启动失败: {ready}")
+
+        self.stderr_task = asyncio.create_task(self._stderr_reader())
+
+    async def _stderr_reader(self):
+        """转发用户代码直接写入 fd 的输出（绕过 sys.stdout 的部分）"""
+        while True:
+            chunk = await self.process.stderr.read(4096)
+            if not chunk:
+                break
+
+            data = chunk.decode("utf-8", errors="replace")
+            self.stderr_buffer.append(data)
+            if self.output_callback:
+                await self.output_callback("stderr", data)
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, code: str, timeout: float, cpu_limit: int,
+                  output_callback: Optional[OutputCallback] = None) -> Dict[str, Any]:
+        """执行一段代码，返回与 _execute_code_locally 相同结构的结果"""
+        job_id = uuid.uuid4().hex
+        stdout_parts = []
+        stderr_parts = []
+        self.stderr_buffer = []
+        self.runs += 1
+
+        async def forward(stream: str, data: str):
+            (stdout_parts if stream == "stdout" else stderr_parts).append(data)
+            if output_callback:
+                await output_callback(stream, data)
+
+        self.output_callback = output_callback
+        start_time = time.time()
+
+        try:
+            job = {"id": job_id, "code": code, "cpu_limit": cpu_limit}
+            self.process.stdin.write((json.dumps(job) + "\n").encode("utf-8"))
+            await self.process.stdin.drain()
+
+            done = await asyncio.wait_for(self._read_until_done(job_id, forward), timeout)
+
+            return {
+                "success": done["success"],
+                "output": "".join(stdout_parts),
+                "error": "".join(stderr_parts) + "".join(self.stderr_buffer) + done.get("error", ""),
+                "timed_out": False,
+                "execution_time": time.time() - start_time
+            }
+
+        except asyncio.TimeoutError:
+            await self.kill()
+            return {
+                "success": False,
+                "output": "".join(stdout_parts),
+                "error": "代码执行超时",
+                "timed_out": True,
+                "execution_time": timeout
+            }
+
+        except (ConnectionError, EOFError) as e:
+            # 工作进程崩溃（例如超出 CPU / 内存限制）
+            await self.kill()
+            return {
+                "success": False,
+                "output": "".join(stdout_parts),
+                "error": "".join(self.stderr_buffer) + f"工作进程异常退出: {e}",
+                "timed_out": False,
+                "execution_time": time.time() - start_time
+            }
+
+        finally:
+            self.output_callback = None
+
+    async def _read_until_done(self, job_id: str, forward: OutputCallback) -> Dict[str, Any]:
+        """读取协议帧直到任务完成"""
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                await self.process.wait()
+                raise EOFError(f"退出码 {self.process.returncode}")
+
+            message = json.loads(line)
+            if message.get("id") != job_id:
+                continue
+
+            if message.get("done"):
+                return message
+
+            await forward(message["stream"], message["data"])
+
+    def terminate(self):
+        """立即终止工作进程（不等待退出，可在任务取消时同步调用）"""
+        if self.alive:
+            self.process.kill()
+
+        if self.stderr_task:
+            self.stderr_task.cancel()
+            self.stderr_task = None
+
+    async def kill(self):
+        """终止工作进程并等待退出"""
+        alive = self.alive
+        self.terminate()
+        if alive:
+            await self.process.wait()
+
+    async def close(self):
+        """优雅关闭工作进程"""
+        if self.alive:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), 2)
+            except asyncio.TimeoutError:
+                pass
+        await self.kill()
+
+
+class CodeWorkerPool:
+    """预热代码执行池"""
+
+    def __init__(self, pool_size: int = 2, max_runs_per_worker: int = 50,
+                 timeout: float = 30.0, cpu_limit: int = 30, memory_limit_mb: int = 512,
+                 acquire_timeout: Optional[float] = None):
+        """
+        Args:
+            acquire_timeout: 等待空闲工作进程的最长时间，默认与执行超时相同
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.pool_size = pool_size
+        self.max_runs_per_worker = max_runs_per_worker
+        self.timeout = timeout
+        self.cpu_limit = cpu_limit
+        self.memory_limit_mb = memory_limit_mb
+        self.acquire_timeout = acquire_timeout or timeout
+
+        self.idle_workers: asyncio.Queue = asyncio.Queue()
+        # 池拥有的工作进程数（空闲 + 执行中 + 正在替换）
+        self.worker_count = 0
+        # 正在执行任务的工作进程，close() 时一并终止
+        self.busy_workers = set()
+        self.workdir = None
+        self.started = False
+
+        self.stats = {
+            "executions": 0,
+            "successful_executions": 0,
+            "timeouts": 0,
+            "crashes": 0,
+            "workers_started": 0,
+            "workers_recycled": 0,
+            "spawn_failures": 0,
+            "average_execution_time": 0.0
+        }
+
+    async def start(self):
+        """预先启动所有工作进程"""
+        if self.started:
+            return
+
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="claude-sync-exec-")
+
+        for _ in range(self.pool_size - self.worker_count):
+            await self.idle_workers.put(await self._spawn_worker())
+            self.worker_count += 1
+
+        self.started = True
+
+        self.logger.info(f"🔥 代码执行池已预热: {self.pool_size} 个工作进程")
+
+    async def _spawn_worker(self) -> CodeWorker:
+        worker = CodeWorker(self.memory_limit_mb, self.workdir)
+        await worker.start()
+        self.stats["workers_started"] += 1
+        return worker
+
+    async def execute(self, code: str, timeout: float = None,
+                      output_callback: Optional[OutputCallback] = None) -> Dict[str, Any]:
+        """在空闲工作进程中执行代码"""
+        if not self.started:
+            await self.start()
+
+        timeout = timeout or self.timeout
+        worker = await self._acquire_worker()
+        self.busy_workers.add(worker)
+
+        try:
+            result = await worker.run(code, timeout, self.cpu_limit, output_callback)
+        except Exception as e:
+            await worker.kill()
+            result = {"success": False, "output": "", "error": str(e), "execution_time": 0}
+        except BaseException:
+            # 任务被取消：工作进程可能仍在执行，终止并替换后重新抛出
+            if worker in self.busy_workers:
+                self.busy_workers.discard(worker)
+                worker.terminate()
+                self.stats["workers_recycled"] += 1
+                self._release_slot()
+            raise
+
+        self._update_stats(result)
+
+        if worker not in self.busy_workers:
+            # 执行期间池已关闭，close() 已终止该进程并释放名额
+            return result
+        self.busy_workers.discard(worker)
+
+        # 崩溃、超时或达到运行次数上限时替换为新进程
+        if not worker.alive or worker.runs >= self.max_runs_per_worker:
+            if not worker.alive:
+                self.stats["timeouts" if result.get("timed_out") else "crashes"] += 1
+            await worker.close()
+            self.stats["workers_recycled"] += 1
+            self._release_slot()
+        else:
+            await self.idle_workers.put(worker)
+
+        return result
+
+    def _release_slot(self):
+        """工作进程被回收后：池仍在运行时在后台替换，已关闭时释放名额"""
+        if self.started:
+            asyncio.create_task(self._replace_worker())
+        else:
+            self.worker_count -= 1
+
+    async def _acquire_worker(self) -> CodeWorker:
+        """取得空闲工作进程；后台替换失败导致池缩小时直接补充（启动失败的异常抛给调用方）"""
+        if self.idle_workers.empty() and self.worker_count < self.pool_size:
+            self.worker_count += 1
+            try:
+                return await self._spawn_worker()
+            except BaseException:
+                self.worker_count -= 1
+                self.stats["spawn_failures"] += 1
+                raise
+
+        try:
+            return await asyncio.wait_for(self.idle_workers.get(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"等待空闲工作进程超时（{self.acquire_timeout}s）")
+
+    async def _replace_worker(self):
+        try:
+            worker = await self._spawn_worker()
+            if not self.started:
+                # 替换期间池已关闭
+                await worker.close()
+                self.worker_count -= 1
+                return
+            await self.idle_workers.put(worker)
+        except Exception as e:
+            # 名额释放后，下一次 execute 会在前台重新启动并把失败原因返回给调用方
+            self.worker_count -= 1
+            self.stats["spawn_failures"] += 1
+            self.logger.error(f"替换工作进程失败: {e}")
+
+    def _update_stats(self, result: Dict[str, Any]):
+        self.stats["executions"] += 1
+        if result.get("success"):
+            self.stats["successful_executions"] += 1
+
+        total_time = self.stats["average_execution_time"] * (self.stats["executions"] - 1)
+        self.stats["average_execution_time"] = (total_time + result.get("execution_time", 0)) / self.stats["executions"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pool_size": self.pool_size, "idle_workers": self.idle_workers.qsize()}
+
+    async def close(self):
+        """关闭所有工作进程：空闲的优雅退出，执行中的直接终止"""
+        self.started = False
+        while not self.idle_workers.empty():
+            worker = self.idle_workers.get_nowait()
+            await worker.close()
+            self.worker_count -= 1
+
+        busy, self.busy_workers = self.busy_workers, set()
+        for worker in busy:
+            await worker.kill()
+            self.worker_count -= 1
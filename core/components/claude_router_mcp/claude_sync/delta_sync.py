@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Delta Sync Protocol - 增量文件同步协议
+基于行级 diff 的增量同步：每个文件维护版本向量，增量帧可压缩并批量发送，
+版本不一致时回退到全量传输，落盘采用写临时文件再原子重命名
+"""
+
+import asyncio
+import base64
+import difflib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Any, Callable, Awaitable, List
+
+logger = logging.getLogger(__name__)
+
+# 帧编码方式
+FRAME_ENCODING_JSON = "json"
+FRAME_ENCODING_ZLIB = "zlib+base64"
+
+
+def content_hash(content: str) -> str:
+    """计算文件内容哈希"""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def compute_line_delta(old_content: str, new_content: str) -> List[list]:
+    """计算行级增量
+
+    返回操作列表：
+    - ["c", start, end]  复制旧内容的 [start, end) 行
+    - ["i", [lines...]]  插入新行
+    """
+    old_lines = old_content.splitlines(keepends=True)
+    new_lines = new_content.splitlines(keepends=True)
+
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(["i", new_lines[j1:j2]])
+        # delete: 不复制即可
+
+    return ops
+
+
+def apply_line_delta(old_content: str, ops: List[list]) -> str:
+    """将行级增量应用到旧内容上"""
+    old_lines = old_content.splitlines(keepends=True)
+    parts = []
+
+    for op in ops:
+        if op[0] == "c":
+            start, end = op[1], op[2]
+            if start < 0 or end > len(old_lines) or start > end:
+                raise ValueError(f"增量复制范围越界: [{start}, {end})")
+            parts.extend(old_lines[start:end])
+        elif op[0] == "i":
+            parts.extend(op[1])
+        else:
+            raise ValueError(f"未知增量操作: {op[0]}")
+
+    return "".join(parts)
+
+
+def increment_version(version: Dict[str, int], node_id: str) -> Dict[str, int]:
+    """返回在 node_id 上递增后的新版本向量"""
+    new_version = dict(version)
+    new_version[node_id] = new_version.get(node_id, 0) + 1
+    return new_version
+
+
+def merge_versions(a: Dict[str, int], b: Dict[str, int]) -> Dict[str, int]:
+    """合并两个版本向量（逐项取最大值）"""
+    merged = dict(a)
+    for node, counter in b.items():
+        merged[node] = max(merged.get(node, 0), counter)
+    return merged
+
+
+def atomic_write(file_path: str, content: str):
+    """原子写入：写入同目录临时文件，fsync 后重命名覆盖目标文件"""
+    directory = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".sync-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # 保留原文件权限
+        if os.path.exists(file_path):
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o777)
+
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def encode_frame(messages: List[Dict[str, Any]], compress: bool = True,
+                 compress_threshold: int = 1024) -> Dict[str, Any]:
+    """将一批同步消息编码为一帧，超过阈值时压缩"""
+    payload = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+
+    if compress and len(payload) >= compress_threshold:
+        compressed = zlib.compress(payload.encode("utf-8"), 6)
+        return {
+            "type": "sync_batch",
+            "encoding": FRAME_ENCODING_ZLIB,
+            "count": len(messages),
+            "payload": base64.b64encode(compressed).decode("ascii")
+        }
+
+    return {
+        "type": "sync_batch",
+        "encoding": FRAME_ENCODING_JSON,
+        "count": len(messages),
+        "payload": messages
+    }
+
+
+def decode_frame(frame: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """解码同步帧，返回其中的消息列表"""
+    encoding = frame.get("encoding", FRAME_ENCODING_JSON)
+
+    if encoding == FRAME_ENCODING_ZLIB:
+        raw = zlib.decompress(base64.b64decode(frame["payload"]))
+        return json.loads(raw.decode("utf-8"))
+    if encoding == FRAME_ENCODING_JSON:
+        return frame.get("payload", [])
+
+    raise ValueError(f"未知帧编码: {encoding}")
+
+
+@dataclass
+class FileSyncState:
+    """文件同步状态（双方已确认的基线）"""
+    file_path: str
+    content: str
+    content_hash: str
+    version: Dict[str, int] = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+
+
+class DeltaSyncEngine:
+    """增量同步引擎：生成/应用增量或全量更新，维护每个文件的版本向量"""
+
+    def __init__(self, node_id: str, min_delta_size: int = 256):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.node_id = node_id
+        # 小于该大小的文件直接全量发送，避免 diff 开销
+        self.min_delta_size = min_delta_size
+        self.files: Dict[str, FileSyncState] = {}
+
+        self.stats = {
+            "delta_updates_sent": 0,
+            "full_updates_sent": 0,
+            "delta_updates_applied": 0,
+            "full_updates_applied": 0,
+            "version_mismatches": 0,
+            "bytes_saved": 0
+        }
+
+    def prepare_update(self, file_path: str, new_content: str, force_full: bool = False,
+                       advance: bool = True) -> Dict[str, Any]:
+        """为本地修改生成同步消息（优先增量，必要时全量）
+
+        advance=False 时不更新基线，由调用方在对端收到消息后调用 record_local_content 推进
+        """
+        state = self.files.get(file_path)
+        base_version = state.version if state else {}
+        new_version = increment_version(base_version, self.node_id)
+        new_hash = content_hash(new_content)
+
+        message = {
+            "file_path": file_path,
+            "version": new_version,
+            "content_hash": new_hash
+        }
+
+        ops = None
+        if state and not force_full and len(new_content) >= self.min_delta_size:
+            ops = compute_line_delta(state.content, new_content)
+            delta_size = len(json.dumps(ops, ensure_ascii=False))
+            # 增量比全量还大时没有意义
+            if delta_size >= len(new_content):
+                ops = None
+            else:
+                self.stats["bytes_saved"] += len(new_content) - delta_size
+
+        if ops is not None:
+            message.update({
+                "mode": "delta",
+                "base_version": base_version,
+                "base_hash": state.content_hash,
+                "ops": ops
+            })
+            self.stats["delta_updates_sent"] += 1
+        else:
+            message.update({"mode": "full", "content": new_content})
+            self.stats["full_updates_sent"] += 1
+
+        if advance:
+            self.files[file_path] = FileSyncState(file_path, new_content, new_hash, new_version)
+        return message
+
+    def apply_update(self, message: Dict[str, Any], write_to_disk: bool = True) -> Dict[str, Any]:
+        """应用远端同步消息；版本不一致时返回 resync_required"""
+        file_path = message["file_path"]
+        mode = message.get("mode", "full")
+        state = self.files.get(file_path)
+
+        if mode == "delta":
+            base_version = message.get("base_version", {})
+            if (state is None or state.version != base_version
+                    or state.content_hash != message.get("base_hash")):
+                self.stats["version_mismatches"] += 1
+                return {
+                    "success": False,
+                    "resync_required": True,
+                    "file_path": file_path,
+                    "error": "版本不一致，需要全量同步"
+                }
+            new_content = apply_line_delta(state.content, message["ops"])
+        else:
+            new_content = message["content"]
+
+        new_hash = content_hash(new_content)
+        if message.get("content_hash") and new_hash != message["content_hash"]:
+            self.stats["version_mismatches"] += 1
+            return {
+                "success": False,
+                "resync_required": True,
+                "file_path": file_path,
+                "error": "内容校验失败，需要全量同步"
+            }
+
+        if write_to_disk:
+            atomic_write(file_path, new_content)
+
+        version = message.get("version", {})
+        if mode == "full" and state is not None:
+            version = merge_versions(state.version, version)
+
+        self.files[file_path] = FileSyncState(file_path, new_content, new_hash, version)
+        self.stats["delta_updates_applied" if mode == "delta" else "full_updates_applied"] += 1
+
+        return {
+            "success": True,
+            "file_path": file_path,
+            "mode": mode,
+            "version": version,
+            "message": f"代码已{'增量' if mode == 'delta' else '全量'}同步到本地文件: {file_path}"
+        }
+
+    def record_local_content(self, file_path: str, content: str, version: Dict[str, int] = None):
+        """记录双方已一致的文件内容（例如全量写入之后）"""
+        state = self.files.get(file_path)
+        if version is None:
+            version = increment_version(state.version if state else {}, self.node_id)
+        self.files[file_path] = FileSyncState(file_path, content, content_hash(content), version)
+
+    def forget(self, file_path: str):
+        """丢弃文件基线，下一次同步将全量传输"""
+        self.files.pop(file_path, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "tracked_files": len(self.files)}
+
+
+class EditBatcher:
+    """编辑批处理器：合并同一文件的连续修改，按时间窗口或大小阈值批量发送"""
+
+    def __init__(self, engine: DeltaSyncEngine,
+                 send_frame: Callable[[Dict[str, Any]], Awaitable[None]],
+                 flush_interval: float = 0.05, max_batch_bytes: int = 256 * 1024,
+                 compress: bool = True, compress_threshold: int = 1024):
+        self.engine = engine
+        self.send_frame = send_frame
+        self.flush_interval = flush_interval
+        self.max_batch_bytes = max_batch_bytes
+        self.compress = compress
+        self.compress_threshold = compress_threshold
+
+        # file_path -> (最新内容, 是否强制全量)
+        self.pending: Dict[str, tuple] = {}
+        self.pending_bytes = 0
+        self.flush_task = None
+        self.lock = asyncio.Lock()
+
+        self.stats = {
+            "edits_received": 0,
+            "edits_coalesced": 0,
+            "frames_sent": 0,
+            "frame_bytes_sent": 0
+        }
+
+    async def submit(self, file_path: str, content: str, force_full: bool = False):
+        """提交一次文件修改"""
+        self.stats["edits_received"] += 1
+
+        if file_path in self.pending:
+            self.stats["edits_coalesced"] += 1
+            previous, previous_force = self.pending[file_path]
+            self.pending_bytes -= len(previous)
+            force_full = force_full or previous_force
+
+        self.pending[file_path] = (content, force_full)
+        self.pending_bytes += len(content)
+
+        if self.pending_bytes >= self.max_batch_bytes:
+            await self.flush()
+        elif self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """立即发送所有待处理修改"""
+        async with self.lock:
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+            self.pending_bytes = 0
+
+            # 基线在发送成功后才推进，发送失败时下一次仍基于对端已有的版本生成增量
+            messages = [
+                self.engine.prepare_update(path, content, force_full=force_full, advance=False)
+                for path, (content, force_full) in pending.items()
+            ]
+            frame = encode_frame(messages, self.compress, self.compress_threshold)
+
+            try:
+                await self.send_frame(frame)
+            except BaseException:
+                self._requeue(pending)
+                raise
+
+            for message, (path, (content, _)) in zip(messages, pending.items()):
+                self.engine.record_local_content(path, content, message["version"])
+
+            self.stats["frames_sent"] += 1
+            payload = frame["payload"]
+            self.stats["frame_bytes_sent"] += len(payload) if isinstance(payload, str) else len(json.dumps(payload))
+
+    def _requeue(self, pending: Dict[str, tuple]):
+        """发送失败的修改放回队列；发送期间又有新修改的文件保留新内容"""
+        for path, (content, force_full) in pending.items():
+            if path in self.pending:
+                newer, newer_force = self.pending[path]
+                self.pending[path] = (newer, newer_force or force_full)
+            else:
+                self.pending[path] = (content, force_full)
+                self.pending_bytes += len(content)
+
+    async def close(self):
+        """刷新剩余修改并停止定时任务"""
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        await self.flush()
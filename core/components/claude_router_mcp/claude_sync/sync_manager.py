@@ -7,6 +7,7 @@ Claude Code Sync Manager - Claude Code 同步管理器
 import asyncio
 import json
 import logging
+import time
 from typing import Dict, Any, Optional, Callable, List
 import httpx
 from dataclasses import dataclass, asdict
@@ -14,6 +15,9 @@ from datetime import datetime
 from enum import Enum
 import uuid
 
+from .delta_sync import DeltaSyncEngine, EditBatcher, atomic_write, decode_frame
+from .code_worker_pool import CodeWorkerPool
+
 # 可选依赖处理
 try:
     import websockets
@@ -88,18 +92,42 @@ class ClaudeSyncManager:
         self.event_handlers = {}
         self.sync_callbacks = []
         
+        # 增量同步：版本向量 + 行级 diff，编辑按窗口批量压缩发送
+        self.node_id = self.config.get("node_id") or f"local-{uuid.uuid4().hex[:8]}"
+        self.delta_engine = DeltaSyncEngine(self.node_id)
+        self.edit_batcher = EditBatcher(
+            self.delta_engine,
+            self._send_to_claudeditor,
+            flush_interval=self.config.get("batch_interval", 0.05),
+            max_batch_bytes=self.config.get("max_batch_bytes", 256 * 1024),
+            compress=self.config.get("enable_compression", True),
+            compress_threshold=self.config.get("compress_threshold", 1024)
+        )
+        
+        # 代码执行：预热的沙箱工作进程池
+        self.code_worker_pool = CodeWorkerPool(
+            pool_size=self.config.get("exec_pool_size", 2),
+            max_runs_per_worker=self.config.get("exec_max_runs_per_worker", 50),
+            timeout=self.config.get("exec_timeout", 30),
+            cpu_limit=self.config.get("exec_cpu_limit", 30),
+            memory_limit_mb=self.config.get("exec_memory_limit_mb", 512)
+        )
+        
         # 统计信息
         self.stats = {
             "total_syncs": 0,
             "successful_syncs": 0,
             "failed_syncs": 0,
             "bytes_synced": 0,
+            "resync_requests": 0,
             "start_time": datetime.now().isoformat()
         }
         
         # 任务管理
         self.sync_task = None
         self.heartbeat_task = None
+        # 进行中的代码执行任务（持有引用，避免任务被回收；清理时取消）
+        self.execute_tasks = set()
         self.running = False
     
     def _get_default_config(self) -> Dict[str, Any]:
@@ -112,7 +140,16 @@ class ClaudeSyncManager:
             "sync_timeout": 60,
             "max_retries": 3,
             "enable_compression": True,
-            "enable_encryption": False
+            "enable_encryption": False,
+            "enable_delta_sync": True,
+            "batch_interval": 0.05,
+            "max_batch_bytes": 256 * 1024,
+            "compress_threshold": 1024,
+            "exec_pool_size": 2,
+            "exec_max_runs_per_worker": 50,
+            "exec_timeout": 30,
+            "exec_cpu_limit": 30,
+            "exec_memory_limit_mb": 512
         }
     
     async def initialize(self) -> bool:
@@ -140,6 +177,12 @@ class ClaudeSyncManager:
         
         self.running = True
         
+        # 预热代码执行池
+        try:
+            await self.code_worker_pool.start()
+        except Exception as e:
+            self.logger.warning(f"⚠️ 代码执行池预热失败，将在首次执行时重试: {e}")
+        
         # 启动同步处理任务
         self.sync_task = asyncio.create_task(self._sync_processor())
         
@@ -209,8 +252,19 @@ class ClaudeSyncManager:
             
             if message_type == "code_sync":
                 await self._handle_code_sync_message(data)
+            elif message_type == "code_delta":
+                await self._handle_delta_messages([data], len(json.dumps(data)))
+            elif message_type == "sync_batch":
+                payload = data.get("payload", "")
+                wire_bytes = len(payload) if isinstance(payload, str) else len(json.dumps(payload))
+                await self._handle_delta_messages(decode_frame(data), wire_bytes)
+            elif message_type == "resync_request":
+                await self._handle_resync_request(data)
             elif message_type == "execute_request":
-                await self._handle_execute_request(data)
+                # 代码执行可能持续数十秒，放到独立任务中，不阻塞后续同步帧的接收
+                task = asyncio.create_task(self._handle_execute_request(data))
+                self.execute_tasks.add(task)
+                task.add_done_callback(self.execute_tasks.discard)
             elif message_type == "heartbeat":
                 await self._handle_heartbeat(data)
             else:
@@ -239,14 +293,68 @@ class ClaudeSyncManager:
         except Exception as e:
             self.logger.error(f"处理代码同步消息失败: {e}")
     
+    async def _handle_delta_messages(self, messages: List[Dict[str, Any]], wire_bytes: int):
+        """处理增量同步消息（单条或批量帧解码后的消息）"""
+        per_message_bytes = wire_bytes // max(len(messages), 1)
+        
+        for message in messages:
+            sync_request = CodeSyncRequest(
+                request_id=message.get("request_id", str(uuid.uuid4())),
+                action="apply_delta",
+                code_content="",
+                file_path=message.get("file_path", ""),
+                language=message.get("language", "python"),
+                metadata={"sync_message": message, "wire_bytes": per_message_bytes}
+            )
+            await self.sync_queue.put(sync_request)
+        
+        self.logger.info(f"📥 收到增量同步消息: {len(messages)} 条")
+    
+    async def _handle_resync_request(self, data: Dict[str, Any]):
+        """ClaudeEditor 版本不一致，重新全量发送本地文件"""
+        file_path = data.get("file_path", "")
+        self.stats["resync_requests"] += 1
+        
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except OSError as e:
+            self.logger.error(f"全量重同步读取文件失败: {file_path} - {e}")
+            return
+        
+        await self.edit_batcher.submit(file_path, content, force_full=True)
+        self.logger.info(f"🔁 全量重同步: {file_path}")
+    
+    async def sync_file_to_claudeditor(self, file_path: str, content: str):
+        """将本地文件修改同步到 ClaudeEditor（增量 + 批量发送）"""
+        if not self.config.get("enable_delta_sync", True):
+            await self._send_to_claudeditor({
+                "type": "code_sync",
+                "request_id": str(uuid.uuid4()),
+                "action": "sync_to_local",
+                "file_path": file_path,
+                "code_content": content
+            })
+            return
+        
+        await self.edit_batcher.submit(file_path, content)
+    
     async def _handle_execute_request(self, data: Dict[str, Any]):
         """处理代码执行请求"""
         try:
             request_id = data.get("request_id", str(uuid.uuid4()))
             code_content = data.get("code_content", "")
             
-            # 执行代码
-            result = await self._execute_code_locally(code_content)
+            # 执行代码，输出实时转发给 ClaudeEditor
+            async def forward_output(stream: str, data: str):
+                await self._send_to_claudeditor({
+                    "type": "execute_output",
+                    "request_id": request_id,
+                    "stream": stream,
+                    "data": data
+                })
+            
+            result = await self._execute_code_locally(code_content, forward_output)
             
             # 发送执行结果
             response = {
@@ -255,6 +363,7 @@ class ClaudeSyncManager:
                 "success": result.get("success", False),
                 "output": result.get("output", ""),
                 "error": result.get("error", ""),
+                "timed_out": result.get("timed_out", False),
                 "execution_time": result.get("execution_time", 0)
             }
             
@@ -265,47 +374,12 @@ class ClaudeSyncManager:
         except Exception as e:
             self.logger.error(f"处理代码执行请求失败: {e}")
     
-    async def _execute_code_locally(self, code_content: str) -> Dict[str, Any]:
-        """本地执行代码"""
+    async def _execute_code_locally(self, code_content: str,
+                                    output_callback: Optional[Callable] = None) -> Dict[str, Any]:
+        """本地执行代码（预热的沙箱工作进程池，不阻塞同步循环）"""
         try:
-            import subprocess
-            import tempfile
-            import os
-            
-            # 创建临时文件
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(code_content)
-                temp_file = f.name
+            return await self.code_worker_pool.execute(code_content, output_callback=output_callback)
             
-            try:
-                # 执行代码
-                start_time = time.time()
-                result = subprocess.run(
-                    ['python', temp_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                )
-                execution_time = time.time() - start_time
-                
-                return {
-                    "success": result.returncode == 0,
-                    "output": result.stdout,
-                    "error": result.stderr,
-                    "execution_time": execution_time
-                }
-                
-            finally:
-                # 清理临时文件
-                os.unlink(temp_file)
-                
-        except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "output": "",
-                "error": "代码执行超时",
-                "execution_time": 30
-            }
         except Exception as e:
             return {
                 "success": False,
@@ -342,6 +416,8 @@ class ClaudeSyncManager:
             
             if request.action == "sync_to_local":
                 result = await self._sync_to_local(request)
+            elif request.action == "apply_delta":
+                result = await self._apply_sync_update(request)
             elif request.action == "sync_to_cloud":
                 result = await self._sync_to_cloud(request)
             elif request.action == "execute_code":
@@ -354,10 +430,20 @@ class ClaudeSyncManager:
             # 更新统计
             if result.get("success", False):
                 self.stats["successful_syncs"] += 1
-                self.stats["bytes_synced"] += len(request.code_content.encode('utf-8'))
+                self.stats["bytes_synced"] += request.metadata.get(
+                    "wire_bytes", len(request.code_content.encode('utf-8'))
+                )
             else:
                 self.stats["failed_syncs"] += 1
             
+            # 版本不一致，请求对端回退到全量传输
+            if result.get("resync_required"):
+                await self._send_to_claudeditor({
+                    "type": "resync_request",
+                    "request_id": request.request_id,
+                    "file_path": request.file_path
+                })
+            
             # 记录同步历史
             sync_event = SyncEvent(
                 event_id=request.request_id,
@@ -392,12 +478,11 @@ class ClaudeSyncManager:
         """同步到本地"""
         try:
             if request.file_path:
-                # 写入文件
-                import os
-                os.makedirs(os.path.dirname(request.file_path), exist_ok=True)
-                
-                with open(request.file_path, 'w', encoding='utf-8') as f:
-                    f.write(request.code_content)
+                # 原子写入文件，并记录为增量同步的新基线
+                atomic_write(request.file_path, request.code_content)
+                self.delta_engine.record_local_content(
+                    request.file_path, request.code_content, request.metadata.get("version")
+                )
                 
                 return {
                     "success": True,
@@ -416,14 +501,40 @@ class ClaudeSyncManager:
                 "error": str(e)
             }
     
+    async def _apply_sync_update(self, request: CodeSyncRequest) -> Dict[str, Any]:
+        """应用增量/全量同步消息，写入采用原子重命名"""
+        try:
+            message = request.metadata["sync_message"]
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.delta_engine.apply_update, message)
+            
+        except Exception as e:
+            # 增量无法应用时丢弃基线，下次回退到全量
+            self.delta_engine.forget(request.file_path)
+            return {
+                "success": False,
+                "resync_required": True,
+                "error": str(e)
+            }
+    
     async def _sync_to_cloud(self, request: CodeSyncRequest) -> Dict[str, Any]:
-        """同步到云端"""
+        """本地文件修改同步到 ClaudeEditor（未附带内容时读取本地文件），经增量批量通道发送"""
         try:
-            # 这里可以实现云端同步逻辑
-            # 目前返回成功状态
+            if not request.file_path:
+                return {
+                    "success": False,
+                    "error": "同步到 ClaudeEditor 需要 file_path"
+                }
+            
+            content = request.code_content
+            if not content:
+                with open(request.file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            
+            await self.sync_file_to_claudeditor(request.file_path, content)
             return {
                 "success": True,
-                "message": "代码已同步到云端"
+                "message": f"本地修改已同步到 ClaudeEditor: {request.file_path}"
             }
             
         except Exception as e:
@@ -498,7 +609,12 @@ class ClaudeSyncManager:
             "stats": self.stats,
             "config": self.config,
             "queue_size": self.sync_queue.qsize(),
-            "active_syncs": len(self.active_syncs)
+            "active_syncs": len(self.active_syncs),
+            "delta_sync": {
+                **self.delta_engine.get_stats(),
+                **self.edit_batcher.stats
+            },
+            "code_execution": self.code_worker_pool.get_stats()
         }
     
     def get_sync_history(self, limit: int = 50) -> List[Dict[str, Any]]:
@@ -513,6 +629,18 @@ class ClaudeSyncManager:
             
             self.running = False
             
+            # 发送剩余的批量修改
+            await self.edit_batcher.close()
+            
+            # 取消进行中的代码执行
+            for task in list(self.execute_tasks):
+                task.cancel()
+            if self.execute_tasks:
+                await asyncio.gather(*self.execute_tasks, return_exceptions=True)
+            
+            # 关闭代码执行池
+            await self.code_worker_pool.close()
+            
             # 关闭 WebSocket 连接
             if self.websocket:
                 await self.websocket.close()
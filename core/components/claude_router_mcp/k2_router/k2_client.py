@@ -14,6 +14,11 @@ from dataclasses import dataclass, asdict
 from datetime import datetime
 import uuid
 
+from .resilience import (
+    CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceededError, LatencyTracker,
+    full_jitter_backoff, is_retryable_status, parse_retry_after
+)
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -48,6 +53,15 @@ class K2Response:
         if self.usage is None:
             self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
 
+@dataclass
+class K2StreamChunk:
+    """K2 流式响应片段"""
+    request_id: str
+    index: int
+    delta: str
+    finish_reason: Optional[str] = None
+    elapsed: float = 0.0
+
 class K2Client:
     """K2 服务客户端"""
     
@@ -68,9 +82,19 @@ class K2Client:
             "failed_requests": 0,
             "total_cost": 0.0,
             "average_response_time": 0.0,
+            "streamed_requests": 0,
+            "average_time_to_first_token": 0.0,
+            "retries": 0,
+            "hedged_requests": 0,
+            "hedge_wins": 0,
+            "circuit_rejections": 0,
             "start_time": datetime.now().isoformat()
         }
         
+        # 弹性层：按端点熔断器和延迟窗口（用于对冲请求）
+        self.circuit_breakers: Dict[str, CircuitBreaker] = {}
+        self.latency_tracker = LatencyTracker()
+        
         # 请求历史（用于调试）
         self.request_history = []
         self.max_history_size = 100
@@ -88,7 +112,13 @@ class K2Client:
             "enabled": True,
             "timeout": 30,
             "max_retries": 3,
-            "retry_delay": 1.0
+            "retry_delay": 1.0,
+            "max_retry_delay": 10.0,
+            "deadline": 60.0,
+            "hedge_requests": False,
+            "hedge_percentile": 95,
+            "circuit_failure_threshold": 5,
+            "circuit_recovery_timeout": 30.0
         }
     
     async def initialize(self) -> bool:
@@ -113,6 +143,10 @@ class K2Client:
     
     async def route_ai_request(self, request: K2Request) -> K2Response:
         """路由 AI 请求到 K2 服务"""
+        # 流式请求：逐片段接收后聚合为完整响应
+        if request.stream:
+            return await self._collect_stream(request)
+        
         start_time = time.time()
         
         try:
@@ -181,42 +215,309 @@ class K2Client:
         }
     
     async def _send_k2_request(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
-        """发送 K2 请求"""
+        """发送 K2 请求（抖动退避重试 + 截止时间预算 + 对冲请求 + 熔断器）"""
         headers = {
             "Authorization": f"Bearer {self.config['api_key']}",
             "Content-Type": "application/json"
         }
         
         url = f"{self.config['url']}/chat/completions"
+        breaker = self._get_circuit_breaker(url)
+        deadline = Deadline(self.config.get("deadline", 60.0))
         
         # 重试机制
         max_retries = self.config.get("max_retries", 3)
         retry_delay = self.config.get("retry_delay", 1.0)
+        max_retry_delay = self.config.get("max_retry_delay", 10.0)
+        last_error = None
         
         for attempt in range(max_retries + 1):
+            if deadline.expired():
+                break
+            
+            if not breaker.allow_request():
+                self.stats["circuit_rejections"] += 1
+                raise CircuitOpenError(f"K2 端点熔断中: {url}")
+            
+            retry_after = None
+            attempt_start = time.monotonic()
+            # 本次尝试是否已记录结果；被取消或抛出其他异常时在 finally 中按失败记录，
+            # 否则 half_open 的探测名额不会释放，熔断器将一直拒绝请求
+            recorded = False
+            
             try:
-                response = await self.http_client.post(
-                    url,
-                    json=request_data,
-                    headers=headers
+                try:
+                    response = await self._post_with_hedge(url, request_data, headers, deadline, breaker)
+                    
+                except (httpx.TransportError, asyncio.TimeoutError) as e:
+                    breaker.record_failure()
+                    recorded = True
+                    last_error = Exception(f"请求异常: {type(e).__name__}: {e}")
+                    
+                else:
+                    if response.status_code < 400:
+                        breaker.record_success()
+                        recorded = True
+                        self.latency_tracker.record(time.monotonic() - attempt_start)
+                        return response.json()
+                    
+                    if not is_retryable_status(response.status_code):
+                        # 端点本身可用，客户端错误不计入熔断，也不重试
+                        breaker.record_success()
+                        recorded = True
+                        raise Exception(f"HTTP 错误 {response.status_code}: {response.text}")
+                    
+                    breaker.record_failure()
+                    recorded = True
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    last_error = Exception(f"HTTP 错误 {response.status_code}: {response.text}")
+            finally:
+                if not recorded:
+                    breaker.record_failure()
+            
+            if attempt == max_retries:
+                break
+            
+            delay = retry_after if retry_after is not None else full_jitter_backoff(attempt, retry_delay, max_retry_delay)
+            if delay >= deadline.remaining():
+                break
+            
+            self.stats["retries"] += 1
+            self.logger.warning(f"请求失败，{delay:.2f}s 后重试 {attempt + 1}/{max_retries}: {last_error}")
+            await asyncio.sleep(delay)
+        
+        if last_error is None or deadline.expired():
+            raise DeadlineExceededError(f"K2 请求超出截止时间预算 {deadline.budget:.1f}s: {last_error}")
+        raise last_error
+    
+    async def _post_with_hedge(self, url: str, request_data: Dict[str, Any], headers: Dict[str, str],
+                               deadline: Deadline, breaker: CircuitBreaker) -> httpx.Response:
+        """发送一次请求；若超过 p95 延迟仍未返回，则发出一个对冲副本，取先返回者"""
+        timeout = min(self.config.get("timeout", 30), deadline.remaining())
+        
+        async def post_once() -> httpx.Response:
+            return await self.http_client.post(url, json=request_data, headers=headers, timeout=timeout)
+        
+        hedge_delay = self.latency_tracker.percentile(self.config.get("hedge_percentile", 95))
+        if (not self.config.get("hedge_requests", False) or hedge_delay is None
+                or hedge_delay >= timeout or breaker.state != CircuitBreaker.CLOSED):
+            return await asyncio.wait_for(post_once(), timeout)
+        
+        pending = {asyncio.create_task(post_once())}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return done.pop().result()
+            
+            self.stats["hedged_requests"] += 1
+            hedge_task = asyncio.create_task(post_once())
+            pending.add(hedge_task)
+            
+            last_error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
                 )
+                if not done:
+                    raise asyncio.TimeoutError()
                 
-                response.raise_for_status()
-                return response.json()
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+            
+            raise last_error
+            
+        finally:
+            # 取消较慢的副本，释放共享连接池
+            for task in pending:
+                task.cancel()
+    
+    def _get_circuit_breaker(self, endpoint: str) -> CircuitBreaker:
+        """获取（或创建）端点对应的熔断器"""
+        if endpoint not in self.circuit_breakers:
+            self.circuit_breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                failure_threshold=self.config.get("circuit_failure_threshold", 5),
+                recovery_timeout=self.config.get("circuit_recovery_timeout", 30.0)
+            )
+        return self.circuit_breakers[endpoint]
+    
+    async def stream_ai_request(self, request: K2Request) -> AsyncGenerator[K2StreamChunk, None]:
+        """流式路由 AI 请求到 K2 服务，逐个返回增量片段"""
+        start_time = time.time()
+        first_token_time = None
+        content_parts = []
+        usage = {}
+        index = 0
+        success = False
+        error_message = ""
+        
+        try:
+            self.logger.info(f"🔄 流式路由 AI 请求到 K2: {request.request_type} - {request.request_id}")
+            
+            if not self.config["enabled"]:
+                raise Exception("K2 服务未启用")
+            
+            k2_request_data = self._build_k2_request(request)
+            k2_request_data["stream"] = True
+            
+            async for event_data in self._send_k2_stream_request(k2_request_data):
+                if event_data == "[DONE]":
+                    break
+                
+                chunk_data = json.loads(event_data)
+                if chunk_data.get("usage"):
+                    usage = chunk_data["usage"]
                 
-            except httpx.HTTPStatusError as e:
-                if attempt == max_retries:
-                    raise Exception(f"HTTP 错误 {e.response.status_code}: {e.response.text}")
+                choices = chunk_data.get("choices") or []
+                if not choices:
+                    continue
                 
-                self.logger.warning(f"请求失败，重试 {attempt + 1}/{max_retries}: {e}")
-                await asyncio.sleep(retry_delay * (attempt + 1))
+                choice = choices[0]
+                delta = (choice.get("delta") or {}).get("content") or choice.get("text") or ""
+                finish_reason = choice.get("finish_reason")
+                if not delta and not finish_reason:
+                    continue
                 
-            except Exception as e:
-                if attempt == max_retries:
-                    raise e
+                elapsed = time.time() - start_time
+                if delta and first_token_time is None:
+                    first_token_time = elapsed
+                
+                content_parts.append(delta)
+                yield K2StreamChunk(
+                    request_id=request.request_id,
+                    index=index,
+                    delta=delta,
+                    finish_reason=finish_reason,
+                    elapsed=elapsed
+                )
+                index += 1
+            
+            success = True
+            
+        except Exception as e:
+            error_message = str(e)
+            self.logger.error(f"❌ K2 流式路由失败: {request.request_id} - {error_message}")
+            raise
+            
+        finally:
+            # 无论正常结束、异常还是调用方提前关闭，都记录统计
+            response_time = time.time() - start_time
+            if not success and not error_message:
+                error_message = "流式请求被调用方中断"
+            k2_response = K2Response(
+                request_id=request.request_id,
+                success=success,
+                content="".join(content_parts),
+                usage=usage or None,
+                response_time=response_time,
+                error_message=error_message
+            )
+            k2_response.cost = self._calculate_cost(k2_response.usage) if success else 0.0
+            
+            self._update_stats(success, response_time, k2_response.cost, time_to_first_token=first_token_time)
+            self._add_to_history(request, k2_response)
+            
+            if success:
+                ttft = f"{first_token_time:.2f}s" if first_token_time is not None else "n/a"
+                self.logger.info(f"✅ K2 流式路由完成: {request.request_id} (首 token {ttft}, 总计 {response_time:.2f}s)")
+    
+    async def _collect_stream(self, request: K2Request) -> K2Response:
+        """消费流式响应并聚合为完整 K2Response"""
+        content_parts = []
+        
+        try:
+            async for chunk in self.stream_ai_request(request):
+                content_parts.append(chunk.delta)
+        except Exception:
+            # 错误已在 stream_ai_request 中记录
+            pass
+        
+        # 统计和历史已在 stream_ai_request 中记录，这里直接取回最终响应
+        for entry in reversed(self.request_history):
+            if entry["request"]["request_id"] == request.request_id:
+                return K2Response(**entry["response"])
+        
+        return K2Response(
+            request_id=request.request_id,
+            success=False,
+            content="".join(content_parts),
+            error_message="流式响应记录丢失"
+        )
+    
+    async def _send_k2_stream_request(self, request_data: Dict[str, Any]) -> AsyncGenerator[str, None]:
+        """发送 K2 流式请求，逐个返回 SSE 事件的 data 字段"""
+        headers = {
+            "Authorization": f"Bearer {self.config['api_key']}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream"
+        }
+        
+        url = f"{self.config['url']}/chat/completions"
+        breaker = self._get_circuit_breaker(url)
+        
+        if not breaker.allow_request():
+            self.stats["circuit_rejections"] += 1
+            raise CircuitOpenError(f"K2 端点熔断中: {url}")
+        
+        # 未记录结果就退出（取消、非传输异常）时按失败记录，释放 half_open 探测名额
+        recorded = False
+        try:
+            async with self.http_client.stream("POST", url, json=request_data, headers=headers) as response:
+                if response.status_code >= 400:
+                    if is_retryable_status(response.status_code):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    recorded = True
+                    body = await response.aread()
+                    raise Exception(f"HTTP 错误 {response.status_code}: {body.decode('utf-8', errors='replace')}")
                 
-                self.logger.warning(f"请求异常，重试 {attempt + 1}/{max_retries}: {e}")
-                await asyncio.sleep(retry_delay * (attempt + 1))
+                breaker.record_success()
+                recorded = True
+                async for event_data in self._iter_sse_events(response.aiter_lines()):
+                    yield event_data
+                    
+        except httpx.TransportError:
+            breaker.record_failure()
+            recorded = True
+            raise
+        finally:
+            if not recorded:
+                breaker.record_failure()
+    
+    @staticmethod
+    async def _iter_sse_events(lines) -> AsyncGenerator[str, None]:
+        """增量解析 server-sent events，按事件返回合并后的 data 字段"""
+        data_lines = []
+        
+        async for line in lines:
+            line = line.rstrip("\r")
+            
+            # 空行表示一个事件结束
+            if not line:
+                if data_lines:
+                    yield "\n".join(data_lines)
+                    data_lines = []
+                continue
+            
+            # 注释行（心跳）
+            if line.startswith(":"):
+                continue
+            
+            field, _, value = line.partition(":")
+            if value.startswith(" "):
+                value = value[1:]
+            
+            if field == "data":
+                data_lines.append(value)
+        
+        # 流结束时没有结尾空行
+        if data_lines:
+            yield "\n".join(data_lines)
     
     def _parse_k2_response(self, request_id: str, response_data: Dict[str, Any]) -> K2Response:
         """解析 K2 响应"""
@@ -255,7 +556,8 @@ class K2Client:
         total_tokens = usage.get("total_tokens", 0)
         return (total_tokens / 1000) * cost_per_1k_tokens
     
-    def _update_stats(self, success: bool, response_time: float, cost: float):
+    def _update_stats(self, success: bool, response_time: float, cost: float,
+                      time_to_first_token: Optional[float] = None):
         """更新统计信息"""
         self.stats["total_requests"] += 1
         
@@ -269,6 +571,12 @@ class K2Client:
         # 更新平均响应时间
         total_time = self.stats["average_response_time"] * (self.stats["total_requests"] - 1) + response_time
         self.stats["average_response_time"] = total_time / self.stats["total_requests"]
+        
+        # 更新平均首 token 时间（仅流式请求）
+        if time_to_first_token is not None:
+            self.stats["streamed_requests"] += 1
+            total_ttft = self.stats["average_time_to_first_token"] * (self.stats["streamed_requests"] - 1) + time_to_first_token
+            self.stats["average_time_to_first_token"] = total_ttft / self.stats["streamed_requests"]
     
     def _add_to_history(self, request: K2Request, response: K2Response):
         """添加到请求历史"""
@@ -375,6 +683,10 @@ class K2Client:
             "requests_per_minute": (self.stats["total_requests"] / max(uptime / 60, 1)),
             "connected": self.connected,
             "last_health_check": self.last_health_check.isoformat() if self.last_health_check else None,
+            "latency_p95": self.latency_tracker.percentile(95),
+            "circuit_breakers": {
+                endpoint: breaker.get_state() for endpoint, breaker in self.circuit_breakers.items()
+            },
             "config": {
                 "url": self.config["url"],
                 "model_id": self.config["model_id"],
@@ -420,7 +732,7 @@ if __name__ == "__main__":
     
     async def main():
         parser = argparse.ArgumentParser(description="K2 服务客户端测试")
-        parser.add_argument("--action", choices=["test", "health", "stats", "chat"], 
+        parser.add_argument("--action", choices=["test", "health", "stats", "chat", "stream"], 
                            default="test", help="执行的动作")
         parser.add_argument("--prompt", type=str, default="Hello, how are you?", 
                            help="测试提示")
@@ -463,6 +775,21 @@ if __name__ == "__main__":
                 response = await client.chat_completion(messages)
                 print(f"响应: {response.content}")
                 print(f"成功: {response.success}")
+            
+            elif args.action == "stream":
+                print(f"🌊 测试 K2 流式生成: {args.prompt}")
+                request = K2Request(
+                    request_id=str(uuid.uuid4()),
+                    request_type="text_generation",
+                    content=args.prompt,
+                    stream=True
+                )
+                async for chunk in client.stream_ai_request(request):
+                    print(chunk.delta, end="", flush=True)
+                print()
+                stats = client.get_stats()
+                print(f"首 token 时间: {stats['average_time_to_first_token']:.2f}s")
+                print(f"总响应时间: {stats['average_response_time']:.2f}s")
         
         finally:
             await client.cleanup()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+K2 Resilience - K2 请求弹性层
+提供抖动退避重试、截止时间预算、对冲请求延迟估计和按端点熔断器
+"""
+
+import random
+import time
+from collections import deque
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional
+
+# 可重试的 HTTP 状态码（其余 4xx 重试也不会成功）
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被拒绝"""
+
+
+class DeadlineExceededError(Exception):
+    """请求超出总截止时间预算"""
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """判断 HTTP 状态码是否值得重试"""
+    return status_code in RETRYABLE_STATUS_CODES
+
+
+def full_jitter_backoff(attempt: int, base_delay: float, max_delay: float) -> float:
+    """全抖动指数退避：在 [0, min(max_delay, base * 2^attempt)] 内均匀取值"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class Deadline:
+    """总截止时间预算，在重试和对冲请求之间共享"""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        """剩余预算（秒）"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class LatencyTracker:
+    """最近成功请求的延迟窗口，用于估计对冲请求的触发延迟"""
+
+    def __init__(self, window_size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window_size)
+        self.min_samples = min_samples
+
+    def record(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """样本不足时返回 None"""
+        if len(self.samples) < self.min_samples:
+            return None
+
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """单个端点的熔断器：closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+        self.stats = {
+            "total_failures": 0,
+            "total_successes": 0,
+            "rejected_requests": 0,
+            "times_opened": 0
+        }
+
+    def allow_request(self) -> bool:
+        """是否允许请求通过；half_open 状态下只放行一个探测请求"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            else:
+                self.stats["rejected_requests"] += 1
+                return False
+
+        if self.state == self.HALF_OPEN:
+            if self.probe_in_flight:
+                self.stats["rejected_requests"] += 1
+                return False
+            self.probe_in_flight = True
+
+        return True
+
+    def record_success(self):
+        self.stats["total_successes"] += 1
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self.stats["total_failures"] += 1
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.stats["times_opened"] += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def get_state(self) -> Dict[str, Any]:
+        """获取熔断器状态"""
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in_seconds": retry_in,
+            **self.stats
+        }
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+K2 客户端流式请求测试
+用本地 http.server 模拟 SSE 端点（分块发送、data 行被拆开），验证增量解析、[DONE] 结束和首 token 时间统计
+"""
+
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from k2_router.k2_client import K2Client, K2Request
+
+FIRST_TOKEN_DELAY = 0.2
+
+
+def sse_event(payload) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def delta_event(text: str, finish_reason=None) -> str:
+    return sse_event({"choices": [{"delta": {"content": text}, "finish_reason": finish_reason}]})
+
+
+class SSEHandler(BaseHTTPRequestHandler):
+    """按 pieces 逐块发送响应体，每块之间暂停；第一个 token 之前额外等待 FIRST_TOKEN_DELAY"""
+
+    protocol_version = "HTTP/1.1"
+    pieces = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        for piece in self.pieces:
+            if piece is None:
+                time.sleep(FIRST_TOKEN_DELAY)
+                continue
+            data = piece.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(0.01)
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def sse_server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SSEHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_client(url: str) -> K2Client:
+    client = K2Client()
+    client.config["url"] = url
+    return client
+
+
+def stream(client: K2Client, request_id: str):
+    async def collect():
+        try:
+            return [chunk async for chunk in client.stream_ai_request(
+                K2Request(request_id=request_id, request_type="chat", content="hi", stream=True))]
+        finally:
+            await client.http_client.aclose()
+
+    return asyncio.run(collect())
+
+
+def test_stream_parses_split_data_lines_until_done(sse_server):
+    hello = delta_event("你好")
+    multiline = "data: {\"choices\": [{\"delta\":\ndata:  {\"content\": \"，世界\"}}]}\r\n\r\n"
+    SSEHandler.pieces = [
+        ": keep-alive\n\n",
+        None,
+        hello[:9], hello[9:20], hello[20:],
+        multiline[:30], multiline[30:],
+        delta_event("", finish_reason="stop"),
+        sse_event({"choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 4, "total_tokens": 7}}),
+        "data: [DO", "NE]\n\n",
+        delta_event("DONE 之后的内容不应出现"),
+    ]
+
+    client = make_client(sse_server)
+    chunks = stream(client, "stream-1")
+
+    assert [chunk.delta for chunk in chunks] == ["你好", "，世界", ""]
+    assert [chunk.index for chunk in chunks] == [0, 1, 2]
+    assert chunks[-1].finish_reason == "stop"
+
+    response = client.request_history[-1]["response"]
+    assert response["success"] and response["content"] == "你好，世界"
+    assert response["usage"]["total_tokens"] == 7
+
+
+def test_average_time_to_first_token(sse_server):
+    SSEHandler.pieces = [None, delta_event("a"), delta_event("b"), "data: [DONE]\n\n"]
+    client = make_client(sse_server)
+    stream(client, "ttft-1")
+
+    first = client.stats["average_time_to_first_token"]
+    assert client.stats["streamed_requests"] == 1
+    assert FIRST_TOKEN_DELAY <= first < client.stats["average_response_time"] + 1e-6
+
+    # 没有任何 token 的流不计入首 token 平均值
+    SSEHandler.pieces = ["data: [DONE]\n\n"]
+    client.http_client = make_client(sse_server).http_client
+    stream(client, "ttft-2")
+
+    assert client.stats["streamed_requests"] == 1
+    assert client.stats["average_time_to_first_token"] == first
+    assert client.stats["successful_requests"] == 2
@@ -16,13 +16,13 @@ import json
 import logging
 import signal
 import sys
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncGenerator
 from datetime import datetime
 import argparse
 
 # 导入统一 MCP 组件
 from .claude_sync.sync_manager import ClaudeSyncManager, get_sync_manager
-from .k2_router.k2_client import K2Client, get_k2_client
+from .k2_router.k2_client import K2Client, K2Request, get_k2_client
 from .tool_mode.tool_manager import ToolModeManager, get_tool_mode_manager
 
 logger = logging.getLogger(__name__)
@@ -50,6 +50,7 @@ class PowerAutomationUnifiedMCPServer:
             "failed_requests": 0,
             "claude_syncs": 0,
             "k2_routes": 0,
+            "k2_stream_routes": 0,
             "tool_blocks": 0
         }
         
@@ -180,6 +181,44 @@ class PowerAutomationUnifiedMCPServer:
         # 这里可以实现请求队列处理逻辑
         pass
     
+    async def stream_k2_request(self, content: str, request_type: str = "text_generation",
+                                **kwargs) -> AsyncGenerator[Dict[str, Any], None]:
+        """将 AI 请求以流式方式路由到 K2，并把 token 片段实时转发给调用方"""
+        self.stats["total_requests"] += 1
+        
+        if not self.config.get("enable_k2_router", True):
+            self.stats["failed_requests"] += 1
+            yield {"type": "error", "error": "K2 路由服务未启用"}
+            return
+        
+        request = K2Request(
+            request_id=kwargs.get("request_id", ""),
+            request_type=request_type,
+            content=content,
+            context=kwargs.get("context"),
+            temperature=kwargs.get("temperature", 0.7),
+            max_tokens=kwargs.get("max_tokens", 4096),
+            stream=True
+        )
+        
+        try:
+            async for chunk in self.k2_client.stream_ai_request(request):
+                yield {
+                    "type": "token",
+                    "request_id": chunk.request_id,
+                    "index": chunk.index,
+                    "content": chunk.delta,
+                    "finish_reason": chunk.finish_reason
+                }
+            
+            self.stats["successful_requests"] += 1
+            self.stats["k2_stream_routes"] += 1
+            yield {"type": "done", "request_id": request.request_id}
+            
+        except Exception as e:
+            self.stats["failed_requests"] += 1
+            yield {"type": "error", "request_id": request.request_id, "error": str(e)}
+    
     async def _update_stats(self):
         """更新统计信息"""
         try:
@@ -8,10 +8,14 @@ import asyncio
 import time
 import json
 import hashlib
+import heapq
+import os
 import zlib
 import lzma
 import bz2
-from typing import Dict, List, Any, Optional, Tuple
+from collections.abc import Mapping
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Any, Optional, Set, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 import re
@@ -33,11 +37,233 @@ class CompressionResult:
     quality_score: float  # 0-1，保真度評分
     memory_usage_mb: float
 
+class SuffixAutomaton:
+    """後綴自動機：線性時間構建，每個狀態對應一組 endpos 相同的子串
+
+    狀態 v 表示長度在 (length[link[v]], length[v]] 之間、以同一組位置結尾的子串，
+    occurrences[v] 為這些子串在文本中的出現次數（允許重疊），
+    end_pos[v] / last_end[v] 為這組結尾位置中最早 / 最晚的一個
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.length = [0]
+        self.link = [-1]
+        self.transitions: List[Dict[str, int]] = [{}]
+        self.end_pos = [-1]
+        self.last_end = [-1]
+        self.occurrences = [0]
+
+        last = 0
+        for position, char in enumerate(text):
+            last = self._extend(last, char, position)
+        self._count_occurrences()
+    
+    def _extend(self, last: int, char: str, position: int) -> int:
+        length, link, transitions = self.length, self.link, self.transitions
+
+        current = len(length)
+        length.append(length[last] + 1)
+        link.append(0)
+        transitions.append({})
+        self.end_pos.append(position)
+        self.last_end.append(position)
+        self.occurrences.append(1)
+
+        state = last
+        while state != -1 and char not in transitions[state]:
+            transitions[state][char] = current
+            state = link[state]
+
+        if state != -1:
+            target = transitions[state][char]
+            if length[state] + 1 == length[target]:
+                link[current] = target
+            else:
+                clone = len(length)
+                length.append(length[state] + 1)
+                link.append(link[target])
+                transitions.append(dict(transitions[target]))
+                self.end_pos.append(self.end_pos[target])
+                self.last_end.append(-1)
+                self.occurrences.append(0)
+
+                while state != -1 and transitions[state].get(char) == target:
+                    transitions[state][char] = clone
+                    state = link[state]
+                link[target] = clone
+                link[current] = clone
+
+        return current
+    
+    def _count_occurrences(self):
+        # 按長度降序把出現次數和最晚結尾位置累加到後綴鏈接（計數排序，線性時間）
+        buckets: List[List[int]] = [[] for _ in range(len(self.text) + 1)]
+        for state, state_length in enumerate(self.length):
+            buckets[state_length].append(state)
+
+        occurrences, last_end, link = self.occurrences, self.last_end, self.link
+        for state_length in range(len(self.text), 0, -1):
+            for state in buckets[state_length]:
+                occurrences[link[state]] += occurrences[state]
+                if last_end[state] > last_end[link[state]]:
+                    last_end[link[state]] = last_end[state]
+
+    def count_non_overlapping_repeats(self, min_length: int, max_length: int) -> int:
+        """統計長度在 [min_length, max_length] 內、能不重疊地出現至少兩次的不同子串數
+
+        長度為 L 的子串能不重疊出現兩次，當且僅當其最晚與最早結尾位置相差至少 L
+        """
+        total = 0
+        for state in range(1, len(self.length)):
+            shortest = max(self.length[self.link[state]] + 1, min_length)
+            longest = min(self.length[state], max_length, self.last_end[state] - self.end_pos[state])
+            if longest >= shortest:
+                total += longest - shortest + 1
+        return total
+    
+    def repeated_states(self, min_length: int, max_length: int, min_count: int = 2):
+        """遍歷長度可達 min_length、出現至少 min_count 次的狀態，返回 (子串, 出現次數)
+
+        子串取狀態內最長者並截斷到 max_length；若截斷後的子串屬於更短的狀態則跳過，避免重複
+        """
+        for state in range(1, len(self.length)):
+            count = self.occurrences[state]
+            if count < min_count or self.length[state] < min_length:
+                continue
+            if self.length[self.link[state]] >= max_length:
+                continue
+
+            pattern_length = min(self.length[state], max_length)
+            end = self.end_pos[state] + 1
+            yield self.text[end - pattern_length:end], count
+
+def find_repeated_substrings(text: str, min_length: int = 10, max_length: int = 200,
+                             top_k: int = 10) -> Dict[str, Any]:
+    """用後綴自動機查找節省空間最多的重複子串（近線性時間）
+
+    子串長度取 [min_length, max_length)，且小於文本長度的一半。
+    候選按 (出現次數 - 1) × 長度 排序，惰性貪心選取：每選中一個就在工作副本中替換掉，
+    其餘候選的收益按替換後的不重疊出現次數重新計算，重疊或互相包含的子串因此不會重複入選。
+    返回的 counts 與按順序 str.replace 的替換次數一致；
+    repeated_substrings / max_repetition_count 與 str.count 語義一致：
+    不重疊出現至少兩次的不同子串數，及其中最大的不重疊出現次數
+    """
+    max_length = min(max_length, len(text) // 2) - 1
+    if max_length < min_length:
+        return {"patterns": [], "counts": [], "repeated_substrings": 0, "max_repetition_count": 0}
+
+    automaton = SuffixAutomaton(text)
+    heap = [(-(count - 1) * len(pattern), pattern)
+            for pattern, count in automaton.repeated_states(min_length, max_length)]
+    heapq.heapify(heap)
+    repeated_substrings = automaton.count_non_overlapping_repeats(min_length, max_length)
+
+    # 較長子串的不重疊出現次數不會超過其前綴，最大值只需在最短長度上按 str.count 的貪心方式統計
+    max_count = 0
+    if repeated_substrings:
+        greedy: Dict[str, List[int]] = {}
+        for start in range(len(text) - min_length + 1):
+            state = greedy.setdefault(text[start:start + min_length], [-min_length, 0])
+            if start >= state[0] + min_length:
+                state[0] = start
+                state[1] += 1
+        max_count = max(count for _, count in greedy.values())
+
+    selected: List[str] = []
+    counts: List[int] = []
+    working = text
+    evaluations = 0
+    while heap and len(selected) < top_k and evaluations < top_k * 50:
+        _, pattern = heapq.heappop(heap)
+        count = working.count(pattern)
+        evaluations += 1
+        saving = (count - 1) * len(pattern)
+        if saving <= 0:
+            continue
+        if heap and saving < -heap[0][0]:
+            # 收益已下降，放回堆中與其他候選重新比較
+            heapq.heappush(heap, (-saving, pattern))
+            continue
+
+        selected.append(pattern)
+        counts.append(count)
+        working = working.replace(pattern, "\x00")
+
+    return {
+        "patterns": selected,
+        "counts": counts,
+        "repeated_substrings": repeated_substrings,
+        "max_repetition_count": max_count
+    }
+
+class LazyContentAnalysis(Mapping):
+    """按需計算並緩存的內容分析特徵
+
+    策略通過 analysis["..."] 讀取特徵，只有被讀取的特徵才會計算；
+    computed() 返回已計算的特徵，可傳給工作進程避免重複計算
+    """
+    
+    def __init__(self, optimizer: "AdvancedCompressionOptimizer", content: str, context_type: str,
+                 precomputed: Optional[Dict[str, Any]] = None):
+        self._features = {
+            "content_type": lambda: context_type,
+            "total_length": lambda: len(content),
+            "word_count": lambda: len(content.split()),
+            "line_count": lambda: content.count('\n'),
+            "character_distribution": lambda: optimizer._analyze_character_distribution(content),
+            "repetition_patterns": lambda: optimizer._find_repetition_patterns(content),
+            "semantic_blocks": lambda: optimizer._identify_semantic_blocks(content, context_type),
+            "compressibility_score": lambda: optimizer._estimate_compressibility(content),
+            "keywords": lambda: optimizer._extract_keywords(content, context_type),
+            "structure_markers": lambda: optimizer._count_structure_markers(content, context_type)
+        }
+        self._values: Dict[str, Any] = dict(precomputed or {})
+    
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._values:
+            self._values[name] = self._features[name]()
+        return self._values[name]
+    
+    def __iter__(self):
+        return iter(self._features)
+    
+    def __len__(self) -> int:
+        return len(self._features)
+    
+    def computed(self) -> Dict[str, Any]:
+        return dict(self._values)
+
+def _evaluate_strategy_in_worker(strategy_name: str, content: str, context_type: str,
+                                 precomputed: Dict[str, Any]) -> Optional[CompressionResult]:
+    """工作進程入口：在獨立的優化器上運行單個策略並評估質量"""
+    optimizer = AdvancedCompressionOptimizer()
+    analysis = LazyContentAnalysis(optimizer, content, context_type, precomputed)
+    return asyncio.run(optimizer._evaluate_candidate(strategy_name, content, context_type, analysis))
+
 class AdvancedCompressionOptimizer:
     """高級壓縮優化器"""
     
-    def __init__(self):
+    def __init__(self, codebook=None, parallel: bool = False, max_workers: Optional[int] = None,
+                 early_exit: bool = True, min_quality_score: float = 0.6, analysis_cache_size: int = 128):
+        """
+        Args:
+            codebook: 可選的共享碼本（ContextCodebook），提供時混合字典壓縮使用碼本編碼
+            parallel: 默認是否以並行候選模式運行管道（見 optimize_compression_pipeline）
+            max_workers: 並行模式的進程池大小，默認為 CPU 核數
+            early_exit: 達到目標壓縮率後不再運行剩餘策略
+            min_quality_score: 並行模式中候選結果的最低質量要求
+            analysis_cache_size: 按內容哈希緩存的分析結果數量
+        """
         self.target_compression_ratio = 0.40  # 目標40%
+        self.codebook = codebook
+        self.parallel = parallel
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.early_exit = early_exit
+        self.min_quality_score = min_quality_score
+        self.analysis_cache_size = analysis_cache_size
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.worker_futures: Set[Future] = set()
         self.current_best_ratio = 0.472  # 當前47.2%
         
         # 多層次壓縮策略
@@ -54,41 +280,48 @@ class AdvancedCompressionOptimizer:
         self.compression_history = []
         self.optimization_cache = {}
         
-    async def optimize_compression_pipeline(self, content: str, context_type: str) -> Dict[str, Any]:
-        """優化壓縮管道"""
+    async def optimize_compression_pipeline(self, content: str, context_type: str,
+                                            parallel: Optional[bool] = None) -> Dict[str, Any]:
+        """優化壓縮管道
+        
+        順序模式：選中的策略依次疊加，達到目標壓縮率即停止（early_exit）。
+        並行模式：每個策略獨立作用於原文，在進程池中同時評估，選出質量達標且壓縮率最低的候選；
+        一旦有候選同時達到目標壓縮率和質量要求，即取消其餘候選。
+        """
+        parallel = self.parallel if parallel is None else parallel
         logger.info(f"🗜️ 開始高級壓縮優化 - 目標: {self.target_compression_ratio:.1%}")
         
         start_time = time.time()
         original_size = len(content.encode('utf-8'))
         
-        # 1. 內容預處理和分析
+        # 1. 內容分析（惰性，只計算策略用到的特徵）
         content_analysis = await self._analyze_content_structure(content, context_type)
         
         # 2. 智能策略選擇
         selected_strategies = self._select_optimal_strategies(content_analysis)
         
-        # 3. 多階段壓縮
-        compression_results = []
-        current_content = content
-        
-        for strategy_name in selected_strategies:
-            strategy_func = self.compression_strategies[strategy_name]
-            result = await strategy_func(current_content, context_type, content_analysis)
-            
-            if result and result.compression_ratio < 1.0:  # 確實有壓縮效果
-                compression_results.append(result)
-                current_content = getattr(result, 'compressed_content', current_content)
-                logger.info(f"  ✅ {strategy_name}: {result.compression_ratio:.1%} 壓縮率")
-            else:
-                logger.info(f"  ⏭️ {strategy_name}: 跳過（無效果）")
+        # 3. 壓縮
+        candidates = []
+        if parallel:
+            candidates = await self._evaluate_candidates_parallel(selected_strategies, content, context_type, content_analysis)
+            best = self._pick_best_candidate(candidates)
+            compression_results = [best] if best else []
+            current_content = best.compressed_content if best else content
+            quality_score = best.evaluated_quality if best else 1.0
+        else:
+            compression_results, current_content = await self._run_strategies_sequential(
+                selected_strategies, content, context_type, content_analysis, original_size
+            )
+            quality_score = None
         
         # 4. 最終結果評估
         final_size = len(current_content.encode('utf-8'))
         final_ratio = final_size / original_size
-        total_time = (time.time() - start_time) * 1000
         
-        # 5. 質量評估
-        quality_score = await self._evaluate_compression_quality(content, current_content, context_type)
+        # 5. 質量評估（原文特徵來自分析緩存，只需分析壓縮結果）
+        if quality_score is None:
+            quality_score = await self._evaluate_compression_quality(content, current_content, context_type, content_analysis)
+        total_time = (time.time() - start_time) * 1000
         
         optimization_result = {
             "original_size": original_size,
@@ -98,28 +331,150 @@ class AdvancedCompressionOptimizer:
             "target_achieved": final_ratio <= self.target_compression_ratio,
             "quality_score": quality_score,
             "total_time_ms": total_time,
+            "mode": "parallel" if parallel else "sequential",
+            "strategies_selected": selected_strategies,
             "strategies_applied": [r.method for r in compression_results],
             "detailed_results": compression_results,
             "compressed_content": current_content
         }
+        if parallel:
+            optimization_result["candidates"] = [
+                {"method": c.method, "compression_ratio": c.stored_ratio, "quality_score": c.evaluated_quality}
+                for c in candidates
+            ]
         
         # 6. 記錄結果
         self.compression_history.append(optimization_result)
         
         return optimization_result
     
-    async def _analyze_content_structure(self, content: str, context_type: str) -> Dict[str, Any]:
-        """分析內容結構"""
-        analysis = {
-            "content_type": context_type,
-            "total_length": len(content),
-            "word_count": len(content.split()),
-            "line_count": content.count('\n'),
-            "character_distribution": self._analyze_character_distribution(content),
-            "repetition_patterns": self._find_repetition_patterns(content),
-            "semantic_blocks": self._identify_semantic_blocks(content, context_type),
-            "compressibility_score": self._estimate_compressibility(content)
-        }
+    async def _run_strategies_sequential(self, strategies: List[str], content: str, context_type: str,
+                                         analysis: Mapping, original_size: int) -> Tuple[List[CompressionResult], str]:
+        """依次疊加策略，達到目標壓縮率後提前結束"""
+        compression_results = []
+        current_content = content
+        
+        for strategy_name in strategies:
+            strategy_func = self.compression_strategies[strategy_name]
+            result = await strategy_func(current_content, context_type, analysis)
+            
+            # 按實際存儲的內容判斷是否確有壓縮效果（字典壓縮以十六進制存儲，大小是字節數的兩倍）
+            if result and self._stored_ratio(result, original_size) < 1.0:
+                compression_results.append(result)
+                current_content = getattr(result, 'compressed_content', current_content)
+                logger.info(f"  ✅ {strategy_name}: {result.compression_ratio:.1%} 壓縮率")
+            else:
+                logger.info(f"  ⏭️ {strategy_name}: 跳過（無效果）")
+                continue
+            
+            if self.early_exit and len(current_content.encode('utf-8')) / original_size <= self.target_compression_ratio:
+                logger.info("  🎯 已達到目標壓縮率，跳過剩餘策略")
+                break
+        
+        return compression_results, current_content
+    
+    async def _evaluate_candidate(self, strategy_name: str, content: str, context_type: str,
+                                  analysis: Mapping) -> Optional[CompressionResult]:
+        """對原文單獨運行一個策略並評估質量；無損策略（quality_score 為 1.0）不需評估"""
+        result = await self.compression_strategies[strategy_name](content, context_type, analysis)
+        if result is None:
+            return None
+        
+        if result.quality_score >= 1.0:
+            result.evaluated_quality = 1.0
+        else:
+            result.evaluated_quality = await self._evaluate_compression_quality(
+                content, result.compressed_content, context_type, analysis
+            )
+        return result
+    
+    @staticmethod
+    def _stored_ratio(result: CompressionResult, original_size: int) -> float:
+        """存儲後的壓縮率：與管道最終報告的 compression_ratio 使用同一度量（compressed_content 的 UTF-8 字節數）"""
+        return len(result.compressed_content.encode('utf-8')) / original_size
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+    
+    def _submit(self, *args) -> asyncio.Future:
+        """提交到進程池並記錄未完成的任務，close() 時可逐個取消"""
+        future = self._get_executor().submit(*args)
+        self.worker_futures.add(future)
+        future.add_done_callback(self.worker_futures.discard)
+        return asyncio.wrap_future(future)
+    
+    def close(self):
+        """關閉並行模式的進程池（取消尚未開始的候選評估，不等待正在運行的任務）"""
+        if self.executor is not None:
+            for future in list(self.worker_futures):
+                future.cancel()
+            self.executor.shutdown(wait=False)
+            self.executor = None
+    
+    async def _evaluate_candidates_parallel(self, strategies: List[str], content: str, context_type: str,
+                                            analysis: LazyContentAnalysis) -> List[CompressionResult]:
+        """在進程池中同時評估各策略；使用共享碼本的策略（含數據庫連接）在本進程運行"""
+        precomputed = analysis.computed()
+        original_size = len(content.encode('utf-8'))
+        
+        pending = []
+        for strategy_name in strategies:
+            if strategy_name == "hybrid_dictionary" and self.codebook is not None:
+                pending.append(asyncio.ensure_future(
+                    self._evaluate_candidate(strategy_name, content, context_type, analysis)
+                ))
+            else:
+                pending.append(self._submit(
+                    _evaluate_strategy_in_worker, strategy_name, content, context_type, precomputed
+                ))
+        
+        candidates = []
+        try:
+            for future in asyncio.as_completed(pending):
+                try:
+                    result = await future
+                except Exception as e:
+                    logger.error(f"候選策略評估失敗: {e}")
+                    continue
+                if result is None:
+                    continue
+                
+                result.stored_ratio = self._stored_ratio(result, original_size)
+                candidates.append(result)
+                logger.info(f"  🧪 {result.method}: {result.stored_ratio:.1%} 壓縮率, 質量 {result.evaluated_quality:.2f}")
+                
+                if (self.early_exit and result.stored_ratio <= self.target_compression_ratio
+                        and result.evaluated_quality >= self.min_quality_score):
+                    logger.info(f"  🎯 {result.method} 已達到目標，取消其餘候選")
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+        
+        return candidates
+    
+    def _pick_best_candidate(self, candidates: List[CompressionResult]) -> Optional[CompressionResult]:
+        """質量達標的候選中取存儲後壓縮率最低者；都不達標時取質量最高且確有壓縮效果者"""
+        effective = [c for c in candidates if c.stored_ratio < 1.0]
+        if not effective:
+            return None
+        
+        acceptable = [c for c in effective if c.evaluated_quality >= self.min_quality_score]
+        if acceptable:
+            return min(acceptable, key=lambda c: (c.stored_ratio, -c.evaluated_quality))
+        return max(effective, key=lambda c: (c.evaluated_quality, -c.stored_ratio))
+    
+    async def _analyze_content_structure(self, content: str, context_type: str) -> LazyContentAnalysis:
+        """分析內容結構（惰性計算，按內容哈希緩存）"""
+        cache_key = (hashlib.sha1(content.encode('utf-8')).hexdigest(), context_type)
+        analysis = self.optimization_cache.get(cache_key)
+        if analysis is None:
+            analysis = LazyContentAnalysis(self, content, context_type)
+            self.optimization_cache[cache_key] = analysis
+            if len(self.optimization_cache) > self.analysis_cache_size:
+                self.optimization_cache.pop(next(iter(self.optimization_cache)))
         
         return analysis
     
@@ -226,18 +581,27 @@ class AdvancedCompressionOptimizer:
         start_time = time.time()
         
         # 構建專用字典
-        custom_dict = self._build_context_dictionary(content, context_type)
+        custom_dict = self._build_context_dictionary(
+            content, context_type, analysis["repetition_patterns"]["patterns"]
+        )
         
-        # 使用 LZMA 與自定義字典
+        # 有共享碼本時用碼本編碼，否則使用 LZMA
         try:
             content_bytes = content.encode('utf-8')
+            codebook_id = None
             
-            # 創建帶字典的壓縮器
-            filters = [
-                {"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1024*1024}
-            ]
+            if self.codebook is not None:
+                codebook_id, payload = self.codebook.encode(content)
             
-            compressed_data = lzma.compress(content_bytes, format=lzma.FORMAT_XZ, filters=filters)
+            if codebook_id is not None:
+                compressed_data = payload
+            else:
+                # 創建帶字典的壓縮器
+                filters = [
+                    {"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1024*1024}
+                ]
+                
+                compressed_data = lzma.compress(content_bytes, format=lzma.FORMAT_XZ, filters=filters)
             
             compression_time = (time.time() - start_time) * 1000
             
@@ -252,6 +616,8 @@ class AdvancedCompressionOptimizer:
                 memory_usage_mb=25.0
             )
             result.compressed_content = compressed_data.hex()  # 轉為十六進制字符串存儲
+            result.codebook_id = codebook_id
+            result.dictionary = custom_dict
             return result
         
         except Exception as e:
@@ -364,6 +730,13 @@ class AdvancedCompressionOptimizer:
         result.compressed_content = important_content
         return result
     
+    def decode_hybrid_dictionary(self, compressed_content: str, codebook_id: Optional[int] = None) -> str:
+        """還原混合字典壓縮的結果"""
+        compressed_data = bytes.fromhex(compressed_content)
+        if codebook_id is not None:
+            return self.codebook.decode(compressed_data, codebook_id)
+        return lzma.decompress(compressed_data).decode('utf-8')
+    
     def _analyze_character_distribution(self, content: str) -> Dict[str, Any]:
         """分析字符分佈"""
         char_counts = {}
@@ -380,28 +753,14 @@ class AdvancedCompressionOptimizer:
         }
     
     def _find_repetition_patterns(self, content: str) -> Dict[str, Any]:
-        """尋找重複模式"""
-        # 尋找重複的子字符串
-        min_length = 10
-        max_length = 200
-        patterns = []
-        
-        for length in range(min_length, min(max_length, len(content)//2)):
-            for i in range(len(content) - length):
-                pattern = content[i:i+length]
-                count = content.count(pattern)
-                if count > 1:
-                    patterns.append(pattern)
-        
-        # 去重並按出現次數排序
-        unique_patterns = list(set(patterns))
-        pattern_counts = [(p, content.count(p)) for p in unique_patterns]
-        pattern_counts.sort(key=lambda x: x[1], reverse=True)
+        """尋找重複模式（後綴自動機，按節省字節數取前10個）"""
+        repeats = find_repeated_substrings(content, min_length=10, max_length=200, top_k=10)
         
         return {
-            "patterns": [p[0] for p in pattern_counts[:10]],  # 前10個最頻繁模式
-            "high_repetition": len(pattern_counts) > 5,
-            "max_repetition_count": pattern_counts[0][1] if pattern_counts else 0
+            "patterns": repeats["patterns"],
+            "pattern_counts": repeats["counts"],
+            "high_repetition": repeats["repeated_substrings"] > 5,
+            "max_repetition_count": repeats["max_repetition_count"]
         }
     
     def _identify_semantic_blocks(self, content: str, context_type: str) -> List[str]:
@@ -516,8 +875,9 @@ class AdvancedCompressionOptimizer:
         important_lines = core_semantics.get("important_lines", [])
         return '\n'.join(important_lines[:3])  # 只保留前3行
     
-    def _build_context_dictionary(self, content: str, context_type: str) -> Dict[str, str]:
-        """構建上下文字典"""
+    def _build_context_dictionary(self, content: str, context_type: str,
+                                  repeated_patterns: Optional[List[str]] = None) -> Dict[str, str]:
+        """構建上下文字典（固定常用短語 + 內容中找到的重複子串）"""
         # 為特定上下文構建壓縮字典
         common_phrases = {
             "conversation": ["用戶:", "助手:", "組件", "功能", "實現"],
@@ -532,6 +892,11 @@ class AdvancedCompressionOptimizer:
             if phrase in content:
                 dictionary[f"D{i}"] = phrase
         
+        if repeated_patterns is None:
+            repeated_patterns = self._find_repetition_patterns(content)["patterns"]
+        for i, pattern in enumerate(repeated_patterns):
+            dictionary[f"R{i}"] = pattern
+        
         return dictionary
     
     def _quantize_conversation(self, content: str) -> str:
@@ -632,12 +997,16 @@ class AdvancedCompressionOptimizer:
             "avg_word_length": sum(len(word) for word in words) / max(total_words, 1)
         }
     
-    async def _evaluate_compression_quality(self, original: str, compressed: str, context_type: str) -> float:
-        """評估壓縮質量"""
+    async def _evaluate_compression_quality(self, original: str, compressed: str, context_type: str,
+                                            original_analysis: Optional[Mapping] = None) -> float:
+        """評估壓縮質量（提供原文分析時復用其中的關鍵詞和結構統計）"""
         # 簡化的質量評估
         
         # 1. 關鍵詞保留率
-        original_keywords = self._extract_keywords(original, context_type)
+        if original_analysis is not None:
+            original_keywords = original_analysis["keywords"]
+        else:
+            original_keywords = self._extract_keywords(original, context_type)
         compressed_keywords = self._extract_keywords(compressed, context_type)
         
         if original_keywords:
@@ -646,7 +1015,8 @@ class AdvancedCompressionOptimizer:
             keyword_retention = 1.0
         
         # 2. 結構保留率
-        structure_retention = self._evaluate_structure_retention(original, compressed, context_type)
+        original_markers = original_analysis["structure_markers"] if original_analysis is not None else None
+        structure_retention = self._evaluate_structure_retention(original, compressed, context_type, original_markers)
         
         # 3. 語義一致性（簡化版）
         semantic_consistency = min(1.0, len(compressed) / len(original) * 2)  # 簡化計算
@@ -669,25 +1039,22 @@ class AdvancedCompressionOptimizer:
         
         return keywords
     
-    def _evaluate_structure_retention(self, original: str, compressed: str, context_type: str) -> float:
-        """評估結構保留率"""
+    def _count_structure_markers(self, content: str, context_type: str) -> int:
+        """統計結構標記數（對話發言者 / 代碼定義 / 文檔標題）"""
         if context_type == "conversation":
-            # 檢查對話結構
-            original_speakers = len(re.findall(r'(用戶:|助手:|User:|Assistant:)', original))
-            compressed_speakers = len(re.findall(r'(用戶:|助手:|User:|Assistant:)', compressed))
-            return min(1.0, compressed_speakers / max(1, original_speakers))
-        
+            return len(re.findall(r'(用戶:|助手:|User:|Assistant:)', content))
         elif context_type == "code":
-            # 檢查代碼結構
-            original_functions = len(re.findall(r'(function |def |class |async )', original))
-            compressed_functions = len(re.findall(r'(function |def |class |async )', compressed))
-            return min(1.0, compressed_functions / max(1, original_functions))
-        
+            return len(re.findall(r'(function |def |class |async )', content))
         else:
-            # 檢查文檔結構
-            original_headers = len(re.findall(r'^#{1,6}\s', original, re.MULTILINE))
-            compressed_headers = len(re.findall(r'^#{1,6}\s', compressed, re.MULTILINE))
-            return min(1.0, compressed_headers / max(1, original_headers))
+            return len(re.findall(r'^#{1,6}\s', content, re.MULTILINE))
+    
+    def _evaluate_structure_retention(self, original: str, compressed: str, context_type: str,
+                                      original_markers: Optional[int] = None) -> float:
+        """評估結構保留率"""
+        if original_markers is None:
+            original_markers = self._count_structure_markers(original, context_type)
+        compressed_markers = self._count_structure_markers(compressed, context_type)
+        return min(1.0, compressed_markers / max(1, original_markers))
     
     def get_optimization_report(self) -> str:
         """生成優化報告"""
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+MemoryOS MCP - 共享上下文碼本
+- 從存儲的記憶中增量學習高頻短語（整行、標識符、詞），按文檔頻率 × 長度選出，組成 deflate 預設字典
+- 碼本按命名空間（項目）持久化在記憶數據庫中，每次重建生成新版本，舊版本保留用於解碼
+- 其他進程 / 引擎在啟動後新建的碼本在解碼時按需從數據庫讀取（使用獨立的只讀連接）
+- 正在使用的當前碼本定期續租（last_used），prune() 不會刪除其他進程仍在編碼使用的版本
+- encode / decode 可逆：短文本單獨壓縮時也能引用碼本中的短語，重複的對話和代碼可縮小數倍
+"""
+
+import logging
+import re
+import sqlite3
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Any, Iterable, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# deflate 窗口為 32KB，預設字典超過部分不會被引用
+MAX_DICTIONARY_BYTES = 32 * 1024
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_.]{3,}|[\u4e00-\u9fff]{2,}")
+
+
+class ContextCodebook:
+    """按項目共享的 deflate 預設字典碼本"""
+
+    def __init__(self, connection: sqlite3.Connection, namespace: str = "default",
+                 max_dictionary_bytes: int = MAX_DICTIONARY_BYTES,
+                 min_training_bytes: int = 16 * 1024,
+                 max_rebuild_interval_bytes: int = 4 * 1024 * 1024,
+                 max_phrases: int = 50_000,
+                 level: int = 9,
+                 lease_seconds: float = 3600):
+        """
+        Args:
+            connection: 記憶數據庫連接（碼本和短語統計存在同一個庫中）
+            namespace: 碼本命名空間，通常為項目名
+            max_dictionary_bytes: 預設字典大小上限（不超過 32KB）
+            min_training_bytes: 首次構建碼本前至少觀察的文本量
+            max_rebuild_interval_bytes: 重建間隔上限；此前新文本量達到上次訓練量時即重建（間隔倍增），
+                版本數隨數據量對數增長
+            max_phrases: 短語統計表的容量，超出時保留得分最高的一半
+            level: deflate 壓縮級別
+            lease_seconds: 碼本租期；當前碼本在租期內續租，prune() 只刪除超過租期未被使用的版本
+        """
+        self.connection = connection
+        self.namespace = namespace
+        self.max_dictionary_bytes = min(max_dictionary_bytes, MAX_DICTIONARY_BYTES)
+        self.min_training_bytes = min_training_bytes
+        self.max_rebuild_interval_bytes = max_rebuild_interval_bytes
+        self.max_phrases = max_phrases
+        self.level = level
+        self.lease_seconds = lease_seconds
+
+        self.phrase_counts: Counter = Counter()
+        self.dictionaries: Dict[int, bytes] = {}
+        self.namespaces: Dict[int, str] = {}
+        self.current_id: Optional[int] = None
+        self.current_phrase_count = 0
+        self.lease_renewed_at = 0.0
+        self.observed_bytes = 0
+        self.trained_bytes = 0
+
+        self.stats = {
+            "encoded": 0,
+            "stored_plain": 0,
+            "raw_bytes": 0,
+            "encoded_bytes": 0,
+            "decoded": 0,
+            "loaded_on_demand": 0,
+            "rebuilds": 0
+        }
+
+        # 數據庫文件路徑（內存數據庫為空），供按需讀取碼本的獨立連接使用
+        self.database_file = next(
+            (row[2] for row in connection.execute("PRAGMA database_list") if row[1] == "main"), ""
+        )
+        self.reader: Optional[sqlite3.Connection] = None
+
+        self._create_tables()
+        self._load()
+
+    def _create_tables(self):
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS codebooks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                namespace TEXT NOT NULL,
+                dictionary BLOB NOT NULL,
+                phrase_count INTEGER NOT NULL,
+                trained_bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL
+            )
+        """)
+        # 舊數據庫遷移：補充租期欄位
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(codebooks)")}
+        if "last_used" not in columns:
+            cursor.execute("ALTER TABLE codebooks ADD COLUMN last_used REAL")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS codebook_phrases (
+                namespace TEXT NOT NULL,
+                phrase TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (namespace, phrase)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_codebooks_namespace ON codebooks(namespace)")
+        self.connection.commit()
+
+    def _load(self):
+        # 已有版本都預先載入：解碼可能在 SQL 函數內進行，此時不便再查詢同一連接
+        for codebook_id, namespace, dictionary, phrase_count, trained_bytes in self.connection.execute(
+            "SELECT id, namespace, dictionary, phrase_count, trained_bytes FROM codebooks ORDER BY id"
+        ):
+            self.dictionaries[codebook_id] = bytes(dictionary)
+            self.namespaces[codebook_id] = namespace
+            if namespace == self.namespace:
+                self.current_id = codebook_id
+                self.current_phrase_count = phrase_count
+                self.observed_bytes = self.trained_bytes = trained_bytes
+
+        for phrase, count in self.connection.execute(
+            "SELECT phrase, count FROM codebook_phrases WHERE namespace = ?", (self.namespace,)
+        ):
+            self.phrase_counts[phrase] = count
+
+        if self.current_id is not None:
+            self._renew_lease()
+            self.connection.commit()
+
+    def _load_codebook(self, codebook_id: int) -> Optional[bytes]:
+        """按需讀取本實例啟動後由其他進程 / 引擎創建的碼本（獨立連接，可在 SQL 函數內調用）"""
+        if not self.database_file:
+            return None
+        if self.reader is None:
+            self.reader = sqlite3.connect(self.database_file, check_same_thread=False)
+
+        row = self.reader.execute(
+            "SELECT namespace, dictionary FROM codebooks WHERE id = ?", (codebook_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.namespaces[codebook_id] = row[0]
+        dictionary = self.dictionaries[codebook_id] = bytes(row[1])
+        self.stats["loaded_on_demand"] += 1
+        return dictionary
+
+    def _renew_lease(self):
+        """續租當前碼本；若已被其他進程超期刪除，按原 ID 恢復（本進程仍可能用它編碼）"""
+        now = time.time()
+        cursor = self.connection.execute(
+            "UPDATE codebooks SET last_used = ? WHERE id = ?", (now, self.current_id)
+        )
+        if cursor.rowcount == 0:
+            self.connection.execute(
+                "INSERT INTO codebooks (id, namespace, dictionary, phrase_count, trained_bytes, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.current_id, self.namespace, self.dictionaries[self.current_id],
+                 self.current_phrase_count, self.trained_bytes, now, now)
+            )
+            logger.warning(f"⚠️ 碼本 {self.current_id} 已被刪除，已恢復")
+        self.lease_renewed_at = now
+
+    @staticmethod
+    def extract_phrases(text: str) -> set:
+        """候選短語：整行（保留縮進）和標識符 / 詞，每個文檔只計一次"""
+        phrases = {line for line in text.splitlines(keepends=True) if 6 <= len(line) <= 256}
+        phrases.update(TOKEN_PATTERN.findall(text))
+        return phrases
+
+    def observe(self, text: str):
+        """把一段文本計入短語統計"""
+        self.phrase_counts.update(self.extract_phrases(text))
+        self.observed_bytes += len(text.encode("utf-8"))
+
+        if len(self.phrase_counts) > self.max_phrases:
+            keep = self.phrase_counts.most_common(self.max_phrases // 2)
+            self.phrase_counts = Counter(dict(keep))
+
+    def should_rebuild(self) -> bool:
+        if self.current_id is None:
+            return self.observed_bytes >= self.min_training_bytes
+        interval = min(max(self.trained_bytes, self.min_training_bytes), self.max_rebuild_interval_bytes)
+        return self.observed_bytes - self.trained_bytes >= interval
+
+    def maybe_rebuild(self) -> Optional[int]:
+        """達到重建條件時構建新版本碼本，返回新碼本 ID"""
+        if self.should_rebuild():
+            return self.rebuild()
+        return None
+
+    def build_dictionary(self) -> Tuple[bytes, int]:
+        """按 文檔頻率 × 長度 選取短語，最有價值的放在字典末尾（deflate 引用距離最短）"""
+        scored = [
+            (count * len(phrase.encode("utf-8")), phrase)
+            for phrase, count in self.phrase_counts.items() if count >= 2
+        ]
+        scored.sort(reverse=True)
+
+        selected = []
+        total = 0
+        for _, phrase in scored:
+            encoded = phrase.encode("utf-8")
+            if total + len(encoded) > self.max_dictionary_bytes:
+                continue
+            selected.append(encoded)
+            total += len(encoded)
+            if total >= self.max_dictionary_bytes - 4:
+                break
+
+        return b"".join(reversed(selected)), len(selected)
+
+    def rebuild(self) -> Optional[int]:
+        """構建並持久化新版本碼本，同時保存短語統計"""
+        dictionary, phrase_count = self.build_dictionary()
+        self.trained_bytes = self.observed_bytes
+        if not dictionary:
+            return None
+
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT INTO codebooks (namespace, dictionary, phrase_count, trained_bytes, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self.namespace, dictionary, phrase_count, self.observed_bytes, time.time(), time.time())
+        )
+        self.current_id = cursor.lastrowid
+        self.current_phrase_count = phrase_count
+        self.lease_renewed_at = time.time()
+        self.dictionaries[self.current_id] = dictionary
+        self.namespaces[self.current_id] = self.namespace
+        self._save_phrases(cursor)
+        self.connection.commit()
+
+        self.stats["rebuilds"] += 1
+        logger.info(f"📚 碼本已重建: {self.namespace} v{self.current_id} "
+                    f"({phrase_count} 個短語, {len(dictionary)} 字節)")
+        return self.current_id
+
+    def _save_phrases(self, cursor: sqlite3.Cursor):
+        # 只出現過一次的短語佔統計表的大部分，不持久化，避免碼本數據抵消壓縮收益
+        cursor.execute("DELETE FROM codebook_phrases WHERE namespace = ?", (self.namespace,))
+        cursor.executemany(
+            "INSERT INTO codebook_phrases (namespace, phrase, count) VALUES (?, ?, ?)",
+            ((self.namespace, phrase, count) for phrase, count in self.phrase_counts.items() if count >= 2)
+        )
+
+    def flush(self):
+        """保存短語統計（關閉前調用，下次啟動可繼續學習）"""
+        self._save_phrases(self.connection.cursor())
+        self.connection.commit()
+
+    def encode(self, text: str) -> Tuple[Optional[int], Union[str, bytes]]:
+        """用當前碼本壓縮，返回 (碼本 ID, 壓縮數據)；尚無碼本或壓縮無收益時返回 (None, 原文)"""
+        raw = text.encode("utf-8")
+        self.stats["raw_bytes"] += len(raw)
+
+        if self.current_id is not None:
+            # 租期過去四分之一時續租（與調用方寫入的記錄在同一事務中提交）
+            if time.time() - self.lease_renewed_at >= self.lease_seconds / 4:
+                self._renew_lease()
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.dictionaries[self.current_id])
+            payload = compressor.compress(raw) + compressor.flush()
+            if len(payload) < len(raw):
+                self.stats["encoded"] += 1
+                self.stats["encoded_bytes"] += len(payload)
+                return self.current_id, payload
+
+        self.stats["stored_plain"] += 1
+        self.stats["encoded_bytes"] += len(raw)
+        return None, text
+
+    def decode(self, payload: Union[str, bytes], codebook_id: Optional[int]) -> str:
+        """還原 encode 的結果"""
+        if codebook_id is None:
+            return payload
+
+        dictionary = self.dictionaries.get(codebook_id)
+        if dictionary is None:
+            dictionary = self._load_codebook(codebook_id)
+        if dictionary is None:
+            raise KeyError(f"碼本不存在: {codebook_id}")
+        decompressor = zlib.decompressobj(-15, zdict=dictionary)
+        self.stats["decoded"] += 1
+        return (decompressor.decompress(payload) + decompressor.flush()).decode("utf-8")
+
+    def prune(self, referenced_ids: Iterable[int]) -> int:
+        """刪除本命名空間中沒有被任何數據引用、且超過租期未被使用的舊版本碼本，返回刪除數量
+
+        當前版本始終保留；其他進程的當前版本在租期內續租，不會被刪除
+        """
+        keep = set(referenced_ids)
+        if self.current_id is not None:
+            keep.add(self.current_id)
+        expired = "namespace = ? AND (last_used IS NULL OR last_used < ?)"
+        cutoff = time.time() - self.lease_seconds
+        candidates = [
+            codebook_id for (codebook_id,) in self.connection.execute(
+                f"SELECT id FROM codebooks WHERE {expired}", (self.namespace, cutoff)
+            ) if codebook_id not in keep
+        ]
+
+        # 刪除時再次檢查租期：其他進程可能在此期間續租並寫入引用它的數據
+        deleted = []
+        for codebook_id in candidates:
+            cursor = self.connection.execute(
+                f"DELETE FROM codebooks WHERE id = ? AND {expired}", (codebook_id, self.namespace, cutoff)
+            )
+            if cursor.rowcount:
+                deleted.append(codebook_id)
+        self.connection.commit()
+
+        for codebook_id in deleted:
+            self.dictionaries.pop(codebook_id, None)
+            self.namespaces.pop(codebook_id, None)
+        return len(deleted)
+
+    def close(self):
+        """關閉按需讀取碼本的連接"""
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        raw_bytes = self.stats["raw_bytes"]
+        return {
+            **self.stats,
+            "namespace": self.namespace,
+            "codebook_id": self.current_id,
+            "dictionary_bytes": len(self.dictionaries.get(self.current_id, b"")),
+            "tracked_phrases": len(self.phrase_counts),
+            "observed_bytes": self.observed_bytes,
+            "compression_ratio": self.stats["encoded_bytes"] / raw_bytes if raw_bytes else 1.0
+        }
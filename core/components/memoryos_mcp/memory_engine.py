@@ -15,6 +15,11 @@ from pathlib import Path
 from typing import Dict, List, Optional, Any, Union
 import numpy as np
 
+try:
+    from .context_codebook import ContextCodebook
+except ImportError:
+    from context_codebook import ContextCodebook
+
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -61,8 +66,14 @@ class MemoryEngine:
     """記憶引擎核心類 - 完整版本"""
     
     def __init__(self, db_path: str = "memoryos.db", max_memories: int = 10000, 
-                 enable_rag: bool = True, enable_s3: bool = False, s3_config: Dict[str, Any] = None):
-        """初始化記憶引擎 - 支持 RAG 和 S3"""
+                 enable_rag: bool = True, enable_s3: bool = False, s3_config: Dict[str, Any] = None,
+                 enable_compression: bool = False, codebook_namespace: str = "default",
+                 codebook_config: Dict[str, Any] = None):
+        """初始化記憶引擎 - 支持 RAG、S3 和碼本壓縮存儲
+        
+        enable_compression 開啟後，記憶內容用按項目（codebook_namespace）共享的碼本壓縮存儲，
+        檢索時自動還原；關閉時仍可讀取已壓縮的記憶
+        """
         self.db_path = Path(db_path)
         self.max_memories = max_memories
         self.working_memory: Dict[str, Memory] = {}
@@ -70,6 +81,12 @@ class MemoryEngine:
         self.connection = None
         self.is_initialized = False
         
+        # 碼本壓縮存儲
+        self.enable_compression = enable_compression
+        self.codebook_namespace = codebook_namespace
+        self.codebook_config = codebook_config or {}
+        self.codebook: Optional[ContextCodebook] = None
+        
         # RAG 扩展功能
         self.enable_rag = enable_rag
         self.embedding_model = None
@@ -155,6 +172,11 @@ class MemoryEngine:
         
         # 創建表結構
         await self._create_tables()
+        
+        # 碼本始終載入，以便讀取已壓縮的記憶；SQL 搜索通過 memory_text() 在還原後的內容上匹配
+        self.codebook = ContextCodebook(self.connection, self.codebook_namespace, **self.codebook_config)
+        self.connection.create_function("memory_text", 2, self.codebook.decode, deterministic=True)
+        
         self.is_initialized = True
         logger.info(f"✅ 記憶引擎初始化完成: {self.db_path}")
     
@@ -173,10 +195,18 @@ class MemoryEngine:
                 access_count INTEGER DEFAULT 0,
                 importance_score REAL DEFAULT 0.5,
                 tags TEXT,
-                embedding BLOB
+                embedding BLOB,
+                codebook_id INTEGER,
+                content_size INTEGER
             )
         """)
         
+        # 舊數據庫遷移：補充碼本壓縮相關欄位
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(memories)")}
+        for column in ("codebook_id", "content_size"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE memories ADD COLUMN {column} INTEGER")
+        
         # 創建索引
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_memory_type ON memories(memory_type)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON memories(created_at)")
@@ -202,22 +232,26 @@ class MemoryEngine:
             elif isinstance(memory.embedding, list):
                 embedding_blob = np.array(memory.embedding).tobytes()
         
+        codebook_id, stored_content = self._encode_content(memory.content)
+        
         cursor.execute("""
             INSERT OR REPLACE INTO memories 
             (id, memory_type, content, metadata, created_at, accessed_at, 
-             access_count, importance_score, tags, embedding)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             access_count, importance_score, tags, embedding, codebook_id, content_size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             memory.id,
             memory.memory_type.value,
-            memory.content,
+            stored_content,
             metadata_json,
             memory.created_at,
             memory.accessed_at,
             memory.access_count,
             memory.importance_score,
             tags_json,
-            embedding_blob
+            embedding_blob,
+            codebook_id,
+            len(memory.content.encode('utf-8'))
         ))
         
         self.connection.commit()
@@ -278,8 +312,8 @@ class MemoryEngine:
         
         cursor = self.connection.cursor()
         
-        # 構建查詢條件
-        conditions = ["content LIKE ?"]
+        # 構建查詢條件（壓縮存儲的記憶先還原再匹配）
+        conditions = ["(CASE WHEN codebook_id IS NULL THEN content ELSE memory_text(content, codebook_id) END) LIKE ?"]
         params = [f"%{query}%"]
         
         if memory_type:
@@ -342,6 +376,68 @@ class MemoryEngine:
             limit=limit
         )
     
+    def _encode_content(self, content: str):
+        """按碼本編碼記憶內容，返回 (碼本 ID, 存儲內容)；未開啟壓縮時原樣存儲"""
+        if not self.enable_compression:
+            return None, content
+        
+        self.codebook.observe(content)
+        self.codebook.maybe_rebuild()
+        return self.codebook.encode(content)
+    
+    async def recompress_memories(self) -> Dict[str, Any]:
+        """用當前碼本重新編碼全部記憶（碼本更新後可回收空間），並刪除不再引用的舊碼本"""
+        if not self.is_initialized:
+            await self.initialize()
+        
+        cursor = self.connection.cursor()
+        before = await self.get_storage_statistics()
+        
+        rows = cursor.execute("SELECT id, content, codebook_id FROM memories").fetchall()
+        updates = []
+        for row in rows:
+            content = self.codebook.decode(row['content'], row['codebook_id'])
+            codebook_id, stored_content = self.codebook.encode(content) if self.enable_compression else (None, content)
+            if codebook_id != row['codebook_id']:
+                updates.append((stored_content, codebook_id, len(content.encode('utf-8')), row['id']))
+        
+        cursor.executemany(
+            "UPDATE memories SET content = ?, codebook_id = ?, content_size = ? WHERE id = ?", updates
+        )
+        self.connection.commit()
+        
+        referenced = [row[0] for row in cursor.execute(
+            "SELECT DISTINCT codebook_id FROM memories WHERE codebook_id IS NOT NULL"
+        )]
+        pruned = self.codebook.prune(referenced)
+        
+        after = await self.get_storage_statistics()
+        logger.info(f"🗜️ 重新編碼 {len(updates)} 條記憶: {before['stored_bytes']} → {after['stored_bytes']} 字節")
+        return {"recompressed": len(updates), "pruned_codebooks": pruned, "before": before, "after": after}
+    
+    async def get_storage_statistics(self) -> Dict[str, Any]:
+        """記憶內容的原始大小與實際存儲大小"""
+        if not self.is_initialized:
+            await self.initialize()
+        
+        cursor = self.connection.cursor()
+        cursor.execute("""
+            SELECT COUNT(codebook_id),
+                   COALESCE(SUM(COALESCE(content_size, LENGTH(CAST(content AS BLOB)))), 0),
+                   COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0)
+            FROM memories
+        """)
+        compressed_memories, raw_bytes, stored_bytes = cursor.fetchone()
+        
+        return {
+            "compression_enabled": self.enable_compression,
+            "compressed_memories": compressed_memories,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "compression_ratio": stored_bytes / raw_bytes if raw_bytes else 1.0,
+            "codebook": self.codebook.get_stats()
+        }
+    
     def _row_to_memory(self, row) -> Memory:
         """將數據庫行轉換為記憶對象"""
         metadata = json.loads(row['metadata']) if row['metadata'] else {}
@@ -357,7 +453,7 @@ class MemoryEngine:
         return Memory(
             id=row['id'],
             memory_type=MemoryType(row['memory_type']),
-            content=row['content'],
+            content=self.codebook.decode(row['content'], row['codebook_id']),
             metadata=metadata,
             created_at=row['created_at'],
             accessed_at=row['accessed_at'],
@@ -422,7 +518,8 @@ class MemoryEngine:
             "average_importance": avg_importance,
             "database_size": self.db_path.stat().st_size if self.db_path.exists() else 0,
             "max_capacity": self.max_memories,
-            "capacity_usage": (total_memories / self.max_memories) * 100
+            "capacity_usage": (total_memories / self.max_memories) * 100,
+            "storage": await self.get_storage_statistics()
         }
         
         # 添加 RAG 统计
@@ -440,6 +537,10 @@ class MemoryEngine:
     async def cleanup(self):
         """清理資源"""
         if self.connection:
+            if self.enable_compression and self.codebook is not None:
+                self.codebook.flush()
+            if self.codebook is not None:
+                self.codebook.close()
             self.connection.close()
             self.connection = None
         self.is_initialized = False
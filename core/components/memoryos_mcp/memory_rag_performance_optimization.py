@@ -5,23 +5,50 @@ Memory RAG性能優化實現
 """
 
 import asyncio
+import sys
 import time
 import json
 import hashlib
+from pathlib import Path
 from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
 import numpy as np
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+from async_cache import AsyncCache
+from semantic_cache import SemanticCache
+
 class OptimizedMemoryRAG:
     """優化的Memory RAG實現"""
     
-    def __init__(self):
-        # 內存緩存（生產環境應使用Redis）
-        self.cache = {}
+    def __init__(self, embedding_model=None, cache_path: Optional[str] = None,
+                 max_cache_entries: int = 10000, max_embedding_bytes: int = 64 * 1024 * 1024,
+                 semantic_threshold: Optional[float] = 0.92, max_semantic_entries: int = 2048):
+        """
+        Args:
+            embedding_model: 可選的嵌入模型（提供 encode(List[str]) 方法），用於查詢向量和語義緩存
+            cache_path: 緩存持久化的 SQLite 文件，重啟後緩存保持預熱；None 表示只用內存
+            max_cache_entries: 響應緩存條目上限
+            max_embedding_bytes: 查詢向量緩存的內存上限
+            semantic_threshold: 語義緩存的相似度閾值，None 表示只按精確查詢緩存（未提供嵌入模型時同樣不啟用）
+            max_semantic_entries: 語義索引條目上限
+        """
+        # 響應緩存（有界，可持久化）
         self.cache_ttl = 3600  # 1小時
+        self.cache = AsyncCache("memory_rag_responses", ttl=self.cache_ttl,
+                                max_entries=max_cache_entries, persist_path=cache_path)
+        
+        # 預計算的embeddings（查詢文本 -> 向量，不過期，按內存大小限制）
+        self.embedding_model = embedding_model
+        self.precomputed_embeddings = AsyncCache("memory_rag_embeddings", ttl=None,
+                                                 max_entries=max_cache_entries,
+                                                 max_bytes=max_embedding_bytes, persist_path=cache_path)
         
-        # 預計算的embeddings
-        self.precomputed_embeddings = {}
+        # 語義緩存：近似重複的查詢複用已緩存的響應
+        self.semantic_cache = None
+        if embedding_model is not None and semantic_threshold is not None:
+            self.semantic_cache = SemanticCache(self.cache, self.get_query_embedding,
+                                                threshold=semantic_threshold,
+                                                max_entries=max_semantic_entries)
         
         # 熱門查詢模式
         self.hot_patterns = []
@@ -38,10 +65,20 @@ class OptimizedMemoryRAG:
         """獲取增強的響應（<200ms目標）"""
         start_time = time.time()
         
-        # 1. 檢查緩存（~5ms）
+        # 1. 檢查緩存（~5ms）（精確查詢，其次語義相似查詢）；未命中時同一查詢的並發請求只計算一次增強響應
         cache_key = self._get_cache_key(user_input)
-        cached_result = self._check_cache(cache_key)
-        if cached_result:
+        loaded = False
+        
+        async def load():
+            nonlocal loaded
+            loaded = True
+            return await self._build_enhanced_response(user_input, k2_response)
+        
+        if self.semantic_cache is not None:
+            cached_result, _ = await self.semantic_cache.get_or_load(user_input, "memory_rag", cache_key, load)
+        else:
+            cached_result = await self.cache.get_or_load(cache_key, load)
+        if not loaded:
             self.performance_stats["cache_hits"] += 1
             latency = (time.time() - start_time) * 1000
             return {
@@ -51,7 +88,27 @@ class OptimizedMemoryRAG:
             }
         
         self.performance_stats["cache_misses"] += 1
+        enhanced_response = cached_result["response"]
         
+        latency = (time.time() - start_time) * 1000
+        
+        # 更新性能統計
+        self._update_performance_stats(latency)
+        
+        return {
+            "enhanced_response": enhanced_response,
+            "latency_ms": latency,
+            "cache_hit": False,
+            "performance_breakdown": {
+                "vector_search": "~50ms",
+                "context_retrieval": "~80ms", 
+                "style_alignment": "~70ms",
+                "combination": "~20ms"
+            }
+        }
+    
+    async def _build_enhanced_response(self, user_input: str, k2_response: str) -> Dict[str, Any]:
+        """執行RAG操作並組合增強響應（緩存未命中時調用）"""
         # 2. 並行執行所有RAG操作
         tasks = [
             self._vector_search(user_input),        # ~50ms
@@ -72,28 +129,26 @@ class OptimizedMemoryRAG:
             style_suggestions
         )
         
-        # 4. 異步寫入緩存（不阻塞）
-        asyncio.create_task(self._update_cache(cache_key, enhanced_response))
-        
-        latency = (time.time() - start_time) * 1000
+        # 4. 由 get_or_load 寫入緩存
+        return {"response": enhanced_response}
+    
+    async def get_query_embedding(self, query: str) -> Optional[np.ndarray]:
+        """查詢向量（緩存在 precomputed_embeddings 中），未配置嵌入模型時返回 None"""
+        if self.embedding_model is None:
+            return None
         
-        # 更新性能統計
-        self._update_performance_stats(latency)
+        async def encode():
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(None, self.embedding_model.encode, [query])
+            return np.asarray(vectors[0], dtype=np.float32)
         
-        return {
-            "enhanced_response": enhanced_response,
-            "latency_ms": latency,
-            "cache_hit": False,
-            "performance_breakdown": {
-                "vector_search": "~50ms",
-                "context_retrieval": "~80ms", 
-                "style_alignment": "~70ms",
-                "combination": "~20ms"
-            }
-        }
+        return await self.precomputed_embeddings.get_or_load(query, encode)
     
     async def _vector_search(self, query: str) -> List[Dict]:
         """向量搜索（優化到50ms）"""
+        # 查詢向量寫入 precomputed_embeddings，語義緩存查找時直接複用
+        await self.get_query_embedding(query)
+        
         # 模擬優化的向量搜索
         await asyncio.sleep(0.05)  # 50ms
         
@@ -151,25 +206,8 @@ class OptimizedMemoryRAG:
         return enhanced
     
     def _get_cache_key(self, user_input: str) -> str:
-        """生成緩存鍵"""
-        return hashlib.md5(user_input.encode()).hexdigest()
-    
-    def _check_cache(self, key: str) -> Optional[Dict]:
-        """檢查緩存"""
-        if key in self.cache:
-            cached = self.cache[key]
-            if cached["expires_at"] > datetime.now():
-                return cached
-            else:
-                del self.cache[key]
-        return None
-    
-    async def _update_cache(self, key: str, response: str):
-        """異步更新緩存"""
-        self.cache[key] = {
-            "response": response,
-            "expires_at": datetime.now() + timedelta(seconds=self.cache_ttl)
-        }
+        """生成緩存鍵（忽略空白差異）"""
+        return hashlib.md5(" ".join(user_input.split()).encode()).hexdigest()
     
     def _update_performance_stats(self, latency: float):
         """更新性能統計"""
@@ -189,8 +227,16 @@ class OptimizedMemoryRAG:
             "total_requests": total,
             "cache_hit_rate": f"{hits/max(total, 1)*100:.1f}%",
             "avg_latency_ms": f"{self.performance_stats['avg_latency_ms']:.1f}",
-            "cache_effectiveness": "高" if hits/max(total, 1) > 0.3 else "低"
+            "cache_effectiveness": "高" if hits/max(total, 1) > 0.3 else "低",
+            "response_cache": self.cache.get_stats(),
+            "embedding_cache": self.precomputed_embeddings.get_stats(),
+            "semantic_cache": self.semantic_cache.get_stats() if self.semantic_cache else None
         }
+    
+    def close(self):
+        """提交並關閉緩存持久層"""
+        self.cache.close()
+        self.precomputed_embeddings.close()
 
 async def test_optimized_rag():
     """測試優化的RAG性能"""
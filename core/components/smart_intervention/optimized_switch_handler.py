@@ -13,8 +13,18 @@ import threading
 import queue
 import logging
 
+try:
+    from metrics_registry import metrics_registry
+    METRICS_AVAILABLE = True
+except ImportError:
+    METRICS_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+if METRICS_AVAILABLE:
+    SWITCH_LATENCY = metrics_registry.histogram(
+        "smart_intervention_switch_latency_seconds", "Smart Intervention 切換總延遲", ["path"])
+
 class SwitchMode(Enum):
     CLAUDE_TO_EDITOR = "claude_to_editor"
     EDITOR_TO_CLAUDE = "editor_to_claude"
@@ -360,6 +370,8 @@ class OptimizedSwitchHandler:
     def _record_metrics(self, metrics: SwitchMetrics):
         """記錄性能指標"""
         self.metrics_history.append(metrics)
+        if METRICS_AVAILABLE:
+            SWITCH_LATENCY.labels("fast" if metrics.cache_hit else "deep").observe(metrics.total_time / 1000)
         
         # 保持最近 100 次記錄
         if len(self.metrics_history) > 100:
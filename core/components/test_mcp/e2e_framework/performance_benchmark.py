@@ -13,19 +13,21 @@ PowerAutomation v4.6.1 性能基準測試系統
 
 import asyncio
 import logging
+import math
+import random
 import time
 import statistics
 import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional, Callable
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from enum import Enum
 import psutil
 import aiohttp
 import json
 from pathlib import Path
 import matplotlib.pyplot as plt
-import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -84,9 +86,29 @@ class BenchmarkResult:
             self.additional_data = {}
 
 
+@dataclass
+class LoadScenario:
+    """負載測試場景（按權重與其他場景混合）"""
+    name: str
+    url: str
+    method: str = "GET"
+    weight: float = 1.0
+    headers: Dict[str, str] = None
+    payload: Dict[str, Any] = None
+    
+    def __post_init__(self):
+        if self.headers is None:
+            self.headers = {}
+
+
 @dataclass
 class LoadTestConfiguration:
-    """負載測試配置"""
+    """負載測試配置
+    
+    mode="closed": 每個用戶等待響應後再發送下一個請求（request_rate 為每用戶的目標速率）
+    mode="open": 按 arrival_rate（總 RPS）的固定到達率發送請求，不等待響應，
+                 延遲從計劃發送時間開始計算，包含排隊延遲（避免 coordinated omission）
+    """
     target_url: str
     concurrent_users: int
     duration_seconds: int
@@ -94,12 +116,35 @@ class LoadTestConfiguration:
     request_rate: int
     headers: Dict[str, str] = None
     payload: Dict[str, Any] = None
+    method: str = "GET"
+    mode: str = "closed"
+    arrival_rate: float = 0.0
+    workers: int = 1
+    max_in_flight: int = 1000
+    timeout_seconds: float = 30.0
+    scenarios: List[LoadScenario] = field(default_factory=list)
     
     def __post_init__(self):
         if self.headers is None:
             self.headers = {}
         if self.payload is None:
             self.payload = {}
+        if self.mode not in ("closed", "open"):
+            raise ValueError(f"不支持的負載模式: {self.mode}")
+        if self.mode == "open" and self.arrival_rate <= 0:
+            raise ValueError("開環模式需要設置 arrival_rate")
+    
+    def get_scenarios(self) -> List[LoadScenario]:
+        """未配置場景時，使用 target_url 作為唯一場景"""
+        if self.scenarios:
+            return self.scenarios
+        return [LoadScenario(
+            name="default",
+            url=self.target_url,
+            method=self.method,
+            headers=self.headers,
+            payload=self.payload if self.method.upper() != "GET" else None
+        )]
 
 
 class SystemPerformanceMonitor:
@@ -204,23 +249,331 @@ class SystemPerformanceMonitor:
         }
 
 
+class LatencyHistogram:
+    """HDR 風格的延遲直方圖（微秒，對數-線性分桶）
+    
+    相對誤差不超過 10^-significant_figures，內存只與不同桶的數量有關，
+    可以合併（多進程負載工作器）和序列化
+    """
+    
+    def __init__(self, significant_figures: int = 3):
+        self.significant_figures = significant_figures
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.counts: Dict[int, int] = {}
+        self.total_count = 0
+        self.min_value = None
+        self.max_value = 0
+        self.total = 0
+        self.total_squares = 0
+    
+    def _bucket(self, value: int) -> int:
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return shift * self.sub_bucket_count + (value >> shift)
+    
+    def _highest_equivalent(self, bucket: int) -> int:
+        shift, sub_bucket = divmod(bucket, self.sub_bucket_count)
+        return ((sub_bucket + 1) << shift) - 1
+    
+    def record(self, value_us: int, count: int = 1):
+        value_us = max(0, int(value_us))
+        bucket = self._bucket(value_us)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total_count += count
+        self.total += value_us * count
+        self.total_squares += value_us * value_us * count
+        if self.min_value is None or value_us < self.min_value:
+            self.min_value = value_us
+        if value_us > self.max_value:
+            self.max_value = value_us
+    
+    def record_corrected(self, value_us: int, expected_interval_us: int):
+        """閉環測試的 coordinated omission 修正：補記響應阻塞期間本應發出的請求的延遲"""
+        self.record(value_us)
+        if expected_interval_us <= 0:
+            return
+        missing = value_us - expected_interval_us
+        while missing >= expected_interval_us:
+            self.record(missing)
+            missing -= expected_interval_us
+    
+    def percentile(self, percent: float) -> int:
+        if self.total_count == 0:
+            return 0
+        target = max(1, math.ceil(percent / 100 * self.total_count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._highest_equivalent(bucket), self.max_value)
+        return self.max_value
+    
+    def mean(self) -> float:
+        return self.total / self.total_count if self.total_count else 0.0
+    
+    def stdev(self) -> float:
+        if self.total_count < 2:
+            return 0.0
+        variance = (self.total_squares - self.total * self.total / self.total_count) / (self.total_count - 1)
+        return math.sqrt(max(0.0, variance))
+    
+    def merge(self, other: "LatencyHistogram"):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total_count += other.total_count
+        self.total += other.total
+        self.total_squares += other.total_squares
+        if other.min_value is not None and (self.min_value is None or other.min_value < self.min_value):
+            self.min_value = other.min_value
+        self.max_value = max(self.max_value, other.max_value)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "significant_figures": self.significant_figures,
+            "counts": self.counts,
+            "total_count": self.total_count,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "total": self.total,
+            "total_squares": self.total_squares
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls(data["significant_figures"])
+        histogram.counts = {int(bucket): count for bucket, count in data["counts"].items()}
+        histogram.total_count = data["total_count"]
+        histogram.min_value = data["min_value"]
+        histogram.max_value = data["max_value"]
+        histogram.total = data["total"]
+        histogram.total_squares = data["total_squares"]
+        return histogram
+    
+    def summary_ms(self) -> Dict[str, float]:
+        """延遲摘要（毫秒）"""
+        if self.total_count == 0:
+            return {}
+        return {
+            "average_ms": self.mean() / 1000,
+            "median_ms": self.percentile(50) / 1000,
+            "min_ms": self.min_value / 1000,
+            "max_ms": self.max_value / 1000,
+            "p90_ms": self.percentile(90) / 1000,
+            "p95_ms": self.percentile(95) / 1000,
+            "p99_ms": self.percentile(99) / 1000,
+            "p99_9_ms": self.percentile(99.9) / 1000,
+            "std_dev_ms": self.stdev() / 1000
+        }
+
+
+class LoadTestStats:
+    """負載測試統計：流式記錄到直方圖和計數器，不保留單個請求的結果"""
+    
+    def __init__(self):
+        self.response_times = LatencyHistogram()  # 開環：計劃發送 → 完成；閉環：修正後的響應時間
+        self.service_times = LatencyHistogram()  # 實際發送 → 完成
+        self.schedule_lag = LatencyHistogram()  # 計劃發送 → 實際發送（負載生成器或連接池飽和）
+        self.total_requests = 0
+        self.successful_requests = 0
+        self.status_codes: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.scenarios: Dict[str, Dict[str, Any]] = {}
+    
+    def _scenario(self, name: str) -> Dict[str, Any]:
+        if name not in self.scenarios:
+            self.scenarios[name] = {"requests": 0, "failures": 0, "response_times": LatencyHistogram()}
+        return self.scenarios[name]
+    
+    def record(self, scenario: str, response_us: int, service_us: int, lag_us: int,
+               status_code: int, error: Optional[str] = None, expected_interval_us: int = 0):
+        success = error is None and 200 <= status_code < 400
+        self.total_requests += 1
+        scenario_stats = self._scenario(scenario)
+        scenario_stats["requests"] += 1
+        
+        if success:
+            self.successful_requests += 1
+            if expected_interval_us:
+                self.response_times.record_corrected(response_us, expected_interval_us)
+            else:
+                self.response_times.record(response_us)
+            self.service_times.record(service_us)
+            self.schedule_lag.record(lag_us)
+            scenario_stats["response_times"].record(response_us)
+        else:
+            scenario_stats["failures"] += 1
+            key = error or f"HTTP {status_code}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+        
+        code = str(status_code)
+        self.status_codes[code] = self.status_codes.get(code, 0) + 1
+    
+    def merge(self, other: "LoadTestStats"):
+        self.response_times.merge(other.response_times)
+        self.service_times.merge(other.service_times)
+        self.schedule_lag.merge(other.schedule_lag)
+        self.total_requests += other.total_requests
+        self.successful_requests += other.successful_requests
+        for target, source in ((self.status_codes, other.status_codes), (self.errors, other.errors)):
+            for key, count in source.items():
+                target[key] = target.get(key, 0) + count
+        for name, scenario_stats in other.scenarios.items():
+            merged = self._scenario(name)
+            merged["requests"] += scenario_stats["requests"]
+            merged["failures"] += scenario_stats["failures"]
+            merged["response_times"].merge(scenario_stats["response_times"])
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "response_times": self.response_times.to_dict(),
+            "service_times": self.service_times.to_dict(),
+            "schedule_lag": self.schedule_lag.to_dict(),
+            "total_requests": self.total_requests,
+            "successful_requests": self.successful_requests,
+            "status_codes": self.status_codes,
+            "errors": self.errors,
+            "scenarios": {
+                name: {**scenario_stats, "response_times": scenario_stats["response_times"].to_dict()}
+                for name, scenario_stats in self.scenarios.items()
+            }
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LoadTestStats":
+        stats = cls()
+        stats.response_times = LatencyHistogram.from_dict(data["response_times"])
+        stats.service_times = LatencyHistogram.from_dict(data["service_times"])
+        stats.schedule_lag = LatencyHistogram.from_dict(data["schedule_lag"])
+        stats.total_requests = data["total_requests"]
+        stats.successful_requests = data["successful_requests"]
+        stats.status_codes = dict(data["status_codes"])
+        stats.errors = dict(data["errors"])
+        stats.scenarios = {
+            name: {**scenario_stats, "response_times": LatencyHistogram.from_dict(scenario_stats["response_times"])}
+            for name, scenario_stats in data["scenarios"].items()
+        }
+        return stats
+
+
+def _arrival_offsets(rate: float, duration: float, ramp_up: float):
+    """固定到達率的計劃發送時間（相對開始時間的秒數），ramp_up 期間速率從 0 線性增加到 rate"""
+    ramp_requests = rate * ramp_up / 2
+    index = 0
+    while True:
+        if index < ramp_requests:
+            offset = math.sqrt(2 * ramp_up * index / rate)
+        else:
+            offset = ramp_up + (index - ramp_requests) / rate
+        if offset >= duration:
+            return
+        yield offset
+        index += 1
+
+
+async def _open_loop_worker(config: LoadTestConfiguration, worker_index: int, start_at: float) -> LoadTestStats:
+    """單個負載工作器：按計劃時間發送請求，不等待前一個請求完成"""
+    stats = LoadTestStats()
+    scenarios = config.get_scenarios()
+    cumulative_weights = []
+    total_weight = 0.0
+    for scenario in scenarios:
+        total_weight += scenario.weight
+        cumulative_weights.append(total_weight)
+    rng = random.Random(worker_index)
+    rate = config.arrival_rate / config.workers
+    
+    # start_at 為所有工作器共用的掛鐘時間，換算到本進程的單調時鐘
+    start = time.perf_counter() + max(0.0, start_at - time.time())
+    in_flight = asyncio.Semaphore(config.max_in_flight)
+    tasks = set()
+    
+    async def fire(session: aiohttp.ClientSession, scenario: LoadScenario, scheduled: float):
+        async with in_flight:
+            sent = time.perf_counter()
+            status_code, error = -1, None
+            try:
+                async with session.request(scenario.method, scenario.url, headers=scenario.headers,
+                                           json=scenario.payload) as response:
+                    await response.read()
+                    status_code = response.status
+            except Exception as e:
+                error = type(e).__name__
+            finished = time.perf_counter()
+        stats.record(scenario.name, int((finished - scheduled) * 1e6), int((finished - sent) * 1e6),
+                     int((sent - scheduled) * 1e6), status_code, error)
+    
+    connector = aiohttp.TCPConnector(limit=config.max_in_flight)
+    timeout = aiohttp.ClientTimeout(total=config.timeout_seconds)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        for offset in _arrival_offsets(rate, config.duration_seconds, config.ramp_up_time):
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            scenario = rng.choices(scenarios, cum_weights=cumulative_weights)[0] if len(scenarios) > 1 else scenarios[0]
+            task = asyncio.create_task(fire(session, scenario, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    return stats
+
+
+def _run_open_loop_worker(config: LoadTestConfiguration, worker_index: int, start_at: float) -> Dict[str, Any]:
+    """負載工作進程入口，返回序列化的統計"""
+    return asyncio.run(_open_loop_worker(config, worker_index, start_at)).to_dict()
+
+
 class LoadTestRunner:
     """負載測試執行器"""
     
     def __init__(self, config: LoadTestConfiguration):
         self.config = config
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.results = []
+        self.stats = LoadTestStats()
+        self.elapsed = 0.0
         self.running = False
     
     async def run_load_test(self) -> Dict[str, Any]:
         """執行負載測試"""
         self.logger.info(f"開始負載測試: {self.config.target_url}")
-        self.logger.info(f"並發用戶: {self.config.concurrent_users}, 持續時間: {self.config.duration_seconds}秒")
+        self.stats = LoadTestStats()
+        start_time = time.time()
+        
+        if self.config.mode == "open":
+            self.logger.info(f"開環模式: {self.config.arrival_rate} RPS, {self.config.workers} 個工作進程, "
+                             f"持續時間: {self.config.duration_seconds}秒")
+            await self._run_open_loop()
+        else:
+            self.logger.info(f"並發用戶: {self.config.concurrent_users}, 持續時間: {self.config.duration_seconds}秒")
+            await self._run_closed_loop(start_time)
+        
+        self.elapsed = time.time() - start_time
         
+        # 分析結果
+        return self._analyze_results()
+    
+    async def _run_open_loop(self):
+        """開環：固定到達率，多進程時各工作器分擔速率並在同一時刻開始"""
+        if self.config.workers <= 1:
+            self.stats = await _open_loop_worker(self.config, 0, time.time())
+            return
+        
+        loop = asyncio.get_running_loop()
+        start_at = time.time() + 1.0  # 預留進程啟動時間
+        with ProcessPoolExecutor(max_workers=self.config.workers) as executor:
+            futures = [
+                loop.run_in_executor(executor, _run_open_loop_worker, self.config, worker_index, start_at)
+                for worker_index in range(self.config.workers)
+            ]
+            for worker_stats in await asyncio.gather(*futures):
+                self.stats.merge(LoadTestStats.from_dict(worker_stats))
+    
+    async def _run_closed_loop(self, start_time: float):
+        """閉環：每個用戶等待響應後再發送下一個請求"""
         self.running = True
-        self.results = []
-        start_time = time.time()
         
         # 創建並發任務
         tasks = []
@@ -238,44 +591,31 @@ class LoadTestRunner:
         
         # 等待所有任務完成
         await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # 分析結果
-        return self._analyze_results()
     
     async def _simulate_user(self, user_id: int, start_time: float):
         """模擬用戶行為"""
-        async with aiohttp.ClientSession() as session:
+        scenarios = self.config.get_scenarios()
+        weights = [scenario.weight for scenario in scenarios]
+        rng = random.Random(user_id)
+        # 有目標速率時，響應時間超過請求間隔的部分按 coordinated omission 修正
+        expected_interval_us = int(1e6 / self.config.request_rate) if self.config.request_rate > 0 else 0
+        
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.config.timeout_seconds)) as session:
             while self.running and (time.time() - start_time) < self.config.duration_seconds:
+                scenario = rng.choices(scenarios, weights=weights)[0] if len(scenarios) > 1 else scenarios[0]
+                request_start = time.perf_counter()
+                status_code, error = -1, None
                 try:
-                    request_start = time.time()
-                    
-                    async with session.get(
-                        self.config.target_url,
-                        headers=self.config.headers
-                    ) as response:
+                    async with session.request(scenario.method, scenario.url,
+                                               headers=scenario.headers, json=scenario.payload) as response:
                         await response.read()
-                        request_end = time.time()
-                        
-                        result = {
-                            "user_id": user_id,
-                            "timestamp": datetime.now().isoformat(),
-                            "response_time": request_end - request_start,
-                            "status_code": response.status,
-                            "success": 200 <= response.status < 400
-                        }
-                        
-                        self.results.append(result)
-                
+                        status_code = response.status
                 except Exception as e:
-                    result = {
-                        "user_id": user_id,
-                        "timestamp": datetime.now().isoformat(),
-                        "response_time": -1,
-                        "status_code": -1,
-                        "success": False,
-                        "error": str(e)
-                    }
-                    self.results.append(result)
+                    error = str(e) or type(e).__name__
+                
+                response_us = int((time.perf_counter() - request_start) * 1e6)
+                self.stats.record(scenario.name, response_us, response_us, 0, status_code, error,
+                                  expected_interval_us=expected_interval_us)
                 
                 # 控制請求頻率
                 if self.config.request_rate > 0:
@@ -283,49 +623,39 @@ class LoadTestRunner:
     
     def _analyze_results(self) -> Dict[str, Any]:
         """分析負載測試結果"""
-        if not self.results:
+        stats = self.stats
+        if not stats.total_requests:
             return {}
         
-        successful_requests = [r for r in self.results if r["success"]]
-        failed_requests = [r for r in self.results if not r["success"]]
-        
-        response_times = [r["response_time"] for r in successful_requests if r["response_time"] > 0]
-        
-        total_requests = len(self.results)
-        success_rate = len(successful_requests) / total_requests * 100 if total_requests > 0 else 0
+        failed_requests = stats.total_requests - stats.successful_requests
+        # 開環模式按計劃發送窗口計算（不含工作進程啟動時間）
+        elapsed = self.config.duration_seconds if self.config.mode == "open" else max(self.elapsed, self.config.duration_seconds)
         
         analysis = {
+            "mode": self.config.mode,
             "summary": {
-                "total_requests": total_requests,
-                "successful_requests": len(successful_requests),
-                "failed_requests": len(failed_requests),
-                "success_rate_percent": success_rate,
-                "throughput_rps": total_requests / self.config.duration_seconds
+                "total_requests": stats.total_requests,
+                "successful_requests": stats.successful_requests,
+                "failed_requests": failed_requests,
+                "success_rate_percent": stats.successful_requests / stats.total_requests * 100,
+                "throughput_rps": stats.total_requests / elapsed,
+                "target_rps": self.config.arrival_rate if self.config.mode == "open" else None
+            },
+            "response_times": stats.response_times.summary_ms(),
+            "service_times": stats.service_times.summary_ms(),
+            "schedule_lag": stats.schedule_lag.summary_ms(),
+            "status_codes": stats.status_codes,
+            "scenarios": {
+                name: {
+                    "requests": scenario_stats["requests"],
+                    "failures": scenario_stats["failures"],
+                    "response_times": scenario_stats["response_times"].summary_ms()
+                }
+                for name, scenario_stats in stats.scenarios.items()
             },
-            "response_times": {},
-            "errors": {}
+            "errors": stats.errors
         }
         
-        if response_times:
-            analysis["response_times"] = {
-                "average_ms": statistics.mean(response_times) * 1000,
-                "median_ms": statistics.median(response_times) * 1000,
-                "min_ms": min(response_times) * 1000,
-                "max_ms": max(response_times) * 1000,
-                "p90_ms": np.percentile(response_times, 90) * 1000,
-                "p95_ms": np.percentile(response_times, 95) * 1000,
-                "p99_ms": np.percentile(response_times, 99) * 1000,
-                "std_dev_ms": statistics.stdev(response_times) * 1000 if len(response_times) > 1 else 0
-            }
-        
-        # 錯誤分析
-        error_types = {}
-        for result in failed_requests:
-            error = result.get("error", "Unknown error")
-            error_types[error] = error_types.get(error, 0) + 1
-        
-        analysis["errors"] = error_types
-        
         return analysis
 
 
@@ -531,6 +861,7 @@ class PerformanceBenchmarkSuite:
         # 提取關鍵指標
         throughput = load_results.get("summary", {}).get("throughput_rps", 0)
         avg_response_time = load_results.get("response_times", {}).get("average_ms", 0)
+        p99_response_time = load_results.get("response_times", {}).get("p99_ms", 0)
         success_rate = load_results.get("summary", {}).get("success_rate_percent", 0)
         
         return BenchmarkResult(
@@ -542,11 +873,12 @@ class PerformanceBenchmarkSuite:
             timestamp=datetime.now().isoformat(),
             duration=duration,
             environment="local",
-            platform=f"{config.concurrent_users} users",
+            platform=f"{config.arrival_rate} rps open-loop" if config.mode == "open" else f"{config.concurrent_users} users",
             additional_data={
                 "load_test_config": asdict(config),
                 "load_test_results": load_results,
                 "average_response_time_ms": avg_response_time,
+                "p99_response_time_ms": p99_response_time,
                 "success_rate_percent": success_rate
             }
         )
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+訓練數據集流式寫入器
+- 逐條接收樣本，按大小上限切分為 JSONL 分片（可選 gzip / zstd 壓縮）
+- 分片先寫入臨時文件，寫滿後原子重命名
+- 統計信息隨寫入增量更新，關閉時生成 manifest
+內存佔用與數據集大小無關
+"""
+
+import gzip
+import json
+import logging
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterable, Optional, List
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _get_path(sample: Dict[str, Any], dotted: str):
+    """按 a.b.c 路徑取值，缺失時返回 None"""
+    value = sample
+    for key in dotted.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+class ShardedDatasetWriter:
+    """按大小切分的 JSONL 數據集寫入器"""
+
+    def __init__(self, output_dir: Path, prefix: str,
+                 max_shard_bytes: int = 256 * 1024 * 1024,
+                 compression: Optional[str] = None,
+                 count_by: Optional[Dict[str, str]] = None,
+                 sum_of: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            output_dir: 輸出目錄
+            prefix: 分片和 manifest 文件名前綴
+            max_shard_bytes: 單個分片的未壓縮大小上限
+            compression: None / "gzip" / "zstd"
+            count_by: 統計名 -> 欄位路徑，按欄位值計數（如 {"by_intent": "metadata.intent_type"}）
+            sum_of: 統計名 -> 欄位路徑，累加數值或布爾值（如 {"has_tools": "metadata.has_tools"}）
+        """
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"不支持的壓縮格式: {compression}")
+        if compression == "zstd" and not ZSTD_AVAILABLE:
+            logger.warning("zstandard 未安裝，改用 gzip 壓縮")
+            compression = "gzip"
+
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.compression = compression
+        self.count_by = count_by or {}
+        self.sum_of = sum_of or {}
+
+        self.shards: List[Dict[str, Any]] = []
+        self.stats = {
+            "total_samples": 0,
+            "total_bytes": 0,
+            **{name: {} for name in self.count_by},
+            **{name: 0 for name in self.sum_of}
+        }
+
+        self._file = None
+        self._raw_file = None
+        self._shard_path: Optional[Path] = None
+        self._shard_samples = 0
+        self._shard_bytes = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _open_shard(self):
+        name = f"{self.prefix}-{len(self.shards):05d}.jsonl{COMPRESSION_SUFFIXES[self.compression]}"
+        self._shard_path = self.output_dir / name
+        temp_path = self._shard_path.with_name(name + ".tmp")
+
+        if self.compression == "gzip":
+            self._file = gzip.open(temp_path, "wb")
+        elif self.compression == "zstd":
+            self._raw_file = open(temp_path, "wb")
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw_file)
+        else:
+            self._file = open(temp_path, "wb")
+
+        self._shard_samples = 0
+        self._shard_bytes = 0
+
+    def _close_shard(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        if self._raw_file is not None:
+            self._raw_file.close()
+            self._raw_file = None
+        self._file = None
+
+        temp_path = self._shard_path.with_name(self._shard_path.name + ".tmp")
+        os.replace(temp_path, self._shard_path)
+
+        self.shards.append({
+            "path": self._shard_path.name,
+            "samples": self._shard_samples,
+            "bytes": self._shard_bytes,
+            "stored_bytes": self._shard_path.stat().st_size
+        })
+
+    def _update_stats(self, sample: Dict[str, Any], size: int):
+        self.stats["total_samples"] += 1
+        self.stats["total_bytes"] += size
+
+        for name, path in self.count_by.items():
+            value = _get_path(sample, path)
+            if value is not None:
+                counts = self.stats[name]
+                counts[str(value)] = counts.get(str(value), 0) + 1
+
+        for name, path in self.sum_of.items():
+            value = _get_path(sample, path)
+            if value:
+                self.stats[name] += value
+
+    @staticmethod
+    def encode(sample: Dict[str, Any]) -> bytes:
+        """把樣本序列化為一行 JSONL（可在工作進程中預先執行）"""
+        return (json.dumps(sample, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def write(self, sample: Dict[str, Any]):
+        """寫入一條樣本"""
+        self.write_encoded(self.encode(sample), sample)
+
+    def write_encoded(self, line: bytes, sample: Optional[Dict[str, Any]] = None):
+        """寫入一行已序列化的樣本；sample 僅用於 count_by / sum_of 統計，省略時只更新總數"""
+        if self.closed:
+            raise ValueError("寫入器已關閉")
+
+        if self._file is not None and self._shard_bytes + len(line) > self.max_shard_bytes and self._shard_samples:
+            self._close_shard()
+        if self._file is None:
+            self._open_shard()
+
+        self._file.write(line)
+        self._shard_samples += 1
+        self._shard_bytes += len(line)
+        if sample is None:
+            self.stats["total_samples"] += 1
+            self.stats["total_bytes"] += len(line)
+        else:
+            self._update_stats(sample, len(line))
+
+    def write_many(self, samples: Iterable[Dict[str, Any]]) -> int:
+        """寫入樣本流，返回寫入條數"""
+        count = 0
+        for sample in samples:
+            self.write(sample)
+            count += 1
+        return count
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.output_dir / f"{self.prefix}_manifest.json"
+
+    def close(self) -> Dict[str, Any]:
+        """關閉當前分片並寫出 manifest，返回 manifest 內容（沒有樣本時不生成文件）"""
+        if self.closed:
+            return self.manifest()
+
+        self._close_shard()
+        self.closed = True
+
+        if not self.shards:
+            return self.manifest()
+
+        manifest = self.manifest()
+        temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+        logger.info(f"💾 已寫入 {self.stats['total_samples']} 條樣本到 {len(self.shards)} 個分片: {self.manifest_path}")
+        return manifest
+
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            "prefix": self.prefix,
+            "created_at": datetime.now().isoformat(),
+            "compression": self.compression,
+            "max_shard_bytes": self.max_shard_bytes,
+            "shards": list(self.shards),
+            "stats": self.stats
+        }
+
+
+def iter_dataset(manifest_path: Path) -> Iterable[Dict[str, Any]]:
+    """按 manifest 順序流式讀取數據集中的樣本"""
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    for shard in manifest["shards"]:
+        shard_path = manifest_path.parent / shard["path"]
+        if manifest["compression"] == "gzip":
+            handle = gzip.open(shard_path, "rb")
+        elif manifest["compression"] == "zstd":
+            handle = zstandard.ZstdDecompressor().stream_reader(open(shard_path, "rb"), closefd=True)
+        else:
+            handle = open(shard_path, "rb")
+
+        with handle:
+            buffer = b""
+            for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
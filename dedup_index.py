@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+內容尋址去重索引
+- SQLite 持久化存儲已見過的鍵（樣本內容哈希、文件哈希、replay ID 等），按命名空間區分
+- 可選 Bloom filter 前置：「沒見過」的查詢不訪問數據庫（索引遠大於頁緩存或位於慢速磁盤時有效；
+  本地磁盤上 SQLite 主鍵查詢本身已很快，因此默認關閉）
+- 樣本先規範化（合併空白、小寫）再哈希，格式差異不會繞過去重
+- 新鍵先以「待確認」狀態（標記本次運行 ID）按批提交，事務很短，不阻塞其他收集器寫入；
+  調用方在對應輸出落盤（分片 + manifest 寫出）後調用 flush() 確認。運行中途崩潰時，
+  下次打開索引會刪除已退出進程留下的待確認鍵，這些數據重新處理，不會出現「已記錄但數據丟失」
+- 所有收集器通過 shared_index_path() 使用同一個索引文件
+供各數據收集器共用，增量運行時無需重新掃描和載入全部歷史
+"""
+
+import hashlib
+import logging
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "dedup_index.sqlite"
+INDEX_PATH_ENV = "DEDUP_INDEX_PATH"
+SAMPLE_FIELDS = ("instruction", "input", "output")
+
+
+class BloomFilter:
+    """定長位數組 Bloom filter（雙重哈希生成 k 個位置）"""
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def shared_index_path() -> Path:
+    """所有數據收集器共用的索引文件路徑（可用環境變量 DEDUP_INDEX_PATH 覆蓋）"""
+    override = os.environ.get(INDEX_PATH_ENV)
+    if override:
+        return Path(override)
+    return Path(__file__).resolve().parent / "data" / INDEX_FILENAME
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DedupIndex:
+    """持久化去重索引"""
+
+    def __init__(self, db_path: Path, use_bloom: bool = False,
+                 bloom_capacity: int = 1_000_000, bloom_error_rate: float = 0.01,
+                 readonly: bool = False, commit_every: int = 1000, busy_timeout: float = 30.0):
+        """
+        Args:
+            db_path: SQLite 文件路徑（":memory:" 為僅本次運行有效的索引）
+            use_bloom: 是否在查詢前使用 Bloom filter（每個命名空間首次查詢時從數據庫載入）
+            readonly: 只讀打開（供工作進程查詢）
+            commit_every: 每多少次寫入提交一次事務（鍵以待確認狀態提交，flush() 時才確認）
+            busy_timeout: 其他收集器持有寫鎖時的最長等待秒數
+        """
+        self.db_path = str(db_path)
+        self.readonly = readonly
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        self.unconfirmed = False
+        # 本次運行 ID：主機名 + 進程號，用於識別已退出進程留下的待確認鍵
+        self.run_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        if self.db_path != ":memory:":
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                                        timeout=busy_timeout, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(self.db_path, timeout=busy_timeout, check_same_thread=False)
+            # WAL 模式：寫入時其他進程仍可讀取已提交的數據
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS seen_keys (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    source TEXT,
+                    first_seen REAL NOT NULL,
+                    pending_run TEXT,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            """)
+            # 舊索引遷移：補充待確認標記
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(seen_keys)")}
+            if "pending_run" not in columns:
+                self.conn.execute("ALTER TABLE seen_keys ADD COLUMN pending_run TEXT")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_seen_keys_pending ON seen_keys(pending_run) "
+                "WHERE pending_run IS NOT NULL"
+            )
+            self.conn.commit()
+            self._discard_abandoned()
+
+        self.stats = {"lookups": 0, "bloom_negatives": 0, "added": 0, "duplicates": 0}
+
+        self.blooms: Optional[Dict[str, BloomFilter]] = None
+        if use_bloom:
+            self.bloom_capacity = bloom_capacity
+            self.bloom_error_rate = bloom_error_rate
+            self.blooms = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _bloom(self, namespace: str) -> BloomFilter:
+        bloom = self.blooms.get(namespace)
+        if bloom is None:
+            bloom = self.blooms[namespace] = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+            for (key,) in self.conn.execute("SELECT key FROM seen_keys WHERE namespace = ?", (namespace,)):
+                bloom.add(key)
+        return bloom
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        # 與 re.sub(r"\s+", " ", text).strip() 等價，但快得多
+        return " ".join(str(text).split()).lower()
+
+    @classmethod
+    def sample_key(cls, sample: Dict[str, Any], fields: Sequence[str] = SAMPLE_FIELDS) -> str:
+        """樣本內容哈希：指定欄位規範化後拼接"""
+        normalized = "\x1f".join(cls.normalize_text(sample.get(field) or "") for field in fields)
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+    def contains(self, namespace: str, key: str) -> bool:
+        with self.lock:
+            self.stats["lookups"] += 1
+            if self.blooms is not None and key not in self._bloom(namespace):
+                self.stats["bloom_negatives"] += 1
+                return False
+
+            row = self.conn.execute(
+                "SELECT 1 FROM seen_keys WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            return row is not None
+
+    def add(self, namespace: str, key: str, source: Optional[str] = None) -> bool:
+        """記錄一個鍵，首次出現返回 True，已存在返回 False"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO seen_keys (namespace, key, source, first_seen, pending_run) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, source, time.time(), self.run_id)
+            )
+            is_new = cursor.rowcount == 1
+
+            if is_new:
+                self.stats["added"] += 1
+                if self.blooms is not None:
+                    self._bloom(namespace).add(key)
+                self.unconfirmed = True
+                self.pending_writes += 1
+                if self.pending_writes >= self.commit_every:
+                    self._commit()
+            else:
+                self.stats["duplicates"] += 1
+
+            return is_new
+
+    def add_many(self, namespace: str, keys: Iterable[str], source: Optional[str] = None) -> int:
+        """批量記錄，返回新增數量"""
+        return sum(1 for key in keys if self.add(namespace, key, source))
+
+    def add_sample(self, sample: Dict[str, Any], namespace: str = "sample",
+                   source: Optional[str] = None, fields: Sequence[str] = SAMPLE_FIELDS) -> bool:
+        """記錄樣本內容，首次出現返回 True（應保留），重複返回 False（應丟棄）"""
+        return self.add(namespace, self.sample_key(sample, fields), source)
+
+    def keys(self, namespace: str) -> Iterator[str]:
+        """遍歷命名空間內的所有鍵"""
+        cursor = self.conn.execute("SELECT key FROM seen_keys WHERE namespace = ?", (namespace,))
+        for (key,) in cursor:
+            yield key
+
+    def count(self, namespace: str) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM seen_keys WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+
+    def _commit(self):
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def _discard_abandoned(self):
+        """刪除本機已退出進程留下的待確認鍵（它們對應的輸出沒有寫完）"""
+        if os.name != "posix":
+            return
+        hostname = socket.gethostname()
+        abandoned = []
+        for (run_id,) in self.conn.execute(
+            "SELECT DISTINCT pending_run FROM seen_keys WHERE pending_run IS NOT NULL"
+        ):
+            host, _, rest = run_id.partition(":")
+            pid = rest.split(":", 1)[0]
+            if host == hostname and pid.isdigit() and not _process_alive(int(pid)):
+                abandoned.append(run_id)
+
+        for run_id in abandoned:
+            cursor = self.conn.execute("DELETE FROM seen_keys WHERE pending_run = ?", (run_id,))
+            logger.warning(f"⚠️ 丟棄中斷運行 {run_id} 留下的 {cursor.rowcount} 個待確認鍵")
+        self.conn.commit()
+
+    def flush(self):
+        """確認本次運行記錄的鍵（在對應輸出落盤後調用）"""
+        if self.readonly:
+            return
+        with self.lock:
+            if self.unconfirmed:
+                self.conn.execute("UPDATE seen_keys SET pending_run = NULL WHERE pending_run = ?", (self.run_id,))
+                self.unconfirmed = False
+            self._commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "bloom_enabled": self.blooms is not None}
+
+    def close(self):
+        if self.conn is None:
+            return
+        self.flush()
+        self.conn.close()
+        self.conn = None
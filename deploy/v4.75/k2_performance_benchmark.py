@@ -2,9 +2,14 @@
 """
 PowerAutomation v4.75 - K2 性能基準測試
 測試 K2 模型的 TPS/時延/並發性能指標
+
+擴展曲線模式（--scaling）：對本地模擬 LLM 服務掃描並發數 × 負載大小，
+分別壓測 K2Router / K2Client（含流式），輸出吞吐-延遲曲線和飽和點，用於路由層離線容量規劃
 """
 
+import argparse
 import asyncio
+import sys
 import time
 import json
 import logging
@@ -20,6 +25,9 @@ import psutil
 import requests
 from collections import defaultdict
 
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -52,6 +60,20 @@ class ConcurrencyTestResult:
     throughput_requests_per_second: float
     error_rate_percent: float
 
+@dataclass
+class ScalingTestResult(ConcurrencyTestResult):
+    """擴展曲線上的一個點（某目標在某負載大小、某並發數下的結果）"""
+    target: str = ""
+    payload_tokens: int = 0
+    p50_latency_ms: float = 0.0
+    avg_ttft_ms: Optional[float] = None
+    p95_ttft_ms: Optional[float] = None
+    server_peak_in_flight: int = 0
+    server_avg_queue_wait_ms: float = 0.0
+    server_injected_errors: int = 0
+
+SCALING_TARGETS = ("router", "client", "client_stream")
+
 class K2PerformanceBenchmark:
     """K2 性能基準測試系統"""
     
@@ -336,6 +358,245 @@ class K2PerformanceBenchmark:
         
         return {"error": "無數據收集"}
     
+    async def test_scaling_curve(self, targets: Tuple[str, ...] = SCALING_TARGETS,
+                                 concurrency_levels: Tuple[int, ...] = (1, 2, 4, 8, 16, 32),
+                                 payload_tokens: Tuple[int, ...] = (64, 512, 2048),
+                                 requests_per_user: int = 5,
+                                 mock_config=None,
+                                 router_config: Optional[Dict[str, Any]] = None,
+                                 client_config: Optional[Dict[str, Any]] = None,
+                                 slo_p95_ms: Optional[float] = None) -> Dict[str, Any]:
+        """擴展曲線測試：在本地模擬 LLM 服務上掃描並發數 × 負載大小
+
+        每個並發級別以閉環方式運行：concurrent_users 個用戶各自順序發送 requests_per_user 個請求，
+        因此並發數即在途請求數。每個目標只初始化一次，查詢帶序號以繞過 K2Router 的響應緩存
+        """
+        from mock_llm_server import MockLLMServer
+
+        unknown = set(targets) - set(SCALING_TARGETS)
+        if unknown:
+            raise ValueError(f"未知的擴展測試目標: {sorted(unknown)}")
+
+        logger.info(f"📈 開始擴展曲線測試: 目標 {list(targets)}, 並發 {list(concurrency_levels)}, "
+                    f"負載 {list(payload_tokens)} tokens")
+
+        curves = []
+        async with MockLLMServer(mock_config) as server:
+            for target in targets:
+                backend = await self._create_scaling_backend(target, server.base_url, router_config, client_config)
+                try:
+                    for payload in payload_tokens:
+                        payload_text = self._build_payload(payload)
+                        results = []
+                        for concurrent_users in concurrency_levels:
+                            server.reset_stats()
+                            result = await self._run_scaling_level(
+                                backend, target, payload, payload_text, concurrent_users, requests_per_user
+                            )
+                            server_stats = server.get_stats()
+                            result.server_peak_in_flight = server_stats["peak_in_flight"]
+                            result.server_avg_queue_wait_ms = server_stats["average_queue_wait_ms"]
+                            result.server_injected_errors = server_stats["injected_errors"]
+                            results.append(result)
+
+                            logger.info(f"✅ {target} / {payload} tokens / {concurrent_users} 並發: "
+                                        f"{result.throughput_requests_per_second:.1f} req/s, "
+                                        f"p95 {result.p95_latency_ms:.1f}ms, 錯誤率 {result.error_rate_percent:.1f}%")
+
+                        curves.append({
+                            "target": target,
+                            "payload_tokens": payload,
+                            "points": [asdict(r) for r in results],
+                            "analysis": {
+                                "linear_scaling": self._check_linear_scaling(results),
+                                "degradation_point": self._find_degradation_point(results),
+                                "saturation": self._find_saturation_point(results, slo_p95_ms)
+                            }
+                        })
+                finally:
+                    await backend.cleanup()
+
+            mock_server_config = server.get_stats()["config"]
+
+        return {
+            "test_type": "scaling_curve",
+            "timestamp": datetime.now().isoformat(),
+            "mock_server": mock_server_config,
+            "concurrency_levels": list(concurrency_levels),
+            "payload_tokens": list(payload_tokens),
+            "requests_per_user": requests_per_user,
+            "slo_p95_ms": slo_p95_ms,
+            "curves": curves
+        }
+
+    async def _create_scaling_backend(self, target: str, base_url: str,
+                                      router_config: Optional[Dict[str, Any]],
+                                      client_config: Optional[Dict[str, Any]]):
+        """創建指向模擬服務的 K2Router 或 K2Client"""
+        sys.path.insert(0, str(ROOT / "core" / "components"))
+        sys.path.insert(0, str(ROOT / "core" / "components" / "aws_bedrock_mcp"))
+
+        if target == "router":
+            from k2_router import K2Router
+
+            # 路由器默認每分鐘 60 次的限流會掩蓋服務端容量，測試中默認放開
+            router = K2Router({
+                "api_endpoint": base_url,
+                "api_key": "mock",
+                "rate_limit_per_minute": 10 ** 9,
+                **(router_config or {})
+            })
+            await router.initialize()
+            return router
+
+        from claude_router_mcp.k2_router.k2_client import K2Client
+
+        client = K2Client()
+        client.config.update({"url": base_url, "api_key": "mock", "enabled": True, **(client_config or {})})
+        return client
+
+    @staticmethod
+    def _build_payload(tokens: int) -> str:
+        """生成約 tokens 個 token 的代碼上下文（按 4 字符一個 token 估算）"""
+        snippet = "def handle_request(request):\n    result = process(request.payload)\n    return result\n"
+        chars = tokens * 4
+        return (snippet * (chars // len(snippet) + 1))[:chars]
+
+    async def _run_scaling_level(self, backend, target: str, payload: int, payload_text: str,
+                                 concurrent_users: int, requests_per_user: int) -> ScalingTestResult:
+        """以閉環方式運行一個並發級別"""
+        latencies = []
+        ttfts = []
+        total_tokens = 0
+        failed = 0
+
+        async def user(user_index: int):
+            nonlocal total_tokens, failed
+            for i in range(requests_per_user):
+                sequence = f"{concurrent_users}-{user_index}-{i}"
+                start_time = time.perf_counter()
+                try:
+                    success, tokens, ttft = await self._send_scaling_request(backend, target, payload_text, sequence)
+                except Exception:
+                    success, tokens, ttft = False, 0, None
+                latency_ms = (time.perf_counter() - start_time) * 1000
+
+                if success:
+                    latencies.append(latency_ms)
+                    total_tokens += tokens
+                    if ttft is not None:
+                        ttfts.append(ttft * 1000)
+                else:
+                    failed += 1
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(user(u) for u in range(concurrent_users)))
+        duration = time.perf_counter() - start_time
+
+        total_requests = concurrent_users * requests_per_user
+        return ScalingTestResult(
+            concurrent_users=concurrent_users,
+            total_requests=total_requests,
+            successful_requests=len(latencies),
+            failed_requests=failed,
+            average_latency_ms=statistics.mean(latencies) if latencies else 0.0,
+            p95_latency_ms=self._percentile(latencies, 95),
+            p99_latency_ms=self._percentile(latencies, 99),
+            total_tokens=total_tokens,
+            average_tps=total_tokens / duration,
+            throughput_requests_per_second=len(latencies) / duration,
+            error_rate_percent=failed / total_requests * 100,
+            target=target,
+            payload_tokens=payload,
+            p50_latency_ms=self._percentile(latencies, 50),
+            avg_ttft_ms=statistics.mean(ttfts) if ttfts else None,
+            p95_ttft_ms=self._percentile(ttfts, 95) if ttfts else None
+        )
+
+    async def _send_scaling_request(self, backend, target: str, payload_text: str,
+                                    sequence: str) -> Tuple[bool, int, Optional[float]]:
+        """發送一個請求，返回 (是否成功, 完成 token 數, 首 token 時間秒)"""
+        query = f"实现一个函数处理请求并返回结果 #{sequence}"
+
+        if target == "router":
+            from k2_router import K2Request as RouterRequest
+
+            response = await backend.route_request(RouterRequest(query=query, context=payload_text, max_tokens=1024))
+            return response.status == "success", response.usage.get("completion_tokens", 0), None
+
+        from claude_router_mcp.k2_router.k2_client import K2Request as ClientRequest
+
+        request = ClientRequest(
+            request_id=f"scaling-{sequence}",
+            request_type="code_generation",
+            content=f"{payload_text}\n\n{query}",
+            max_tokens=1024,
+            stream=target == "client_stream"
+        )
+
+        if target == "client":
+            response = await backend.route_ai_request(request)
+            return response.success, response.usage.get("completion_tokens", 0), None
+
+        first_token = None
+        async for chunk in backend.stream_ai_request(request):
+            if first_token is None and chunk.delta:
+                first_token = chunk.elapsed
+
+        # 統計在流結束時同步寫入歷史，這裡直接取回用量
+        usage = {}
+        for entry in reversed(backend.request_history):
+            if entry["request"]["request_id"] == request.request_id:
+                usage = entry["response"]["usage"] or {}
+                break
+        return True, usage.get("completion_tokens", 0), first_token
+
+    @staticmethod
+    def _percentile(values: List[float], percent: float) -> float:
+        """最近秩百分位數"""
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        rank = max(1, -(-len(ordered) * percent // 100))
+        return ordered[int(rank) - 1]
+
+    def _find_saturation_point(self, results: List[ScalingTestResult],
+                               slo_p95_ms: Optional[float] = None) -> Dict[str, Any]:
+        """找出飽和點：吞吐量首次達到峰值 90% 的並發數
+
+        按 Little 定律，峰值吞吐量 × 最低並發下的平均延遲（近似無排隊的服務時間）
+        即後端實際能並行處理的請求數（有效容量）
+        """
+        if not results:
+            return {"found": False}
+
+        peak = max(results, key=lambda r: r.throughput_requests_per_second)
+        if peak.throughput_requests_per_second <= 0:
+            return {"found": False}
+
+        knee = next(r for r in results if r.throughput_requests_per_second >= 0.9 * peak.throughput_requests_per_second)
+        saturation = {
+            "found": knee.concurrent_users < results[-1].concurrent_users,
+            "saturation_concurrency": knee.concurrent_users,
+            "throughput_at_saturation_rps": knee.throughput_requests_per_second,
+            "p95_latency_at_saturation_ms": knee.p95_latency_ms,
+            "peak_throughput_rps": peak.throughput_requests_per_second,
+            "peak_concurrency": peak.concurrent_users,
+            "effective_capacity": peak.throughput_requests_per_second * results[0].average_latency_ms / 1000
+        }
+
+        if slo_p95_ms is not None:
+            within_slo = [r for r in results if r.successful_requests and r.p95_latency_ms <= slo_p95_ms
+                          and r.error_rate_percent < 1.0]
+            best = max(within_slo, key=lambda r: r.throughput_requests_per_second) if within_slo else None
+            saturation["slo"] = {
+                "p95_latency_ms": slo_p95_ms,
+                "max_concurrency": best.concurrent_users if best else None,
+                "max_throughput_rps": best.throughput_requests_per_second if best else 0.0
+            }
+
+        return saturation
+
     async def _concurrent_request_task(self, prompt: str, user_id: str, request_id: int) -> Dict[str, Any]:
         """並發請求任務"""
         try:
@@ -681,8 +942,68 @@ K2 模型在測試中表現出良好的性能特性：
 
 
 # 主要執行函數
+def _parse_int_list(value: str) -> Tuple[int, ...]:
+    return tuple(int(item) for item in value.split(",") if item.strip())
+
+
+async def run_scaling_benchmark(args: argparse.Namespace):
+    """擴展曲線模式：啟動本地模擬服務並掃描並發數 × 負載大小"""
+    from mock_llm_server import build_config
+
+    args.host, args.port, args.model = "127.0.0.1", 0, "mock-k2"
+    benchmark = K2PerformanceBenchmark()
+    results = await benchmark.test_scaling_curve(
+        targets=tuple(args.targets.split(",")),
+        concurrency_levels=_parse_int_list(args.concurrency),
+        payload_tokens=_parse_int_list(args.payload_tokens),
+        requests_per_user=args.requests_per_user,
+        mock_config=build_config(args),
+        slo_p95_ms=args.slo_p95_ms
+    )
+
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print(f"\n📈 擴展曲線（結果已保存：{output_path}）")
+    for curve in results["curves"]:
+        print(f"\n{curve['target']} / 負載 {curve['payload_tokens']} tokens")
+        print(f"  {'並發':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'TTFT ms':>9} {'錯誤率':>7}")
+        for point in curve["points"]:
+            ttft = f"{point['avg_ttft_ms']:.1f}" if point["avg_ttft_ms"] is not None else "-"
+            print(f"  {point['concurrent_users']:>6} {point['throughput_requests_per_second']:>9.1f} "
+                  f"{point['p50_latency_ms']:>9.1f} {point['p95_latency_ms']:>9.1f} {ttft:>9} "
+                  f"{point['error_rate_percent']:>6.1f}%")
+
+        saturation = curve["analysis"]["saturation"]
+        if saturation.get("peak_throughput_rps"):
+            print(f"  🎯 飽和並發 {saturation['saturation_concurrency']}, "
+                  f"峰值 {saturation['peak_throughput_rps']:.1f} req/s, "
+                  f"有效容量 {saturation['effective_capacity']:.1f}")
+        if "slo" in saturation:
+            print(f"  ⏱️ p95 ≤ {saturation['slo']['p95_latency_ms']:.0f}ms 時最大並發 {saturation['slo']['max_concurrency']}")
+
+
 async def main():
     """主函數"""
+    parser = argparse.ArgumentParser(description="K2 性能基準測試")
+    parser.add_argument("--scaling", action="store_true", help="擴展曲線模式（使用本地模擬 LLM 服務）")
+    parser.add_argument("--targets", default=",".join(SCALING_TARGETS), help="壓測目標: router,client,client_stream")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="並發級別列表")
+    parser.add_argument("--payload-tokens", default="64,512,2048", help="請求上下文大小列表（tokens）")
+    parser.add_argument("--requests-per-user", type=int, default=5, help="每個並發用戶順序發送的請求數")
+    parser.add_argument("--slo-p95-ms", type=float, default=None, help="p95 延遲目標，用於計算可承載的最大並發")
+    parser.add_argument("--output", default="deploy/v4.75/k2_scaling_results.json", help="擴展曲線結果文件")
+
+    from mock_llm_server import add_mock_arguments
+    add_mock_arguments(parser.add_argument_group("模擬服務"))
+    args = parser.parse_args()
+
+    if args.scaling:
+        await run_scaling_benchmark(args)
+        return
+
     print("""
 ╔══════════════════════════════════════════════╗
 ║        K2 性能基準測試系統                   ║
@@ -2,10 +2,13 @@
 """
 PowerAutomation v4.75 - 技術指標和體驗指標系統
 建立 P0-P2 MCP 技術指標和 ClaudeEditor 體驗指標
+指標值從進程內 metrics_registry 讀取（MCP 組件和 ClaudeEditor 記錄的真實測量），
+沒有記錄的指標標記為無數據，不參與健康度計算
 """
 
 import json
 import logging
+import sys
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Any, Optional
@@ -14,6 +17,9 @@ from enum import Enum
 import asyncio
 import time
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from metrics_registry import MetricsRegistry, metrics_registry
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -44,10 +50,26 @@ class ExperienceMetric:
     target_score: float
     current_score: float = 0.0
 
+@dataclass
+class MetricSource:
+    """指標在 metrics registry 中的來源"""
+    metric: str  # registry 中的指標名
+    stat: Optional[str] = None  # None 按類型選擇：Histogram 取 p95，Counter 取兩次收集間的速率，Gauge 取當前值
+    scale: float = 1.0  # registry 數值換算到指標單位的倍數
+
 class MetricsSystem:
-    """指標系統"""
+    """指標系統
     
-    def __init__(self):
+    默認來源命名（可通過 metric_sources 覆蓋）：
+    - 技術指標 {mcp}_{metric}：ms / s 單位記錄為秒的 Histogram（{name}_seconds），
+      % 單位記錄為 0-1 的 Gauge（{name}_ratio），x/s 單位記錄為 Counter（{name}_total），其他為 Gauge
+    - 體驗指標 editor_{area}_{metric}：以指標本身的單位記錄為 Gauge 或 Histogram
+    """
+    
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or metrics_registry
+        self.metric_sources: Dict[str, MetricSource] = {}
+        self._counter_readings: Dict[str, tuple] = {}
         self.mcp_metrics = self._define_mcp_metrics()
         self.experience_metrics = self._define_experience_metrics()
         self.metrics_data = {
@@ -477,14 +499,21 @@ class MetricsSystem:
                 mcp_results = []
                 
                 for metric in metrics:
-                    # 模擬收集指標數據
                     current_value = await self._measure_technical_metric(mcp_name, metric)
+                    if current_value is None:
+                        mcp_results.append({
+                            "metric": asdict(metric),
+                            "health_score": None,
+                            "status": "no_data"
+                        })
+                        continue
                     metric.current_value = current_value
                     
                     # 計算健康度
                     health_score = current_value / metric.target_value
                     if metric.unit == "ms" or metric.unit == "s":  # 時間類指標，越小越好
                         health_score = metric.target_value / current_value if current_value > 0 else 1.0
+                    health_score = min(1.0, health_score)  # 超過目標不再加分，避免單個指標拉高整體健康度
                     
                     status = "healthy"
                     if health_score < metric.threshold_critical:
@@ -515,8 +544,14 @@ class MetricsSystem:
             area_results = []
             
             for metric in metrics:
-                # 模擬收集體驗數據
                 current_score = await self._measure_experience_metric(area, metric)
+                if current_score is None:
+                    area_results.append({
+                        "metric": asdict(metric),
+                        "experience_score": None,
+                        "grade": "N/A"
+                    })
+                    continue
                 metric.current_score = current_score
                 
                 # 計算體驗分數
@@ -535,44 +570,75 @@ class MetricsSystem:
                     "grade": self._get_experience_grade(experience_score)
                 })
             
+            scores = [m["experience_score"] for m in area_results if m["experience_score"] is not None]
             results[area] = {
                 "metrics": area_results,
-                "area_score": round(sum(m["experience_score"] for m in area_results) / len(area_results), 1)
+                "area_score": round(sum(scores) / len(scores), 1) if scores else None
             }
         
         return results
     
-    async def _measure_technical_metric(self, mcp_name: str, metric: TechnicalMetric) -> float:
-        """測量技術指標（模擬）"""
-        # 實際實現中應該調用相應的 MCP 獲取真實數據
-        import random
-        
-        # 模擬不同的測量值
+    def _default_technical_source(self, mcp_name: str, metric: TechnicalMetric) -> MetricSource:
+        """按單位推導技術指標在 registry 中的名稱"""
+        name = f"{mcp_name}_{metric.name}"
+        if metric.unit == "ms":
+            return MetricSource(f"{name}_seconds", scale=1000.0)
+        if metric.unit == "s":
+            return MetricSource(f"{name}_seconds")
         if metric.unit == "%":
-            return random.uniform(metric.target_value * 0.8, min(100, metric.target_value * 1.1))
-        elif metric.unit == "ms" or metric.unit == "s":
-            return random.uniform(metric.target_value * 0.7, metric.target_value * 1.3)
-        else:
-            return random.uniform(metric.target_value * 0.9, metric.target_value * 1.1)
+            return MetricSource(f"{name}_ratio", scale=100.0)
+        if metric.unit.endswith("/s"):
+            return MetricSource(f"{name}_total")
+        return MetricSource(name)
     
-    async def _measure_experience_metric(self, area: str, metric: ExperienceMetric) -> float:
-        """測量體驗指標（模擬）"""
-        # 實際實現中應該通過用戶行為分析獲取
-        import random
+    def _read_source(self, source: MetricSource) -> Optional[float]:
+        """從 registry 讀取指標值，沒有記錄時返回 None"""
+        metric = self.registry.get(source.metric)
+        if metric is None:
+            return None
         
-        # 模擬測量值，略有波動
-        return random.uniform(metric.target_score * 0.85, metric.target_score * 1.05)
+        stat = source.stat
+        if stat is None:
+            stat = {"summary": "p95", "counter": "rate"}.get(metric.type_name, "value")
+        
+        if stat == "rate":
+            # 計數器速率：與上次收集（首次為 registry 創建時）的差值除以時間間隔
+            now = time.time()
+            value = self.registry.read(source.metric)
+            last_value, last_time = self._counter_readings.get(source.metric, (0.0, self.registry.created_at))
+            self._counter_readings[source.metric] = (value, now)
+            if now <= last_time:
+                return None
+            return (value - last_value) / (now - last_time) * source.scale
+        
+        value = self.registry.read(source.metric, stat)
+        return None if value is None else value * source.scale
+    
+    async def _measure_technical_metric(self, mcp_name: str, metric: TechnicalMetric) -> Optional[float]:
+        """測量技術指標（從 metrics registry 讀取）"""
+        source = self.metric_sources.get(f"{mcp_name}.{metric.name}") or self._default_technical_source(mcp_name, metric)
+        return self._read_source(source)
+    
+    async def _measure_experience_metric(self, area: str, metric: ExperienceMetric) -> Optional[float]:
+        """測量體驗指標（從 ClaudeEditor 上報到 metrics registry 的數據讀取）"""
+        source = self.metric_sources.get(f"{area}.{metric.name}") or MetricSource(f"editor_{area}_{metric.name}")
+        return self._read_source(source)
+    
+    def export_prometheus(self) -> str:
+        """以 Prometheus 文本格式導出 registry 中的所有指標"""
+        return self.registry.export_prometheus()
     
     def _calculate_overall_health(self, mcp_results: List[Dict]) -> Dict[str, Any]:
-        """計算整體健康度"""
-        health_scores = [r["health_score"] for r in mcp_results]
+        """計算整體健康度（只統計有數據的指標）"""
+        health_scores = [r["health_score"] for r in mcp_results if r["health_score"] is not None]
         
         return {
-            "average_health": round(sum(health_scores) / len(health_scores), 2),
-            "min_health": round(min(health_scores), 2),
+            "average_health": round(sum(health_scores) / len(health_scores), 2) if health_scores else None,
+            "min_health": round(min(health_scores), 2) if health_scores else None,
             "critical_count": sum(1 for r in mcp_results if r["status"] == "critical"),
             "warning_count": sum(1 for r in mcp_results if r["status"] == "warning"),
-            "healthy_count": sum(1 for r in mcp_results if r["status"] == "healthy")
+            "healthy_count": sum(1 for r in mcp_results if r["status"] == "healthy"),
+            "no_data_count": sum(1 for r in mcp_results if r["status"] == "no_data")
         }
     
     def _get_experience_grade(self, score: float) -> str:
@@ -599,15 +665,16 @@ class MetricsSystem:
         tech_scores = []
         for priority, mcps in technical_metrics.items():
             for mcp_name, data in mcps.items():
-                tech_scores.append(data["overall_health"]["average_health"])
+                if data["overall_health"]["average_health"] is not None:
+                    tech_scores.append(data["overall_health"]["average_health"])
         
-        exp_scores = [data["area_score"] for data in experience_metrics.values()]
+        exp_scores = [data["area_score"] for data in experience_metrics.values() if data["area_score"] is not None]
         
         dashboard = {
             "timestamp": datetime.now().isoformat(),
             "overall_scores": {
-                "technical_health": round(sum(tech_scores) / len(tech_scores) * 100, 1),
-                "experience_score": round(sum(exp_scores) / len(exp_scores), 1)
+                "technical_health": round(sum(tech_scores) / len(tech_scores) * 100, 1) if tech_scores else None,
+                "experience_score": round(sum(exp_scores) / len(exp_scores), 1) if exp_scores else None
             },
             "technical_metrics": technical_metrics,
             "experience_metrics": experience_metrics,
@@ -631,7 +698,7 @@ class MetricsSystem:
         
         # 體驗建議
         for area, data in exp_metrics.items():
-            if data["area_score"] < 80:
+            if data["area_score"] is not None and data["area_score"] < 80:
                 area_name = {
                     "ai_model_control": "AI模型控制",
                     "workflow_area": "工作流區域",
@@ -668,7 +735,7 @@ class MetricsSystem:
         
         # 體驗告警
         for area, data in exp_metrics.items():
-            if data["area_score"] < 70:
+            if data["area_score"] is not None and data["area_score"] < 70:
                 alerts.append({
                     "type": "experience",
                     "severity": "warning",
@@ -686,8 +753,8 @@ class MetricsSystem:
 生成時間：{dashboard_data['timestamp']}
 
 ## 總體評分
-- 技術健康度：{dashboard_data['overall_scores']['technical_health']}%
-- 用戶體驗分：{dashboard_data['overall_scores']['experience_score']}%
+- 技術健康度：{_format_score(dashboard_data['overall_scores']['technical_health'])}
+- 用戶體驗分：{_format_score(dashboard_data['overall_scores']['experience_score'])}
 
 ## 技術指標詳情
 
@@ -701,8 +768,9 @@ class MetricsSystem:
                 for mcp_name, data in dashboard_data["technical_metrics"][priority].items():
                     health = data["overall_health"]
                     report += f"#### {mcp_name}\n"
-                    report += f"- 平均健康度：{health['average_health'] * 100:.1f}%\n"
-                    report += f"- 健康/警告/危險：{health['healthy_count']}/{health['warning_count']}/{health['critical_count']}\n\n"
+                    average_health = None if health['average_health'] is None else health['average_health'] * 100
+                    report += f"- 平均健康度：{_format_score(average_health)}\n"
+                    report += f"- 健康/警告/危險/無數據：{health['healthy_count']}/{health['warning_count']}/{health['critical_count']}/{health['no_data_count']}\n\n"
                     
                     # 詳細指標
                     for metric_data in data["metrics"]:
@@ -710,10 +778,14 @@ class MetricsSystem:
                         status_icon = {
                             "healthy": "✅",
                             "warning": "⚠️",
-                            "critical": "🚨"
+                            "critical": "🚨",
+                            "no_data": "⚪"
                         }[metric_data["status"]]
                         
-                        report += f"  - {metric['name']} {status_icon}: {metric['current_value']:.2f} / {metric['target_value']} {metric['unit']}\n"
+                        if metric_data["status"] == "no_data":
+                            report += f"  - {metric['name']} {status_icon}: 無數據 / {metric['target_value']} {metric['unit']}\n"
+                        else:
+                            report += f"  - {metric['name']} {status_icon}: {metric['current_value']:.2f} / {metric['target_value']} {metric['unit']}\n"
                     
                     report += "\n"
         
@@ -722,16 +794,19 @@ class MetricsSystem:
         
         for area, data in dashboard_data["experience_metrics"].items():
             area_name = area.replace("_", " ").title()
-            report += f"### {area_name} (評分: {data['area_score']}%)\n\n"
+            report += f"### {area_name} (評分: {_format_score(data['area_score'])})\n\n"
             
             for metric_data in data["metrics"]:
                 metric = metric_data["metric"]
                 grade = metric_data["grade"]
                 score = metric_data["experience_score"]
                 
-                report += f"- **{metric['name']}** [{grade}]: {score:.1f}%\n"
+                report += f"- **{metric['name']}** [{grade}]: {_format_score(score)}\n"
                 report += f"  - {metric['description']}\n"
-                report += f"  - 當前: {metric['current_score']:.2f} / 目標: {metric['target_score']}\n\n"
+                if score is None:
+                    report += f"  - 當前: 無數據 / 目標: {metric['target_score']}\n\n"
+                else:
+                    report += f"  - 當前: {metric['current_score']:.2f} / 目標: {metric['target_score']}\n\n"
         
         # 建議和告警
         if dashboard_data["recommendations"]:
@@ -748,6 +823,10 @@ class MetricsSystem:
         return report
 
 
+def _format_score(score: Optional[float]) -> str:
+    return "無數據" if score is None else f"{score:.1f}%"
+
+
 # 創建實時監控儀表板
 def create_metrics_dashboard_ui() -> str:
     """創建指標儀表板 UI"""
@@ -1029,8 +1108,8 @@ async def main():
     
     # 顯示總體評分
     print(f"\n總體評分：")
-    print(f"- 技術健康度：{dashboard_data['overall_scores']['technical_health']}%")
-    print(f"- 用戶體驗分：{dashboard_data['overall_scores']['experience_score']}%")
+    print(f"- 技術健康度：{_format_score(dashboard_data['overall_scores']['technical_health'])}")
+    print(f"- 用戶體驗分：{_format_score(dashboard_data['overall_scores']['experience_score'])}")
     
     # 顯示告警
     if dashboard_data["alerts"]:
@@ -1050,6 +1129,12 @@ async def main():
         f.write(report)
     print(f"✅ 指標報告已生成：{report_path}")
     
+    # Prometheus 導出
+    prometheus_path = Path("deploy/v4.75/metrics.prom")
+    with open(prometheus_path, 'w', encoding='utf-8') as f:
+        f.write(system.export_prometheus())
+    print(f"✅ Prometheus 指標已導出：{prometheus_path}")
+    
     # 生成 UI
     ui_path = Path("deploy/v4.75/MetricsDashboard.jsx")
     with open(ui_path, 'w', encoding='utf-8') as f:
@@ -8,11 +8,21 @@ K2數據整合引擎
 import asyncio
 import json
 import logging
+import sys
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple, AsyncIterator, Union, NamedTuple
 from dataclasses import dataclass
+import multiprocessing as mp
+
+# 添加項目路徑（共用的數據集寫入器和去重索引）
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from dataset_writer import ShardedDatasetWriter
+from dedup_index import DedupIndex, shared_index_path
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,15 +40,106 @@ class TrainingDataPoint:
     metadata: Dict[str, Any] = None
     source: str = ""
 
+
+class EncodedSample(NamedTuple):
+    """已序列化為兩種輸出格式的樣本，以及寫入時需要的統計欄位"""
+    source: str
+    quality_score: float
+    has_thinking: bool
+    k2_line: bytes
+    deepswe_line: bytes
+
+
+# 轉換任務：(數據源類型, 文件路徑, JSONL 行批次；replay 文件為 None 表示整個文件)
+ConvertTask = Tuple[str, str, Optional[List[str]]]
+
+
+def _run_convert_task(task: ConvertTask) -> Dict[str, Any]:
+    """工作進程：載入 → 轉換 → 評分 → 過濾 → 哈希 → 序列化，返回通過質量檢查的樣本、去重鍵和各階段耗時"""
+    kind, path, lines = task
+    outcome = {"kind": kind, "path": path, "samples": [], "keys": [], "passed": 0, "converted": 0,
+               "bytes": 0, "timings": {}, "error": None}
+    try:
+        start = time.perf_counter()
+        if lines is None:
+            with open(path, 'rb') as f:
+                raw = f.read()
+            outcome["bytes"] = len(raw)
+            records = [json.loads(raw)]
+        else:
+            outcome["bytes"] = sum(len(line) for line in lines)
+            records = [json.loads(line) for line in lines if line.strip()]
+        outcome["timings"]["load"] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        points = []
+        for record in records:
+            if kind == "manus_replay":
+                points.extend(K2DataIntegrationEngine._convert_replay_to_training(record, path))
+            else:
+                point = K2DataIntegrationEngine._convert_claude_to_training(record, path)
+                if point:
+                    points.append(point)
+        outcome["timings"]["convert"] = time.perf_counter() - start
+        outcome["converted"] = len(points)
+        
+        start = time.perf_counter()
+        for point in points:
+            K2DataIntegrationEngine._score_training_point(point)
+        outcome["timings"]["score"] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        points = [point for point in points if K2DataIntegrationEngine._passes_quality_check(point)]
+        outcome["timings"]["filter"] = time.perf_counter() - start
+        outcome["passed"] = len(points)
+        
+        start = time.perf_counter()
+        outcome["keys"] = [DedupIndex.sample_key(vars(point)) for point in points]
+        outcome["timings"]["hash"] = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        outcome["samples"] = [K2DataIntegrationEngine._encode_training_point(point) for point in points]
+        outcome["timings"]["encode"] = time.perf_counter() - start
+        
+    except Exception as e:
+        outcome["error"] = str(e)
+    
+    return outcome
+
+
+def _run_convert_chunk(tasks: List[ConvertTask]) -> List[Dict[str, Any]]:
+    """工作進程：一次處理一組任務，減少進程間往返"""
+    return [_run_convert_task(task) for task in tasks]
+
+
 class K2DataIntegrationEngine:
     """K2數據整合引擎"""
     
-    def __init__(self):
+    def __init__(self, incremental: bool = False, max_workers: Optional[int] = None):
+        """
+        Args:
+            incremental: 默認 False，只在本次運行內去重，每次運行完整重建數據集；
+                         True 時使用與其他數據收集器共用的持久化去重索引，只輸出之前未輸出過的樣本
+                         （重複運行只會輸出新樣本，命令行用 --incremental 開啟）
+            max_workers: 轉換 / 評分進程數，默認為 CPU 核數
+        """
         self.base_dir = Path(__file__).parent
         self.data_dir = self.base_dir / "data"
         self.output_dir = self.data_dir / "integrated_training"
         self.output_dir.mkdir(parents=True, exist_ok=True)
         
+        # 流水線配置
+        self.max_workers = max_workers or mp.cpu_count()
+        self.chunk_size = 8  # 每次提交給工作進程的任務數
+        self.lines_per_task = 2000  # JSONL 文件每個任務包含的行數
+        self.max_in_flight = self.max_workers * 2  # 同時在途的任務組數上限（階段間的有界隊列）
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.stage_stats: Dict[str, Dict[str, float]] = {}
+        
+        # 輸出配置：JSONL 分片大小上限和壓縮格式（None / "gzip" / "zstd"）
+        self.max_shard_bytes = 256 * 1024 * 1024
+        self.output_compression = None
+        
         # 數據源路徑
         self.sources = {
             "manus_replays": self.data_dir / "replay_analysis",
@@ -54,48 +155,35 @@ class K2DataIntegrationEngine:
             "claude_conversation_count": 0,
             "claude_realtime_count": 0,
             "high_quality_count": 0,
-            "sources_processed": []
+            "duplicate_count": 0,
+            "sources_processed": [],
+            "stage_stats": self.stage_stats
         }
         
-    async def integrate_all_data(self) -> Dict[str, Any]:
-        """整合所有數據源"""
-        logger.info("🚀 開始K2數據整合...")
-        start_time = time.time()
-        
-        all_training_data = []
+        self.dedup_index = DedupIndex(shared_index_path() if incremental else ":memory:")
         
-        # 1. 處理511個Manus replay數據
-        logger.info("📊 處理Manus replay數據...")
-        replay_data = await self._process_manus_replays()
-        all_training_data.extend(replay_data)
-        self.stats["manus_replay_count"] = len(replay_data)
-        
-        # 2. 處理Claude實時對話數據
-        logger.info("💬 處理Claude對話數據...")
-        claude_data = await self._process_claude_conversations()
-        all_training_data.extend(claude_data)
-        self.stats["claude_conversation_count"] = len(claude_data)
+    async def integrate_all_data(self) -> Dict[str, Any]:
+        """整合所有數據源
         
-        # 3. 處理實時收集數據
-        logger.info("⚡ 處理實時收集數據...")
-        realtime_data = await self._process_realtime_data()
-        all_training_data.extend(realtime_data)
-        self.stats["claude_realtime_count"] = len(realtime_data)
+        分階段流水線：載入 → 轉換 → 評分 → 過濾 → 哈希 → 序列化在進程池中並行執行，
+        去重和寫入在主進程中按輸入順序流式進行，不在內存中保留整個數據集
+        """
+        logger.info(f"🚀 開始K2數據整合（{self.max_workers} 個工作進程）...")
+        start_time = time.time()
         
-        # 4. 質量過濾和增強
-        logger.info("🔍 質量過濾和增強...")
-        high_quality_data = await self._quality_filter_and_enhance(all_training_data)
-        self.stats["high_quality_count"] = len(high_quality_data)
+        try:
+            output_files = await self._generate_training_datasets(self.iter_encoded_samples())
+        finally:
+            self.close()
         
-        # 5. 生成多種格式
-        logger.info("📦 生成訓練數據集...")
-        output_files = await self._generate_training_datasets(high_quality_data)
+        logger.info(f"質量過濾: {self.stats['total_processed']} -> {self.stats['high_quality_count']} "
+                    f"(保留率: {self.stats['high_quality_count']/max(self.stats['total_processed'], 1)*100:.1f}%, "
+                    f"重複: {self.stats['duplicate_count']})")
         
         total_time = time.time() - start_time
-        self.stats["total_processed"] = len(all_training_data)
         self.stats["processing_time"] = total_time
         
-        # 6. 生成報告
+        # 生成報告
         await self._generate_integration_report(output_files)
         
         logger.info("✅ K2數據整合完成！")
@@ -105,73 +193,139 @@ class K2DataIntegrationEngine:
             "processing_time": total_time
         }
     
-    async def _process_manus_replays(self) -> List[TrainingDataPoint]:
-        """處理Manus replay數據"""
-        training_data = []
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """懶加載轉換進程池"""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+    
+    def close(self):
+        """關閉進程池，提交去重索引"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.dedup_index.flush()
+    
+    def _record_stage(self, stage: str, seconds: float, items: int = 1, nbytes: int = 0):
+        """累計某個階段的處理量和耗時"""
+        counters = self.stage_stats.setdefault(stage, {"items": 0, "bytes": 0, "seconds": 0.0})
+        counters["items"] += items
+        counters["bytes"] += nbytes
+        counters["seconds"] += seconds
+    
+    def _iter_convert_tasks(self) -> Iterator[ConvertTask]:
+        """載入階段：列出 replay 文件，按行批次讀取 JSONL 文件"""
         replay_dir = self.sources["manus_replays"]
-        
-        if not replay_dir.exists():
+        if replay_dir.exists():
+            for file_path in replay_dir.glob("raw_*.json"):
+                yield ("manus_replay", str(file_path), None)
+        else:
             logger.warning(f"Manus replay目錄不存在: {replay_dir}")
-            return training_data
         
-        # 處理所有replay JSON文件
-        for file_path in replay_dir.glob("raw_*.json"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    replay_data = json.load(f)
-                
-                # 轉換replay數據為訓練格式
-                converted = await self._convert_replay_to_training(replay_data, str(file_path))
-                training_data.extend(converted)
-                
-            except Exception as e:
-                logger.error(f"處理replay文件失敗 {file_path}: {e}")
-        
-        logger.info(f"✅ 從Manus replays生成 {len(training_data)} 個訓練樣本")
-        return training_data
-    
-    async def _process_claude_conversations(self) -> List[TrainingDataPoint]:
-        """處理Claude對話數據"""
-        training_data = []
         claude_dir = self.sources["claude_conversations"]
-        
-        if not claude_dir.exists():
+        if claude_dir.exists():
+            for file_path in claude_dir.glob("*.jsonl"):
+                try:
+                    start = time.perf_counter()
+                    batch = []
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            batch.append(line)
+                            if len(batch) >= self.lines_per_task:
+                                self._record_stage("read", time.perf_counter() - start, items=len(batch))
+                                yield ("claude_conversation", str(file_path), batch)
+                                start = time.perf_counter()
+                                batch = []
+                    if batch:
+                        self._record_stage("read", time.perf_counter() - start, items=len(batch))
+                        yield ("claude_conversation", str(file_path), batch)
+                except Exception as e:
+                    logger.error(f"讀取Claude對話文件失敗 {file_path}: {e}")
+        else:
             logger.warning(f"Claude對話目錄不存在: {claude_dir}")
-            return training_data
         
-        # 處理JSONL文件
-        for file_path in claude_dir.glob("*.jsonl"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if line.strip():
-                            data = json.loads(line)
-                            converted = await self._convert_claude_to_training(data, str(file_path))
-                            if converted:
-                                training_data.append(converted)
-                                
-            except Exception as e:
-                logger.error(f"處理Claude對話文件失敗 {file_path}: {e}")
-        
-        logger.info(f"✅ 從Claude對話生成 {len(training_data)} 個訓練樣本")
-        return training_data
-    
-    async def _process_realtime_data(self) -> List[TrainingDataPoint]:
-        """處理實時收集數據"""
-        training_data = []
         realtime_dir = self.sources["claude_realtime"]
-        
         if not realtime_dir.exists():
             logger.warning(f"實時數據目錄不存在: {realtime_dir}")
-            return training_data
-        
-        # 這裡可以添加實時數據處理邏輯
-        # 目前返回空列表
-        logger.info(f"✅ 從實時數據生成 {len(training_data)} 個訓練樣本")
-        return training_data
+        # 實時數據處理邏輯尚未實現
     
-    async def _convert_replay_to_training(self, replay_data: Dict[str, Any], source: str) -> List[TrainingDataPoint]:
-        """將replay數據轉換為訓練格式"""
+    def _iter_task_chunks(self) -> Iterator[List[ConvertTask]]:
+        chunk = []
+        for task in self._iter_convert_tasks():
+            chunk.append(task)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    async def iter_encoded_samples(self) -> AsyncIterator[EncodedSample]:
+        """在進程池中並行轉換、評分、過濾和序列化，按輸入順序產出去重後的高質量樣本
+        
+        任務按 chunk_size 分組提交，在途組數不超過 max_in_flight，
+        始終等待最早提交的一組，因此輸出順序與輸入一致且內存有界
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        pending = deque()
+        
+        async def drain_one() -> List[EncodedSample]:
+            tasks, future = pending.popleft()
+            try:
+                outcomes = await future
+            except Exception as e:
+                logger.error(f"轉換任務組失敗 ({len(tasks)} 個任務): {e}")
+                return []
+            
+            samples = []
+            for outcome in outcomes:
+                samples.extend(self._collect_outcome(outcome))
+            return samples
+        
+        for tasks in self._iter_task_chunks():
+            pending.append((tasks, loop.run_in_executor(executor, _run_convert_chunk, tasks)))
+            if len(pending) >= self.max_in_flight:
+                for sample in await drain_one():
+                    yield sample
+        
+        while pending:
+            for sample in await drain_one():
+                yield sample
+    
+    def _collect_outcome(self, outcome: Dict[str, Any]) -> List[EncodedSample]:
+        """在主進程中合併單個任務的結果：更新統計、去重"""
+        for stage, seconds in outcome["timings"].items():
+            if stage == "load":
+                self._record_stage(stage, seconds, nbytes=outcome["bytes"])
+            elif stage in ("hash", "encode"):
+                self._record_stage(stage, seconds, items=outcome["passed"])
+            else:
+                self._record_stage(stage, seconds, items=outcome["converted"])
+        
+        if outcome["error"]:
+            logger.error(f"處理{outcome['kind']}數據失敗 {outcome['path']}: {outcome['error']}")
+            return []
+        
+        count_key = {"manus_replay": "manus_replay_count",
+                     "claude_conversation": "claude_conversation_count"}[outcome["kind"]]
+        self.stats[count_key] += outcome["converted"]
+        self.stats["total_processed"] += outcome["converted"]
+        
+        # 內容去重（鍵為工作進程計算的規範化 instruction/input/output 哈希）
+        start = time.perf_counter()
+        unique_samples = []
+        for sample, key in zip(outcome["samples"], outcome["keys"]):
+            if self.dedup_index.add("sample", key, source=sample.source):
+                unique_samples.append(sample)
+            else:
+                self.stats["duplicate_count"] += 1
+        self._record_stage("dedup", time.perf_counter() - start, items=outcome["passed"])
+        
+        return unique_samples
+    
+    @staticmethod
+    def _convert_replay_to_training(replay_data: Dict[str, Any], source: str) -> List[TrainingDataPoint]:
+        """將replay數據轉換為訓練格式（質量分數在評分階段計算）"""
         training_points = []
         
         try:
@@ -212,7 +366,6 @@ class K2DataIntegrationEngine:
                             thinking=thinking if thinking else None,
                             context="包含多輪對話上下文",
                             tools_used=tools_used,
-                            quality_score=self._calculate_quality_score(user_input, assistant_output),
                             metadata={
                                 "source": source,
                                 "timestamp": replay_data.get("timestamp", ""),
@@ -228,7 +381,8 @@ class K2DataIntegrationEngine:
         
         return training_points
     
-    async def _convert_claude_to_training(self, claude_data: Dict[str, Any], source: str) -> Optional[TrainingDataPoint]:
+    @staticmethod
+    def _convert_claude_to_training(claude_data: Dict[str, Any], source: str) -> Optional[TrainingDataPoint]:
         """將Claude對話數據轉換為訓練格式"""
         try:
             return TrainingDataPoint(
@@ -246,7 +400,16 @@ class K2DataIntegrationEngine:
             logger.error(f"轉換Claude數據失敗: {e}")
             return None
     
-    def _calculate_quality_score(self, user_input: str, assistant_output: str) -> float:
+    @staticmethod
+    def _score_training_point(data_point: TrainingDataPoint):
+        """評分階段：replay樣本按內容計算質量分數，Claude對話沿用收集時的置信度"""
+        if data_point.source == "manus_replay":
+            data_point.quality_score = K2DataIntegrationEngine._calculate_quality_score(
+                data_point.input, data_point.output
+            )
+    
+    @staticmethod
+    def _calculate_quality_score(user_input: str, assistant_output: str) -> float:
         """計算質量分數"""
         score = 0.6  # 基礎分數
         
@@ -269,63 +432,114 @@ class K2DataIntegrationEngine:
         
         return min(score, 0.95)
     
-    async def _quality_filter_and_enhance(self, training_data: List[TrainingDataPoint]) -> List[TrainingDataPoint]:
-        """質量過濾和增強"""
-        high_quality = []
-        
-        for data_point in training_data:
-            # 基本質量檢查
-            if (len(data_point.input) >= 10 and 
+    @staticmethod
+    def _passes_quality_check(data_point: TrainingDataPoint) -> bool:
+        """基本質量檢查"""
+        return (len(data_point.input) >= 10 and 
                 len(data_point.output) >= 20 and 
-                data_point.quality_score >= 0.6):
-                high_quality.append(data_point)
-        
-        logger.info(f"質量過濾: {len(training_data)} -> {len(high_quality)} (保留率: {len(high_quality)/len(training_data)*100:.1f}%)")
-        return high_quality
+                data_point.quality_score >= 0.6)
+    
+    @staticmethod
+    def _to_k2_format(data_point: TrainingDataPoint) -> Dict[str, Any]:
+        """K2格式 (對話格式)"""
+        return {
+            "messages": [
+                {"role": "system", "content": "你是K2優化器，專門協助用戶完成軟件工程和自動化任務。"},
+                {"role": "user", "content": data_point.input},
+                {"role": "assistant", "content": data_point.output}
+            ],
+            "quality_score": data_point.quality_score,
+            "context": data_point.context,
+            "metadata": data_point.metadata
+        }
+    
+    @staticmethod
+    def _to_deepswe_format(data_point: TrainingDataPoint) -> Dict[str, Any]:
+        """DeepSWE格式"""
+        return {
+            "instruction": data_point.instruction,
+            "input": data_point.input,
+            "output": data_point.output,
+            "thinking": data_point.thinking,
+            "tools_used": data_point.tools_used or [],
+            "metadata": {
+                "category": "software_engineering",
+                "quality_score": data_point.quality_score,
+                "has_thinking": data_point.thinking is not None,
+                **(data_point.metadata or {})
+            }
+        }
+    
+    @staticmethod
+    def _encode_training_point(data_point: TrainingDataPoint) -> EncodedSample:
+        """把樣本序列化為兩種輸出格式"""
+        return EncodedSample(
+            source=data_point.source,
+            quality_score=data_point.quality_score,
+            has_thinking=data_point.thinking is not None,
+            k2_line=ShardedDatasetWriter.encode(K2DataIntegrationEngine._to_k2_format(data_point)),
+            deepswe_line=ShardedDatasetWriter.encode(K2DataIntegrationEngine._to_deepswe_format(data_point))
+        )
     
-    async def _generate_training_datasets(self, training_data: List[TrainingDataPoint]) -> Dict[str, str]:
-        """生成多種格式的訓練數據集"""
+    async def _generate_training_datasets(
+            self, training_data: Union[Iterable[Union[TrainingDataPoint, EncodedSample]],
+                                       AsyncIterator[Union[TrainingDataPoint, EncodedSample]]]) -> Dict[str, str]:
+        """生成多種格式的訓練數據集
+        
+        training_data 可以是任意可迭代對象（包括生成器和異步生成器），元素為 TrainingDataPoint
+        或已序列化的 EncodedSample，逐條寫入兩種格式的 JSONL 分片，不在內存中保留整個數據集
+        """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_files = {}
         
-        # 1. K2格式 (對話格式)
-        k2_file = self.output_dir / f"k2_integrated_training_{timestamp}.jsonl"
-        with open(k2_file, 'w', encoding='utf-8') as f:
-            for data_point in training_data:
-                k2_format = {
-                    "messages": [
-                        {"role": "system", "content": "你是K2優化器，專門協助用戶完成軟件工程和自動化任務。"},
-                        {"role": "user", "content": data_point.input},
-                        {"role": "assistant", "content": data_point.output}
-                    ],
-                    "quality_score": data_point.quality_score,
-                    "context": data_point.context,
-                    "metadata": data_point.metadata
-                }
-                f.write(json.dumps(k2_format, ensure_ascii=False) + '\n')
-        
-        output_files["k2_format"] = str(k2_file)
-        
-        # 2. DeepSWE格式
-        deepswe_file = self.output_dir / f"deepswe_integrated_training_{timestamp}.jsonl"
-        with open(deepswe_file, 'w', encoding='utf-8') as f:
-            for data_point in training_data:
-                deepswe_format = {
-                    "instruction": data_point.instruction,
-                    "input": data_point.input,
-                    "output": data_point.output,
-                    "thinking": data_point.thinking,
-                    "tools_used": data_point.tools_used or [],
-                    "metadata": {
-                        "category": "software_engineering",
-                        "quality_score": data_point.quality_score,
-                        "has_thinking": data_point.thinking is not None,
-                        **data_point.metadata
-                    }
-                }
-                f.write(json.dumps(deepswe_format, ensure_ascii=False) + '\n')
-        
-        output_files["deepswe_format"] = str(deepswe_file)
+        writer_options = {"max_shard_bytes": self.max_shard_bytes, "compression": self.output_compression}
+        k2_writer = ShardedDatasetWriter(self.output_dir, f"k2_integrated_training_{timestamp}", **writer_options)
+        deepswe_writer = ShardedDatasetWriter(self.output_dir, f"deepswe_integrated_training_{timestamp}",
+                                              **writer_options)
+        
+        by_source = {}
+        quality_score_total = 0.0
+        with_thinking = 0
+        
+        def write(sample: Union[TrainingDataPoint, EncodedSample]):
+            nonlocal quality_score_total, with_thinking
+            start = time.perf_counter()
+            if isinstance(sample, TrainingDataPoint):
+                sample = self._encode_training_point(sample)
+            k2_writer.write_encoded(sample.k2_line)
+            deepswe_writer.write_encoded(sample.deepswe_line)
+            by_source[sample.source] = by_source.get(sample.source, 0) + 1
+            quality_score_total += sample.quality_score
+            with_thinking += sample.has_thinking
+            self._record_stage("write", time.perf_counter() - start)
+        
+        with k2_writer, deepswe_writer:
+            if hasattr(training_data, "__aiter__"):
+                async for data_point in training_data:
+                    write(data_point)
+            else:
+                for data_point in training_data:
+                    write(data_point)
+        
+        # 分片和 manifest 已寫出，此時才提交對應的樣本哈希
+        self.dedup_index.flush()
+        
+        # 沒有樣本時寫入器不生成 manifest，不報告不存在的文件
+        if k2_writer.shards:
+            output_files["k2_format"] = str(k2_writer.manifest_path)
+        if deepswe_writer.shards:
+            output_files["deepswe_format"] = str(deepswe_writer.manifest_path)
+        
+        sample_count = deepswe_writer.stats["total_samples"]
+        self.stats["high_quality_count"] = sample_count
+        self.stats["dataset"] = {
+            "samples": sample_count,
+            "by_source": by_source,
+            "with_thinking": with_thinking,
+            "average_quality": quality_score_total / sample_count if sample_count else 0.0,
+            "k2_shards": len(k2_writer.shards),
+            "deepswe_shards": len(deepswe_writer.shards)
+        }
         
         # 3. 統計文件
         stats_file = self.output_dir / f"integration_stats_{timestamp}.json"
@@ -334,9 +548,9 @@ class K2DataIntegrationEngine:
         
         output_files["statistics"] = str(stats_file)
         
-        logger.info(f"✅ 生成訓練數據集: {len(training_data)} 個樣本")
-        logger.info(f"   K2格式: {k2_file}")
-        logger.info(f"   DeepSWE格式: {deepswe_file}")
+        logger.info(f"✅ 生成訓練數據集: {sample_count} 個樣本")
+        logger.info(f"   K2格式: {output_files.get('k2_format', 'N/A')}")
+        logger.info(f"   DeepSWE格式: {output_files.get('deepswe_format', 'N/A')}")
         
         return output_files
     
@@ -354,9 +568,15 @@ class K2DataIntegrationEngine:
 - Claude對話樣本: {self.stats['claude_conversation_count']} 
 - 實時收集樣本: {self.stats['claude_realtime_count']}
 - 高質量樣本: {self.stats['high_quality_count']}
+- 重複樣本（已跳過）: {self.stats['duplicate_count']}
 - 質量保留率: {self.stats['high_quality_count']/max(self.stats['total_processed'], 1)*100:.1f}%
 
-## 📁 輸出文件
+## ⏱️ 階段耗時
+- 工作進程數: {self.max_workers}
+
+{self._format_stage_table()}
+
+## 📁 輸出文件（JSONL 分片清單）
 - K2格式: {output_files.get('k2_format', 'N/A')}
 - DeepSWE格式: {output_files.get('deepswe_format', 'N/A')}
 - 統計數據: {output_files.get('statistics', 'N/A')}
@@ -375,9 +595,30 @@ class K2DataIntegrationEngine:
         
         logger.info(f"📋 整合報告已生成: {report_file}")
 
+    def _format_stage_table(self) -> str:
+        """各階段耗時表（工作進程階段的耗時為所有進程累計）"""
+        lines = [
+            "| 階段 | 處理量 | 數據量 (MB) | 累計耗時 (s) | 處理量/秒 |",
+            "|------|--------|-------------|--------------|-----------|"
+        ]
+        for stage, counters in self.stage_stats.items():
+            seconds = counters["seconds"]
+            lines.append(
+                f"| {stage} | {counters['items']:,} | {counters['bytes'] / (1024 * 1024):.1f} | {seconds:.2f} | "
+                f"{counters['items'] / seconds if seconds else 0:.1f} |"
+            )
+        return "\n".join(lines)
+
 async def main():
     """主函數"""
-    integration_engine = K2DataIntegrationEngine()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='K2數據整合引擎')
+    parser.add_argument('--incremental', action='store_true',
+                        help='使用共用去重索引，只輸出之前未輸出過的樣本（默認完整重建數據集）')
+    args = parser.parse_args()
+
+    integration_engine = K2DataIntegrationEngine(incremental=args.incremental)
     result = await integration_engine.integrate_all_data()
     
     print("\n🎉 K2數據整合完成!")
@@ -8,9 +8,11 @@ import asyncio
 import json
 import os
 import sys
+import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import logging
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import multiprocessing as mp
@@ -18,9 +20,88 @@ from dataclasses import dataclass
 import aiofiles
 import hashlib
 
+# 添加項目路徑（共用的數據集寫入器和去重索引）
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+
+from dataset_writer import ShardedDatasetWriter
+from dedup_index import DedupIndex, shared_index_path
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+HASH_CHUNK_SIZE = 1024 * 1024  # 流式哈希每次讀取 1MB
+
+# 工作進程內的只讀去重索引連接（由進程池 initializer 設置）
+_worker_index: Optional[DedupIndex] = None
+
+
+def _new_hasher():
+    """快速內容哈希：優先 xxh3-128，否則 blake2b-128（均快於 MD5）"""
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def _init_parse_worker(index_path: str):
+    global _worker_index
+    _worker_index = DedupIndex(index_path, use_bloom=False, readonly=True)
+
+
+def _read_and_hash(file_path: str) -> Tuple[bytes, str]:
+    """分塊讀取文件並同時計算哈希，只讀一遍"""
+    hasher = _new_hasher()
+    chunks = []
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            chunks.append(chunk)
+    return b''.join(chunks), hasher.hexdigest()
+
+
+def _parse_file_task(file_path: str, file_type: str) -> Dict[str, Any]:
+    """工作進程：讀取 + 哈希 + 解析單個文件，返回結果和各階段耗時"""
+    outcome = {"path": file_path, "file_type": file_type, "file_hash": "", "status": "empty",
+               "result": None, "error": None, "bytes": 0, "timings": {}}
+    try:
+        start = time.perf_counter()
+        raw, file_hash = _read_and_hash(file_path)
+        outcome["file_hash"] = file_hash
+        outcome["bytes"] = len(raw)
+        outcome["timings"]["hash"] = time.perf_counter() - start
+
+        if _worker_index is not None and _worker_index.contains("file", file_hash):
+            outcome["status"] = "skipped"
+            return outcome
+
+        start = time.perf_counter()
+        content = raw.decode('utf-8')
+        if file_type == 'html':
+            result = MassiveDataProcessor.extract_conversations_from_html(content, Path(file_path))
+        else:
+            result = MassiveDataProcessor.build_training_samples(json.loads(content), Path(file_path))
+        outcome["timings"]["parse"] = time.perf_counter() - start
+
+        if result:
+            outcome["status"] = "parsed"
+            outcome["result"] = result
+
+    except Exception as e:
+        outcome["status"] = "error"
+        outcome["error"] = str(e)
+
+    return outcome
+
+
+def _parse_chunk(tasks: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """工作進程：一次處理一組文件，減少進程間往返"""
+    return [_parse_file_task(file_path, file_type) for file_path, file_type in tasks]
+
 @dataclass
 class DataStats:
     """數據統計"""
@@ -31,16 +112,28 @@ class DataStats:
     total_tokens: int = 0
     categories: Dict[str, int] = None
     error_count: int = 0
+    skipped_files: int = 0
+    duplicate_samples: int = 0
     processing_time: float = 0.0
+    stage_stats: Dict[str, Dict[str, float]] = None
     
     def __post_init__(self):
         if self.categories is None:
             self.categories = {"thinking": 0, "observation": 0, "action": 0}
+        if self.stage_stats is None:
+            self.stage_stats = {}
+    
+    def record_stage(self, stage: str, seconds: float, files: int = 1, nbytes: int = 0):
+        """累計某個處理階段的文件數、數據量和耗時"""
+        counters = self.stage_stats.setdefault(stage, {"files": 0, "bytes": 0, "seconds": 0.0})
+        counters["files"] += files
+        counters["bytes"] += nbytes
+        counters["seconds"] += seconds
 
 class MassiveDataProcessor:
     """巨量數據處理器"""
     
-    def __init__(self):
+    def __init__(self, max_workers: Optional[int] = None):
         self.base_dir = Path(__file__).parent
         self.data_dir = self.base_dir / "data"
         self.output_dir = self.base_dir / "massive_training_data"
@@ -50,42 +143,53 @@ class MassiveDataProcessor:
         self.stats = DataStats()
         
         # 處理器配置
-        self.max_workers = min(mp.cpu_count(), 8)  # 限制併發數避免系統過載
+        self.max_workers = max_workers or mp.cpu_count()  # 解析進程數
         self.batch_size = 50  # 批次處理大小
+        self.chunk_size = 8  # 每次提交給工作進程的文件數
+        self.max_in_flight = self.max_workers * 2  # 同時在途的文件組數上限
         self.max_file_size = 10 * 1024 * 1024  # 10MB 文件大小限制
-        
-        # 數據去重
-        self.processed_hashes = set()
-        self.hash_file = self.output_dir / "processed_hashes.txt"
-        self._load_processed_hashes()
-    
-    def _load_processed_hashes(self):
-        """載入已處理的文件哈希"""
-        if self.hash_file.exists():
-            try:
-                with open(self.hash_file, 'r') as f:
-                    self.processed_hashes = set(line.strip() for line in f)
-                logger.info(f"載入 {len(self.processed_hashes)} 個已處理文件的哈希")
-            except Exception as e:
-                logger.warning(f"載入哈希文件失敗: {e}")
-    
-    def _save_processed_hash(self, file_hash: str):
-        """保存已處理文件的哈希"""
-        self.processed_hashes.add(file_hash)
-        try:
-            with open(self.hash_file, 'a') as f:
-                f.write(file_hash + '\n')
-        except Exception as e:
-            logger.warning(f"保存哈希失敗: {e}")
+        self.executor: Optional[ProcessPoolExecutor] = None
+        
+        # 輸出配置：JSONL 分片大小上限和壓縮格式（None / "gzip" / "zstd"）
+        self.max_shard_bytes = 256 * 1024 * 1024
+        self.output_compression = None
+        self.sample_writer: Optional[ShardedDatasetWriter] = None
+        self.conversation_writer: Optional[ShardedDatasetWriter] = None
+        self.output_manifests: List[str] = []
+        
+        # 數據去重：文件哈希和樣本內容哈希存於持久化索引，與其他數據收集器共用
+        self.index_path = shared_index_path()
+        self.dedup_index = DedupIndex(self.index_path)
     
     def _calculate_file_hash(self, file_path: Path) -> str:
-        """計算文件哈希"""
+        """計算文件哈希（流式讀取）"""
         try:
+            hasher = _new_hasher()
             with open(file_path, 'rb') as f:
-                return hashlib.md5(f.read()).hexdigest()
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            return hasher.hexdigest()
         except Exception:
             return ""
     
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """懶加載解析進程池；工作進程以只讀方式查詢去重索引"""
+        if self.executor is None:
+            self.dedup_index.flush()
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=_init_parse_worker,
+                initargs=(str(self.index_path),)
+            )
+        return self.executor
+    
+    def close(self):
+        """關閉解析進程池，提交去重索引"""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.dedup_index.flush()
+    
     async def discover_all_data_files(self) -> Dict[str, List[Path]]:
         """發現所有數據文件"""
         logger.info("🔍 開始發現數據文件...")
@@ -133,84 +237,51 @@ class MassiveDataProcessor:
     
     async def process_html_file(self, html_file: Path) -> Optional[Dict]:
         """處理單個 HTML 文件"""
-        try:
-            # 檢查是否已處理
-            file_hash = self._calculate_file_hash(html_file)
-            if file_hash in self.processed_hashes:
-                return None
-            
-            # 讀取並分析 HTML
-            async with aiofiles.open(html_file, 'r', encoding='utf-8') as f:
-                content = await f.read()
-            
-            # 使用您的 manus_complete_analyzer 邏輯
-            conversations = await self._extract_conversations_from_html(content, html_file)
-            
-            if conversations:
-                self._save_processed_hash(file_hash)
-                self.stats.processed_files += 1
-                return conversations
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"處理 HTML 文件失敗 {html_file}: {e}")
-            self.stats.error_count += 1
-            return None
+        results = await self.process_batch([html_file], 'html')
+        return results[0] if results else None
     
-    async def _extract_conversations_from_html(self, content: str, source_file: Path) -> Optional[Dict]:
-        """從 HTML 內容提取對話（簡化版）"""
-        try:
-            # 這裡應該集成您的 manus_complete_analyzer 邏輯
-            # 目前是簡化實現
-            
-            lines = content.split('\n')
-            messages = []
-            
-            for i, line in enumerate(lines):
-                line = line.strip()
-                if len(line) > 20:  # 過濾太短的行
-                    # 簡單的分類邏輯
-                    category = self._classify_line(line)
-                    
-                    message = {
-                        'index': len(messages),
-                        'content': line[:500],  # 限制長度
-                        'category': category,
-                        'confidence': 0.6,
-                        'source_file': str(source_file),
-                        'line_number': i + 1
-                    }
-                    
-                    messages.append(message)
-                    
-                    # 限制每個文件的消息數量
-                    if len(messages) >= 100:
-                        break
-            
-            if messages:
-                self.stats.total_messages += len(messages)
-                self.stats.total_conversations += 1
-                
-                # 更新類別統計
-                for msg in messages:
-                    category = msg['category']
-                    self.stats.categories[category] = self.stats.categories.get(category, 0) + 1
+    @staticmethod
+    def extract_conversations_from_html(content: str, source_file: Path) -> Optional[Dict]:
+        """從 HTML 內容提取對話（簡化版，在工作進程中執行）"""
+        # 這裡應該集成您的 manus_complete_analyzer 邏輯
+        # 目前是簡化實現
+        
+        lines = content.split('\n')
+        messages = []
+        
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if len(line) > 20:  # 過濾太短的行
+                # 簡單的分類邏輯
+                category = MassiveDataProcessor._classify_line(line)
                 
-                return {
+                message = {
+                    'index': len(messages),
+                    'content': line[:500],  # 限制長度
+                    'category': category,
+                    'confidence': 0.6,
                     'source_file': str(source_file),
-                    'extraction_time': datetime.now().isoformat(),
-                    'message_count': len(messages),
-                    'messages': messages
+                    'line_number': i + 1
                 }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"提取對話失敗: {e}")
-            return None
+                
+                messages.append(message)
+                
+                # 限制每個文件的消息數量
+                if len(messages) >= 100:
+                    break
+        
+        if messages:
+            return {
+                'source_file': str(source_file),
+                'extraction_time': datetime.now().isoformat(),
+                'message_count': len(messages),
+                'messages': messages
+            }
+        
+        return None
     
-    def _classify_line(self, line: str) -> str:
+    @staticmethod
+    def _classify_line(line: str) -> str:
         """簡單的行分類（應該使用您的完整分類邏輯）"""
         line_lower = line.lower()
         
@@ -229,71 +300,43 @@ class MassiveDataProcessor:
     
     async def process_json_file(self, json_file: Path) -> Optional[Dict]:
         """處理 JSON 分析文件"""
-        try:
-            # 檢查是否已處理
-            file_hash = self._calculate_file_hash(json_file)
-            if file_hash in self.processed_hashes:
-                return None
-            
-            async with aiofiles.open(json_file, 'r', encoding='utf-8') as f:
-                content = await f.read()
-                data = json.loads(content)
-            
-            # 處理 JSON 數據
-            processed_data = await self._process_json_data(data, json_file)
-            
-            if processed_data:
-                self._save_processed_hash(file_hash)
-                self.stats.processed_files += 1
-                return processed_data
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"處理 JSON 文件失敗 {json_file}: {e}")
-            self.stats.error_count += 1
-            return None
+        results = await self.process_batch([json_file], 'json')
+        return results[0] if results else None
     
-    async def _process_json_data(self, data: Dict, source_file: Path) -> Optional[Dict]:
-        """處理 JSON 數據"""
-        try:
-            training_samples = []
-            
-            # 處理不同格式的 JSON 數據
-            if 'categories' in data:
-                # manus_analysis 格式
-                for category, messages in data['categories'].items():
-                    for msg in messages:
-                        sample = self._create_training_sample(msg, category, str(source_file))
-                        if sample:
-                            training_samples.append(sample)
-            
-            elif 'messages' in data:
-                # manus_raw_data 格式
-                for msg in data['messages']:
-                    category = self._classify_message(msg)
-                    sample = self._create_training_sample(msg, category, str(source_file))
+    @staticmethod
+    def build_training_samples(data: Dict, source_file: Path) -> Optional[Dict]:
+        """從 JSON 數據生成訓練樣本（在工作進程中執行）"""
+        training_samples = []
+        
+        # 處理不同格式的 JSON 數據
+        if 'categories' in data:
+            # manus_analysis 格式
+            for category, messages in data['categories'].items():
+                for msg in messages:
+                    sample = MassiveDataProcessor._create_training_sample(msg, category, str(source_file))
                     if sample:
                         training_samples.append(sample)
-            
-            if training_samples:
-                self.stats.total_messages += len(training_samples)
-                self.stats.total_conversations += 1
-                
-                return {
-                    'source_file': str(source_file),
-                    'extraction_time': datetime.now().isoformat(),
-                    'sample_count': len(training_samples),
-                    'training_samples': training_samples
-                }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"處理 JSON 數據失敗: {e}")
-            return None
+        
+        elif 'messages' in data:
+            # manus_raw_data 格式
+            for msg in data['messages']:
+                category = MassiveDataProcessor._classify_message(msg)
+                sample = MassiveDataProcessor._create_training_sample(msg, category, str(source_file))
+                if sample:
+                    training_samples.append(sample)
+        
+        if training_samples:
+            return {
+                'source_file': str(source_file),
+                'extraction_time': datetime.now().isoformat(),
+                'sample_count': len(training_samples),
+                'training_samples': training_samples
+            }
+        
+        return None
     
-    def _classify_message(self, msg: Dict) -> str:
+    @staticmethod
+    def _classify_message(msg: Dict) -> str:
         """分類消息"""
         content = msg.get('content', '').lower()
         msg_type = msg.get('type', '')
@@ -305,9 +348,10 @@ class MassiveDataProcessor:
             return 'observation'
         
         # 基於內容
-        return self._classify_line(content)
+        return MassiveDataProcessor._classify_line(content)
     
-    def _create_training_sample(self, msg: Dict, category: str, source_file: str) -> Optional[Dict]:
+    @staticmethod
+    def _create_training_sample(msg: Dict, category: str, source_file: str) -> Optional[Dict]:
         """創建訓練樣本"""
         content = msg.get('content')
         if not content or len(content.strip()) < 10:
@@ -316,7 +360,7 @@ class MassiveDataProcessor:
         return {
             'instruction': '分析並執行任務',
             'input': content[:300],
-            'output': self._generate_output(content, category),
+            'output': MassiveDataProcessor._generate_output(content, category),
             'category': category,
             'confidence': msg.get('confidence', 0.6),
             'source': 'massive_processor',
@@ -327,7 +371,8 @@ class MassiveDataProcessor:
             }
         }
     
-    def _generate_output(self, content: str, category: str) -> str:
+    @staticmethod
+    def _generate_output(content: str, category: str) -> str:
         """生成輸出內容"""
         if category == 'action':
             return f"執行操作: {content[:200]}"
@@ -336,71 +381,150 @@ class MassiveDataProcessor:
         else:
             return f"分析思考: {content[:200]}"
     
+    async def iter_parsed_files(self, files: List[Path], file_type: str):
+        """在進程池中並行解析文件，按輸入順序逐個產出解析結果
+        
+        文件按 chunk_size 分組提交，在途組數不超過 max_in_flight，
+        始終等待最早提交的一組，因此結果順序與輸入一致且內存有界
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        pending = deque()
+        
+        async def drain_one():
+            tasks, future = pending.popleft()
+            try:
+                outcomes = await future
+            except Exception as e:
+                # 整組失敗（例如工作進程崩潰）
+                logger.error(f"批次處理錯誤: {e}")
+                outcomes = [{"path": path, "status": "error", "error": str(e)} for path, _ in tasks]
+            
+            results = []
+            for outcome in outcomes:
+                result = self._collect_outcome(outcome)
+                if result:
+                    results.append(result)
+            return results
+        
+        for i in range(0, len(files), self.chunk_size):
+            tasks = [(str(file_path), file_type) for file_path in files[i:i + self.chunk_size]]
+            pending.append((tasks, loop.run_in_executor(executor, _parse_chunk, tasks)))
+            
+            if len(pending) >= self.max_in_flight:
+                for result in await drain_one():
+                    yield result
+        
+        while pending:
+            for result in await drain_one():
+                yield result
+    
+    def _collect_outcome(self, outcome: Dict[str, Any]) -> Optional[Dict]:
+        """在主進程中合併單個文件的解析結果：去重、更新統計"""
+        timings = outcome.get("timings", {})
+        if "hash" in timings:
+            self.stats.record_stage("hash", timings["hash"], nbytes=outcome["bytes"])
+        if "parse" in timings:
+            self.stats.record_stage("parse", timings["parse"], nbytes=outcome["bytes"])
+        
+        status = outcome["status"]
+        if status == "error":
+            logger.error(f"處理 {outcome.get('file_type', '').upper()} 文件失敗 {outcome['path']}: {outcome['error']}")
+            self.stats.error_count += 1
+            return None
+        
+        if status == "skipped":
+            self.stats.skipped_files += 1
+            return None
+        
+        # 工作進程只能看到已提交的記錄，同一批次內的相同內容在這裡攔截；
+        # 解析不出內容的文件也記錄哈希，下次運行直接跳過
+        if not self.dedup_index.add("file", outcome["file_hash"], source=Path(outcome["path"]).name):
+            self.stats.skipped_files += 1
+            return None
+        
+        result = outcome["result"]
+        if status != "parsed" or not result:
+            return None
+        
+        if 'training_samples' in result:
+            # 樣本級去重：不同文件中內容相同的樣本只保留第一條
+            unique_samples = [sample for sample in result['training_samples']
+                              if self.dedup_index.add_sample(sample, source=sample.get('source'))]
+            self.stats.duplicate_samples += len(result['training_samples']) - len(unique_samples)
+            result['training_samples'] = unique_samples
+        
+        self.stats.processed_files += 1
+        self.stats.total_conversations += 1
+        
+        if 'messages' in result:
+            self.stats.total_messages += len(result['messages'])
+            # 更新類別統計
+            for msg in result['messages']:
+                category = msg['category']
+                self.stats.categories[category] = self.stats.categories.get(category, 0) + 1
+        else:
+            self.stats.total_messages += len(result['training_samples'])
+        
+        return result
+    
     async def process_batch(self, files: List[Path], file_type: str) -> List[Dict]:
         """批次處理文件"""
-        results = []
-        
-        tasks = []
-        for file_path in files:
-            if file_type == 'html':
-                task = self.process_html_file(file_path)
-            elif file_type == 'json':
-                task = self.process_json_file(file_path)
-            else:
-                continue
-            
-            tasks.append(task)
+        if file_type not in ('html', 'json'):
+            return []
         
-        # 並行處理
-        batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [result async for result in self.iter_parsed_files(files, file_type)]
+    
+    def _open_writers(self):
+        """打開訓練樣本和對話數據的分片寫入器"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.sample_writer = ShardedDatasetWriter(
+            self.output_dir, f"massive_training_samples_{timestamp}",
+            max_shard_bytes=self.max_shard_bytes, compression=self.output_compression,
+            count_by={"by_category": "category"}
+        )
+        self.conversation_writer = ShardedDatasetWriter(
+            self.output_dir, f"massive_conversations_{timestamp}",
+            max_shard_bytes=self.max_shard_bytes, compression=self.output_compression,
+            sum_of={"total_messages": "message_count"}
+        )
+    
+    def _close_writers(self):
+        """關閉寫入器，記錄生成的 manifest，再提交去重索引"""
+        for writer in (self.sample_writer, self.conversation_writer):
+            if writer is not None and writer.close()["shards"]:
+                self.output_manifests.append(str(writer.manifest_path))
+        self.sample_writer = None
+        self.conversation_writer = None
+        # 樣本已落盤，此時才提交對應的文件/樣本哈希
+        self.dedup_index.flush()
+    
+    def _write_result(self, data: Dict):
+        """把單個文件的處理結果寫入對應的數據集"""
+        save_start = time.perf_counter()
         
-        for result in batch_results:
-            if isinstance(result, Exception):
-                self.stats.error_count += 1
-                logger.error(f"批次處理錯誤: {result}")
-            elif result:
-                results.append(result)
+        if 'training_samples' in data:
+            self.sample_writer.write_many(data['training_samples'])
+        if 'messages' in data:
+            self.conversation_writer.write(data)
         
-        return results
+        self.stats.record_stage("save", time.perf_counter() - save_start)
     
     async def save_training_data(self, processed_data: List[Dict]):
-        """保存訓練數據"""
+        """保存訓練數據（流式寫入 JSONL 分片）"""
         if not processed_data:
             return
         
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # 分別保存不同類型的數據
-        training_samples = []
-        conversation_data = []
+        # 不在 process_all_data 運行中時，單獨生成一組數據集文件
+        standalone = self.sample_writer is None
+        if standalone:
+            self._open_writers()
         
         for data in processed_data:
-            if 'training_samples' in data:
-                training_samples.extend(data['training_samples'])
-            if 'messages' in data:
-                conversation_data.append(data)
+            self._write_result(data)
         
-        # 保存訓練樣本
-        if training_samples:
-            training_file = self.output_dir / f"massive_training_samples_{timestamp}.jsonl"
-            async with aiofiles.open(training_file, 'w', encoding='utf-8') as f:
-                for sample in training_samples:
-                    await f.write(json.dumps(sample, ensure_ascii=False) + '\n')
-            
-            logger.info(f"💾 已保存 {len(training_samples)} 個訓練樣本: {training_file}")
-        
-        # 保存對話數據
-        if conversation_data:
-            conversation_file = self.output_dir / f"massive_conversations_{timestamp}.json"
-            async with aiofiles.open(conversation_file, 'w', encoding='utf-8') as f:
-                data_to_save = {
-                    'extraction_time': datetime.now().isoformat(),
-                    'total_conversations': len(conversation_data),
-                    'conversations': conversation_data
-                }
-                await f.write(json.dumps(data_to_save, ensure_ascii=False, indent=2))
-            
-            logger.info(f"💬 已保存 {len(conversation_data)} 個對話: {conversation_file}")
+        if standalone:
+            self._close_writers()
     
     async def generate_processing_report(self):
         """生成處理報告"""
@@ -429,6 +553,14 @@ class MassiveDataProcessor:
 - **👁️ 觀察 (Observation)**: {self.stats.categories.get('observation', 0):,} ({self.stats.categories.get('observation', 0)/max(self.stats.total_messages, 1)*100:.1f}%)
 - **🎯 動作 (Action)**: {self.stats.categories.get('action', 0):,} ({self.stats.categories.get('action', 0)/max(self.stats.total_messages, 1)*100:.1f}%)
 
+## 階段吞吐量
+
+- **解析進程數**: {self.max_workers}
+- **跳過（已處理）文件數**: {self.stats.skipped_files}
+- **重複樣本數**: {self.stats.duplicate_samples}
+
+{self._format_stage_table()}
+
 ## 數據質量評估
 
 基於數據量評估，建議的訓練策略:
@@ -459,8 +591,9 @@ class MassiveDataProcessor:
 
 ## 文件輸出
 
-- 訓練樣本: `massive_training_samples_*.jsonl`
-- 對話數據: `massive_conversations_*.json`
+- 訓練樣本: `massive_training_samples_*-NNNNN.jsonl`（分片）
+- 對話數據: `massive_conversations_*-NNNNN.jsonl`（分片，每行一個對話）
+- 數據集清單: {', '.join(f"`{Path(path).name}`" for path in self.output_manifests) or '無'}
 - 處理日誌: `processing_report_*.md`
 """
 
@@ -469,49 +602,50 @@ class MassiveDataProcessor:
         
         logger.info(f"📊 處理報告已生成: {report_file}")
     
+    def _format_stage_table(self) -> str:
+        """各階段吞吐量表（工作進程階段的耗時為所有進程累計）"""
+        lines = [
+            "| 階段 | 文件數 | 數據量 (MB) | 累計耗時 (s) | 文件/秒 | MB/秒 |",
+            "|------|--------|-------------|--------------|---------|-------|"
+        ]
+        for stage, counters in self.stats.stage_stats.items():
+            seconds = counters["seconds"]
+            megabytes = counters["bytes"] / (1024 * 1024)
+            lines.append(
+                f"| {stage} | {counters['files']:,} | {megabytes:.1f} | {seconds:.2f} | "
+                f"{counters['files'] / seconds if seconds else 0:.1f} | {megabytes / seconds if seconds else 0:.1f} |"
+            )
+        return "\n".join(lines)
+    
     async def process_all_data(self):
         """處理所有數據"""
         start_time = datetime.now()
-        logger.info("🚀 開始巨量數據處理...")
+        logger.info(f"🚀 開始巨量數據處理（{self.max_workers} 個解析進程）...")
         
         # 發現文件
         discovered_files = await self.discover_all_data_files()
         
-        all_processed_data = []
+        self._open_writers()
         
-        # 處理 HTML 文件
-        html_files = discovered_files['html_files']
-        if html_files:
-            logger.info(f"📄 開始處理 {len(html_files)} 個 HTML 文件...")
-            
-            # 分批處理
-            for i in range(0, len(html_files), self.batch_size):
-                batch = html_files[i:i + self.batch_size]
-                logger.info(f"   處理批次 {i//self.batch_size + 1}/{(len(html_files)-1)//self.batch_size + 1}")
+        try:
+            for file_type, files in (('html', discovered_files['html_files']),
+                                     ('json', discovered_files['json_files'])):
+                if not files:
+                    continue
                 
-                batch_results = await self.process_batch(batch, 'html')
-                all_processed_data.extend(batch_results)
+                logger.info(f"📄 開始處理 {len(files)} 個 {file_type.upper()} 文件...")
+                stage_start = time.perf_counter()
                 
-                # 定期保存避免數據丟失
-                if len(all_processed_data) >= 100:
-                    await self.save_training_data(all_processed_data)
-                    all_processed_data = []
-        
-        # 處理 JSON 文件
-        json_files = discovered_files['json_files']
-        if json_files:
-            logger.info(f"📄 開始處理 {len(json_files)} 個 JSON 文件...")
-            
-            for i in range(0, len(json_files), self.batch_size):
-                batch = json_files[i:i + self.batch_size]
-                logger.info(f"   處理批次 {i//self.batch_size + 1}/{(len(json_files)-1)//self.batch_size + 1}")
+                # 結果按順序流式返回並立即寫入分片，解析與保存重疊進行
+                async for result in self.iter_parsed_files(files, file_type):
+                    self._write_result(result)
                 
-                batch_results = await self.process_batch(batch, 'json')
-                all_processed_data.extend(batch_results)
+                self.stats.record_stage(f"{file_type}_pipeline", time.perf_counter() - stage_start,
+                                        files=len(files), nbytes=sum(f.stat().st_size for f in files))
         
-        # 保存剩餘數據
-        if all_processed_data:
-            await self.save_training_data(all_processed_data)
+        finally:
+            self._close_writers()
+            self.close()
         
         # 計算處理時間
         self.stats.processing_time = (datetime.now() - start_time).total_seconds()
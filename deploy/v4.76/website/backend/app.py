@@ -31,6 +31,15 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'powerauto-ai-v476-secre
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///powerauto.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# 數據庫連接池（SQLite 使用默認配置）
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
 # 初始化擴展
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
@@ -73,7 +82,7 @@ class User(db.Model):
     subscription = db.Column(db.String(20), default='free')  # free, personal, professional, enterprise
     api_calls_used = db.Column(db.Integer, default=0)
     api_calls_limit = db.Column(db.Integer, default=100)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     last_login = db.Column(db.DateTime)
     stripe_customer_id = db.Column(db.String(100))
 
@@ -85,6 +94,11 @@ class APIUsage(db.Model):
     cost = db.Column(db.Float, default=0.0)
     response_time = db.Column(db.Integer)  # ms
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_api_usage_timestamp', 'timestamp'),
+        db.Index('ix_api_usage_user_timestamp', 'user_id', 'timestamp'),
+    )
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -95,6 +109,44 @@ class Payment(db.Model):
     status = db.Column(db.String(20), default='pending')
     stripe_payment_intent_id = db.Column(db.String(100))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_payment_status_created', 'status', 'created_at'),
+        db.Index('ix_payment_user_created', 'user_id', 'created_at'),
+    )
+
+# 用量匯總表（由 UsageMeter 在寫入用量時增量維護）
+class UsageRollupHourly(db.Model):
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    calls = db.Column(db.Integer, default=0, nullable=False)
+    cost = db.Column(db.Float, default=0.0, nullable=False)
+    response_time_total = db.Column(db.BigInteger, default=0, nullable=False)  # ms
+
+class UsageRollupDaily(db.Model):
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    calls = db.Column(db.Integer, default=0, nullable=False)
+    cost = db.Column(db.Float, default=0.0, nullable=False)
+    response_time_total = db.Column(db.BigInteger, default=0, nullable=False)  # ms
+    
+    __table_args__ = (
+        db.Index('ix_usage_rollup_daily_user', 'user_id', 'bucket_start'),
+    )
+
+# API 用量計量（原子配額扣減 + 批量寫入用量記錄 + 匯總表增量更新）
+from usage_metering import usage_meter
+usage_meter.dead_letter_path = os.environ.get('USAGE_DEAD_LETTER_PATH', 'usage_dead_letter.jsonl')
+usage_meter.init_app(app, db, User, APIUsage, UsageRollupHourly, UsageRollupDaily)
+
+# 認證緩存（JWT 驗證結果 + 用戶資料）
+from auth_cache import auth_cache
+auth_cache.init_app(db, User)
+usage_meter.add_consume_listener(auth_cache.invalidate_user)
+
+# 管理後台統計緩存
+ADMIN_STATS_TTL = int(os.environ.get('ADMIN_STATS_TTL', 30))
+_admin_stats_cache = {'data': None, 'expires_at': 0.0}
 
 # 裝飾器
 def token_required(f):
@@ -107,8 +159,18 @@ def token_required(f):
         try:
             if token.startswith('Bearer '):
                 token = token[7:]
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            
+            # 已驗證令牌直接取緩存，過期時間不晚於令牌 exp
+            data = auth_cache.get_token_payload(token)
+            if data is None:
+                data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+                auth_cache.put_token_payload(token, data)
+            
+            current_user = auth_cache.get_user(data['user_id'])
+            if current_user is None:
+                current_user = User.query.get(data['user_id'])
+                if current_user is not None:
+                    auth_cache.put_user(current_user)
         except:
             return jsonify({'message': '無效的認證令牌'}), 401
         
@@ -289,9 +351,11 @@ def create_payment_intent(current_user):
 def claude_k2_chat(current_user):
     data = request.get_json()
     
-    # 檢查API調用限制
-    if current_user.api_calls_used >= current_user.api_calls_limit:
+    # 原子扣減API調用配額（檢查與計數在同一條 SQL 中完成）
+    consumed = usage_meter.try_consume(current_user.id)
+    if consumed is None:
         return jsonify({'message': 'API調用次數已達上限，請升級訂閱'}), 429
+    api_calls_used, api_calls_limit = consumed
     
     message = data['message']
     model = data.get('model', 'auto')  # claude, k2, auto
@@ -319,27 +383,21 @@ def claude_k2_chat(current_user):
     
     response_time = int((time.time() - start_time) * 1000)
     
-    # 更新用戶API使用情況
-    current_user.api_calls_used += 1
-    db.session.commit()
-    
-    # 記錄API使用情況
-    usage = APIUsage(
+    # 記錄API使用情況（緩衝後批量寫入）
+    usage_meter.record_usage(
         user_id=current_user.id,
         model_used=model,
         endpoint='/api/claude-k2/chat',
         cost=cost,
         response_time=response_time
     )
-    db.session.add(usage)
-    db.session.commit()
     
     return jsonify({
         'response': response,
         'model_used': model,
         'cost': cost,
         'response_time': response_time,
-        'api_calls_remaining': current_user.api_calls_limit - current_user.api_calls_used
+        'api_calls_remaining': api_calls_limit - api_calls_used
     })
 
 @app.route('/api/claudeditor/launch', methods=['POST'])
@@ -390,27 +448,67 @@ def get_all_users(current_user):
 @token_required
 @admin_required  
 def get_admin_stats(current_user):
+    import time
+    now = time.time()
+    
+    # 短 TTL 緩存，避免每次刷新儀表板都查詢數據庫
+    if _admin_stats_cache['data'] is not None and now < _admin_stats_cache['expires_at']:
+        return jsonify({**_admin_stats_cache['data'], 'cached': True})
+    
+    # 用量統計讀取匯總表，不掃描 APIUsage 明細
     total_users = User.query.count()
-    total_api_calls = db.session.query(db.func.sum(APIUsage.cost)).scalar() or 0
+    total_api_calls = db.session.query(db.func.sum(UsageRollupDaily.cost)).scalar() or 0
     total_revenue = db.session.query(db.func.sum(Payment.amount)).filter_by(status='completed').scalar() or 0
     
     # 最近7天的統計
     week_ago = datetime.utcnow() - timedelta(days=7)
     recent_users = User.query.filter(User.created_at >= week_ago).count()
-    recent_api_calls = APIUsage.query.filter(APIUsage.timestamp >= week_ago).count()
+    recent_api_calls = db.session.query(db.func.sum(UsageRollupHourly.calls)).filter(
+        UsageRollupHourly.bucket_start >= week_ago.replace(minute=0, second=0, microsecond=0)
+    ).scalar() or 0
     
-    return jsonify({
+    stats = {
         'total_users': total_users,
         'total_api_calls': total_api_calls,
         'total_revenue': total_revenue,
         'recent_users': recent_users,
         'recent_api_calls': recent_api_calls,
+        'usage_metering': usage_meter.get_stats(),
+        'auth_cache': auth_cache.get_stats(),
         'performance_metrics': {
             'smart_intervention_latency': '<100ms',
             'memoryrag_compression': '2.4%',
             'smartui_accessibility': '100%',
             'k2_accuracy': '95%'
         }
+    }
+    
+    _admin_stats_cache['data'] = stats
+    _admin_stats_cache['expires_at'] = now + ADMIN_STATS_TTL
+    
+    return jsonify({**stats, 'cached': False})
+
+@app.route('/api/usage/summary', methods=['GET'])
+@token_required
+def get_usage_summary(current_user):
+    """當前用戶的按天用量匯總（計費用）"""
+    days = min(int(request.args.get('days', 30)), 366)
+    since = (datetime.utcnow() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    rollups = UsageRollupDaily.query.filter(
+        UsageRollupDaily.user_id == current_user.id,
+        UsageRollupDaily.bucket_start >= since
+    ).order_by(UsageRollupDaily.bucket_start).all()
+    
+    return jsonify({
+        'days': [{
+            'date': rollup.bucket_start.date().isoformat(),
+            'calls': rollup.calls,
+            'cost': rollup.cost,
+            'average_response_time': rollup.response_time_total / rollup.calls if rollup.calls else 0
+        } for rollup in rollups],
+        'total_calls': sum(rollup.calls for rollup in rollups),
+        'total_cost': sum(rollup.cost for rollup in rollups)
     })
 
 # Webhook處理
@@ -1245,6 +1343,11 @@ def register_page():
 def create_tables():
     db.create_all()
     
+    # create_all 不會為已存在的表補建索引
+    for model in (User, APIUsage, Payment):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+    
     # 創建默認管理員用戶
     admin = User.query.filter_by(username='admin').first()
     if not admin:
@@ -1259,6 +1362,10 @@ def create_tables():
         )
         db.session.add(admin)
         db.session.commit()
+    
+    # 首次啟用匯總表時，從已有用量記錄回填
+    if not UsageRollupDaily.query.first() and APIUsage.query.first():
+        usage_meter.rebuild_rollups()
 
 if __name__ == '__main__':
     # 初始化数据库
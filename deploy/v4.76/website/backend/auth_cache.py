@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+PowerAuto.ai 認證緩存
+- 已驗證 JWT 緩存：以令牌 SHA-256 為鍵，有界 LRU，過期時間不晚於令牌的 exp
+- 用戶資料緩存：短 TTL，經 ORM 更新用戶（登錄時間、角色、訂閱等）或扣減配額後自動失效；
+  失效只作用於本進程，因此配額欄位不進快照，每次訪問時從數據庫讀取（多個 worker 下也不會讀到舊配額）
+兩者都提供命中率統計
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+# 由原子 UPDATE 在任意 worker 中修改的欄位，不緩存
+VOLATILE_COLUMNS = frozenset({"api_calls_used", "api_calls_limit"})
+
+
+class TTLCache:
+    """線程安全的有界 LRU + TTL 緩存"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                self.stats["misses"] += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, value, expires_at: Optional[float] = None):
+        expires_at = min(expires_at or float("inf"), time.time() + self.ttl)
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self.entries),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0
+        }
+
+
+class AuthCache:
+    """JWT 驗證結果緩存 + 用戶資料緩存"""
+
+    def __init__(self, token_cache_size: int = 10000, token_max_ttl: float = 3600,
+                 user_cache_size: int = 5000, user_ttl: float = 30):
+        self.tokens = TTLCache(token_cache_size, token_max_ttl)
+        self.users = TTLCache(user_cache_size, user_ttl)
+        self.db = None
+        self.user_model = None
+
+    def init_app(self, db, user_model):
+        """綁定數據庫和用戶模型，並註冊變更失效監聽"""
+        self.db = db
+        self.user_model = user_model
+        event.listen(user_model, "after_update", self._on_user_update)
+        event.listen(user_model, "after_delete", self._on_user_delete)
+
+    @staticmethod
+    def token_key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get_token_payload(self, token: str) -> Optional[Dict[str, Any]]:
+        return self.tokens.get(self.token_key(token))
+
+    def put_token_payload(self, token: str, payload: Dict[str, Any]):
+        """緩存已驗證的令牌，過期時間取令牌 exp 與最大 TTL 的較小者"""
+        self.tokens.put(self.token_key(token), payload, payload.get("exp"))
+
+    def get_user(self, user_id: int):
+        """取出緩存的用戶並合併到當前會話（配額欄位在首次訪問時從數據庫加載）"""
+        snapshot = self.users.get(user_id)
+        if snapshot is None:
+            return None
+
+        user = self.user_model(**snapshot)
+        make_transient_to_detached(user)
+        return self.db.session.merge(user, load=False)
+
+    def put_user(self, user):
+        """緩存用戶欄位快照（不緩存 ORM 實例本身，避免跨會話共享狀態；不含配額欄位）"""
+        snapshot = {
+            attr.key: getattr(user, attr.key)
+            for attr in inspect(self.user_model).column_attrs
+            if attr.key not in VOLATILE_COLUMNS
+        }
+        self.users.put(user.id, snapshot)
+
+    def invalidate_user(self, user_id: int):
+        self.users.invalidate(user_id)
+
+    def _on_user_update(self, mapper, connection, target):
+        # 快照包含所有欄位（含 last_login、api_calls_used），任何欄位變更都要失效
+        self.invalidate_user(target.id)
+
+    def _on_user_delete(self, mapper, connection, target):
+        self.invalidate_user(target.id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "token_cache": self.tokens.get_stats(),
+            "user_cache": self.users.get_stats()
+        }
+
+
+auth_cache = AuthCache()
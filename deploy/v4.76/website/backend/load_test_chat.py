@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+PowerAuto.ai 聊天端點壓力測試
+對比舊的計量方式（讀-改-寫 + 每請求兩次 commit）與 UsageMeter
+（原子配額扣減 + 用量批量寫入）的吞吐量 (requests/sec)
+
+用法:
+    python load_test_chat.py --requests 2000 --concurrency 8
+    python load_test_chat.py --database-url postgresql://...   # 指定數據庫
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="聊天端點壓力測試")
+    parser.add_argument("--requests", type=int, default=2000, help="每種模式的請求總數")
+    parser.add_argument("--concurrency", type=int, default=8, help="並發線程數")
+    parser.add_argument("--database-url", type=str, default=None, help="數據庫 URL（默認臨時 SQLite）")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# 必須在導入 app 前設定數據庫
+if args.database_url:
+    os.environ["DATABASE_URL"] = args.database_url
+else:
+    db_file = os.path.join(tempfile.mkdtemp(prefix="powerauto-load-"), "load_test.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import jwt
+from flask import jsonify, request
+
+from app import app, db, bcrypt, User, APIUsage, token_required, create_tables
+from usage_metering import usage_meter
+
+
+@token_required
+def legacy_chat(current_user):
+    """舊版計量邏輯（用於對比）"""
+    data = request.get_json()
+
+    if current_user.api_calls_used >= current_user.api_calls_limit:
+        return jsonify({'message': 'API調用次數已達上限，請升級訂閱'}), 429
+
+    start_time = time.time()
+    response = f"K2模型回應：{data['message']}"
+    response_time = int((time.time() - start_time) * 1000)
+
+    current_user.api_calls_used += 1
+    db.session.commit()
+
+    usage = APIUsage(
+        user_id=current_user.id,
+        model_used='k2',
+        endpoint='/api/claude-k2/chat',
+        cost=0.001,
+        response_time=response_time
+    )
+    db.session.add(usage)
+    db.session.commit()
+
+    return jsonify({
+        'response': response,
+        'api_calls_remaining': current_user.api_calls_limit - current_user.api_calls_used
+    })
+
+
+app.add_url_rule('/api/claude-k2/chat-legacy', 'legacy_chat', legacy_chat, methods=['POST'])
+
+
+def create_load_user(username: str) -> str:
+    """創建壓測用戶並返回 JWT"""
+    with app.app_context():
+        user = User(
+            username=username,
+            email=f"{username}@powerauto.ai",
+            password_hash=bcrypt.generate_password_hash('load-test').decode('utf-8'),
+            api_calls_limit=10 ** 9
+        )
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    return jwt.encode({'user_id': user_id}, app.config['SECRET_KEY'], algorithm='HS256')
+
+
+def run_load(endpoint: str, token: str, total: int, concurrency: int) -> dict:
+    """多線程發送請求，返回吞吐量統計"""
+    counter = {"next": 0, "ok": 0, "errors": 0}
+    lock = threading.Lock()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if counter["next"] >= total:
+                    return
+                counter["next"] += 1
+
+            response = client.post(endpoint, json={'message': 'hello', 'model': 'k2'}, headers=headers)
+            with lock:
+                counter["ok" if response.status_code == 200 else "errors"] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start_time
+
+    return {
+        "requests": total,
+        "ok": counter["ok"],
+        "errors": counter["errors"],
+        "elapsed": elapsed,
+        "rps": total / elapsed if elapsed else 0.0
+    }
+
+
+def main():
+    with app.app_context():
+        create_tables()
+
+    print("🚀 聊天端點壓力測試")
+    print(f"   數據庫: {os.environ['DATABASE_URL']}")
+    print(f"   請求數: {args.requests}  並發: {args.concurrency}")
+
+    results = {}
+    for name, endpoint in [("before (legacy)", "/api/claude-k2/chat-legacy"),
+                           ("after (UsageMeter)", "/api/claude-k2/chat")]:
+        token = create_load_user(f"load_{name.split()[0]}_{int(time.time())}")
+        results[name] = run_load(endpoint, token, args.requests, args.concurrency)
+
+    usage_meter.flush()
+
+    print("\n📊 結果:")
+    for name, result in results.items():
+        print(f"   {name:<20} {result['rps']:>8.1f} req/s  "
+              f"({result['ok']} ok, {result['errors']} errors, {result['elapsed']:.2f}s)")
+
+    before = results["before (legacy)"]["rps"]
+    after = results["after (UsageMeter)"]["rps"]
+    if before:
+        print(f"\n⚡ 吞吐量提升: {after / before:.2f}x")
+    print(f"   計量統計: {usage_meter.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
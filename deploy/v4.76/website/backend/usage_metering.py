@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+PowerAuto.ai API 用量計量系統
+- 配額扣減：單條原子 SQL（UPDATE ... SET x = x + 1 WHERE x < limit RETURNING），
+  一次往返完成檢查與計數，並發下不會超額
+- 用量記錄：APIUsage 行先寫入內存緩衝，由後台線程按批量或時間間隔批量插入；
+  寫入失敗的批次在之後的週期重試，超過重試上限後寫入死信文件（未配置時記錄到日誌）並丟棄
+- 用量匯總：批量插入時在同一事務中增量更新按小時/按天的匯總表，
+  管理後台和計費統計只讀匯總表，不再全表掃描 APIUsage
+"""
+
+import atexit
+import json
+import logging
+import threading
+from collections import deque, defaultdict
+from datetime import datetime
+from typing import Callable, Dict, Any, Optional, Tuple, List
+
+from sqlalchemy import update, insert
+
+logger = logging.getLogger(__name__)
+
+
+class UsageMeter:
+    """API 用量計量器"""
+
+    def __init__(self, app=None, db=None, user_model=None, usage_model=None,
+                 hourly_model=None, daily_model=None,
+                 flush_interval: float = 1.0, batch_size: int = 500,
+                 max_flush_attempts: int = 5, dead_letter_path: Optional[str] = None):
+        self.db = db
+        self.user_model = user_model
+        self.usage_model = usage_model
+        self.hourly_model = hourly_model
+        self.daily_model = daily_model
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_flush_attempts = max_flush_attempts
+        self.dead_letter_path = dead_letter_path
+
+        self.buffer = deque()
+        # 寫入失敗待重試的批次：(行, 已失敗次數)
+        self.retry_batches = deque()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flush_thread = None
+        self.running = False
+        self.app = None
+        self.consume_listeners = []
+
+        self.stats = {
+            "quota_checks": 0,
+            "quota_rejections": 0,
+            "usage_recorded": 0,
+            "usage_flushed": 0,
+            "flush_batches": 0,
+            "flush_errors": 0,
+            "usage_dead_lettered": 0
+        }
+
+        if app is not None:
+            self.init_app(app, db, user_model, usage_model, hourly_model, daily_model)
+
+    def init_app(self, app, db, user_model, usage_model, hourly_model=None, daily_model=None):
+        """綁定 Flask 應用並啟動後台批量寫入線程"""
+        self.app = app
+        self.db = db
+        self.user_model = user_model
+        self.usage_model = usage_model
+        self.hourly_model = hourly_model
+        self.daily_model = daily_model
+
+        self.running = True
+        self.flush_thread = threading.Thread(target=self._flush_loop, name="usage-meter-flush", daemon=True)
+        self.flush_thread.start()
+        atexit.register(self.shutdown)
+
+    def add_consume_listener(self, listener: Callable[[int], None]):
+        """註冊配額扣減成功後的回調（參數為 user_id）
+
+        扣減用的是 Core UPDATE，不經過 ORM，不會觸發 after_update 事件；
+        緩存了 api_calls_used 的組件（如認證緩存）需通過這裡失效
+        """
+        self.consume_listeners.append(listener)
+
+    def _supports_returning(self) -> bool:
+        dialect = self.db.engine.dialect
+        return bool(getattr(dialect, "update_returning", getattr(dialect, "implicit_returning", False)))
+
+    def try_consume(self, user_id: int, amount: int = 1) -> Optional[Tuple[int, int]]:
+        """原子扣減配額
+
+        成功返回 (已用次數, 上限)；已達上限返回 None
+        """
+        self.stats["quota_checks"] += 1
+        User = self.user_model
+
+        statement = (
+            update(User)
+            .where(User.id == user_id, User.api_calls_used + amount <= User.api_calls_limit)
+            .values(api_calls_used=User.api_calls_used + amount)
+            .execution_options(synchronize_session=False)
+        )
+
+        if self._supports_returning():
+            row = self.db.session.execute(
+                statement.returning(User.api_calls_used, User.api_calls_limit)
+            ).first()
+            self.db.session.commit()
+            consumed = tuple(row) if row else None
+        else:
+            # 不支持 RETURNING 的數據庫：條件 UPDATE 保證原子性，再讀取結果
+            result = self.db.session.execute(statement)
+            consumed = None
+            if result.rowcount:
+                consumed = tuple(self.db.session.query(
+                    User.api_calls_used, User.api_calls_limit
+                ).filter(User.id == user_id).one())
+            self.db.session.commit()
+
+        if consumed is None:
+            self.stats["quota_rejections"] += 1
+        else:
+            for listener in self.consume_listeners:
+                listener(user_id)
+        return consumed
+
+    def record_usage(self, user_id: int, model_used: str, endpoint: str,
+                     cost: float, response_time: int):
+        """記錄一次 API 調用（緩衝，異步批量寫入）"""
+        self.buffer.append({
+            "user_id": user_id,
+            "model_used": model_used,
+            "endpoint": endpoint,
+            "cost": cost,
+            "response_time": response_time,
+            "timestamp": datetime.utcnow()
+        })
+        self.stats["usage_recorded"] += 1
+
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    def _flush_loop(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """將緩衝中的用量記錄批量插入數據庫，返回寫入行數"""
+        with self.flush_lock:
+            rows = []
+            while self.buffer:
+                rows.append(self.buffer.popleft())
+
+            # 先重試之前失敗的批次（各自獨立事務，一個壞批次不會拖累新記錄）
+            batches = list(self.retry_batches)
+            self.retry_batches.clear()
+            if rows:
+                batches.append((rows, 0))
+
+            return sum(self._write_batch(batch, attempts) for batch, attempts in batches)
+
+    def _write_batch(self, rows: List[Dict[str, Any]], attempts: int) -> int:
+        try:
+            with self.app.app_context():
+                self.db.session.bulk_insert_mappings(self.usage_model, rows)
+                self._apply_rollups(rows)
+                self.db.session.commit()
+
+            self.stats["usage_flushed"] += len(rows)
+            self.stats["flush_batches"] += 1
+            return len(rows)
+
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            attempts += 1
+            if attempts >= self.max_flush_attempts:
+                self._dead_letter(rows, e)
+            else:
+                # 下個週期重試
+                self.retry_batches.append((rows, attempts))
+                logger.error(f"用量記錄批量寫入失敗（第 {attempts} 次）: {e}")
+            return 0
+
+    def _dead_letter(self, rows: List[Dict[str, Any]], error: Exception):
+        """超過重試上限的記錄寫入死信文件（JSONL），未配置文件或寫入失敗時整批記錄到日誌"""
+        self.stats["usage_dead_lettered"] += len(rows)
+        lines = [json.dumps({**row, "error": str(error)}, default=str, ensure_ascii=False) for row in rows]
+
+        if self.dead_letter_path:
+            try:
+                with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                logger.error(f"用量記錄重試 {self.max_flush_attempts} 次仍失敗，{len(rows)} 行已寫入死信文件 "
+                             f"{self.dead_letter_path}: {error}")
+                return
+            except OSError as e:
+                logger.error(f"寫入死信文件失敗: {e}")
+
+        logger.error(f"用量記錄重試 {self.max_flush_attempts} 次仍失敗，丟棄 {len(rows)} 行: {error}\n"
+                     + "\n".join(lines))
+
+    def _aggregate(self, rows: List[Dict[str, Any]], granularity: str,
+                   buckets: Optional[Dict] = None) -> Dict[tuple, Dict[str, float]]:
+        """按 (時間桶, 用戶) 匯總用量"""
+        if buckets is None:
+            buckets = defaultdict(lambda: {"calls": 0, "cost": 0.0, "response_time_total": 0})
+
+        for row in rows:
+            timestamp = row["timestamp"]
+            if granularity == "hour":
+                bucket = timestamp.replace(minute=0, second=0, microsecond=0)
+            else:
+                bucket = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+            totals = buckets[(bucket, row["user_id"])]
+            totals["calls"] += 1
+            totals["cost"] += row["cost"] or 0.0
+            totals["response_time_total"] += row["response_time"] or 0
+
+        return buckets
+
+    def _apply_rollups(self, rows: List[Dict[str, Any]]):
+        """增量更新小時/天匯總表（與用量插入在同一事務中）"""
+        for model, granularity in ((self.hourly_model, "hour"), (self.daily_model, "day")):
+            if model is None:
+                continue
+
+            for (bucket, user_id), totals in self._aggregate(rows, granularity).items():
+                self._upsert_rollup(model, bucket, user_id, totals)
+
+    def _upsert_rollup(self, model, bucket: datetime, user_id: int, totals: Dict[str, float]):
+        """累加一個匯總桶；支持 ON CONFLICT 的數據庫使用原子 upsert"""
+        dialect = self.db.engine.dialect.name
+        values = {"bucket_start": bucket, "user_id": user_id, **totals}
+        increments = {
+            "calls": model.calls + totals["calls"],
+            "cost": model.cost + totals["cost"],
+            "response_time_total": model.response_time_total + totals["response_time_total"]
+        }
+
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+
+            statement = dialect_insert(model).values(**values).on_conflict_do_update(
+                index_elements=["bucket_start", "user_id"], set_=increments
+            )
+            self.db.session.execute(statement)
+            return
+
+        # 其他數據庫：先累加，不存在時再插入
+        result = self.db.session.execute(
+            update(model)
+            .where(model.bucket_start == bucket, model.user_id == user_id)
+            .values(**increments)
+            .execution_options(synchronize_session=False)
+        )
+        if not result.rowcount:
+            self.db.session.execute(insert(model).values(**values))
+
+    def rebuild_rollups(self, chunk_size: int = 10000) -> int:
+        """從 APIUsage 全量重建匯總表（首次部署或修復時使用），返回處理行數"""
+        with self.flush_lock:
+            hourly = defaultdict(lambda: {"calls": 0, "cost": 0.0, "response_time_total": 0})
+            daily = defaultdict(lambda: {"calls": 0, "cost": 0.0, "response_time_total": 0})
+            processed = 0
+
+            # 流式讀取，只在內存中保留匯總桶
+            query = self.db.session.query(
+                self.usage_model.user_id, self.usage_model.cost,
+                self.usage_model.response_time, self.usage_model.timestamp
+            ).yield_per(chunk_size)
+
+            for user_id, cost, response_time, timestamp in query:
+                row = {"user_id": user_id, "cost": cost, "response_time": response_time, "timestamp": timestamp}
+                self._aggregate([row], "hour", hourly)
+                self._aggregate([row], "day", daily)
+                processed += 1
+
+            for model, buckets in ((self.hourly_model, hourly), (self.daily_model, daily)):
+                if model is None:
+                    continue
+                self.db.session.query(model).delete(synchronize_session=False)
+                for (bucket, user_id), totals in buckets.items():
+                    self._upsert_rollup(model, bucket, user_id, totals)
+
+            self.db.session.commit()
+            return processed
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "buffered": len(self.buffer),
+            "pending_retry": sum(len(rows) for rows, _ in self.retry_batches)
+        }
+
+    def shutdown(self):
+        """停止後台線程並寫入剩餘記錄"""
+        if not self.running:
+            return
+
+        self.running = False
+        self.wakeup.set()
+        if self.flush_thread and self.flush_thread.is_alive():
+            self.flush_thread.join(timeout=5)
+        self.flush()
+
+        # 退出前仍未寫入的重試批次不再等待下個週期
+        with self.flush_lock:
+            while self.retry_batches:
+                rows, _ = self.retry_batches.popleft()
+                self._dead_letter(rows, RuntimeError("進程退出時仍未寫入"))
+
+
+usage_meter = UsageMeter()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+可斷點續傳的並發下載引擎
+- 共用 aiohttp 連接池（總連接數和每主機連接數有上限，連接可重用）
+- 固定數量的工作協程持續從隊列取 URL，不再按批次等待最慢的請求
+- 並發上限根據觀測到的延遲和錯誤率自適應調整（加性增、乘性減）
+- 失敗按指數退避重試（遵守 Retry-After），完成 / 失敗 / 待重試狀態追加寫入檢查點，崩潰後從斷點繼續
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Dict, Any, Iterable, Optional, Callable, Awaitable, List
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """可重試的下載錯誤（網絡錯誤、超時、限流、5xx）"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DownloadCheckpoint:
+    """追加寫入的下載檢查點（JSONL 日誌，每個 URL 以最後一條記錄為準）"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        torn = False
+
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    torn = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩潰時寫了一半的最後一行
+                        continue
+                    self.entries[entry["url"]] = entry
+            logger.info(f"📂 載入下載檢查點: {len(self.completed())} 完成, "
+                        f"{len(self.failed())} 失敗, {len(self.retry_after())} 待重試")
+
+        self._file = open(self.path, "a", encoding="utf-8")
+        if torn:
+            # 新記錄不能接在半行後面，否則下次載入時一起被丟棄
+            self._file.write("\n")
+
+    def record(self, url: str, status: str, attempts: int = 0,
+               retry_at: Optional[float] = None, error: Optional[str] = None):
+        entry = {"url": url, "status": status, "attempts": attempts,
+                 "retry_at": retry_at, "error": error, "updated_at": time.time()}
+        self.entries[url] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def _with_status(self, status: str) -> Dict[str, Dict[str, Any]]:
+        return {url: entry for url, entry in self.entries.items() if entry["status"] == status}
+
+    def completed(self) -> Dict[str, Dict[str, Any]]:
+        return self._with_status("completed")
+
+    def failed(self) -> Dict[str, Dict[str, Any]]:
+        return self._with_status("failed")
+
+    def retry_after(self) -> Dict[str, Dict[str, Any]]:
+        return self._with_status("retry")
+
+    def attempts(self, url: str) -> int:
+        entry = self.entries.get(url)
+        return entry["attempts"] if entry else 0
+
+    def compact(self):
+        """每個 URL 只保留最新狀態，重寫日誌"""
+        self._file.close()
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self._file is None:
+            return
+        self.compact()
+        self._file.close()
+        self._file = None
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD 並發限制器：每個觀測窗口結束時調整並發上限
+
+    窗口大小為 max(window, 2 × 當前上限) 個請求。窗口內錯誤率超過閾值，或延遲中位數超過基準延遲的
+    latency_tolerance 倍時，上限乘以 decrease_factor；否則上限加一。
+    基準延遲取歷史窗口的最小中位數（不受長尾影響），並緩慢上浮以適應服務端的長期變化
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32,
+                 window: int = 20, error_threshold: float = 0.2,
+                 latency_tolerance: float = 2.0, decrease_factor: float = 0.75):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.error_threshold = error_threshold
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None
+        self.history: List[Dict[str, Any]] = []
+        self._latencies: List[float] = []
+        self._errors = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, latency: float, error: bool):
+        async with self._condition:
+            self.in_flight -= 1
+            if error:
+                self._errors += 1
+            else:
+                self._latencies.append(latency)
+
+            if self._errors + len(self._latencies) >= max(self.window, 2 * self.limit):
+                self._adjust()
+            self._condition.notify_all()
+
+    def _adjust(self):
+        samples = self._errors + len(self._latencies)
+        error_rate = self._errors / samples
+        median_latency = sorted(self._latencies)[len(self._latencies) // 2] if self._latencies else None
+
+        if median_latency is not None:
+            if self.baseline_latency is None:
+                self.baseline_latency = median_latency
+            else:
+                self.baseline_latency = min(median_latency, self.baseline_latency * 1.05)
+
+        overloaded = error_rate > self.error_threshold or (
+            median_latency is not None and median_latency > self.baseline_latency * self.latency_tolerance
+        )
+        if overloaded:
+            self.limit = max(self.minimum, int(self.limit * self.decrease_factor))
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        self.history.append({
+            "time": time.time(),
+            "limit": self.limit,
+            "error_rate": error_rate,
+            "median_latency": median_latency
+        })
+        self._latencies = []
+        self._errors = 0
+
+
+class DownloadEngine:
+    """可斷點續傳的並發下載引擎"""
+
+    def __init__(self, checkpoint_path: Path,
+                 max_concurrency: int = 32, min_concurrency: int = 1, initial_concurrency: int = 4,
+                 limit_per_host: int = 16, max_retries: int = 4,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 timeout: float = 30.0, headers: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            checkpoint_path: 檢查點文件路徑（JSONL）
+            max_concurrency / min_concurrency / initial_concurrency: 自適應並發的上下限和初始值
+            limit_per_host: 每個主機的連接數上限
+            max_retries: 可重試錯誤的最大重試次數，超過後記為失敗
+            backoff_base / backoff_max: 指數退避的基數和上限（秒），實際延遲帶 ±50% 抖動
+            timeout: 單個請求的總超時（秒）
+        """
+        self.checkpoint = DownloadCheckpoint(checkpoint_path)
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.headers = headers or {}
+
+        self.limiter = AdaptiveConcurrencyLimiter(
+            initial=initial_concurrency, minimum=min_concurrency, maximum=max_concurrency
+        )
+        self.stats = {"completed": 0, "failed": 0, "retries": 0, "skipped": 0, "bytes": 0}
+
+    def _backoff_delay(self, attempts: int, retry_after: Optional[float]) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1)))
+        delay *= random.uniform(0.5, 1.5)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str) -> str:
+        try:
+            async with session.get(url) as response:
+                if response.status in RETRYABLE_STATUS:
+                    raise RetryableError(f"HTTP {response.status}",
+                                         self._parse_retry_after(response.headers.get("Retry-After")))
+                response.raise_for_status()
+                return await response.text()
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            raise RetryableError(f"{type(e).__name__}: {e}")
+
+    async def download_all(self, urls: Iterable[str],
+                           on_success: Callable[[str, str], Awaitable[None]],
+                           retry_failed: bool = False) -> Dict[str, Any]:
+        """下載所有 URL，每個成功的響應交給 on_success(url, body) 處理
+
+        已完成的 URL 直接跳過；之前記為失敗的 URL 只在 retry_failed=True 時重新嘗試；
+        待重試的 URL 在其 retry_at 時間到達後繼續重試
+        """
+        loop = asyncio.get_running_loop()
+        completed = self.checkpoint.completed()
+        failed = self.checkpoint.failed()
+        retry_after = self.checkpoint.retry_after()
+
+        pending = []
+        for url in dict.fromkeys(urls):
+            if url in completed or (url in failed and not retry_failed):
+                self.stats["skipped"] += 1
+            else:
+                pending.append(url)
+
+        if not pending:
+            logger.info("沒有需要下載的URL")
+            return self.get_stats()
+
+        logger.info(f"📥 開始下載 {len(pending)} 個URL（跳過 {self.stats['skipped']} 個）")
+
+        # 之前失敗的 URL 重新嘗試時從零計數
+        attempts_by_url = {url: 0 if url in failed else self.checkpoint.attempts(url) for url in pending}
+        queue: asyncio.Queue = asyncio.Queue()
+        remaining = len(pending)
+        finished = asyncio.Event()
+        timers = []
+
+        def schedule(url: str, delay: float):
+            if delay <= 0:
+                queue.put_nowait(url)
+            else:
+                timers.append(loop.call_later(delay, queue.put_nowait, url))
+
+        def settle():
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0:
+                finished.set()
+
+        for url in pending:
+            entry = retry_after.get(url)
+            schedule(url, entry["retry_at"] - time.time() if entry and entry.get("retry_at") else 0)
+
+        async def worker(session: aiohttp.ClientSession):
+            while True:
+                url = await queue.get()
+                attempts = attempts_by_url[url]
+
+                await self.limiter.acquire()
+                start = time.perf_counter()
+                error = None
+                try:
+                    body = await self._fetch(session, url)
+                except RetryableError as e:
+                    error = e
+                except Exception as e:
+                    await self.limiter.release(time.perf_counter() - start, error=True)
+                    self.checkpoint.record(url, "failed", attempts + 1, error=str(e))
+                    self.stats["failed"] += 1
+                    logger.error(f"下載失敗 {url}: {e}")
+                    settle()
+                    continue
+                await self.limiter.release(time.perf_counter() - start, error=error is not None)
+
+                if error is not None:
+                    attempts += 1
+                    attempts_by_url[url] = attempts
+                    if attempts > self.max_retries:
+                        self.checkpoint.record(url, "failed", attempts, error=str(error))
+                        self.stats["failed"] += 1
+                        logger.error(f"下載失敗（已重試 {self.max_retries} 次）{url}: {error}")
+                        settle()
+                    else:
+                        delay = self._backoff_delay(attempts, error.retry_after)
+                        self.checkpoint.record(url, "retry", attempts, retry_at=time.time() + delay, error=str(error))
+                        self.stats["retries"] += 1
+                        schedule(url, delay)
+                    continue
+
+                try:
+                    await on_success(url, body)
+                    self.checkpoint.record(url, "completed", attempts + 1)
+                    self.stats["completed"] += 1
+                    self.stats["bytes"] += len(body)
+                except Exception as e:
+                    self.checkpoint.record(url, "failed", attempts + 1, error=f"處理失敗: {e}")
+                    self.stats["failed"] += 1
+                    logger.error(f"處理下載結果失敗 {url}: {e}")
+                settle()
+
+        start_time = time.time()
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.limit_per_host,
+                                         ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+            workers = [asyncio.create_task(worker(session)) for _ in range(self.max_concurrency)]
+            try:
+                await finished.wait()
+            finally:
+                for timer in timers:
+                    timer.cancel()
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                self.checkpoint.compact()
+
+        self.stats["elapsed"] = time.time() - start_time
+        logger.info(f"✅ 下載完成: {self.stats['completed']} 成功, {self.stats['failed']} 失敗, "
+                    f"{self.stats['retries']} 次重試, 最終並發上限 {self.limiter.limit}")
+        return self.get_stats()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "concurrency_limit": self.limiter.limit,
+            "concurrency_adjustments": len(self.limiter.history)
+        }
+
+    def close(self):
+        self.checkpoint.close()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+下載引擎基準測試（本地 HTTP 夾具服務器）
+夾具服務器模擬長尾延遲、隨機 503（帶 Retry-After）以及超過容量後的排隊延遲，
+對比固定批次下載與 DownloadEngine 的吞吐量，並驗證中斷後從檢查點續傳
+
+用法:
+    python download_engine_benchmark.py --urls 300 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from download_engine import DownloadEngine
+
+
+class FixtureServer:
+    """可注入延遲和錯誤的本地 HTTP 服務器"""
+
+    def __init__(self, base_latency: float, tail_latency: float, tail_ratio: float,
+                 error_rate: float, capacity: int, seed: int = 0):
+        self.base_latency = base_latency
+        self.tail_latency = tail_latency
+        self.tail_ratio = tail_ratio
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.rng = random.Random(seed)
+        self.in_flight = 0
+        self.hits = {}
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        replay_id = request.match_info["replay_id"]
+        self.hits[replay_id] = self.hits.get(replay_id, 0) + 1
+        self.in_flight += 1
+        try:
+            latency = self.tail_latency if self.rng.random() < self.tail_ratio else self.base_latency
+            # 超過容量時每個額外的並發請求都增加排隊延遲
+            latency *= 1 + max(0, self.in_flight - self.capacity) * 0.5
+            await asyncio.sleep(latency)
+
+            if self.rng.random() < self.error_rate:
+                return web.Response(status=503, headers={"Retry-After": "0.05"})
+            return web.Response(text=f"<html><body>replay {replay_id}</body></html>", content_type="text/html")
+        finally:
+            self.in_flight -= 1
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/share/{replay_id}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def fixed_batches(urls, batch_size: int, max_retries: int) -> int:
+    """原有方式：固定批次，每批等待最慢的請求後才開始下一批"""
+    succeeded = 0
+    async with aiohttp.ClientSession() as session:
+        async def fetch(url):
+            for _ in range(max_retries + 1):
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        await response.text()
+                        return True
+            return False
+
+        for i in range(0, len(urls), batch_size):
+            results = await asyncio.gather(*(fetch(url) for url in urls[i:i + batch_size]))
+            succeeded += sum(results)
+    return succeeded
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="下載引擎基準測試")
+    parser.add_argument("--urls", type=int, default=300, help="URL 數量")
+    parser.add_argument("--base-latency", type=float, default=0.02, help="正常響應延遲（秒）")
+    parser.add_argument("--tail-latency", type=float, default=0.3, help="長尾響應延遲（秒）")
+    parser.add_argument("--tail-ratio", type=float, default=0.05, help="長尾響應比例")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="503 響應比例")
+    parser.add_argument("--capacity", type=int, default=24, help="服務器開始排隊的並發數")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = FixtureServer(args.base_latency, args.tail_latency, args.tail_ratio, args.error_rate, args.capacity)
+    base_url = await server.start()
+    urls = [f"{base_url}/share/{i:022d}?replay=1" for i in range(args.urls)]
+
+    print(f"🚀 下載引擎基準測試: {len(urls)} 個URL, 夾具服務器 {base_url}")
+
+    try:
+        start = time.perf_counter()
+        succeeded = await fixed_batches(urls, batch_size=5, max_retries=4)
+        baseline = time.perf_counter() - start
+        print(f"\n📊 固定批次 (5/批)       {baseline:>7.2f}s  成功 {succeeded}/{len(urls)}  {len(urls) / baseline:>7.1f} URL/s")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            checkpoint = Path(temp_dir) / "checkpoint.jsonl"
+
+            async def on_success(url, body):
+                pass
+
+            engine = DownloadEngine(checkpoint, max_concurrency=64, backoff_base=0.05, backoff_max=1.0)
+            start = time.perf_counter()
+            stats = await engine.download_all(urls, on_success)
+            elapsed = time.perf_counter() - start
+            engine.close()
+            print(f"📊 DownloadEngine         {elapsed:>7.2f}s  成功 {stats['completed']}/{len(urls)}  "
+                  f"{len(urls) / elapsed:>7.1f} URL/s  加速 {baseline / elapsed:.2f}x")
+            print(f"   重試 {stats['retries']} 次, 最終並發上限 {stats['concurrency_limit']}, "
+                  f"調整 {stats['concurrency_adjustments']} 次")
+
+            # 續傳：下載到一半時中斷，重新運行只請求剩餘的 URL
+            checkpoint.unlink()
+            server.hits.clear()
+            interrupted = DownloadEngine(checkpoint, max_concurrency=64, backoff_base=0.05, backoff_max=1.0)
+            task = asyncio.create_task(interrupted.download_all(urls, on_success))
+            while interrupted.stats["completed"] < len(urls) // 2:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            interrupted_at = interrupted.stats["completed"]
+
+            engine = DownloadEngine(checkpoint, max_concurrency=64, backoff_base=0.05, backoff_max=1.0)
+            stats = await engine.download_all(urls, on_success)
+            engine.close()
+            total_completed = len(engine.checkpoint.completed())
+            # 中斷時仍在途的請求會在續傳時重新發出
+            extra_requests = sum(server.hits.values()) - len(urls) - interrupted.stats["retries"] - stats["retries"]
+            print(f"\n📊 斷點續傳: 中斷時已完成 {interrupted_at}, 續傳跳過 {stats['skipped']}, "
+                  f"續傳完成 {stats['completed']}, 總完成 {total_completed}/{len(urls)}")
+            print(f"   重複請求（中斷時在途，不含重試）: {extra_requests}")
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
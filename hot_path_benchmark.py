@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+記憶 / RAG / 路由熱路徑基準測試
+- 固定種子生成可配置規模的合成語料（中英混合的開發對話、記憶、文檔）
+- 覆蓋 MemoryEngine.store_memory / search_memories / rag_query、ContextManager.get_context_recommendations、
+  K2Router._make_routing_decision、AdvancedCompressionOptimizer.optimize_compression_pipeline、
+  RAGService.retrieve_documents
+- 結果輸出為 JSON（含提交、環境和結果摘要），可與基線比較，超過回歸閾值時返回非零退出碼
+
+用法:
+    python hot_path_benchmark.py --size 2000 --output bench.json
+    python hot_path_benchmark.py --size 2000 --baseline bench.json --threshold 0.15
+    python hot_path_benchmark.py --cases memory.search_memories,k2_router.routing_decision
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT / "core" / "components" / "memoryos_mcp"))
+sys.path.insert(0, str(ROOT / "core" / "components" / "aws_bedrock_mcp"))
+
+import context_manager
+from memory_engine import Memory, MemoryEngine, MemoryType
+from context_manager import ContextManager, ContextType
+from advanced_compression_optimizer import AdvancedCompressionOptimizer
+from k2_router import K2Request, K2Router
+from rag_service import RAGService
+
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+# 固定時間基準，保證記憶的時間戳與排序在各次運行之間一致
+BASE_TIME = 1_700_000_000.0
+EMBEDDING_DIMENSION = 384
+
+# 低於此延遲的用例單次運行噪聲大，至少重複 FAST_CASE_MIN_REPEAT 次
+FAST_CASE_US = 100.0
+FAST_CASE_MIN_REPEAT = 10
+
+TOPICS = ["python", "react", "docker", "sqlite", "asyncio", "kubernetes", "memory", "rag", "router", "cache",
+          "數據庫", "部署", "測試", "重構", "性能", "組件", "接口", "緩存", "日誌", "認證"]
+VERBS = ["實現", "修復", "優化", "解釋", "審查", "生成", "調試", "部署", "write", "fix", "explain", "optimize",
+         "review", "generate", "debug", "implement"]
+OBJECTS = ["函數", "類", "模塊", "API", "查詢", "配置", "測試用例", "錯誤處理", "function", "class", "module",
+           "endpoint", "query", "config", "migration", "pipeline"]
+PHRASES = ["請幫我", "這段代碼", "為什麼會報錯", "有沒有更好的方法", "how does this work", "what does", "code review",
+           "not working", "生成代碼", "代碼示例", "項目分析", "文檔說明", "exception traceback", "寫一個"]
+CODE_LINES = ["def handle(request):", "    return process(request.data)", "class Service:", "    pass",
+              "import asyncio", "async def main():", "    await asyncio.sleep(0)", "for item in items:",
+              "    results.append(item)", "if __name__ == '__main__':", "    main()"]
+
+
+def make_sentence(rng: random.Random) -> str:
+    return (f"{rng.choice(PHRASES)} {rng.choice(VERBS)} {rng.choice(TOPICS)} {rng.choice(OBJECTS)} "
+            f"{rng.choice(TOPICS)} {rng.choice(OBJECTS)}")
+
+
+def make_document(rng: random.Random, sentences: int) -> str:
+    """段落 + 代碼塊混合的文檔（含重複片段，供壓縮器使用）"""
+    parts = []
+    for _ in range(sentences):
+        if rng.random() < 0.2:
+            parts.append("```python\n" + "\n".join(rng.sample(CODE_LINES, 4)) + "\n```")
+        else:
+            parts.append(make_sentence(rng) + "。")
+    return "\n".join(parts)
+
+
+def build_corpus(size: int, queries: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    memory_types = list(MemoryType)
+    memories = []
+    for i in range(size):
+        created_at = BASE_TIME + i
+        memories.append(Memory(
+            id=f"mem_{i:06d}",
+            memory_type=memory_types[i % len(memory_types)],
+            content=make_document(rng, rng.randint(1, 6)),
+            metadata={"source": "benchmark", "index": i},
+            created_at=created_at,
+            accessed_at=created_at + rng.random() * 3600,
+            access_count=rng.randint(0, 20),
+            importance_score=round(rng.random(), 4),
+            tags=rng.sample(TOPICS, 3)
+        ))
+
+    return {
+        "memories": memories,
+        "documents": [{"id": f"doc_{i:06d}", "content": make_document(rng, rng.randint(2, 8)),
+                       "metadata": {"index": i}} for i in range(size)],
+        "queries": [rng.choice(TOPICS) if rng.random() < 0.5 else make_sentence(rng) for _ in range(queries)],
+        "long_documents": [make_document(rng, 60) for _ in range(max(1, queries // 20))]
+    }
+
+
+class HashingEmbedder:
+    """確定性的特徵哈希嵌入（代替 SentenceTransformer，不需要下載模型）"""
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dimension
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return vectors
+
+
+class FlatInnerProductIndex:
+    """faiss.IndexFlatIP 的 numpy 實現（未安裝 faiss 時使用）"""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.vectors)
+
+    def add(self, vectors: np.ndarray):
+        self.vectors = np.vstack([self.vectors, vectors.astype(np.float32)])
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = queries @ self.vectors.T
+        indices = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, indices, axis=1), indices
+
+
+class PinnedClock:
+    """代替 context_manager 模塊中的 time：time()/strftime() 使用固定時間，其餘屬性轉發給 time 模塊"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def strftime(self, fmt: str, t=None) -> str:
+        return time.strftime(fmt, time.gmtime(self.now) if t is None else t)
+
+    def __getattr__(self, name: str):
+        return getattr(time, name)
+
+
+def make_vector_index():
+    return faiss.IndexFlatIP(EMBEDDING_DIMENSION) if FAISS_AVAILABLE else FlatInnerProductIndex(EMBEDDING_DIMENSION)
+
+
+# ==================== 測試用例 ====================
+# 每個用例返回 (操作列表, 清理函數)；準備階段不計時，每個操作單獨計時
+
+async def _memory_engine(corpus, args, temp_dir: Path, populate: bool) -> MemoryEngine:
+    engine = MemoryEngine(db_path=str(temp_dir / "memoryos.db"), max_memories=args.size * 2,
+                          enable_rag=args.rag)
+    await engine.initialize()
+    if populate:
+        for memory in corpus["memories"]:
+            await engine.store_memory(memory)
+    return engine
+
+
+async def case_store_memory(corpus, args, temp_dir: Path):
+    engine = await _memory_engine(corpus, args, temp_dir, populate=False)
+    ops = [lambda memory=memory: engine.store_memory(memory) for memory in corpus["memories"]]
+    return ops, engine.cleanup
+
+
+async def case_search_memories(corpus, args, temp_dir: Path):
+    engine = await _memory_engine(corpus, args, temp_dir, populate=True)
+    ops = [lambda query=query: engine.search_memories(query, limit=10) for query in corpus["queries"]]
+    return ops, engine.cleanup
+
+
+async def case_rag_query(corpus, args, temp_dir: Path):
+    engine = await _memory_engine(corpus, args, temp_dir, populate=True)
+    ops = [lambda query=query: engine.rag_query(query, top_k=5) for query in corpus["queries"]]
+    return ops, engine.cleanup
+
+
+async def case_context_recommendations(corpus, args, temp_dir: Path):
+    # 相關性按上下文年齡衰減，固定時鐘才能讓推薦結果在各次運行之間一致
+    clock = context_manager.time = PinnedClock(BASE_TIME)
+    manager = ContextManager()
+    await manager.initialize()
+    context_types = list(ContextType)
+    for i, memory in enumerate(corpus["memories"]):
+        clock.now = BASE_TIME + i
+        await manager.create_context(context_types[i % len(context_types)], memory.content)
+    clock.now = BASE_TIME + len(corpus["memories"])
+    ops = [lambda query=query: manager.get_context_recommendations(query, limit=5) for query in corpus["queries"]]
+
+    async def restore_clock():
+        context_manager.time = time
+
+    return ops, restore_clock
+
+
+async def case_routing_decision(corpus, args, temp_dir: Path):
+    router = K2Router({"api_key": "benchmark"})
+    requests = [K2Request(query=query, context=memory.content)
+                for query, memory in zip(corpus["queries"], corpus["memories"])]
+    ops = [lambda request=request: router._make_routing_decision(request) for request in requests]
+    return ops, None
+
+
+async def case_compression_pipeline(corpus, args, temp_dir: Path):
+    optimizer = AdvancedCompressionOptimizer()
+    ops = [lambda document=document: optimizer.optimize_compression_pipeline(document, "technical_documentation")
+           for document in corpus["long_documents"]]
+    return ops, None
+
+
+async def case_retrieve_documents(corpus, args, temp_dir: Path):
+    service = RAGService()
+    service.embedding_model = HashingEmbedder()
+    service.vector_index = make_vector_index()
+    await service.add_documents(corpus["documents"])
+    ops = [lambda query=query: service.retrieve_documents(query, top_k=5) for query in corpus["queries"]]
+    return ops, None
+
+
+CASES = {
+    "memory.store_memory": case_store_memory,
+    "memory.search_memories": case_search_memories,
+    "memory.rag_query": case_rag_query,
+    "context.get_context_recommendations": case_context_recommendations,
+    "k2_router.routing_decision": case_routing_decision,
+    "compression.optimize_pipeline": case_compression_pipeline,
+    "rag_service.retrieve_documents": case_retrieve_documents,
+}
+
+
+def summarize_result(result: Any) -> Any:
+    """把返回值歸約為可比較的摘要（ID 列表、決策欄位等），用於發現優化改變了結果"""
+    if result is None:
+        return None
+    if isinstance(result, list):
+        return [summarize_result(item) for item in result]
+    if isinstance(result, dict):
+        if "documents" in result:
+            return [doc["id"] for doc in result["documents"]]
+        if "compressed_size" in result:
+            return [result["compressed_size"], result["strategies_applied"]]
+        return result.get("doc_id") or result.get("memory_id") or sorted(result)
+    if hasattr(result, "model_version"):
+        return [result.model_version.value, result.request_type.value, result.use_rag, result.context_strategy]
+    if hasattr(result, "context_type"):
+        # 上下文 ID 含隨機 uuid，用內容代替
+        return hashlib.blake2b(result.content.encode("utf-8"), digest_size=8).hexdigest()
+    return getattr(result, "id", repr(result))
+
+
+async def run_case(name: str, corpus, args) -> Dict[str, Any]:
+    samples: List[float] = []
+    run_means: List[float] = []
+    digest = hashlib.sha256()
+
+    repeat = 0
+    while repeat < args.repeat or (samples and repeat < FAST_CASE_MIN_REPEAT
+                                   and statistics.median(samples) < FAST_CASE_US):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            ops, cleanup = await CASES[name](corpus, args, Path(temp_dir))
+            run_samples = []
+            for op in ops:
+                start = time.perf_counter_ns()
+                result = await op()
+                run_samples.append((time.perf_counter_ns() - start) / 1000)
+                if repeat == 0:
+                    digest.update(json.dumps(summarize_result(result), ensure_ascii=False, default=str).encode("utf-8"))
+            if cleanup is not None:
+                await cleanup()
+
+        samples.extend(run_samples)
+        run_means.append(statistics.fmean(run_samples))
+        repeat += 1
+
+    samples.sort()
+    return {
+        "operations": len(samples) // repeat,
+        "repeats": repeat,
+        "median_us": statistics.median(samples),
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "mean_us": statistics.fmean(samples),
+        "best_run_mean_us": min(run_means),
+        "ops_per_sec": 1e6 / statistics.fmean(samples),
+        "result_digest": digest.hexdigest()[:16]
+    }
+
+
+def environment_info() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "faiss": FAISS_AVAILABLE,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """與基線比較最佳單次運行的平均延遲（比中位數更少受偶發抖動影響），返回回歸的用例名"""
+    if baseline.get("config") != results["config"]:
+        print(f"⚠️ 基線配置不同: {baseline.get('config')} vs {results['config']}")
+
+    regressions = []
+    print(f"\n📊 與基線比較 ({baseline.get('environment', {}).get('commit', '?')}，閾值 +{threshold:.0%})")
+    for name, current in results["cases"].items():
+        previous = baseline.get("cases", {}).get(name)
+        if previous is None:
+            print(f"   {name:<40} 基線中沒有")
+            continue
+
+        # 舊基線沒有 best_run_mean_us 時退回中位數
+        metric = "best_run_mean_us" if "best_run_mean_us" in previous else "median_us"
+        ratio = current[metric] / previous[metric] if previous[metric] else float("inf")
+        status = "✅"
+        if ratio > 1 + threshold:
+            status = "🚨 回歸"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = "🚀 提升"
+        digest_note = "" if current["result_digest"] == previous["result_digest"] else "  ⚠️ 結果摘要變化"
+        print(f"   {name:<40} {previous[metric]:>10.1f} → {current[metric]:>10.1f} µs  "
+              f"{ratio:>6.2f}x {status}{digest_note}")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="記憶 / RAG / 路由熱路徑基準測試")
+    parser.add_argument("--size", type=int, default=2000, help="語料規模（記憶、上下文、文檔數量）")
+    parser.add_argument("--queries", type=int, default=200, help="查詢數量")
+    parser.add_argument("--seed", type=int, default=0, help="隨機種子")
+    parser.add_argument("--repeat", type=int, default=3, help=f"每個用例重複運行次數（中位數低於 {FAST_CASE_US:.0f}µs 的用例至少 {FAST_CASE_MIN_REPEAT} 次）")
+    parser.add_argument("--cases", type=str, default="", help="逗號分隔的用例名（默認全部）")
+    parser.add_argument("--rag", action="store_true", help="MemoryEngine 啟用 RAG（需要 sentence-transformers 和 faiss）")
+    parser.add_argument("--output", type=str, default="", help="結果 JSON 輸出路徑")
+    parser.add_argument("--baseline", type=str, default="", help="基線結果 JSON 路徑")
+    parser.add_argument("--threshold", type=float, default=0.10, help="最佳單次運行平均延遲的回歸閾值（比例）")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    selected = [name.strip() for name in args.cases.split(",") if name.strip()] or list(CASES)
+    unknown = [name for name in selected if name not in CASES]
+    if unknown:
+        parser.error(f"未知用例: {unknown}，可選: {list(CASES)}")
+
+    corpus = build_corpus(args.size, args.queries, args.seed)
+    results = {
+        "config": {"size": args.size, "queries": args.queries, "seed": args.seed, "repeat": args.repeat,
+                   "rag": args.rag},
+        "environment": environment_info(),
+        "cases": {}
+    }
+
+    print(f"🚀 熱路徑基準測試: 語料 {args.size}, 查詢 {args.queries}, 種子 {args.seed}, 重複 {args.repeat} 次")
+    print(f"\n   {'用例':<40} {'中位數':>10} {'p95':>10} {'ops/s':>10}")
+    for name in selected:
+        case_result = await run_case(name, corpus, args)
+        results["cases"][name] = case_result
+        print(f"   {name:<40} {case_result['median_us']:>8.1f}µs {case_result['p95_us']:>8.1f}µs "
+              f"{case_result['ops_per_sec']:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 結果已保存: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n🚨 {len(regressions)} 個用例回歸: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ 沒有超過閾值的回歸")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
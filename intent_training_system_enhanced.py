@@ -6,24 +6,108 @@
 
 import json
 import logging
+import zlib
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 import numpy as np
+from scipy import sparse
 from collections import defaultdict
 import random
 from datetime import datetime
 
+from keyword_matcher import KeywordMatcher
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# 所有可能的意圖（權重矩陣的行順序）
+ALL_INTENTS = ["read_code", "write_code", "edit_code", "debug_error",
+               "fix_bug", "search_code", "run_test", "run_command"]
+
+# 意圖推斷關鍵詞（按優先順序，第一個命中的意圖勝出）
+INFERENCE_KEYWORDS = [
+    (["看", "讀", "顯示", "查看", "打開", "show", "read", "display", "view", "檢視", "瀏覽"], "read_code"),
+    (["創建", "寫", "新建", "生成", "create", "write", "new", "generate", "建立", "實現"], "write_code"),
+    (["修改", "改", "更新", "替換", "edit", "modify", "update", "replace", "變更", "調整"], "edit_code"),
+    (["錯誤", "error", "異常", "exception", "報錯", "debug", "崩潰", "失敗"], "debug_error"),
+    (["修復", "fix", "解決", "處理", "糾正", "solve", "修正", "解決"], "fix_bug"),
+    (["搜索", "找", "查找", "尋找", "search", "find", "grep", "定位", "檢索"], "search_code"),
+    (["測試", "test", "單元測試", "pytest", "運行測試", "驗證", "檢測"], "run_test"),
+    (["執行", "運行", "run", "execute", "npm", "git", "docker", "啟動", "命令"], "run_command")
+]
+
+INFERENCE_FILE_EXTENSIONS = [".py", ".js", ".json", ".yaml", ".yml", ".md", ".txt", ".sh", ".jsx", ".tsx"]
+INFERENCE_READ_WORDS = ["看", "讀", "查看", "show", "read", "view"]
+INFERENCE_CREATE_WORDS = ["創建", "新建", "create", "new"]
+
+# 特徵提取用的信號表
+FEATURE_FILE_EXTENSIONS = [".py", ".js", ".json", ".yaml", ".md"]
+ACTION_VERBS = {
+    "read_code": ["看", "讀", "顯示", "查看", "打開", "show", "read", "display", "view"],
+    "write_code": ["創建", "寫", "新建", "生成", "create", "write", "new", "generate"],
+    "edit_code": ["修改", "改", "更新", "替換", "edit", "modify", "update", "replace"],
+    "debug_error": ["錯誤", "error", "異常", "exception", "報錯", "debug"],
+    "fix_bug": ["修復", "fix", "解決", "處理", "糾正", "solve"],
+    "search_code": ["搜索", "找", "查找", "尋找", "search", "find", "grep"],
+    "run_test": ["測試", "test", "驗證", "檢測"],
+    "run_command": ["執行", "運行", "run", "execute", "啟動"]
+}
+POLITE_WORDS = ["幫我", "請", "可以", "能否"]
+TECH_TERMS = ["函數", "變量", "類", "方法", "參數", "返回值", "api", "端口", "配置", "模塊"]
+
+# 所有信號表共用一個自動機，每段文本只掃描一次
+SIGNAL_MATCHER = KeywordMatcher(
+    [keyword for keywords, _ in INFERENCE_KEYWORDS for keyword in keywords]
+    + INFERENCE_FILE_EXTENSIONS + INFERENCE_READ_WORDS + INFERENCE_CREATE_WORDS
+    + FEATURE_FILE_EXTENSIONS + [verb for verbs in ACTION_VERBS.values() for verb in verbs]
+    + POLITE_WORDS + TECH_TERMS
+)
+
+
+class HashedFeatureVectorizer:
+    """特徵雜湊向量化器：把 extract_features 的輸出轉為 CSR 稀疏行"""
+
+    def __init__(self, n_features: int = 2 ** 18):
+        self.n_features = n_features
+        # 特徵名 -> 列索引（避免重複計算雜湊），同時用於報告中還原特徵名
+        self.index_cache: Dict[str, int] = {}
+        self.feature_names: Dict[int, str] = {}
+
+    def feature_index(self, name: str) -> int:
+        index = self.index_cache.get(name)
+        if index is None:
+            index = zlib.crc32(name.encode("utf-8")) % self.n_features
+            self.index_cache[name] = index
+            self.feature_names.setdefault(index, name)
+        return index
+
+    def transform(self, feature_dicts: List[Dict[str, float]]) -> sparse.csr_matrix:
+        """多個特徵字典 -> (樣本數 × n_features) CSR 矩陣，雜湊衝突的特徵值相加"""
+        indices = []
+        data = []
+        indptr = [0]
+
+        for features in feature_dicts:
+            for name, value in features.items():
+                indices.append(self.feature_index(name))
+                data.append(value)
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(feature_dicts), self.n_features)
+        )
+        matrix.sum_duplicates()
+        return matrix
+
 
 class EnhancedIntentTrainingSystem:
     """增強版意圖理解訓練系統"""
     
-    def __init__(self):
+    def __init__(self, n_features: int = 2 ** 18):
         self.base_dir = Path("/Users/alexchuang/alexchuangtest/aicore0720")
         
         # 意圖映射（用於參考，不是直接的字典）
@@ -41,17 +125,23 @@ class EnhancedIntentTrainingSystem:
         # 初始化訓練數據列表
         self.training_data = []
         
-        # 意圖模型參數
+        # 意圖模型參數：權重為 意圖 × 雜湊特徵 的稠密矩陣
+        self.intents = list(ALL_INTENTS)
+        self.intent_index = {intent: i for i, intent in enumerate(self.intents)}
+        self.vectorizer = HashedFeatureVectorizer(n_features)
         self.model_params = {
-            "keyword_weights": defaultdict(lambda: defaultdict(float)),
+            "weights": np.zeros((len(self.intents), n_features), dtype=np.float32),
+            "intent_priors": np.zeros(len(self.intents), dtype=np.float32),
             "pattern_importance": defaultdict(float),
             "context_relevance": defaultdict(float),
-            "intent_priors": defaultdict(float),
             "confidence_threshold": 0.3,
             "learning_rate": 0.05,
             "regularization": 0.001
         }
         
+        # 緩存的 L1 正則項（每個意圖的 regularization * sum|w|），只在權重更新時增量維護
+        self.regularization_penalty = np.zeros(len(self.intents), dtype=np.float64)
+        
         # 性能指標
         self.metrics = {
             "training_iterations": 0,
@@ -60,6 +150,8 @@ class EnhancedIntentTrainingSystem:
             "intent_distribution": defaultdict(int),
             "feature_importance": defaultdict(float)
         }
+        self.confusion = np.zeros((len(self.intents), len(self.intents)), dtype=np.int64)
+        self.feature_importance = np.zeros(n_features, dtype=np.float64)
         
         # 載入所有訓練數據
         self.load_all_training_data()
@@ -176,28 +268,18 @@ class EnhancedIntentTrainingSystem:
     
     def _infer_intent_from_text(self, text: str) -> str:
         """根據文本內容推斷意圖"""
-        text_lower = text.lower()
+        hits = SIGNAL_MATCHER.find_all(text.lower())
         
         # 基於關鍵詞的意圖推斷
-        for keywords, intent in [
-            (["看", "讀", "顯示", "查看", "打開", "show", "read", "display", "view", "檢視", "瀏覽"], "read_code"),
-            (["創建", "寫", "新建", "生成", "create", "write", "new", "generate", "建立", "實現"], "write_code"),
-            (["修改", "改", "更新", "替換", "edit", "modify", "update", "replace", "變更", "調整"], "edit_code"),
-            (["錯誤", "error", "異常", "exception", "報錯", "debug", "崩潰", "失敗"], "debug_error"),
-            (["修復", "fix", "解決", "處理", "糾正", "solve", "修正", "解決"], "fix_bug"),
-            (["搜索", "找", "查找", "尋找", "search", "find", "grep", "定位", "檢索"], "search_code"),
-            (["測試", "test", "單元測試", "pytest", "運行測試", "驗證", "檢測"], "run_test"),
-            (["執行", "運行", "run", "execute", "npm", "git", "docker", "啟動", "命令"], "run_command")
-        ]:
-            if any(keyword in text_lower for keyword in keywords):
+        for keywords, intent in INFERENCE_KEYWORDS:
+            if any(keyword in hits for keyword in keywords):
                 return intent
         
         # 基於文件擴展名的推斷
-        file_extensions = [".py", ".js", ".json", ".yaml", ".yml", ".md", ".txt", ".sh", ".jsx", ".tsx"]
-        if any(ext in text_lower for ext in file_extensions):
-            if any(word in text_lower for word in ["看", "讀", "查看", "show", "read", "view"]):
+        if any(ext in hits for ext in INFERENCE_FILE_EXTENSIONS):
+            if any(word in hits for word in INFERENCE_READ_WORDS):
                 return "read_code"
-            elif any(word in text_lower for word in ["創建", "新建", "create", "new"]):
+            elif any(word in hits for word in INFERENCE_CREATE_WORDS):
                 return "write_code"
         
         return "unknown"
@@ -289,6 +371,7 @@ class EnhancedIntentTrainingSystem:
         # 轉換為小寫
         text_lower = text.lower()
         words = text_lower.split()
+        hits = SIGNAL_MATCHER.find_all(text_lower)
         
         # 1. 單詞特徵
         for word in words:
@@ -310,24 +393,13 @@ class EnhancedIntentTrainingSystem:
             features["has_question"] = 1.0
         if "." in text:
             features["has_dot"] = 1.0
-        if any(ext in text_lower for ext in [".py", ".js", ".json", ".yaml", ".md"]):
+        if any(ext in hits for ext in FEATURE_FILE_EXTENSIONS):
             features["has_file_reference"] = 1.0
         
         # 5. 動詞特徵（擴展）
-        action_verbs = {
-            "read_code": ["看", "讀", "顯示", "查看", "打開", "show", "read", "display", "view"],
-            "write_code": ["創建", "寫", "新建", "生成", "create", "write", "new", "generate"],
-            "edit_code": ["修改", "改", "更新", "替換", "edit", "modify", "update", "replace"],
-            "debug_error": ["錯誤", "error", "異常", "exception", "報錯", "debug"],
-            "fix_bug": ["修復", "fix", "解決", "處理", "糾正", "solve"],
-            "search_code": ["搜索", "找", "查找", "尋找", "search", "find", "grep"],
-            "run_test": ["測試", "test", "驗證", "檢測"],
-            "run_command": ["執行", "運行", "run", "execute", "啟動"]
-        }
-        
-        for intent, verbs in action_verbs.items():
+        for intent, verbs in ACTION_VERBS.items():
             for verb in verbs:
-                if verb in text_lower:
+                if verb in hits:
                     features[f"verb_{intent}_{verb}"] = 1.0
         
         # 6. 長度特徵
@@ -335,19 +407,22 @@ class EnhancedIntentTrainingSystem:
         features["char_length"] = len(text) / 100.0
         
         # 7. 上下文特徵
-        if any(word in text_lower for word in ["幫我", "請", "可以", "能否"]):
+        if any(word in hits for word in POLITE_WORDS):
             features["polite_request"] = 1.0
         
         # 8. 技術詞彙特徵
-        tech_terms = ["函數", "變量", "類", "方法", "參數", "返回值", "api", "端口", "配置", "模塊"]
-        for term in tech_terms:
-            if term in text_lower:
+        for term in TECH_TERMS:
+            if term in hits:
                 features[f"tech_{term}"] = 1.0
         
         return dict(features)
     
+    def vectorize(self, texts: List[str]) -> sparse.csr_matrix:
+        """文本列表 -> 雜湊特徵 CSR 矩陣"""
+        return self.vectorizer.transform([self.extract_features(text) for text in texts])
+    
     def train_model(self, epochs: int = 50, batch_size: int = 32):
-        """訓練意圖理解模型（增強版）"""
+        """訓練意圖理解模型（向量化小批次訓練）"""
         logger.info(f"開始訓練，共{epochs}輪，批次大小{batch_size}...")
         
         # 分割訓練集和驗證集
@@ -358,6 +433,14 @@ class EnhancedIntentTrainingSystem:
         
         logger.info(f"訓練集: {len(train_data)} 樣本，驗證集: {len(val_data)} 樣本")
         
+        # 特徵只提取一次，之後每輪都在稀疏矩陣上運算
+        X_train = self.vectorize([sample["text"] for sample in train_data])
+        y_train = np.array([self.intent_index[sample["intent"]] for sample in train_data], dtype=np.int64)
+        X_val = self.vectorize([sample["text"] for sample in val_data])
+        y_val = np.array([self.intent_index[sample["intent"]] for sample in val_data], dtype=np.int64)
+        
+        self._refresh_regularization_penalty()
+        
         best_val_accuracy = 0.0
         patience = 5
         no_improvement_count = 0
@@ -365,45 +448,32 @@ class EnhancedIntentTrainingSystem:
         for epoch in range(epochs):
             # 訓練階段
             correct_predictions = 0
-            total_predictions = 0
             
             # 打亂訓練數據
-            random.shuffle(train_data)
+            order = np.random.permutation(len(train_data))
             
-            # 批次訓練
-            for i in range(0, len(train_data), batch_size):
-                batch = train_data[i:i+batch_size]
+            # 批次訓練：整批預測後一次性更新權重
+            for i in range(0, len(order), batch_size):
+                batch = order[i:i+batch_size]
+                X_batch = X_train[batch]
+                y_batch = y_train[batch]
+                
+                predicted, confidences = self.predict_batch(X_batch)
+                correct_predictions += int(np.sum(predicted == y_batch))
+                
+                self.update_weights_batch(X_batch, y_batch, predicted, confidences)
                 
-                for sample in batch:
-                    text = sample["text"]
-                    true_intent = sample["intent"]
-                    
-                    # 提取特徵
-                    features = self.extract_features(text)
-                    
-                    # 預測
-                    predicted_intent, confidence = self.predict_intent(features)
-                    
-                    # 更新模型
-                    if predicted_intent == true_intent:
-                        correct_predictions += 1
-                        # 強化正確預測
-                        self.reinforce_correct_prediction(features, true_intent, confidence)
-                    else:
-                        # 學習錯誤
-                        self.update_weights(features, true_intent, predicted_intent)
-                    
-                    total_predictions += 1
-                    
-                    # 更新混淆矩陣
-                    self.metrics["confusion_matrix"][true_intent][predicted_intent] += 1
+                # 更新混淆矩陣
+                np.add.at(self.confusion, (y_batch, predicted), 1)
             
             # 計算訓練準確率
-            train_accuracy = correct_predictions / total_predictions if total_predictions > 0 else 0.0
+            train_accuracy = correct_predictions / len(train_data) if len(train_data) > 0 else 0.0
             
             # 驗證階段
-            val_results = self.evaluate_on_test_set(val_data)
-            val_accuracy = val_results["accuracy"]
+            val_accuracy = 0.0
+            if len(val_data) > 0:
+                val_predicted, _ = self.predict_batch(X_val)
+                val_accuracy = float(np.mean(val_predicted == y_val))
             
             # 更新指標
             self.metrics["current_accuracy"] = train_accuracy
@@ -420,7 +490,7 @@ class EnhancedIntentTrainingSystem:
                 best_val_accuracy = val_accuracy
                 no_improvement_count = 0
                 # 保存最佳模型
-                self.save_model("best_intent_model.json")
+                self.save_model_npz("best_intent_model.npz")
             else:
                 no_improvement_count += 1
                 if no_improvement_count >= patience:
@@ -429,75 +499,96 @@ class EnhancedIntentTrainingSystem:
             
             # 定期保存檢查點
             if (epoch + 1) % 10 == 0:
-                self.save_model(f"intent_model_checkpoint_epoch{epoch+1}.json")
+                self.save_model_npz(f"intent_model_checkpoint_epoch{epoch+1}.npz")
+        
+        self._sync_metrics()
     
-    def reinforce_correct_prediction(self, features: Dict[str, float], intent: str, confidence: float):
-        """強化正確的預測"""
-        # 如果置信度較低，仍然需要強化
-        if confidence < 0.8:
-            reinforcement_rate = self.model_params["learning_rate"] * 0.3
-            for feature, value in features.items():
-                self.model_params["keyword_weights"][intent][feature] += reinforcement_rate * value
+    def _refresh_regularization_penalty(self):
+        """從權重矩陣完整重算 L1 正則項緩存"""
+        self.regularization_penalty = self.model_params["regularization"] * np.abs(
+            self.model_params["weights"]
+        ).sum(axis=1, dtype=np.float64)
     
-    def predict_intent(self, features: Dict[str, float]) -> Tuple[str, float]:
-        """預測意圖（增強版）"""
-        intent_scores = defaultdict(float)
-        
-        # 所有可能的意圖
-        all_intents = ["read_code", "write_code", "edit_code", "debug_error", 
-                      "fix_bug", "search_code", "run_test", "run_command"]
-        
-        # 計算每個意圖的分數
-        for intent in all_intents:
-            # 基礎分數
-            base_score = self.model_params["intent_priors"].get(intent, 0.0)
-            
-            # 特徵分數
-            for feature, value in features.items():
-                weight = self.model_params["keyword_weights"][intent].get(feature, 0.0)
-                intent_scores[intent] += weight * value
-            
-            # 加上基礎分數和正則化
-            intent_scores[intent] += base_score
-            intent_scores[intent] -= self.model_params["regularization"] * sum(
-                abs(w) for w in self.model_params["keyword_weights"][intent].values()
-            )
-        
-        # 找出最高分的意圖
-        if not intent_scores:
-            return "unknown", 0.0
+    @staticmethod
+    def _compact_columns(X: sparse.csr_matrix) -> Tuple[np.ndarray, sparse.csr_matrix]:
+        """只保留批次中出現過的特徵列，返回 (列索引, 重新編號後的矩陣)"""
+        columns, remapped = np.unique(X.indices, return_inverse=True)
+        compact = sparse.csr_matrix((X.data, remapped.astype(np.int32), X.indptr),
+                                    shape=(X.shape[0], len(columns)))
+        return columns, compact
+    
+    def predict_batch(self, X: sparse.csr_matrix) -> Tuple[np.ndarray, np.ndarray]:
+        """批量預測，返回 (意圖索引, 置信度)"""
+        # 只取出用到的權重列，避免每次都觸及整個 意圖 × 特徵 矩陣
+        columns, compact = self._compact_columns(X)
+        scores = np.asarray(compact @ self.model_params["weights"][:, columns].T, dtype=np.float64)
+        scores += self.model_params["intent_priors"]
+        scores -= self.regularization_penalty
         
         # Softmax 計算置信度
-        max_score = max(intent_scores.values())
-        exp_scores = {intent: np.exp(score - max_score) for intent, score in intent_scores.items()}
-        total_exp = sum(exp_scores.values())
-        
-        probabilities = {intent: exp_score / total_exp for intent, exp_score in exp_scores.items()}
-        
-        # 選擇最高概率的意圖
-        best_intent = max(probabilities.items(), key=lambda x: x[1])
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
         
-        return best_intent[0], best_intent[1]
+        predicted = probabilities.argmax(axis=1)
+        return predicted, probabilities[np.arange(len(predicted)), predicted]
     
-    def update_weights(self, features: Dict[str, float], true_intent: str, predicted_intent: str):
-        """更新權重（增強版）"""
+    def predict_intent(self, features: Dict[str, float]) -> Tuple[str, float]:
+        """預測意圖（單個特徵字典）"""
+        predicted, confidences = self.predict_batch(self.vectorizer.transform([features]))
+        return self.intents[predicted[0]], float(confidences[0])
+    
+    def update_weights_batch(self, X: sparse.csr_matrix, y_true: np.ndarray,
+                             predicted: np.ndarray, confidences: np.ndarray):
+        """小批次更新權重
+        
+        錯誤預測：增加正確意圖權重、減少錯誤意圖權重並調整先驗；
+        正確但置信度低於 0.8：以 0.3 倍學習率強化正確意圖
+        """
         learning_rate = self.model_params["learning_rate"]
+        rows = np.arange(len(y_true))
+        wrong = predicted != y_true
+        weak = ~wrong & (confidences < 0.8)
+        
+        # 每個樣本對每個意圖的更新係數
+        coefficients = np.zeros((len(y_true), len(self.intents)), dtype=np.float32)
+        coefficients[rows[wrong], y_true[wrong]] = learning_rate
+        coefficients[rows[wrong], predicted[wrong]] = -learning_rate * 0.7
+        coefficients[rows[weak], y_true[weak]] = learning_rate * 0.3
+        
+        # 只更新本批次出現過的特徵列，並增量維護正則項
+        columns, compact = self._compact_columns(X)
+        if len(columns):
+            weights = self.model_params["weights"]
+            old = weights[:, columns]
+            new = old + np.asarray(compact.T @ coefficients).T
+            self.regularization_penalty += self.model_params["regularization"] * (
+                np.abs(new).sum(axis=1, dtype=np.float64) - np.abs(old).sum(axis=1, dtype=np.float64)
+            )
+            weights[:, columns] = new
         
-        # 增加正確意圖的權重
-        for feature, value in features.items():
-            self.model_params["keyword_weights"][true_intent][feature] += learning_rate * value
+        if wrong.any():
+            # 更新意圖先驗概率
+            priors = self.model_params["intent_priors"]
+            np.add.at(priors, y_true[wrong], learning_rate * 0.1)
+            np.add.at(priors, predicted[wrong], -learning_rate * 0.05)
+            
             # 更新特徵重要性
-            self.metrics["feature_importance"][feature] += abs(learning_rate * value)
-        
-        # 減少錯誤意圖的權重
-        if predicted_intent != "unknown":
-            for feature, value in features.items():
-                self.model_params["keyword_weights"][predicted_intent][feature] -= learning_rate * value * 0.7
-        
-        # 更新意圖先驗概率
-        self.model_params["intent_priors"][true_intent] += learning_rate * 0.1
-        if predicted_intent != "unknown":
-            self.model_params["intent_priors"][predicted_intent] -= learning_rate * 0.05
+            self.feature_importance += learning_rate * np.asarray(abs(X[wrong]).sum(axis=0)).ravel()
+    
+    def _sync_metrics(self, top_n: int = 100):
+        """把矩陣形式的混淆矩陣和特徵重要性同步到 metrics 字典"""
+        for i, true_intent in enumerate(self.intents):
+            for j, predicted_intent in enumerate(self.intents):
+                if self.confusion[i, j]:
+                    self.metrics["confusion_matrix"][true_intent][predicted_intent] = int(self.confusion[i, j])
+        
+        nonzero = np.flatnonzero(self.feature_importance)
+        top = nonzero[np.argsort(-self.feature_importance[nonzero], kind="stable")[:top_n]]
+        self.metrics["feature_importance"] = defaultdict(float, {
+            self.vectorizer.feature_names.get(int(col), f"hash_{col}"): float(self.feature_importance[col])
+            for col in top
+        })
     
     def evaluate_on_test_set(self, test_data: List[Dict]) -> Dict[str, float]:
         """在測試集上評估"""
@@ -508,12 +599,17 @@ class EnhancedIntentTrainingSystem:
         intent_correct_counts = defaultdict(int)
         intent_total_counts = defaultdict(int)
         
-        for sample in test_data:
+        if not test_data:
+            return {"accuracy": 0.0, "predictions": [], "intent_accuracies": {}}
+        
+        X = self.vectorize([sample["text"] for sample in test_data])
+        predicted, confidences = self.predict_batch(X)
+        
+        for sample, predicted_index, confidence in zip(test_data, predicted, confidences):
             text = sample["text"]
             true_intent = sample["intent"]
-            
-            features = self.extract_features(text)
-            predicted_intent, confidence = self.predict_intent(features)
+            predicted_intent = self.intents[predicted_index]
+            confidence = float(confidence)
             
             intent_total_counts[true_intent] += 1
             
@@ -545,16 +641,27 @@ class EnhancedIntentTrainingSystem:
             "intent_accuracies": intent_accuracies
         }
     
+    def keyword_weights(self) -> Dict[str, Dict[str, float]]:
+        """以特徵名還原非零權重（雜湊衝突的列以首次出現的特徵名表示）"""
+        weights = self.model_params["weights"]
+        keyword_weights = {}
+        for row, intent in enumerate(self.intents):
+            columns = np.flatnonzero(weights[row])
+            keyword_weights[intent] = {
+                self.vectorizer.feature_names.get(int(col), f"hash_{col}"): float(weights[row, col])
+                for col in columns
+            }
+        return keyword_weights
+    
     def save_model(self, path: str = "enhanced_intent_model.json"):
         """保存模型"""
-        # 轉換 defaultdict 為普通 dict
         model_data = {
             "params": {
-                "keyword_weights": {
-                    intent: dict(weights)
-                    for intent, weights in self.model_params["keyword_weights"].items()
+                "keyword_weights": self.keyword_weights(),
+                "intent_priors": {
+                    intent: float(prior)
+                    for intent, prior in zip(self.intents, self.model_params["intent_priors"])
                 },
-                "intent_priors": dict(self.model_params["intent_priors"]),
                 "confidence_threshold": self.model_params["confidence_threshold"],
                 "learning_rate": self.model_params["learning_rate"],
                 "regularization": self.model_params["regularization"]
@@ -580,6 +687,54 @@ class EnhancedIntentTrainingSystem:
         
         logger.info(f"模型已保存到: {path}")
     
+    def save_model_npz(self, path: str = "enhanced_intent_model.npz"):
+        """以緊湊的 .npz 格式保存模型（權重矩陣以 CSR 形式存儲）"""
+        weights = sparse.csr_matrix(self.model_params["weights"])
+        np.savez_compressed(
+            path,
+            weights_data=weights.data,
+            weights_indices=weights.indices,
+            weights_indptr=weights.indptr,
+            intent_priors=self.model_params["intent_priors"],
+            intents=np.array(self.intents),
+            meta=np.array([
+                self.vectorizer.n_features,
+                self.model_params["confidence_threshold"],
+                self.model_params["learning_rate"],
+                self.model_params["regularization"],
+                self.metrics["training_iterations"],
+                self.metrics["current_accuracy"]
+            ], dtype=np.float64)
+        )
+        
+        logger.info(f"模型已保存到: {path} ({weights.nnz} 個非零權重)")
+    
+    def load_model_npz(self, path: str = "enhanced_intent_model.npz"):
+        """載入 save_model_npz 保存的模型"""
+        with np.load(path) as data:
+            n_features = int(data["meta"][0])
+            self.intents = [str(intent) for intent in data["intents"]]
+            self.intent_index = {intent: i for i, intent in enumerate(self.intents)}
+            
+            self.model_params["weights"] = sparse.csr_matrix(
+                (data["weights_data"], data["weights_indices"], data["weights_indptr"]),
+                shape=(len(self.intents), n_features)
+            ).toarray()
+            self.model_params["intent_priors"] = data["intent_priors"].astype(np.float32)
+            
+            (_, self.model_params["confidence_threshold"], self.model_params["learning_rate"],
+             self.model_params["regularization"], iterations, accuracy) = data["meta"].tolist()
+            self.metrics["training_iterations"] = int(iterations)
+            self.metrics["current_accuracy"] = accuracy
+        
+        if n_features != self.vectorizer.n_features:
+            self.vectorizer = HashedFeatureVectorizer(n_features)
+            self.feature_importance = np.zeros(n_features, dtype=np.float64)
+        self.confusion = np.zeros((len(self.intents), len(self.intents)), dtype=np.int64)
+        self._refresh_regularization_penalty()
+        
+        logger.info(f"模型已載入: {path}")
+    
     def demonstrate_improved_understanding(self):
         """演示改進後的意圖理解"""
         # 訓練模型
@@ -633,6 +788,7 @@ class EnhancedIntentTrainingSystem:
         
         # 保存最終模型
         self.save_model("enhanced_intent_model_final.json")
+        self.save_model_npz("enhanced_intent_model_final.npz")
         
         # 創建詳細報告
         self.create_detailed_report()
@@ -667,7 +823,8 @@ class EnhancedIntentTrainingSystem:
         report += f"""
 ## 重要特徵 (Top 20)
 """
-        for i, (feature, importance) in enumerate(list(self.metrics["feature_importance"].items())[:20]):
+        top_features = sorted(self.metrics["feature_importance"].items(), key=lambda x: x[1], reverse=True)
+        for i, (feature, importance) in enumerate(top_features[:20]):
             report += f"{i+1}. {feature}: {importance:.3f}\n"
         
         report += f"""
@@ -6,14 +6,17 @@
 
 import json
 import logging
+import re
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Set
 from datetime import datetime
 from collections import defaultdict
 import numpy as np
 from dataclasses import dataclass, field
 from enum import Enum
 
+from keyword_matcher import KeywordMatcher
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -71,6 +74,8 @@ class IntentUnderstandingOptimizer:
         
         # 意圖信號庫
         self.intent_signals = self._initialize_intent_signals()
+        self.signal_matcher = self._build_signal_matcher()
+        self.compiled_patterns = self._compile_signal_patterns()
         
         # 意圖理解模型
         self.intent_model = {
@@ -188,6 +193,30 @@ class IntentUnderstandingOptimizer:
             )
         }
     
+    def _build_signal_matcher(self) -> KeywordMatcher:
+        """把所有意圖的關鍵詞/上下文線索/負面信號編譯成一個匹配器
+        
+        修改信號庫後需重新調用本方法和 _compile_signal_patterns
+        """
+        return KeywordMatcher(
+            keyword
+            for signal in self.intent_signals.values()
+            for keyword in signal.keywords + signal.context_clues + signal.negative_signals
+        )
+    
+    def _compile_signal_patterns(self) -> Dict[str, "re.Pattern"]:
+        """預編譯意圖模式；re.search 下首尾的 .* 不影響是否命中，去掉以避免回溯"""
+        compiled = {}
+        for signal in self.intent_signals.values():
+            for pattern in signal.patterns:
+                core = pattern
+                if core.startswith(".*"):
+                    core = core[2:]
+                if core.endswith(".*") and not core.endswith("\\.*"):
+                    core = core[:-2]
+                compiled[pattern] = re.compile(core)
+        return compiled
+    
     def understand_intent(self, user_input: str, context: Optional[Dict] = None) -> Dict:
         """
         理解用戶意圖
@@ -202,10 +231,15 @@ class IntentUnderstandingOptimizer:
         # 預處理輸入
         normalized_input = user_input.lower().strip()
         
+        # 一次掃描取得所有信號命中，供各意圖評分共用
+        input_hits = self.signal_matcher.find_all(normalized_input)
+        context_hits = self.signal_matcher.find_all(json.dumps(context).lower()) if context else set()
+        
         # 計算每個意圖的分數
         intent_scores = {}
         for intent, signal in self.intent_signals.items():
-            score = self._calculate_intent_score(normalized_input, signal, context)
+            score = self._calculate_intent_score(normalized_input, signal, context,
+                                                 input_hits, context_hits)
             if score > 0:
                 intent_scores[intent] = score
         
@@ -263,15 +297,26 @@ class IntentUnderstandingOptimizer:
     def _calculate_intent_score(self, 
                                input_text: str, 
                                signal: IntentSignal,
-                               context: Optional[Dict]) -> float:
-        """計算單個意圖的分數"""
+                               context: Optional[Dict],
+                               input_hits: Optional[Set[str]] = None,
+                               context_hits: Optional[Set[str]] = None) -> float:
+        """計算單個意圖的分數
+        
+        input_hits/context_hits 為 signal_matcher 預先算好的命中集合；
+        未提供時就地計算
+        """
         score = 0.0
         weights = self.intent_model["signal_weights"]
         
+        if input_hits is None:
+            input_hits = self.signal_matcher.find_all(input_text)
+        if context_hits is None:
+            context_hits = self.signal_matcher.find_all(json.dumps(context).lower()) if context else set()
+        
         # 1. 關鍵詞匹配
         keyword_score = 0.0
         for keyword in signal.keywords:
-            if keyword in input_text:
+            if keyword in input_hits:
                 keyword_score += 1.0
         if signal.keywords:
             keyword_score = keyword_score / len(signal.keywords)
@@ -280,9 +325,9 @@ class IntentUnderstandingOptimizer:
         # 2. 模式匹配
         pattern_score = 0.0
         if signal.patterns:
-            import re
             for pattern in signal.patterns:
-                if re.search(pattern, input_text):
+                compiled = self.compiled_patterns.get(pattern) or re.compile(pattern)
+                if compiled.search(input_text):
                     pattern_score += 1.0
             pattern_score = pattern_score / len(signal.patterns)
         score += pattern_score * weights["patterns"]
@@ -290,9 +335,8 @@ class IntentUnderstandingOptimizer:
         # 3. 上下文線索
         context_score = 0.0
         if context and signal.context_clues:
-            context_str = json.dumps(context).lower()
             for clue in signal.context_clues:
-                if clue in context_str or clue in input_text:
+                if clue in context_hits or clue in input_hits:
                     context_score += 1.0
             context_score = context_score / len(signal.context_clues)
         score += context_score * weights["context"]
@@ -304,7 +348,7 @@ class IntentUnderstandingOptimizer:
         # 5. 負面信號檢查
         if signal.negative_signals:
             for neg_signal in signal.negative_signals:
-                if neg_signal in input_text:
+                if neg_signal in input_hits:
                     score *= 0.5  # 減半分數
         
         # 6. 置信度提升
@@ -12,19 +12,25 @@ from groq import Groq
 import asyncio
 import time
 
+from k2_memory_bank import K2MemoryBank
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class K2GroqInferenceEngine:
     """使用 Groq API 的 K2 推理引擎"""
     
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, memory_path: Optional[str] = None):
         self.client = Groq(api_key=api_key)
         self.model = "moonshotai/kimi-k2-instruct"
         
-        # 記憶庫
-        self.memory_bank = []
+        # 記憶庫（環形緩衝區 + 向量化檢索，可持久化）
         self.max_memories = 100
+        self.memory_path = str(K2MemoryBank.resolve_path(memory_path)) if memory_path else None
+        if self.memory_path and os.path.exists(self.memory_path):
+            self.memory_bank = K2MemoryBank.load(self.memory_path)
+        else:
+            self.memory_bank = K2MemoryBank(max_memories=self.max_memories)
         
         # 工具映射
         self.tool_mapping = {
@@ -130,22 +136,8 @@ class K2GroqInferenceEngine:
     
     def _retrieve_memories(self, query: str, top_k: int = 3) -> List[str]:
         """檢索相關記憶"""
-        if not self.memory_bank:
-            return []
-        
-        # 簡單的關鍵詞匹配（實際應用中應使用向量相似度）
-        relevant = []
-        query_words = set(query.lower().split())
-        
-        for memory in self.memory_bank:
-            memory_words = set(memory['content'].lower().split())
-            overlap = len(query_words & memory_words)
-            if overlap > 0:
-                relevant.append((overlap, memory['content']))
-        
-        # 排序並返回top-k
-        relevant.sort(reverse=True, key=lambda x: x[0])
-        return [mem[1] for mem in relevant[:top_k]]
+        # 雜湊詞袋向量內積 = 詞重疊數，一次矩陣乘法完成 top-k
+        return self.memory_bank.search(query, top_k)
     
     def _update_memory(self, query: str, response: str):
         """更新記憶庫"""
@@ -156,11 +148,14 @@ class K2GroqInferenceEngine:
             "content": f"Q: {query[:100]}... A: {response[:100]}..."
         }
         
-        self.memory_bank.append(memory_entry)
-        
-        # 保持記憶庫大小
-        if len(self.memory_bank) > self.max_memories:
-            self.memory_bank.pop(0)
+        # 環形緩衝區自動覆蓋最舊記憶
+        self.memory_bank.add(memory_entry)
+    
+    def save_memories(self, path: Optional[str] = None):
+        """保存記憶庫到磁碟"""
+        path = path or self.memory_path
+        if path:
+            self.memory_bank.save(path)
     
     def _parse_tool_calls(self, response: str) -> List[Dict]:
         """解析工具調用"""
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+K2 記憶庫組件
+環形緩衝區 + 雜湊詞袋向量矩陣：淘汰為 O(1)，檢索以一次矩陣乘法完成 top-k，
+並支持保存/載入到磁碟
+"""
+
+import json
+import logging
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class K2MemoryBank:
+    """向量化記憶庫"""
+
+    def __init__(self, max_memories: int = 100, dim: int = 4096):
+        self.max_memories = max_memories
+        self.dim = dim
+
+        # 環形緩衝區：新記憶覆蓋最舊的槽位，淘汰為 O(1)
+        self.entries: List[Optional[Dict]] = [None] * max_memories
+        self.vectors = np.zeros((max_memories, dim), dtype=np.float32)
+        self.next_slot = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _tokenize(self, text: str) -> List[str]:
+        """與原關鍵詞匹配一致：小寫後按空白切分"""
+        return text.lower().split()
+
+    def _embed(self, text: str) -> np.ndarray:
+        """雜湊詞袋向量（二值），兩向量內積即為詞集合重疊數"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in set(self._tokenize(text)):
+            vector[zlib.crc32(token.encode("utf-8")) % self.dim] = 1.0
+        return vector
+
+    def add(self, entry: Dict):
+        """加入一條記憶（entry 需包含 content 欄位）"""
+        slot = self.next_slot
+        self.entries[slot] = entry
+        self.vectors[slot] = self._embed(entry["content"])
+
+        self.next_slot = (slot + 1) % self.max_memories
+        self.count = min(self.count + 1, self.max_memories)
+
+    def search(self, query: str, top_k: int = 3) -> List[str]:
+        """檢索與查詢詞重疊最多的記憶內容"""
+        if self.count == 0 or top_k <= 0:
+            return []
+
+        # 緩衝區從槽位 0 開始填充，前 count 行即為全部有效記憶
+        scores = self.vectors[:self.count] @ self._embed(query)
+
+        k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [self.entries[i]["content"] for i in candidates if scores[i] > 0]
+
+    def recent(self, limit: int = 10) -> List[Dict]:
+        """按時間順序返回最近的記憶"""
+        ordered = []
+        for offset in range(min(limit, self.count)):
+            slot = (self.next_slot - 1 - offset) % self.max_memories
+            ordered.append(self.entries[slot])
+        return list(reversed(ordered))
+
+    @staticmethod
+    def resolve_path(path: str) -> Path:
+        """統一為 .npz 後綴（np.savez_compressed 會自動補上，載入和存在性檢查需用同一路徑）"""
+        path = Path(path)
+        return path if path.suffix == ".npz" else path.with_name(path.name + ".npz")
+
+    def save(self, path: str):
+        """保存到 .npz 文件（向量矩陣 + 記憶條目 JSON）"""
+        path = self.resolve_path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        np.savez_compressed(
+            path,
+            vectors=self.vectors,
+            entries=np.array(json.dumps(self.entries, ensure_ascii=False)),
+            meta=np.array([self.max_memories, self.dim, self.next_slot, self.count])
+        )
+        logger.info(f"💾 記憶庫已保存: {path} ({self.count} 條)")
+
+    @classmethod
+    def load(cls, path: str) -> "K2MemoryBank":
+        """從 .npz 文件載入"""
+        path = cls.resolve_path(path)
+        with np.load(path) as data:
+            max_memories, dim, next_slot, count = (int(x) for x in data["meta"])
+            bank = cls(max_memories=max_memories, dim=dim)
+            bank.vectors = data["vectors"].astype(np.float32)
+            bank.entries = json.loads(str(data["entries"]))
+
+        bank.next_slot = next_slot
+        bank.count = count
+        logger.info(f"📂 記憶庫已載入: {path} ({count} 條)")
+        return bank
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+關鍵詞多模式匹配器
+把多個關鍵詞表編譯成一個正則自動機，一次掃描文本即可取得所有命中的關鍵詞，
+取代逐個關鍵詞執行 `keyword in text` 的做法。
+正則每個位置的嘗試成本高於 C 實現的子串查找，文本長度超過關鍵詞數的一半時
+（如約 90 個關鍵詞、百字以上的輸入）逐個 `in` 更快，此時自動改用逐個檢查
+"""
+
+import re
+from typing import Dict, Iterable, List, Set
+
+# 正則單次掃描只用於長度不超過「關鍵詞數 × 此係數」的文本（keyword_matcher_benchmark.py 實測的交叉點）
+SCAN_LENGTH_PER_KEYWORD = 0.5
+
+
+class KeywordMatcher:
+    """編譯一次、單次掃描的關鍵詞匹配器
+
+    語義與逐個 `keyword in text` 完全一致（子串包含，允許重疊）：
+    - 關鍵詞先組成前綴樹再生成正則，每個位置的匹配代價取決於關鍵詞深度而非數量
+    - 以零寬前瞻 (?=(...)) 在每個位置嘗試匹配，重疊的命中不會互相吞掉；
+      首字符字符集前置過濾，不可能命中的位置只需一次集合檢查
+    - 前綴樹中較長的分支貪婪優先，因此每個位置命中的是最長關鍵詞；
+      同一位置上更短的命中必然是它的前綴，通過預先計算的前綴閉包補回
+    - 文本長於 max_scan_length 時正則掃描反而更慢，直接逐個 `in` 檢查
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = sorted({k for k in keywords if k}, key=len, reverse=True)
+        self.max_scan_length = int(len(self.keywords) * SCAN_LENGTH_PER_KEYWORD)
+
+        if self.keywords:
+            first_chars = "".join(sorted({re.escape(keyword[0]) for keyword in self.keywords}))
+            trie = self._build_trie(self.keywords)
+            self.pattern = re.compile(f"(?=[{first_chars}])(?=({self._trie_to_regex(trie)}))", re.DOTALL)
+        else:
+            self.pattern = None
+
+        # 關鍵詞 -> 作為它前綴的其他關鍵詞（只記錄非空的）
+        keyword_set = set(self.keywords)
+        self.prefix_closure: Dict[str, frozenset] = {}
+        for keyword in self.keywords:
+            prefixes = frozenset(keyword[:length] for length in range(1, len(keyword))
+                                 if keyword[:length] in keyword_set)
+            if prefixes:
+                self.prefix_closure[keyword] = prefixes
+
+    @staticmethod
+    def _build_trie(keywords: Iterable[str]) -> Dict:
+        trie: Dict = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = True
+        return trie
+
+    @classmethod
+    def _trie_to_regex(cls, node: Dict) -> str:
+        """前綴樹 -> 正則；終止節點的後續分支設為可選（貪婪，優先更長的關鍵詞）"""
+        branches = [re.escape(char) + cls._trie_to_regex(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+
+        if len(branches) == 1 and len(branches[0]) == 1:
+            body = branches[0]
+        else:
+            body = "(?:" + "|".join(branches) + ")"
+        return body + "?" if "" in node else body
+
+    def find_all(self, text: str) -> Set[str]:
+        """返回文本中出現的所有關鍵詞"""
+        if self.pattern is None or not text:
+            return set()
+        if len(text) > self.max_scan_length:
+            return {keyword for keyword in self.keywords if keyword in text}
+        return self._scan(text)
+
+    def _scan(self, text: str) -> Set[str]:
+        """正則單次掃描（不檢查文本長度）"""
+        hits = set(self.pattern.findall(text))
+
+        for keyword in hits & self.prefix_closure.keys():
+            hits |= self.prefix_closure[keyword]
+        return hits
+
+    def __len__(self) -> int:
+        return len(self.keywords)
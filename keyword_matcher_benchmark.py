@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+關鍵詞匹配微基準測試
+對比逐個 `keyword in text` 掃描與 KeywordMatcher 單次掃描（現有信號表，以及擴大後的關鍵詞表），
+並測量三條意圖檢測路徑（extract_features / _infer_intent_from_text / understand_intent）的單次耗時
+
+用法:
+    python keyword_matcher_benchmark.py --iterations 20000
+"""
+
+import argparse
+import logging
+import random
+import time
+
+from keyword_matcher import KeywordMatcher
+from intent_training_system_enhanced import EnhancedIntentTrainingSystem, SIGNAL_MATCHER
+from intent_understanding_optimizer import IntentUnderstandingOptimizer
+
+SAMPLE_TEXTS = [
+    "幫我看看config.json文件的內容",
+    "創建一個處理用戶輸入的函數",
+    "把所有的var改成let",
+    "程序拋出異常了，traceback 顯示 keyerror",
+    "修復登錄頁面的跳轉問題",
+    "找找哪裡用了deprecated的API",
+    "運行所有測試用例 pytest -x",
+    "執行部署腳本 docker compose up",
+    "please refactor the payment module and update the readme",
+    "為什麼這段代碼會報錯？",
+]
+
+
+def bench(label: str, fn, texts, iterations: int) -> float:
+    """返回每次調用的平均微秒數"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(texts[i % len(texts)])
+    per_call = (time.perf_counter() - start) / iterations * 1e6
+    print(f"   {label:<44} {per_call:>8.2f} µs/op")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description="關鍵詞匹配微基準測試")
+    parser.add_argument("--iterations", type=int, default=20000, help="每項測試的調用次數")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    # 加長的輸入用於觀察文本長度對兩種方式的影響
+    rng = random.Random(0)
+    long_texts = [" ".join(rng.sample(SAMPLE_TEXTS, 5)) for _ in range(len(SAMPLE_TEXTS))]
+
+    optimizer = IntentUnderstandingOptimizer()
+    trainer = EnhancedIntentTrainingSystem()
+
+    print("🚀 關鍵詞匹配微基準測試")
+    for name, matcher in [("訓練系統信號表", SIGNAL_MATCHER), ("意圖優化器信號表", optimizer.signal_matcher)]:
+        keywords = matcher.keywords
+
+        def naive(text, keywords=keywords):
+            return {keyword for keyword in keywords if keyword in text}
+
+        for text in SAMPLE_TEXTS + long_texts:
+            text = text.lower()
+            assert naive(text) == matcher.find_all(text) == matcher._scan(text), text
+
+        print(f"\n📊 {name} ({len(keywords)} 個關鍵詞，正則掃描上限 {matcher.max_scan_length} 字)")
+        for texts_label, texts in [("短文本", SAMPLE_TEXTS), ("長文本", long_texts)]:
+            texts = [text.lower() for text in texts]
+            before = bench(f"逐個 in 掃描 - {texts_label}", naive, texts, args.iterations)
+            scan = bench(f"正則掃描 - {texts_label}", matcher._scan, texts, args.iterations)
+            after = bench(f"KeywordMatcher - {texts_label}", matcher.find_all, texts, args.iterations)
+            print(f"   {'正則掃描加速':<42} {before / scan:>8.2f}x")
+            print(f"   {'加速':<44} {before / after:>8.2f}x")
+
+    # 關鍵詞表增長（例如從反饋中學到新關鍵詞）時，逐個掃描的成本線性增長，單次掃描基本不變
+    print("\n📊 關鍵詞表規模")
+    alphabet = "abcdefghijklmnopqrstuvwxyz看讀寫改測試運行錯誤修復文件"
+    texts = [text.lower() for text in SAMPLE_TEXTS]
+    for size in (100, 1000, 5000):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(2, 8))) for _ in range(size)]
+        matcher = KeywordMatcher(keywords)
+        before = bench(f"逐個 in 掃描 - {size} 個關鍵詞",
+                       lambda text: {keyword for keyword in matcher.keywords if keyword in text},
+                       texts, args.iterations // 10)
+        after = bench(f"KeywordMatcher - {size} 個關鍵詞", matcher.find_all, texts, args.iterations // 10)
+        print(f"   {'加速':<44} {before / after:>8.2f}x")
+
+    print("\n📊 意圖檢測路徑")
+    bench("EnhancedIntentTrainingSystem.extract_features", trainer.extract_features, SAMPLE_TEXTS, args.iterations)
+    bench("EnhancedIntentTrainingSystem._infer_intent", trainer._infer_intent_from_text, SAMPLE_TEXTS, args.iterations)
+    bench("IntentUnderstandingOptimizer.understand_intent", optimizer.understand_intent, SAMPLE_TEXTS, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
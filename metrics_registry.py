@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+進程內指標註冊表
+- Counter / Gauge / Histogram 三種指標，支持標籤
+- Histogram 使用相對誤差有界的對數分桶分位數草圖（DDSketch 風格），內存與樣本數無關
+- 熱路徑無鎖：Counter 和 Histogram 按線程分片，每個線程只寫自己的分片，讀取時合併；
+  已結束線程的分片併入一個歸檔分片，分片數不隨線程創建次數增長
+- 拉取接口 read() / collect() 供指標系統讀取，export_prometheus() 輸出 Prometheus 文本格式
+MCP 組件直接記錄到全局 metrics_registry，無需額外服務
+"""
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class QuantileSketch:
+    """對數分桶分位數草圖：任意分位數的相對誤差不超過 relative_accuracy
+
+    桶數超過 max_bins 時合併最低的桶（只犧牲低分位數的精度），內存有上界
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048,
+                 min_value: float = 1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        if value > self.min_value:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            bins = self.bins
+            bins[index] = bins.get(index, 0) + 1
+            if len(bins) > self.max_bins:
+                self._collapse()
+        else:
+            self.zero_count += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def _collapse(self):
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins + 1
+        target = indexes[excess]
+        self.bins[target] += sum(self.bins.pop(index) for index in indexes[:excess])
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def merge(self, other: "QuantileSketch"):
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def copy(self) -> "QuantileSketch":
+        sketch = QuantileSketch(self.relative_accuracy, self.max_bins, self.min_value)
+        sketch.merge(self)
+        return sketch
+
+
+class _Metric:
+    """指標基類：無標籤時直接記錄，有標籤時通過 labels() 取得子指標"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str = "", labelnames: Sequence[str] = (),
+                 label_values: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.label_values = label_values
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self, label_values: Tuple[str, ...]) -> "_Metric":
+        return self.__class__(self.name, self.documentation, label_values=label_values)
+
+    def labels(self, *values, **kwargs) -> "_Metric":
+        if not self.labelnames:
+            raise ValueError(f"指標 {self.name} 沒有定義標籤")
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"指標 {self.name} 需要標籤 {self.labelnames}")
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child(values)
+        return child
+
+    def samples(self) -> Iterator["_Metric"]:
+        """有標籤時遍歷所有子指標，否則只有自身"""
+        if self.labelnames:
+            yield from list(self._children.values())
+        else:
+            yield self
+
+    def label_dict(self, labelnames: Sequence[str]) -> Dict[str, str]:
+        return dict(zip(labelnames, self.label_values))
+
+
+class _ThreadSharded(_Metric):
+    """按線程分片的指標：記錄只寫當前線程的分片，讀取時合併所有分片
+
+    線程結束後其分片不再被寫入，在新線程註冊分片或讀取時併入 _retired
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+        self._shards: List[Tuple[threading.Thread, Any]] = []
+        self._retired = None
+
+    def _new_shard(self):
+        raise NotImplementedError
+
+    def _merge_shard(self, target, shard):
+        raise NotImplementedError
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self._new_shard()
+            with self._lock:
+                self._fold_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _fold_dead_shards(self):
+        """把已結束線程的分片併入歸檔分片（調用方持有 self._lock）"""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                if self._retired is None:
+                    self._retired = self._new_shard()
+                self._merge_shard(self._retired, shard)
+        self._shards = live
+
+    def _all_shards(self) -> List[Any]:
+        """當前所有分片（調用方持有 self._lock，避免歸檔過程中重複計入）"""
+        self._fold_dead_shards()
+        shards = [shard for _, shard in self._shards]
+        if self._retired is not None:
+            shards.append(self._retired)
+        return shards
+
+
+class Counter(_ThreadSharded):
+    """單調遞增計數器"""
+
+    type_name = "counter"
+
+    def _new_shard(self):
+        return [0.0]
+
+    def _merge_shard(self, target, shard):
+        target[0] += shard[0]
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("計數器只能遞增")
+        try:
+            self._local.shard[0] += amount
+        except AttributeError:
+            self._shard()[0] += amount
+
+    def get(self) -> float:
+        with self._lock:
+            return sum(shard[0] for shard in self._all_shards())
+
+
+class Gauge(_Metric):
+    """可增可減的當前值；set() 是單次賦值，inc()/dec() 需要短暫加鎖"""
+
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """讀取時調用 function 取值（如隊列長度、緩存大小）"""
+        self._function = function
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def get(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+
+class Histogram(_ThreadSharded):
+    """分佈指標（延遲、大小等），使用分位數草圖，不保留單個樣本"""
+
+    type_name = "summary"
+
+    def __init__(self, name: str, documentation: str = "", labelnames: Sequence[str] = (),
+                 label_values: Tuple[str, ...] = (), relative_accuracy: float = 0.01,
+                 max_bins: int = 2048, quantiles: Sequence[float] = DEFAULT_QUANTILES):
+        super().__init__(name, documentation, labelnames, label_values)
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.quantiles = tuple(quantiles)
+
+    def _new_child(self, label_values: Tuple[str, ...]) -> "Histogram":
+        return Histogram(self.name, self.documentation, label_values=label_values,
+                         relative_accuracy=self.relative_accuracy, max_bins=self.max_bins,
+                         quantiles=self.quantiles)
+
+    def _new_shard(self):
+        return QuantileSketch(self.relative_accuracy, self.max_bins)
+
+    def _merge_shard(self, target, shard):
+        target.merge(shard)
+
+    def observe(self, value: float):
+        try:
+            self._local.shard.add(value)
+        except AttributeError:
+            self._shard().add(value)
+
+    @contextmanager
+    def time(self):
+        """記錄代碼塊耗時（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self) -> QuantileSketch:
+        """合併所有線程分片（其他線程可能正在寫入，結果是近似的某一時刻值）"""
+        merged = self._new_shard()
+        # 持鎖拷貝：歸檔分片只在持鎖時修改，不會同時計入歸檔前後的同一分片
+        with self._lock:
+            for shard in self._all_shards():
+                # dict() 拷貝在 GIL 下一次完成，不會遇到迭代中被修改
+                other = QuantileSketch(shard.relative_accuracy, shard.max_bins, shard.min_value)
+                other.bins = dict(shard.bins)
+                other.zero_count = shard.zero_count
+                other.count = shard.count
+                other.sum = shard.sum
+                other.min = shard.min
+                other.max = shard.max
+                merged.merge(other)
+        return merged
+
+
+class MetricsRegistry:
+    """指標註冊表：按名稱創建或取得指標，並提供拉取和導出接口"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames: Sequence[str], **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        if not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"指標 {name} 已以不同類型或標籤註冊")
+        return metric
+
+    def counter(self, name: str, documentation: str = "", labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str = "", labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str = "", labelnames: Sequence[str] = (),
+                  **kwargs) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, **kwargs)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self.metrics.get(name)
+
+    def read(self, name: str, stat: str = "value", labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+        """讀取指標的當前值，沒有數據時返回 None
+
+        stat: Counter / Gauge 為 "value"；Histogram 為 "count" / "sum" / "mean" / "min" / "max"
+              或 "p50"、"p95"、"p99.9" 形式的分位數
+        labels: 指定子指標；省略時聚合所有子指標（Counter 求和、Gauge 取平均、Histogram 合併）
+        """
+        metric = self.metrics.get(name)
+        if metric is None:
+            return None
+
+        if labels is not None and metric.labelnames:
+            children = [metric.labels(**labels)]
+        else:
+            children = list(metric.samples())
+        if not children:
+            return None
+
+        if isinstance(metric, Counter):
+            return sum(child.get() for child in children)
+        if isinstance(metric, Gauge):
+            return sum(child.get() for child in children) / len(children)
+
+        sketch = children[0].snapshot()
+        for child in children[1:]:
+            sketch.merge(child.snapshot())
+        if sketch.count == 0:
+            return None
+        if stat == "count":
+            return float(sketch.count)
+        if stat == "sum":
+            return sketch.sum
+        if stat == "mean":
+            return sketch.sum / sketch.count
+        if stat == "min":
+            return sketch.min
+        if stat == "max":
+            return sketch.max
+        if stat.startswith("p"):
+            return sketch.quantile(float(stat[1:]) / 100)
+        raise ValueError(f"不支持的統計量: {stat}")
+
+    def collect(self) -> Dict[str, Any]:
+        """所有指標的快照（可序列化為 JSON）"""
+        snapshot = {}
+        for name, metric in list(self.metrics.items()):
+            samples = []
+            for child in metric.samples():
+                labels = child.label_dict(metric.labelnames)
+                if isinstance(child, Histogram):
+                    sketch = child.snapshot()
+                    samples.append({
+                        "labels": labels,
+                        "count": sketch.count,
+                        "sum": sketch.sum,
+                        "quantiles": {str(q): sketch.quantile(q) for q in child.quantiles} if sketch.count else {}
+                    })
+                else:
+                    samples.append({"labels": labels, "value": child.get()})
+            snapshot[name] = {"type": metric.type_name, "help": metric.documentation, "samples": samples}
+        return snapshot
+
+    def export_prometheus(self) -> str:
+        """Prometheus 文本格式（0.0.4）；Histogram 以 summary 類型導出分位數"""
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {name} {metric.type_name}")
+            for child in metric.samples():
+                labels = child.label_dict(metric.labelnames)
+                if isinstance(child, Histogram):
+                    sketch = child.snapshot()
+                    if sketch.count:
+                        for q in child.quantiles:
+                            lines.append(f"{name}{_format_labels({**labels, 'quantile': str(q)})} "
+                                         f"{_format_value(sketch.quantile(q))}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(sketch.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {sketch.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(child.get())}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label_value(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0",
+                      registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """在後台線程提供 /metrics 端點供 Prometheus 抓取"""
+    registry = registry or metrics_registry
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.export_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"📈 Prometheus 指標端點: http://{addr}:{server.server_address[1]}/metrics")
+    return server
+
+
+# 全局註冊表
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+本地模擬 LLM 服務（OpenAI 兼容 /chat/completions）
+- 首 token 延遲按可配置分佈採樣（固定 / 均勻 / 指數 / 對數正態，可疊加長尾）
+- 預填充耗時與提示長度成正比，生成階段按 tokens_per_second 輸出，支持 SSE 流式
+- 按概率注入 429 / 503 等錯誤（帶 Retry-After）
+- capacity 限制同時生成的請求數，超出部分排隊，用於復現服務端飽和
+供 K2 路由層做離線容量規劃，不消耗真實 API 配額
+
+用法:
+    python mock_llm_server.py --port 8080 --latency lognormal --latency-ms 300 --capacity 8
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+@dataclass
+class LatencyModel:
+    """延遲分佈（毫秒）
+
+    mean_ms 為分佈均值；spread 對 uniform 為相對半寬，對 lognormal 為對數標準差；
+    tail_probability 的請求額外乘以 tail_multiplier，模擬長尾
+    """
+    distribution: str = "lognormal"
+    mean_ms: float = 200.0
+    spread: float = 0.5
+    tail_probability: float = 0.0
+    tail_multiplier: float = 10.0
+
+    def __post_init__(self):
+        if self.distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"不支持的延遲分佈: {self.distribution}")
+        if self.mean_ms < 0:
+            raise ValueError("mean_ms 不能為負")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "fixed" or self.mean_ms == 0:
+            value = self.mean_ms
+        elif self.distribution == "uniform":
+            value = rng.uniform(self.mean_ms * (1 - self.spread), self.mean_ms * (1 + self.spread))
+        elif self.distribution == "exponential":
+            value = rng.expovariate(1 / self.mean_ms)
+        else:
+            # 取 mu 使分佈均值等於 mean_ms
+            mu = math.log(self.mean_ms) - self.spread ** 2 / 2
+            value = rng.lognormvariate(mu, self.spread)
+
+        if self.tail_probability and rng.random() < self.tail_probability:
+            value *= self.tail_multiplier
+        return max(0.0, value)
+
+
+@dataclass
+class MockLLMConfig:
+    """模擬服務配置"""
+    host: str = "127.0.0.1"
+    port: int = 0                              # 0 表示隨機空閒端口
+    model: str = "mock-k2"
+    first_token_latency: LatencyModel = field(default_factory=LatencyModel)
+    prefill_ms_per_token: float = 0.05         # 每個提示 token 的預填充耗時
+    tokens_per_second: float = 50.0            # 單請求生成速率，<= 0 表示瞬時完成
+    output_tokens: int = 128                   # 完成 token 數（受請求的 max_tokens 限制）
+    stream_chunk_tokens: int = 4               # 每個 SSE 片段包含的 token 數
+    capacity: int = 0                          # 同時生成的請求上限，0 表示不限
+    error_rate: float = 0.0
+    error_statuses: Tuple[int, ...] = (429, 503)
+    error_latency_ms: float = 5.0
+    retry_after_seconds: Optional[float] = 0.1
+    seed: int = 42
+
+    def __post_init__(self):
+        if not 0.0 <= self.error_rate <= 1.0:
+            raise ValueError("error_rate 必須在 [0, 1] 之間")
+        if self.capacity < 0:
+            raise ValueError("capacity 不能為負")
+        if self.stream_chunk_tokens < 1:
+            raise ValueError("stream_chunk_tokens 至少為 1")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 數（約 4 字符一個 token，中文按字計）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return max(1, ascii_chars // 4 + (len(text) - ascii_chars))
+
+
+class MockLLMServer:
+    """OpenAI 兼容的本地模擬 LLM 服務"""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None):
+        self.config = config or MockLLMConfig()
+        self.rng = random.Random(self.config.seed)
+        self.slots = asyncio.Semaphore(self.config.capacity) if self.config.capacity else None
+
+        self.app = web.Application()
+        for prefix in ("", "/v1"):
+            self.app.router.add_post(f"{prefix}/chat/completions", self.handle_chat_completion)
+        self.app.router.add_get("/health", self.handle_health)
+        self.app.router.add_get("/stats", self.handle_stats)
+
+        self.runner: Optional[web.AppRunner] = None
+        self.base_url: Optional[str] = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "requests": 0,
+            "completed": 0,
+            "streamed": 0,
+            "injected_errors": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "queued": 0,
+            "peak_queued": 0,
+            "total_queue_wait_ms": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+
+    async def start(self) -> str:
+        """啟動服務，返回 base_url（如 http://127.0.0.1:8080/v1）"""
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.config.host, self.config.port)
+        await site.start()
+
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://{self.config.host}:{port}/v1"
+        logger.info(f"🤖 模擬 LLM 服務已啟動: {self.base_url} (容量 {self.config.capacity or '不限'})")
+        return self.base_url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "model": self.config.model})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get_stats())
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued_total = max(1, self.stats["requests"] - self.stats["injected_errors"])
+        return {
+            **self.stats,
+            "average_queue_wait_ms": self.stats["total_queue_wait_ms"] / queued_total,
+            "config": {**asdict(self.config), "error_statuses": list(self.config.error_statuses)}
+        }
+
+    async def handle_chat_completion(self, request: web.Request) -> web.StreamResponse:
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            return web.json_response({"error": {"message": "無效的 JSON 請求體"}}, status=400)
+
+        messages = body.get("messages") or []
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = max(1, min(body.get("max_tokens") or self.config.output_tokens, self.config.output_tokens))
+        stream = bool(body.get("stream"))
+        self.stats["requests"] += 1
+
+        # 錯誤注入：在排隊前返回，模擬網關限流 / 過載
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            self.stats["injected_errors"] += 1
+            await asyncio.sleep(self.config.error_latency_ms / 1000)
+            status = self.rng.choice(self.config.error_statuses)
+            headers = {}
+            if self.config.retry_after_seconds is not None and status in (429, 503):
+                headers["Retry-After"] = f"{self.config.retry_after_seconds:g}"
+            return web.json_response(
+                {"error": {"message": "injected error", "type": "mock_error", "code": status}},
+                status=status, headers=headers
+            )
+
+        queue_start = time.perf_counter()
+        self.stats["queued"] += 1
+        self.stats["peak_queued"] = max(self.stats["peak_queued"], self.stats["queued"])
+        if self.slots is not None:
+            await self.slots.acquire()
+        self.stats["queued"] -= 1
+        self.stats["total_queue_wait_ms"] += (time.perf_counter() - queue_start) * 1000
+
+        self.stats["in_flight"] += 1
+        self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+        try:
+            first_token_delay = (self.config.first_token_latency.sample(self.rng)
+                                 + prompt_tokens * self.config.prefill_ms_per_token) / 1000
+            await asyncio.sleep(first_token_delay)
+
+            if stream:
+                response = await self._stream_completion(request, prompt_tokens, completion_tokens)
+            else:
+                await asyncio.sleep(self._decode_seconds(completion_tokens))
+                response = web.json_response(self._completion_body(prompt_tokens, completion_tokens))
+
+            self.stats["completed"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+            return response
+        finally:
+            self.stats["in_flight"] -= 1
+            if self.slots is not None:
+                self.slots.release()
+
+    def _decode_seconds(self, tokens: int) -> float:
+        if self.config.tokens_per_second <= 0:
+            return 0.0
+        return tokens / self.config.tokens_per_second
+
+    @staticmethod
+    def _generate_text(start: int, count: int) -> str:
+        return "".join(f"tok{i} " for i in range(start, start + count))
+
+    def _completion_body(self, prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.config.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self._generate_text(0, completion_tokens)},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+
+    async def _stream_completion(self, request: web.Request, prompt_tokens: int,
+                                 completion_tokens: int) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        self.stats["streamed"] += 1
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        async def send(delta: Dict[str, Any], finish_reason: Optional[str] = None, usage: Optional[Dict[str, int]] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": self.config.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        # 以單調時鐘為基準排程每個片段，避免 sleep 誤差累積導致速率偏低
+        chunk_size = self.config.stream_chunk_tokens
+        start = time.perf_counter()
+        sent = 0
+        while sent < completion_tokens:
+            count = min(chunk_size, completion_tokens - sent)
+            await send({"content": self._generate_text(sent, count)})
+            sent += count
+            if sent < completion_tokens:
+                delay = start + self._decode_seconds(sent) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        await send({}, finish_reason="stop", usage={
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        })
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+def build_config(args: argparse.Namespace) -> MockLLMConfig:
+    return MockLLMConfig(
+        host=args.host,
+        port=args.port,
+        model=args.model,
+        first_token_latency=LatencyModel(
+            distribution=args.latency,
+            mean_ms=args.latency_ms,
+            spread=args.latency_spread,
+            tail_probability=args.tail_probability,
+            tail_multiplier=args.tail_multiplier
+        ),
+        prefill_ms_per_token=args.prefill_ms_per_token,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        capacity=args.capacity,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    """註冊模擬服務的命令行參數（供基準測試腳本復用）"""
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="lognormal", help="首 token 延遲分佈")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="首 token 延遲均值（毫秒）")
+    parser.add_argument("--latency-spread", type=float, default=0.5, help="uniform 相對半寬 / lognormal 對數標準差")
+    parser.add_argument("--tail-probability", type=float, default=0.0, help="長尾請求比例")
+    parser.add_argument("--tail-multiplier", type=float, default=10.0, help="長尾請求延遲倍數")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.05, help="每個提示 token 的預填充耗時")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="單請求生成速率")
+    parser.add_argument("--output-tokens", type=int, default=128, help="每個響應的完成 token 數")
+    parser.add_argument("--capacity", type=int, default=0, help="同時生成的請求上限（0 表示不限）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="錯誤注入比例")
+    parser.add_argument("--seed", type=int, default=42, help="隨機種子")
+
+
+async def serve(config: MockLLMConfig):
+    server = MockLLMServer(config)
+    await server.start()
+    print(f"✅ 模擬 LLM 服務運行中: {server.base_url}（Ctrl+C 退出）")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模擬 LLM 服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="mock-k2")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(build_config(args)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
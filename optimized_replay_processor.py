@@ -1,24 +1,33 @@
 #!/usr/bin/env python3
 """
 優化的Replay處理器
-1. 下載剩餘的331個replay URLs
+1. 下載所有未處理的replay URLs（自適應並發，可斷點續傳）
 2. 從每個replay提取10-50個訓練樣本
 3. 生成高質量的K2訓練數據
 """
 
 import json
 import asyncio
-import aiohttp
 import logging
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Iterable
 from datetime import datetime
 import re
-from collections import defaultdict
+
+from dataset_writer import ShardedDatasetWriter
+from dedup_index import DedupIndex, shared_index_path
+from download_engine import DownloadEngine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# replay 頁面內嵌狀態 JSON 的起始位置
+REPLAY_STATE_PATTERNS = [
+    re.compile(r'conversationData\s*=\s*(?={)'),
+    re.compile(r'__INITIAL_STATE__\s*=\s*(?={)'),
+    re.compile(r'<script[^>]*id="__NEXT_DATA__"[^>]*>\s*(?={)')
+]
+
 
 class OptimizedReplayProcessor:
     """優化的Replay處理器"""
@@ -31,109 +40,176 @@ class OptimizedReplayProcessor:
         self.training_data_dir = self.base_dir / "data" / "k2_training_optimized"
         self.training_data_dir.mkdir(parents=True, exist_ok=True)
         
+        # 輸出配置：JSONL 分片大小上限和壓縮格式（None / "gzip" / "zstd"）
+        self.max_shard_bytes = 256 * 1024 * 1024
+        self.output_compression = None
+        
+        # 下載配置：自適應並發上限、每主機連接數和重試次數
+        self.max_concurrency = 16
+        self.limit_per_host = 8
+        self.max_retries = 4
+        self.checkpoint_file = self.data_dir / "download_checkpoint.jsonl"
+        self.download_stats: Dict = {}
+        
         self.downloaded_urls = set()
         self.failed_urls = set()
+        self.duplicate_samples = 0
         
-    def get_unprocessed_urls(self) -> List[str]:
-        """獲取未處理的URLs"""
-        # 收集所有URLs
-        all_urls = set()
+        # 持久化去重索引：已發現的 URL、已讀取的 URL 文件、已處理的 replay ID、樣本內容哈希
+        self.dedup_index = DedupIndex(shared_index_path())
+        
+    def get_unprocessed_urls(self, limit: Optional[int] = None) -> List[str]:
+        """獲取未處理的URLs（只讀取新增或修改過的 URL 文件），limit 限制返回數量"""
         url_files = list(self.base_dir.glob("**/replay*.txt")) + \
                    list(self.base_dir.glob("**/*replay*urls*.txt"))
         
         for url_file in url_files:
             try:
+                stat = url_file.stat()
+                signature = f"{url_file}:{stat.st_mtime_ns}:{stat.st_size}"
+                if self.dedup_index.contains("url_file", signature):
+                    continue
+                
                 with open(url_file, 'r') as f:
                     content = f.read()
                     urls = re.findall(r'https://manus\.im/share/[^?\s]+\?replay=1', content)
-                    all_urls.update(urls)
-            except:
-                pass
+                self.dedup_index.add_many("replay_url", urls, source=url_file.name)
+                self.dedup_index.add("url_file", signature)
+            except Exception as e:
+                logger.warning(f"讀取 URL 文件失敗 {url_file}: {e}")
         
-        # 檢查已下載的
+        # 其他工具已生成的結果文件也視為已處理
         existing_files = list(self.base_dir.glob("**/replay_analysis*.json")) + \
                         list(self.base_dir.glob("**/conversation*.json"))
         
-        processed_ids = set()
         for f in existing_files:
             # 從文件名提取ID
             match = re.search(r'([a-zA-Z0-9]{22})', f.name)
             if match:
-                processed_ids.add(match.group(1))
+                self.dedup_index.add("replay", match.group(1), source=f.name)
         
         # 找出未處理的URLs
         unprocessed = []
-        for url in all_urls:
+        for url in self.dedup_index.keys("replay_url"):
             match = re.search(r'/share/([^?]+)', url)
-            if match and match.group(1) not in processed_ids:
+            if match and not self.dedup_index.contains("replay", match.group(1)):
                 unprocessed.append(url)
         
-        logger.info(f"總URLs: {len(all_urls)}, 已處理: {len(processed_ids)}, 待處理: {len(unprocessed)}")
-        return unprocessed[:331]  # 限制331個
+        self.dedup_index.flush()
+        logger.info(f"總URLs: {self.dedup_index.count('replay_url')}, "
+                    f"已處理: {self.dedup_index.count('replay')}, 待處理: {len(unprocessed)}")
+        return unprocessed[:limit] if limit else unprocessed
     
-    async def download_replay(self, session: aiohttp.ClientSession, url: str) -> Optional[Dict]:
-        """下載單個replay"""
-        try:
-            # 模擬WebFetch調用
-            prompt = f"請獲取這個Manus對話的完整內容，包括所有訊息、代碼和工具調用: {url}"
-            
-            # 這裡應該調用實際的WebFetch，現在模擬
-            # 實際實現需要調用 WebFetch 工具
-            
-            replay_id = re.search(r'/share/([^?]+)', url).group(1)
-            
-            # 模擬數據結構
-            mock_data = {
-                "url": url,
-                "replay_id": replay_id,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": "請幫我創建一個Python函數來處理文件上傳",
-                        "timestamp": datetime.now().isoformat()
-                    },
+    @staticmethod
+    def parse_replay_page(content: str) -> List[Dict]:
+        """從 replay 頁面內嵌的狀態 JSON（conversationData / __INITIAL_STATE__ / __NEXT_DATA__）提取消息
+
+        找不到可識別的消息列表時返回空列表
+        """
+        decoder = json.JSONDecoder()
+        for pattern in REPLAY_STATE_PATTERNS:
+            for match in pattern.finditer(content):
+                try:
+                    state, _ = decoder.raw_decode(content, match.end())
+                except ValueError:
+                    continue
+                messages = OptimizedReplayProcessor._find_messages(state)
+                if messages:
+                    return messages
+        return []
+    
+    @staticmethod
+    def _find_messages(node, depth: int = 0) -> List[Dict]:
+        """在狀態樹中查找第一個由 {role, content} 組成的 messages 列表"""
+        if depth > 12:
+            return []
+        if isinstance(node, dict):
+            candidates = node.get("messages")
+            if isinstance(candidates, list):
+                messages = [
                     {
-                        "role": "assistant",
-                        "content": "我將為您創建一個文件上傳處理函數。",
+                        "role": item["role"],
+                        "content": item["content"],
                         "tool_calls": [
-                            {"tool": "Write", "parameters": {"file_path": "upload.py"}}
+                            {"tool": call.get("tool") or call.get("name"),
+                             "parameters": call.get("parameters") or call.get("arguments") or {}}
+                            for call in item.get("tool_calls") or []
+                            if isinstance(call, dict) and (call.get("tool") or call.get("name"))
                         ],
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": item.get("timestamp", "")
                     }
-                ],
-                "metadata": {
-                    "duration": 180,
-                    "tool_count": 1,
-                    "message_count": 2
-                }
+                    for item in candidates
+                    if isinstance(item, dict) and item.get("role") in ("user", "assistant")
+                    and isinstance(item.get("content"), str) and item["content"].strip()
+                ]
+                if messages:
+                    return messages
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            return []
+        
+        for child in children:
+            messages = OptimizedReplayProcessor._find_messages(child, depth + 1)
+            if messages:
+                return messages
+        return []
+    
+    def _save_replay(self, url: str, content: str) -> Dict:
+        """保存下載的replay頁面並解析出消息；解析不出消息時只保留原始頁面，不產生訓練樣本"""
+        replay_id = re.search(r'/share/([^?]+)', url).group(1)
+        
+        # 保存原始頁面（解析規則更新後可重新解析）
+        raw_file = self.data_dir / f"replay_{replay_id}.html"
+        with open(raw_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        
+        messages = self.parse_replay_page(content)
+        if not messages:
+            logger.warning(f"未能從頁面解析出消息: {url}")
+        
+        replay_data = {
+            "url": url,
+            "replay_id": replay_id,
+            "raw_file": raw_file.name,
+            "parsed": bool(messages),
+            "messages": messages,
+            "metadata": {
+                "tool_count": sum(len(msg["tool_calls"]) for msg in messages),
+                "message_count": len(messages),
+                "content_length": len(content)
             }
-            
-            # 保存原始數據
-            output_file = self.data_dir / f"replay_{replay_id}.json"
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(mock_data, f, ensure_ascii=False, indent=2)
-            
-            self.downloaded_urls.add(url)
-            return mock_data
-            
-        except Exception as e:
-            logger.error(f"下載失敗 {url}: {e}")
-            self.failed_urls.add(url)
-            return None
+        }
+        
+        output_file = self.data_dir / f"replay_{replay_id}.json"
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(replay_data, f, ensure_ascii=False, indent=2)
+        
+        self.downloaded_urls.add(url)
+        self.dedup_index.add("replay", replay_id, source=output_file.name)
+        return replay_data
     
-    async def batch_download(self, urls: List[str], batch_size: int = 5):
-        """批量下載replays"""
-        async with aiohttp.ClientSession() as session:
-            for i in range(0, len(urls), batch_size):
-                batch = urls[i:i+batch_size]
-                tasks = [self.download_replay(session, url) for url in batch]
-                results = await asyncio.gather(*tasks)
-                
-                success_count = sum(1 for r in results if r is not None)
-                logger.info(f"批次 {i//batch_size + 1}: 成功 {success_count}/{len(batch)}")
-                
-                # 避免請求過快
-                await asyncio.sleep(1)
+    async def batch_download(self, urls: List[str], retry_failed: bool = False) -> Dict:
+        """並發下載replays，進度寫入檢查點，中斷後重新運行會從斷點繼續"""
+        engine = DownloadEngine(
+            self.checkpoint_file,
+            max_concurrency=self.max_concurrency,
+            limit_per_host=self.limit_per_host,
+            max_retries=self.max_retries
+        )
+        
+        async def on_success(url: str, content: str):
+            self._save_replay(url, content)
+        
+        try:
+            self.download_stats = await engine.download_all(urls, on_success, retry_failed=retry_failed)
+        finally:
+            engine.close()
+            self.dedup_index.flush()
+        
+        self.failed_urls.update(engine.checkpoint.failed().keys() & set(urls))
+        return self.download_stats
     
     def extract_training_samples(self, replay_data: Dict) -> List[Dict]:
         """從單個replay提取多個訓練樣本"""
@@ -234,33 +310,50 @@ class OptimizedReplayProcessor:
         
         return None
     
-    def save_training_data(self, all_samples: List[Dict]):
-        """保存訓練數據"""
+    def save_training_data(self, all_samples: Iterable[Dict]) -> Dict:
+        """流式保存訓練數據（JSONL 分片 + 增量統計），返回統計信息"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = self.training_data_dir / f"k2_training_optimized_{timestamp}.jsonl"
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for sample in all_samples:
-                f.write(json.dumps(sample, ensure_ascii=False) + '\n')
+        writer = ShardedDatasetWriter(
+            self.training_data_dir, f"k2_training_optimized_{timestamp}",
+            max_shard_bytes=self.max_shard_bytes, compression=self.output_compression,
+            count_by={"by_instruction": "instruction", "by_intent": "metadata.intent_type"},
+            sum_of={"has_tools": "metadata.has_tools"}
+        )
+        with writer:
+            writer.write_many(all_samples)
+        # 分片和 manifest 已寫出，此時才提交對應的樣本哈希
+        self.dedup_index.flush()
         
-        logger.info(f"保存了 {len(all_samples)} 條訓練樣本到 {output_file}")
+        logger.info(f"保存了 {writer.stats['total_samples']} 條訓練樣本到 {writer.manifest_path}")
         
         # 生成統計報告
-        stats = {
-            "total_samples": len(all_samples),
-            "by_instruction": defaultdict(int),
-            "has_tools": sum(1 for s in all_samples if s["metadata"].get("has_tools")),
-            "by_intent": defaultdict(int)
-        }
-        
-        for sample in all_samples:
-            stats["by_instruction"][sample["instruction"]] += 1
-            if sample["metadata"].get("intent_type"):
-                stats["by_intent"][sample["metadata"]["intent_type"]] += 1
+        stats = {key: value for key, value in writer.stats.items() if key != "total_bytes"}
+        stats["shards"] = len(writer.shards)
         
         stats_file = self.training_data_dir / f"training_stats_{timestamp}.json"
         with open(stats_file, 'w', encoding='utf-8') as f:
-            json.dump(dict(stats), f, ensure_ascii=False, indent=2)
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        
+        return stats
+    
+    def iter_training_samples(self) -> Iterable[Dict]:
+        """逐個replay文件提取訓練樣本，跳過內容已見過的樣本（包括之前運行中輸出的）"""
+        for replay_file in self.data_dir.glob("replay_*.json"):
+            try:
+                with open(replay_file, 'r', encoding='utf-8') as f:
+                    replay_data = json.load(f)
+                # 未解析出消息的頁面（以及舊版生成的模擬數據）不進入數據集
+                if not replay_data.get("parsed"):
+                    continue
+                
+                for sample in self.extract_training_samples(replay_data):
+                    if self.dedup_index.add_sample(sample, source=replay_file.name):
+                        yield sample
+                    else:
+                        self.duplicate_samples += 1
+            except Exception as e:
+                logger.error(f"處理文件 {replay_file} 失敗: {e}")
     
     async def process_all(self):
         """處理所有未下載的replays"""
@@ -276,23 +369,9 @@ class OptimizedReplayProcessor:
         # 2. 批量下載
         await self.batch_download(unprocessed_urls)
         
-        # 3. 處理已下載的數據
-        all_samples = []
-        replay_files = list(self.data_dir.glob("replay_*.json"))
-        
-        for replay_file in replay_files:
-            try:
-                with open(replay_file, 'r', encoding='utf-8') as f:
-                    replay_data = json.load(f)
-                
-                samples = self.extract_training_samples(replay_data)
-                all_samples.extend(samples)
-            except Exception as e:
-                logger.error(f"處理文件 {replay_file} 失敗: {e}")
-        
-        # 4. 保存訓練數據
-        if all_samples:
-            self.save_training_data(all_samples)
+        # 3. 處理已下載的數據並流式保存
+        stats = self.save_training_data(self.iter_training_samples())
+        total_samples = stats["total_samples"]
         
         # 5. 生成報告
         report = f"""
@@ -304,10 +383,13 @@ class OptimizedReplayProcessor:
 - 嘗試下載: {len(unprocessed_urls)} 個URLs
 - 成功下載: {len(self.downloaded_urls)} 個
 - 失敗: {len(self.failed_urls)} 個
+- 重試次數: {self.download_stats.get('retries', 0)}
+- 最終並發上限: {self.download_stats.get('concurrency_limit', 'N/A')}
 
 ## 訓練數據生成
-- 總樣本數: {len(all_samples)}
-- 平均每個replay: {len(all_samples) / len(self.downloaded_urls) if self.downloaded_urls else 0:.1f} 個樣本
+- 總樣本數: {total_samples}
+- 跳過重複樣本: {self.duplicate_samples}
+- 平均每個replay: {total_samples / len(self.downloaded_urls) if self.downloaded_urls else 0:.1f} 個樣本
 
 ## 下一步
 1. 使用生成的訓練數據訓練K2模型
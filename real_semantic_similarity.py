@@ -5,18 +5,33 @@
 """
 
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, TfidfTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 import nltk
 from difflib import SequenceMatcher
 import re
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import List, Tuple, Optional
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 綜合評分權重
+SIMILARITY_WEIGHTS = {
+    "tfidf": 0.35,
+    "sequence": 0.25,
+    "lexical": 0.20,
+    "structural": 0.15,
+    "basic": 0.05
+}
+
+# 超過此總長度的文本對改用詞級序列匹配，避免字元級 O(n^2)
+DEFAULT_SEQUENCE_CUTOFF = 2000
+
 class RealSemanticSimilarity:
     """真實語義相似度計算器"""
     
@@ -36,6 +51,17 @@ class RealSemanticSimilarity:
             lowercase=True,
             strip_accents='unicode'
         )
+        
+        # 批量模式使用特徵雜湊，免去大語料上建立詞彙表的開銷
+        self.hashing_vectorizer = HashingVectorizer(
+            n_features=2 ** 20,
+            ngram_range=(1, 3),
+            stop_words='english',
+            lowercase=True,
+            strip_accents='unicode',
+            alternate_sign=False,
+            norm=None
+        )
     
     def calculate_similarity(self, text1: str, text2: str) -> dict:
         """計算兩個文本的真實語義相似度"""
@@ -58,39 +84,84 @@ class RealSemanticSimilarity:
         # 5. 結構相似度
         structural_similarity = self._structural_similarity(text1, text2)
         
-        # 綜合評分 (權重)
-        weights = {
-            "tfidf": 0.35,
-            "sequence": 0.25, 
-            "lexical": 0.20,
-            "structural": 0.15,
-            "basic": 0.05
-        }
-        
-        overall_similarity = (
-            tfidf_similarity * weights["tfidf"] +
-            sequence_similarity * weights["sequence"] +
-            lexical_similarity * weights["lexical"] +
-            structural_similarity * weights["structural"] +
-            basic_similarity * weights["basic"]
+        return _build_similarity_result(
+            text1, text2, tfidf_similarity, sequence_similarity,
+            lexical_similarity, structural_similarity, basic_similarity
         )
+    
+    def tfidf_similarity_matrix(self, texts_a: List[str], texts_b: List[str]) -> np.ndarray:
+        """批量TF-IDF餘弦相似度：整個語料只擬合一次，以稀疏矩陣乘積得到 N×M 矩陣"""
+        if not texts_a or not texts_b:
+            return np.zeros((len(texts_a), len(texts_b)))
+        
+        tfidf_matrix = self._fit_corpus_tfidf(list(texts_a) + list(texts_b))
         
-        return {
-            "overall_similarity": overall_similarity,
-            "breakdown": {
-                "tfidf_cosine": tfidf_similarity,
-                "sequence_matching": sequence_similarity,
-                "lexical_overlap": lexical_similarity,
-                "structural": structural_similarity,
-                "basic_stats": basic_similarity
-            },
-            "text1_length": len(text1),
-            "text2_length": len(text2),
-            "text1_words": len(text1.split()),
-            "text2_words": len(text2.split())
-        }
+        # 各行已 L2 正規化，內積即餘弦相似度
+        matrix_a = tfidf_matrix[:len(texts_a)]
+        matrix_b = tfidf_matrix[len(texts_a):]
+        return (matrix_a @ matrix_b.T).toarray()
     
-    def _basic_text_similarity(self, text1: str, text2: str) -> float:
+    def calculate_similarity_batch(self, texts_a: List[str], texts_b: List[str],
+                                   pairs: Optional[List[Tuple[int, int]]] = None,
+                                   max_workers: Optional[int] = None,
+                                   sequence_cutoff: int = DEFAULT_SEQUENCE_CUTOFF,
+                                   chunksize: int = 64) -> List[dict]:
+        """批量計算文本對相似度
+        
+        pairs 為 (i, j) 索引對，預設逐一配對 texts_a[i] 與 texts_b[i]；
+        TF-IDF 對整個語料只擬合一次，其餘指標在多個工作進程中並行計算
+        """
+        if pairs is None:
+            if len(texts_a) != len(texts_b):
+                raise ValueError("未指定 pairs 時 texts_a 與 texts_b 長度必須相同")
+            pairs = [(i, i) for i in range(len(texts_a))]
+        
+        if not pairs:
+            return []
+        
+        # 1. TF-IDF：一次擬合，逐對取稀疏行內積
+        tfidf_scores = self._tfidf_pair_scores(texts_a, texts_b, pairs)
+        
+        # 2. 其餘指標：按 chunk 分發到進程池
+        tasks = [(texts_a[i], texts_b[j], sequence_cutoff) for i, j in pairs]
+        max_workers = max_workers or os.cpu_count() or 1
+        
+        if max_workers <= 1 or len(tasks) < chunksize:
+            pair_features = [_score_pair_features(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                pair_features = list(executor.map(_score_pair_features, tasks, chunksize=chunksize))
+        
+        results = []
+        for (i, j), tfidf_similarity, features in zip(pairs, tfidf_scores, pair_features):
+            text1, text2 = texts_a[i], texts_b[j]
+            if features is None:
+                results.append({"error": "空文本"})
+                continue
+            
+            result = _build_similarity_result(text1, text2, tfidf_similarity, *features)
+            result["pair"] = [i, j]
+            results.append(result)
+        
+        return results
+    
+    def _tfidf_pair_scores(self, texts_a: List[str], texts_b: List[str],
+                           pairs: List[Tuple[int, int]]) -> np.ndarray:
+        """只計算指定文本對的TF-IDF餘弦相似度（不展開完整 N×M 矩陣）"""
+        tfidf_matrix = self._fit_corpus_tfidf(list(texts_a) + list(texts_b))
+        
+        rows_a = np.array([i for i, _ in pairs])
+        rows_b = np.array([len(texts_a) + j for _, j in pairs])
+        products = tfidf_matrix[rows_a].multiply(tfidf_matrix[rows_b])
+        return np.asarray(products.sum(axis=1)).ravel()
+    
+    def _fit_corpus_tfidf(self, corpus: List[str]):
+        """對整個語料擬合一次 TF-IDF，返回 L2 正規化的稀疏矩陣"""
+        counts = self.hashing_vectorizer.transform(corpus)
+        return TfidfTransformer(norm='l2').fit_transform(counts).tocsr()
+    
+    @staticmethod
+    def _basic_text_similarity(text1: str, text2: str) -> float:
         """基本文本統計相似度"""
         len1, len2 = len(text1), len(text2)
         words1, words2 = len(text1.split()), len(text2.split())
@@ -113,11 +184,29 @@ class RealSemanticSimilarity:
         except:
             return 0.0
     
-    def _sequence_matching_similarity(self, text1: str, text2: str) -> float:
+    @staticmethod
+    def _sequence_matching_similarity(text1: str, text2: str) -> float:
         """序列匹配相似度"""
         return SequenceMatcher(None, text1, text2).ratio()
     
-    def _lexical_overlap_similarity(self, text1: str, text2: str) -> float:
+    @staticmethod
+    def _fast_sequence_similarity(text1: str, text2: str,
+                                  cutoff: int = DEFAULT_SEQUENCE_CUTOFF) -> float:
+        """快速序列匹配相似度：短文本用字元級精確比率，長文本改用詞級序列近似"""
+        if len(text1) + len(text2) <= cutoff:
+            return SequenceMatcher(None, text1, text2).ratio()
+        
+        tokens1 = re.findall(r'\w+|[^\w\s]', text1)
+        tokens2 = re.findall(r'\w+|[^\w\s]', text2)
+        matcher = SequenceMatcher(None, tokens1, tokens2)
+        
+        # real_quick_ratio / quick_ratio 為上界，為 0 時可直接返回
+        if matcher.real_quick_ratio() == 0 or matcher.quick_ratio() == 0:
+            return 0.0
+        return matcher.ratio()
+    
+    @staticmethod
+    def _lexical_overlap_similarity(text1: str, text2: str) -> float:
         """詞彙重疊相似度"""
         words1 = set(re.findall(r'\w+', text1.lower()))
         words2 = set(re.findall(r'\w+', text2.lower()))
@@ -130,7 +219,8 @@ class RealSemanticSimilarity:
         
         return len(intersection) / len(union) if union else 0.0
     
-    def _structural_similarity(self, text1: str, text2: str) -> float:
+    @staticmethod
+    def _structural_similarity(text1: str, text2: str) -> float:
         """結構相似度"""
         # 句子數量
         sentences1 = len(re.split(r'[.!?]+', text1))
@@ -148,6 +238,46 @@ class RealSemanticSimilarity:
         
         return (sent_sim + para_sim) / 2
 
+def _build_similarity_result(text1: str, text2: str, tfidf_similarity: float,
+                             sequence_similarity: float, lexical_similarity: float,
+                             structural_similarity: float, basic_similarity: float) -> dict:
+    """按權重組合各項指標"""
+    overall_similarity = (
+        tfidf_similarity * SIMILARITY_WEIGHTS["tfidf"] +
+        sequence_similarity * SIMILARITY_WEIGHTS["sequence"] +
+        lexical_similarity * SIMILARITY_WEIGHTS["lexical"] +
+        structural_similarity * SIMILARITY_WEIGHTS["structural"] +
+        basic_similarity * SIMILARITY_WEIGHTS["basic"]
+    )
+    
+    return {
+        "overall_similarity": float(overall_similarity),
+        "breakdown": {
+            "tfidf_cosine": float(tfidf_similarity),
+            "sequence_matching": sequence_similarity,
+            "lexical_overlap": lexical_similarity,
+            "structural": structural_similarity,
+            "basic_stats": basic_similarity
+        },
+        "text1_length": len(text1),
+        "text2_length": len(text2),
+        "text1_words": len(text1.split()),
+        "text2_words": len(text2.split())
+    }
+
+def _score_pair_features(task: tuple) -> Optional[tuple]:
+    """進程池工作函數：計算 TF-IDF 以外的各項指標"""
+    text1, text2, sequence_cutoff = task
+    if not text1 or not text2:
+        return None
+    
+    return (
+        RealSemanticSimilarity._fast_sequence_similarity(text1, text2, sequence_cutoff),
+        RealSemanticSimilarity._lexical_overlap_similarity(text1, text2),
+        RealSemanticSimilarity._structural_similarity(text1, text2),
+        RealSemanticSimilarity._basic_text_similarity(text1, text2)
+    )
+
 def test_real_similarity():
     """測試真實相似度計算"""
     
@@ -239,11 +369,21 @@ def fibonacci(n):
     for metric, score in result3['breakdown'].items():
         print(f"  {metric}: {score:.3f}")
     
+    # 測試4: 批量模式 (TF-IDF 只擬合一次)
+    print("\n📊 測試4: 批量模式")
+    batch_results = calculator.calculate_similarity_batch(
+        [claude_response, claude_response, k2_response],
+        [k2_response, unrelated_text, unrelated_text]
+    )
+    for name, result in zip(["claude_vs_k2", "claude_vs_unrelated", "k2_vs_unrelated"], batch_results):
+        print(f"  {name}: {result['overall_similarity']:.3f}")
+    
     # 保存結果
     results = {
         "claude_vs_k2": result1,
         "claude_vs_unrelated": result2,
         "k2_vs_unrelated": result3,
+        "batch": batch_results,
         "timestamp": "2024-01-20T12:00:00"
     }
     
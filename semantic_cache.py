@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+語義響應緩存
+- 在 AsyncCache（按精確鍵緩存值）之上維護一個有界的查詢向量索引：精確鍵未命中時，
+  查找同一作用域（模型 + 上下文哈希）內最相似的近期查詢，相似度達到閾值即返回其緩存值
+- 索引容量固定，滿時淘汰最久未命中的條目；值已被底層緩存淘汰或過期的條目在查找時移除
+- 索引最多幾千條，精確搜索只是一次矩陣向量乘（2048 條 × 512 維約 0.3ms），相對 LLM 請求可忽略，也不會像近似索引那樣漏召回
+- 誤命中統計：按 verify_rate 抽樣重新加載並與緩存值比較，或由調用方通過 record_false_hit 反饋
+- 等待同一精確鍵進行中加載的請求單獨計為 coalesced，不計入精確命中
+- 語義命中需要真正的嵌入模型；沒有模型時調用方應只用 normalize_query 做格式規範化的精確鍵
+  （字符 n-gram 哈希向量對「升序 / 降序」「刪除 / 創建分支」這類只差一兩個字的查詢相似度仍在 0.9 以上）
+- 作用域在其最後一個索引條目移除時釋放，作用域表與索引一樣有界
+"""
+
+import hashlib
+import inspect
+import logging
+import random
+import re
+import time
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from async_cache import AsyncCache, MISSING
+
+try:
+    from metrics_registry import metrics_registry
+    METRICS_AVAILABLE = True
+except ImportError:
+    METRICS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+
+STAT_NAMES = {"exact_hit": "exact_hits", "coalesced": "coalesced", "semantic_hit": "semantic_hits",
+              "miss": "misses", "false_hit": "false_hits"}
+
+if METRICS_AVAILABLE:
+    SEMANTIC_REQUESTS = metrics_registry.counter(
+        "semantic_cache_requests_total", "語義緩存查找次數", ["cache", "result"])
+    SEMANTIC_SIMILARITY = metrics_registry.histogram(
+        "semantic_cache_hit_similarity", "語義緩存命中的相似度", ["cache"])
+
+
+def normalize_query(text: str) -> str:
+    """格式規範化：NFKC、轉小寫並去掉空白和標點，大小寫、全半角、空白和標點不同的查詢得到相同結果"""
+    return "".join(WORD_PATTERN.findall(unicodedata.normalize("NFKC", text).lower()))
+
+
+def context_scope(*parts: Any) -> str:
+    """由模型名、上下文等組成作用域鍵（上下文只保留哈希）"""
+    return hashlib.md5("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """查詢向量索引 + 精確鍵緩存"""
+
+    def __init__(self, cache: AsyncCache, embed: Callable[[str], Awaitable[np.ndarray]],
+                 threshold: float = 0.92, max_entries: int = 2048, verify_rate: float = 0.0,
+                 verify: Optional[Callable[[Any, Any], Union[bool, Awaitable[bool]]]] = None,
+                 name: Optional[str] = None):
+        """
+        Args:
+            cache: 存放值的精確鍵緩存（TTL、容量和持久化由它負責）
+            embed: 查詢文本 -> 向量的異步函數（不要求已歸一化）
+            threshold: 餘弦相似度閾值，達到才視為命中
+            max_entries: 索引條目上限
+            verify_rate: 語義命中時重新加載並比較的抽樣比例（0 表示不抽樣）
+            verify: 比較 (緩存值, 新值)，返回 True 表示命中可接受（可為異步函數）；默認比較是否相等
+            name: 統計標籤，默認為底層緩存名稱
+        """
+        self.cache = cache
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.verify_rate = verify_rate
+        self.verify = verify or (lambda cached, fresh: cached == fresh)
+        self.name = name or cache.name
+
+        self.vectors: Optional[np.ndarray] = None  # 首次插入時按向量維度分配
+        self.scope_ids = np.full(max_entries, -1, dtype=np.int64)
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+        self.slot_keys: List[Optional[Hashable]] = [None] * max_entries
+        self.key_slots: Dict[Hashable, int] = {}
+        self.free_slots = list(range(max_entries - 1, -1, -1))
+        # 作用域 -> ID，以及每個 ID 佔用的槽位數；最後一個槽位釋放時回收 ID
+        self.scopes: Dict[str, int] = {}
+        self.scope_names: Dict[int, str] = {}
+        self.scope_slots: Dict[int, int] = {}
+        self.free_scope_ids: List[int] = []
+
+        self.stats = {
+            "lookups": 0,
+            "exact_hits": 0,
+            "coalesced": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "verified": 0,
+            "false_hits": 0,
+            "stale_removed": 0,
+            "evictions": 0
+        }
+
+        if METRICS_AVAILABLE:
+            self._metric_results = {
+                result: SEMANTIC_REQUESTS.labels(self.name, result)
+                for result in STAT_NAMES
+            }
+            self._metric_similarity = SEMANTIC_SIMILARITY.labels(self.name)
+
+    def _record(self, result: str, similarity: Optional[float] = None):
+        self.stats[STAT_NAMES[result]] += 1
+        if METRICS_AVAILABLE:
+            self._metric_results[result].inc()
+            if similarity is not None:
+                self._metric_similarity.observe(similarity)
+
+    # ---------- 索引 ----------
+
+    def _scope_id(self, scope: str) -> int:
+        scope_id = self.scopes.get(scope)
+        if scope_id is None:
+            scope_id = self.free_scope_ids.pop() if self.free_scope_ids else len(self.scopes)
+            self.scopes[scope] = scope_id
+            self.scope_names[scope_id] = scope
+            self.scope_slots[scope_id] = 0
+        return scope_id
+
+    def _set_slot_scope(self, slot: int, scope_id: int):
+        """設置槽位的作用域，並釋放原作用域（-1 表示清空）"""
+        previous = int(self.scope_ids[slot])
+        if previous == scope_id:
+            return
+        if scope_id >= 0:
+            self.scope_slots[scope_id] += 1
+        self.scope_ids[slot] = scope_id
+        if previous >= 0:
+            self.scope_slots[previous] -= 1
+            if not self.scope_slots[previous]:
+                del self.scopes[self.scope_names.pop(previous)]
+                del self.scope_slots[previous]
+                self.free_scope_ids.append(previous)
+
+    def _search(self, vector: np.ndarray, scope: str) -> Tuple[Optional[int], float]:
+        scope_id = self.scopes.get(scope)
+        if scope_id is None or self.vectors is None:
+            return None, 0.0
+        # 整個矩陣做一次矩陣向量乘（不複製），再屏蔽其他作用域和空槽位
+        similarities = self.vectors @ vector
+        similarities[self.scope_ids != scope_id] = -np.inf
+        best = int(np.argmax(similarities))
+        if similarities[best] == -np.inf:
+            return None, 0.0
+        return best, float(similarities[best])
+
+    def _add(self, vector: np.ndarray, scope: str, key: Hashable):
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+
+        slot = self.key_slots.get(key)
+        if slot is None:
+            if self.free_slots:
+                slot = self.free_slots.pop()
+            else:
+                # 淘汰最久未命中的條目
+                slot = int(np.argmin(self.last_used))
+                del self.key_slots[self.slot_keys[slot]]
+                self.stats["evictions"] += 1
+            self.key_slots[key] = slot
+            self.slot_keys[slot] = key
+
+        self.vectors[slot] = vector
+        self._set_slot_scope(slot, self._scope_id(scope))
+        self.last_used[slot] = time.time()
+
+    def _remove_slot(self, slot: int):
+        del self.key_slots[self.slot_keys[slot]]
+        self.slot_keys[slot] = None
+        self._set_slot_scope(slot, -1)
+        self.last_used[slot] = 0.0
+        self.free_slots.append(slot)
+
+    async def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(await self.embed(query), dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # ---------- 查找 ----------
+
+    async def get_or_load(self, query: str, scope: str, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          cache_if: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, str]:
+        """按精確鍵 -> 語義相似查詢 -> loader 的順序取值，返回 (值, 來源)
+
+        來源為 "exact"、"coalesced"、"semantic" 或 "loaded"；同一精確鍵的並發調用由底層緩存合併，
+        等待其他調用方加載結果的來源為 "coalesced"。
+        語義命中的值也以新查詢的精確鍵寫入緩存，但不加入索引（避免近似查詢堆積）
+        """
+        self.stats["lookups"] += 1
+        # 檢查與底層緩存的查找之間沒有 await，結果一致；加載者被取消時 load() 會改寫來源
+        source = "coalesced" if key in self.cache.inflight and key not in self.cache else "exact"
+        vector = None
+
+        async def load():
+            nonlocal source, vector
+            vector = await self._embed(query)
+            slot, similarity = self._search(vector, scope)
+
+            if slot is not None and similarity >= self.threshold:
+                matched_key = self.slot_keys[slot]
+                cached = self.cache.lookup(matched_key)
+                if cached is MISSING:
+                    self._remove_slot(slot)
+                    self.stats["stale_removed"] += 1
+                elif self.verify_rate and random.random() < self.verify_rate:
+                    self.stats["verified"] += 1
+                    fresh = await loader()
+                    agree = self.verify(cached, fresh)
+                    if inspect.isawaitable(agree):
+                        agree = await agree
+                    # 加載和比較期間槽位可能已被淘汰或重用，按鍵重新定位
+                    slot = self.key_slots.get(matched_key)
+                    if not agree:
+                        if slot is not None:
+                            self._remove_slot(slot)
+                        self._record("false_hit", similarity)
+                        source = "loaded"
+                        return fresh
+                    if slot is not None:
+                        self.last_used[slot] = time.time()
+                    self._record("semantic_hit", similarity)
+                    source = "semantic"
+                    return fresh
+                else:
+                    self.last_used[slot] = time.time()
+                    self._record("semantic_hit", similarity)
+                    source = "semantic"
+                    return cached
+
+            self._record("miss")
+            source = "loaded"
+            return await loader()
+
+        value = await self.cache.get_or_load(key, load, cache_if=cache_if)
+        if source == "exact":
+            self._record("exact_hit")
+        elif source == "coalesced":
+            self._record("coalesced")
+        elif source == "loaded" and key in self.cache:
+            self._add(vector, scope, key)
+        return value, source
+
+    async def record_false_hit(self, query: str, scope: str, key: Optional[Hashable] = None):
+        """調用方發現語義命中的結果不適用（如用戶要求重新生成）時反饋：移除最相似的條目"""
+        vector = await self._embed(query)
+        slot, similarity = self._search(vector, scope)
+        if slot is not None and similarity >= self.threshold:
+            self._remove_slot(slot)
+        if key is not None:
+            self.cache.delete(key)
+        self._record("false_hit")
+
+    def get_stats(self) -> Dict[str, Any]:
+        semantic_lookups = self.stats["semantic_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "name": self.name,
+            "index_size": len(self.key_slots),
+            "max_entries": self.max_entries,
+            "scopes": len(self.scopes),
+            "threshold": self.threshold,
+            "semantic_hit_rate": self.stats["semantic_hits"] / semantic_lookups if semantic_lookups else 0.0,
+            "false_hit_rate": self.stats["false_hits"] / max(1, self.stats["semantic_hits"] + self.stats["false_hits"])
+        }
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+下載引擎測試
+用本地 http.server 模擬服務端，驗證 AIMD 並發調整與退避重試、檢查點續傳、跳過已完成 / 已失敗的 URL
+"""
+
+import asyncio
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download_engine import AdaptiveConcurrencyLimiter, DownloadEngine
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """/ok/* 返回 200；/flaky/* 前兩次返回 503；/broken/* 總是返回 500；其他返回 404"""
+
+    hits: Counter = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] += 1
+            hits = self.hits[self.path]
+
+        if self.path.startswith("/ok/") or (self.path.startswith("/flaky/") and hits > 2):
+            self._respond(200, f"body of {self.path}")
+        elif self.path.startswith("/flaky/"):
+            self._respond(503, "busy", {"Retry-After": "0"})
+        elif self.path.startswith("/broken/"):
+            self._respond(500, "error")
+        else:
+            self._respond(404, "not found")
+
+    def _respond(self, status, body, headers=None):
+        payload = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    ReplayHandler.hits = Counter()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", ReplayHandler.hits
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def run_engine(engine, urls, retry_failed=False):
+    bodies = {}
+
+    async def on_success(url, body):
+        bodies[url] = body
+
+    stats = asyncio.run(engine.download_all(urls, on_success, retry_failed=retry_failed))
+    engine.close()
+    return stats, bodies
+
+
+def test_limiter_decreases_on_errors_and_increases_on_success():
+    async def scenario():
+        limiter = AdaptiveConcurrencyLimiter(initial=8, minimum=1, maximum=10, window=4)
+        for _ in range(16):
+            await limiter.acquire()
+            await limiter.release(0.01, error=True)
+        decreased = limiter.limit
+
+        for _ in range(40):
+            await limiter.acquire()
+            await limiter.release(0.01, error=False)
+        return decreased, limiter.limit
+
+    decreased, recovered = asyncio.run(scenario())
+    assert decreased < 8
+    assert recovered > decreased
+
+
+def test_retryable_errors_back_off_and_reduce_concurrency(server, tmp_path):
+    base_url, hits = server
+    engine = DownloadEngine(tmp_path / "checkpoint.jsonl", max_concurrency=8, initial_concurrency=8,
+                            max_retries=3, backoff_base=0.01, backoff_max=0.05, timeout=5)
+    engine.limiter = AdaptiveConcurrencyLimiter(initial=8, minimum=1, maximum=8, window=4)
+    urls = [f"{base_url}/flaky/{i}" for i in range(4)] + [f"{base_url}/broken/{i}" for i in range(4)]
+
+    stats, bodies = run_engine(engine, urls)
+
+    assert stats["completed"] == 4
+    assert sorted(bodies) == sorted(urls[:4])
+    # 503 重試兩次後成功；500 重試 max_retries 次後記為失敗
+    assert all(hits[f"/flaky/{i}"] == 3 for i in range(4))
+    assert all(hits[f"/broken/{i}"] == 4 for i in range(4))
+    assert stats["failed"] == 4
+    assert stats["retries"] == 4 * 2 + 4 * 3
+    assert min(entry["limit"] for entry in engine.limiter.history) < 8
+
+
+def test_resume_from_checkpoint_skips_completed(server, tmp_path):
+    base_url, hits = server
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    urls = [f"{base_url}/ok/{i}" for i in range(5)]
+
+    stats, _ = run_engine(DownloadEngine(checkpoint_path, timeout=5), urls[:3])
+    assert stats["completed"] == 3
+
+    # 模擬崩潰時寫了一半的最後一行，以及一個到期的待重試記錄
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"url": urls[3], "status": "retry", "attempts": 1, "retry_at": 0,
+                            "error": "HTTP 503", "updated_at": 0}) + "\n")
+        f.write('{"url": "' + urls[4])
+
+    engine = DownloadEngine(checkpoint_path, timeout=5)
+    stats, bodies = run_engine(engine, urls)
+
+    assert stats["skipped"] == 3
+    assert sorted(bodies) == urls[3:]
+    assert all(hits[f"/ok/{i}"] == 1 for i in range(5))
+    assert set(engine.checkpoint.completed()) == set(urls)
+
+
+def test_record_after_torn_line_survives_reload(tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    checkpoint_path.write_text('{"url": "http://a", "status": "completed"}\n{"url": "http://b", "sta',
+                               encoding="utf-8")
+
+    engine = DownloadEngine(checkpoint_path)
+    engine.checkpoint.record("http://c", "completed", 1)
+    # 不經過 compact，直接重新載入追加寫入的日誌
+    engine.checkpoint._file.close()
+
+    assert set(DownloadEngine(checkpoint_path).checkpoint.completed()) == {"http://a", "http://c"}
+
+
+def test_failed_urls_skipped_unless_retry_failed(server, tmp_path):
+    base_url, hits = server
+    checkpoint_path = tmp_path / "checkpoint.jsonl"
+    missing = f"{base_url}/missing"
+    done = f"{base_url}/ok/done"
+
+    stats, _ = run_engine(DownloadEngine(checkpoint_path, timeout=5), [missing, done])
+    assert stats["failed"] == 1 and stats["completed"] == 1
+
+    stats, bodies = run_engine(DownloadEngine(checkpoint_path, timeout=5), [missing, done])
+    assert stats["skipped"] == 2 and not bodies
+    assert hits["/missing"] == 1
+
+    stats, _ = run_engine(DownloadEngine(checkpoint_path, timeout=5), [missing, done], retry_failed=True)
+    assert stats["skipped"] == 1 and stats["failed"] == 1
+    assert hits["/missing"] == 2
+    assert hits["/ok/done"] == 1